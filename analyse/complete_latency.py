@@ -0,0 +1,121 @@
+"""
+Per-keystroke latency of /complete: the old path, which ran the whole of get_results() and
+picked a URL from the top of the ranked results, against Ranker.complete's bounded lookup,
+reported against COMPLETE_LATENCY_SLO_MS.
+
+Each query is typed a letter at a time, as the search box sends it. Against a copy of the
+real index, and optionally with the LTR model the site ranks with:
+
+    python -m analyse.complete_latency ~/mwmbl-data/index-v2.tinysearch [MODEL_PATH]
+
+With no index path a small synthetic index is built from the crawl terms, with a page of
+documents for each term that is typed. Blacklist filtering is off for both paths, as it
+needs Redis; it costs the same per document on either.
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+from random import Random
+
+import numpy as np
+from django.conf import settings
+
+settings.configure(BLACKLIST_FILTER_AT_RETRIEVAL=False)
+
+from mwmbl.tinysearchengine.completer import Completer, load_terms
+from mwmbl.tinysearchengine.indexer import TinyIndex, Document
+from mwmbl.tinysearchengine.rank import (HeuristicRanker, Ranker, HTTPS_STRING, COMPLETE_LATENCY_SLO_MS,
+                                         COMPLETE_MAX_PAGES)
+
+NUM_QUERIES = 200
+SYNTHETIC_PAGES = 20_000
+SYNTHETIC_PAGE_SIZE = 4096
+DOCUMENTS_PER_TERM = 30
+
+random = Random(32)
+
+
+def full_complete(ranker: Ranker, q: str):
+    """/complete as it was, through get_results()."""
+    ordered_results, terms, completions = ranker.get_results(q, [], use_external_search=False)
+    if len(ordered_results) == 0:
+        completion_queries = [' '.join(terms[:-1] + [t]) for t in completions]
+        adjusted_completions = completion_queries if q in completion_queries else [q] + completion_queries
+        return [q, ["search: google.com " + t for t in adjusted_completions]]
+    adjusted_completions = [c for c in completions if c != terms[-1]]
+    urls = ["go: " + item.url[len(HTTPS_STRING):].rstrip('/') for item in ordered_results[:5]
+            if item.url.startswith(HTTPS_STRING) and all(term in item.url for term in terms)][:1]
+    return [q, urls + [' '.join(terms[:-1] + [t]) for t in adjusted_completions]]
+
+
+def build_synthetic_index(path: str, words: list[str], vocabulary: list[str]) -> None:
+    TinyIndex.create(Document, path, SYNTHETIC_PAGES, SYNTHETIC_PAGE_SIZE)
+    with TinyIndex(Document, path, mode='w') as index:
+        pages: dict[int, list[Document]] = {}
+        for word in words:
+            for i in range(DOCUMENTS_PER_TERM):
+                filler = " ".join(random.choices(vocabulary, k=20))
+                document = Document(f"{word} {filler[:40]}", f"https://{word}{i % 7}.example.com/{word}/{i}",
+                                    f"{filler} {word}", random.random())
+                pages.setdefault(index.get_key_page_index(word), []).append(document)
+        for page, documents in pages.items():
+            index.store_in_page(page, documents)
+
+
+def keystrokes(queries: list[str]) -> list[str]:
+    return [query[:length] for query in queries for length in range(2, len(query) + 1)]
+
+
+def measure(complete, typed: list[str]) -> np.ndarray:
+    timings = []
+    for q in typed:
+        start = time.perf_counter()
+        complete(q)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings)
+
+
+def make_ranker(index: TinyIndex, completer: Completer, model_path: str | None) -> Ranker:
+    if model_path is None:
+        return HeuristicRanker(index, completer)
+    from mwmbl.tinysearchengine.ltr import RustXGBPipeline
+    from mwmbl.tinysearchengine.ltr_rank import LTRRanker
+    return LTRRanker(index, completer, RustXGBPipeline.from_model_path(model_path), include_wiki=False)
+
+
+def run():
+    index_path = sys.argv[1] if len(sys.argv) > 1 else None
+    model_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    terms = load_terms()
+    vocabulary = [term for term, _ in sorted(terms, key=lambda pair: -pair[1])[:5000] if term.isalpha()]
+    words = random.sample(vocabulary[:2000], NUM_QUERIES)
+    queries = [" ".join(random.sample(words, random.choice([1, 1, 2]))) for _ in range(NUM_QUERIES)]
+    typed = keystrokes(queries)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if index_path is None:
+            index_path = str(Path(temp_dir) / "synthetic.tinysearch")
+            build_synthetic_index(index_path, words, vocabulary)
+
+        with TinyIndex(Document, index_path) as index:
+            ranker = make_ranker(index, Completer(), model_path)
+            print(f"{len(typed)} keystrokes from {NUM_QUERIES} queries, ranked by {type(ranker).__name__}, "
+                  f"at most {COMPLETE_MAX_PAGES} pages per keystroke")
+            # Warm the page cache so both are measured on the same footing.
+            measure(ranker.complete, typed)
+
+            old = measure(lambda q: full_complete(ranker, q), typed)
+            new = measure(ranker.complete, typed)
+            agree = np.mean([full_complete(ranker, q) == ranker.complete(q) for q in typed])
+
+    print(f"Method\tp50 ms\tp99 ms\tmax ms\tover {COMPLETE_LATENCY_SLO_MS}ms SLO")
+    for name, timings in [("full", old), ("bounded", new)]:
+        print(f"{name}\t{np.percentile(timings, 50):.2f}\t{np.percentile(timings, 99):.2f}\t"
+              f"{timings.max():.2f}\t{np.mean(timings > COMPLETE_LATENCY_SLO_MS):.1%}")
+    print(f"Identical suggestions on {agree:.1%} of keystrokes")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,100 @@
+"""
+Startup, resident memory and lookup latency of the completer: the old pandas-loaded sorted
+lists searched with bisect, versus the compiled trie in completer.py.
+
+Startup and memory are measured in fresh interpreters so neither sees the other's
+allocations; the trie's pages are file-backed and shared between workers, so most of what
+it touches is not private to a process. Run the build step first so the compiled index is
+measured rather than compiled:
+
+    python -m mwmbl.tinysearchengine.completer
+    python -m analyse.completer_benchmark
+"""
+import subprocess
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from random import Random
+
+import numpy as np
+
+from mwmbl.tinysearchengine.completer import TERMS_PATH, Completer
+
+MEASURE = """
+import time, psutil
+process = psutil.Process()
+rss_before = process.memory_info().rss
+start = time.perf_counter()
+{load}
+elapsed = time.perf_counter() - start
+print(elapsed * 1000, (process.memory_info().rss - rss_before) / 2 ** 20)
+"""
+
+LOAD_PANDAS = f"""
+import pandas as pd
+terms = pd.read_csv({str(TERMS_PATH)!r})
+terms_dict = terms.sort_values('term').set_index('term')['count'].to_dict()
+sorted_terms, counts = list(terms_dict.keys()), list(terms_dict.values())
+"""
+
+LOAD_TRIE = """
+from mwmbl.tinysearchengine.completer import Completer
+completer = Completer()
+"""
+
+
+class BisectCompleter:
+    """The old lookup, over the same terms."""
+
+    def __init__(self, terms: list[tuple[str, int]]):
+        counts_by_term = dict(terms)
+        self.terms = sorted(counts_by_term)
+        self.counts = [counts_by_term[term] for term in self.terms]
+
+    def complete(self, term: str) -> list[str]:
+        term_length = len(term)
+        start_index = bisect_left(self.terms, term, key=lambda x: x[:term_length])
+        end_index = bisect_right(self.terms, term, key=lambda x: x[:term_length])
+        matching_terms = zip(self.counts[start_index:end_index], self.terms[start_index:end_index])
+        return [term for _, term in sorted(matching_terms, reverse=True)[:3]]
+
+
+def measure(load: str) -> tuple[float, float]:
+    output = subprocess.check_output([sys.executable, "-c", MEASURE.format(load=load)], text=True)
+    milliseconds, megabytes = output.split()
+    return float(milliseconds), float(megabytes)
+
+
+def latency_by_prefix_length(complete, prefixes_by_length: dict[int, list[str]]) -> dict[int, float]:
+    latencies = {}
+    for length, prefixes in prefixes_by_length.items():
+        start = time.perf_counter()
+        for prefix in prefixes:
+            complete(prefix)
+        latencies[length] = (time.perf_counter() - start) / len(prefixes) * 1e6
+    return latencies
+
+
+def run():
+    print("Method\tLoad ms\tRSS increase MiB")
+    for name, load in [("pandas", LOAD_PANDAS), ("trie", LOAD_TRIE)]:
+        milliseconds, megabytes = measure(load)
+        print(f"{name}\t{milliseconds:.1f}\t{megabytes:.1f}")
+
+    from mwmbl.tinysearchengine.completer import load_terms
+    terms = load_terms()
+    rng = Random(31)
+    words = [term for term, _ in rng.sample(terms, 2000)]
+    prefixes_by_length = {length: [word[:length] for word in words if len(word) >= length]
+                          for length in [1, 2, 3, 5, 8]}
+
+    old = latency_by_prefix_length(BisectCompleter(terms).complete, prefixes_by_length)
+    new = latency_by_prefix_length(Completer().complete, prefixes_by_length)
+    print("\nPrefix length\tbisect µs\ttrie µs")
+    for length in prefixes_by_length:
+        print(f"{length}\t{old[length]:.1f}\t{new[length]:.1f}")
+    print(f"Overall speedup: {np.mean(list(old.values())) / np.mean(list(new.values())):.0f}x")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,126 @@
+"""
+Relevance judge throughput with 1, 4 and 16 concurrent callers, each scoring a Super
+Search's worth of documents per call: every caller running the judge itself, as before
+JudgeBatcher, against every caller sharing the batcher's batches.
+
+Uses the judge at SUPER_SEARCH_JUDGE_MODEL_DIR if it is there. Without it, a stand-in
+with the cross-encoder's shape of cost - a fixed price per forward pass plus a price per
+pair, both spent in numpy with the GIL released - shows what the scheduler does, though
+not what the model would gain.
+
+    python -m analyse.judge_batching_benchmark [CALLS_PER_CALLER] [DOCS_PER_CALL] [WAIT_MS]
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mwmbl.settings_dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from mwmbl.tinysearchengine.super_search_select.judge import (  # noqa: E402
+    BATCH_SIZE, Judge, JudgeBatcher, doc_text,
+)
+
+CALLERS = (1, 4, 16)
+
+
+class SyntheticJudge:
+    """Costs a fixed matmul per forward pass and a slice of one per pair."""
+
+    def __init__(self, hidden: int = 384, tokens_per_pair: int = 48, fixed_tokens: int = 512):
+        rng = np.random.default_rng(0)
+        self.weights = rng.standard_normal((hidden, hidden)).astype(np.float32)
+        self.fixed = rng.standard_normal((fixed_tokens, hidden)).astype(np.float32)
+        self.tokens_per_pair = tokens_per_pair
+
+    def score_pairs(self, pairs: list[tuple[str, str]]) -> list[float]:
+        self.fixed @ self.weights
+        activations = np.ones((len(pairs) * self.tokens_per_pair, self.weights.shape[0]), dtype=np.float32)
+        for _ in range(4):
+            activations = np.tanh(activations @ self.weights / 32)
+        logits = activations.reshape(len(pairs), self.tokens_per_pair, -1).mean(axis=(1, 2))
+        return [float(s) for s in 1 / (1 + np.exp(-logits))]
+
+    def score(self, query: str, doc_texts: list[str]) -> list[float]:
+        scores = []
+        for start in range(0, len(doc_texts), BATCH_SIZE):
+            scores.extend(self.score_pairs([(query, text) for text in doc_texts[start:start + BATCH_SIZE]]))
+        return scores
+
+
+def _load_judge():
+    model_dir = Path(settings.SUPER_SEARCH_JUDGE_MODEL_DIR)
+    if (model_dir / "model.onnx").exists():
+        print(f"Judge: {model_dir}")
+        return Judge(model_dir)
+    print(f"Judge: synthetic stand-in (no model at {model_dir})")
+    return SyntheticJudge()
+
+
+class _CountingJudge:
+    def __init__(self, judge):
+        self.judge = judge
+        self.batch_sizes = []
+
+    def score_pairs(self, pairs):
+        self.batch_sizes.append(len(pairs))
+        return self.judge.score_pairs(pairs)
+
+
+def _run(scorer, callers: int, calls: int, docs: list[str]) -> tuple[float, list[float]]:
+    barrier = threading.Barrier(callers + 1)
+    latencies = [[] for _ in range(callers)]
+
+    def caller(index):
+        barrier.wait()
+        for call in range(calls):
+            start = time.perf_counter()
+            scorer.score(f"query {index} {call}", docs)
+            latencies[index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=caller, args=(index,)) for index in range(callers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, [latency for caller in latencies for latency in caller]
+
+
+def run():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    docs_per_call = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    wait = (float(sys.argv[3]) if len(sys.argv) > 3 else settings.SUPER_SEARCH_JUDGE_BATCH_WAIT_SECONDS * 1000) / 1000
+    judge = _load_judge()
+    docs = [doc_text(f"Result {i}", f"An extract about result {i}. " * 8) for i in range(docs_per_call)]
+    judge.score("warm up", docs)
+
+    print(f"{calls} calls per caller, {docs_per_call} documents per call, {wait * 1000:.1f}ms batch wait")
+    print(f"{'callers':>7} {'mode':<8} {'pairs/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'batches':>8} {'mean fill':>10}")
+    for callers in CALLERS:
+        counting = _CountingJudge(judge)
+        batcher = JudgeBatcher(counting, batch_size=BATCH_SIZE, max_wait=wait)
+        for mode, scorer in (("direct", judge), ("batched", batcher)):
+            elapsed, latencies = _run(scorer, callers, calls, docs)
+            pairs = callers * calls * docs_per_call
+            p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+            if mode == "batched":
+                batches = f"{len(counting.batch_sizes):>8}"
+                fill = f"{np.mean(counting.batch_sizes) / BATCH_SIZE:>10.2f}"
+            else:
+                batches = f"{callers * calls * -(-docs_per_call // BATCH_SIZE):>8}"
+                fill = f"{docs_per_call / (-(-docs_per_call // BATCH_SIZE) * BATCH_SIZE):>10.2f}"
+            print(f"{callers:>7} {mode:<8} {pairs / elapsed:>9.0f} {p50:>8.1f} {p95:>8.1f} {batches} {fill}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,98 @@
+"""
+Throughput of LTR scoring under concurrent requests, with feature extraction on one thread
+per call (the old path) and split across predict_threads.
+
+Each caller thread scores a candidate set of NUM_CANDIDATES records in a loop, as
+concurrent searches do. Alongside them a pure Python thread counts loop iterations: while a
+predict() holds the GIL it cannot run, so its rate shows how much of the process the
+scoring leaves for other requests and the event loop.
+
+    python -m analyse.ltr_predict_throughput [MODEL_PATH]
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+from random import Random
+
+import numpy as np
+
+from mwmbl.tinysearchengine.ltr import RustXGBPipeline
+
+NUM_CANDIDATES = 500
+DURATION_SECONDS = 5.0
+CALLERS = [1, 2, 4, 8]
+
+DEFAULT_MODEL_PATH = Path(__file__).parent.parent / "mwmbl" / "resources" / "model.xgb"
+WORDS = ("python rust search engine index crawler tutorial guide the a open source ranking model web "
+         "documentation reference release notes blog news wiki api library framework").split()
+
+
+def _records(rng: Random) -> list[dict]:
+    query = " ".join(rng.choices(WORDS, k=2))
+    return [{
+        "query": query,
+        "url": f"https://site{rng.randrange(50)}.com/{'/'.join(rng.choices(WORDS, k=2))}",
+        "title": " ".join(rng.choices(WORDS, k=rng.randint(3, 10))),
+        "extract": " ".join(rng.choices(WORDS, k=rng.randint(20, 40))),
+        "score": rng.random(),
+    } for _ in range(NUM_CANDIDATES)]
+
+
+def _ticker(stop: threading.Event, ticks: list[int]):
+    count = 0
+    while not stop.is_set():
+        count += 1
+    ticks.append(count)
+
+
+def _run(model: RustXGBPipeline, callers: int) -> tuple[float, np.ndarray, float]:
+    """Returns (predicts per second, per-call latencies in ms, ticker iterations per second)."""
+    records = _records(Random(30))
+    stop = threading.Event()
+    latencies: list[float] = []
+    ticks: list[int] = []
+
+    def call():
+        while not stop.is_set():
+            start = time.perf_counter()
+            model.predict(records)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    ticker = threading.Thread(target=_ticker, args=(stop, ticks))
+    start = time.perf_counter()
+    for thread in threads + [ticker]:
+        thread.start()
+    time.sleep(DURATION_SECONDS)
+    stop.set()
+    for thread in threads + [ticker]:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, np.array(latencies), ticks[0] / elapsed
+
+
+def run():
+    model_path = sys.argv[1] if len(sys.argv) > 1 else str(DEFAULT_MODEL_PATH)
+    # Reference rate for the ticker with nothing else running.
+    stop, ticks = threading.Event(), []
+    idle = threading.Thread(target=_ticker, args=(stop, ticks))
+    idle.start()
+    time.sleep(1.0)
+    stop.set()
+    idle.join()
+    idle_rate = ticks[0] / 1.0
+
+    print(f"{NUM_CANDIDATES} candidates per predict, {DURATION_SECONDS:.0f}s per run")
+    for predict_threads in [1, None]:
+        model = RustXGBPipeline.from_model_path(model_path, predict_threads=predict_threads)
+        print(f"\n{model!r}")
+        for callers in CALLERS:
+            rate, latencies, tick_rate = _run(model, callers)
+            print(f"{callers:>2} callers: {rate:7.1f} predicts/s, p50 {np.percentile(latencies, 50):6.2f}ms, "
+                  f"p99 {np.percentile(latencies, 99):6.2f}ms, other Python threads ran "
+                  f"{tick_rate / idle_rate:.0%} of idle speed")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,125 @@
+"""
+Generate test/mmr_golden.json: candidate lists and the order the Python MMR implementation
+puts them in, which the native implementation in mwmbl_rank/src/mmr.rs must reproduce.
+
+The cases are random but seeded, and lean on the places a port is most likely to differ:
+repeated domains and near-duplicate text (so the similarity kernel decides the order),
+tied scores, URLs whose netloc urlparse() and a URL library disagree on (case, ports,
+userinfo, no scheme, leading whitespace), and text that str.split() and a naive
+whitespace split tokenize differently.
+
+Regenerate it only when the algorithm or its constants deliberately change:
+
+    python -m analyse.make_mmr_golden
+"""
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+settings.configure()
+
+from mwmbl.tinysearchengine.indexer import Document
+from mwmbl.tinysearchengine.mmr_rank import (
+    DOMAIN_SIMILARITY_WEIGHT, MMR_LAMBDA, MMR_WINDOW, _mmr_order, order_and_rerank,
+)
+
+GOLDEN_PATH = Path(__file__).parent.parent / "test" / "mmr_golden.json"
+
+WORDS = ["python", "rust", "search", "engine", "index", "crawler", "Tutorial", "guide", "the", "a",
+         "Straße", "naïve", "ΟΔΟΣ", "日本語", "café", "open", "source", "ranking", "model", "web"]
+SEPARATORS = [" ", " ", " ", "  ", "\t", "\n", "\x1c", "　", "\xa0"]
+URL_FORMATS = [
+    "https://{host}/{path}",
+    "http://{host}/{path}?q=1",
+    "https://{HOST}/{path}",
+    "https://{host}:8080/{path}",
+    "https://user@{host}/{path}#frag",
+    "{host}/{path}",
+    "//{host}/{path}",
+    "  https://{host}/{path}",
+    "ht\ttps://{host}/{path}",
+    "git+ssh://{host}/{path}",
+]
+HOSTS = ["github.com", "en.wikipedia.org", "example.org", "docs.python.org", "news.ycombinator.com"]
+
+
+def _text(rng: random.Random, length: int) -> str:
+    text = ""
+    for _ in range(length):
+        text += rng.choice(WORDS) + rng.choice(SEPARATORS)
+    text = text.strip(" ")
+    if rng.random() < 0.2:
+        text += "…"
+    return text
+
+
+def _url(rng: random.Random, i: int) -> str:
+    host = rng.choice(HOSTS)
+    return rng.choice(URL_FORMATS).format(host=host, HOST=host.upper(), path=f"page/{i}")
+
+
+def _case(rng: random.Random, name: str, size: int, limit: int) -> dict:
+    candidates = []
+    for i in range(size):
+        title = _text(rng, rng.randint(0, 4))
+        extract = _text(rng, rng.randint(0, 12))
+        candidates.append([title, extract, _url(rng, i)])
+
+    # float32 scores, like the model's, with some exact ties.
+    scores = [float(np.float32(rng.choice([0.5, rng.random()]))) for _ in range(size)]
+    return _expected(name, candidates, scores, limit)
+
+
+def _expected(name: str, candidates: list, scores: list[float], limit: int) -> dict:
+    pages = [Document(title, url, extract) for title, extract, url in candidates]
+    ordered = order_and_rerank(pages, scores, limit)
+    position = {id(page): i for i, page in enumerate(pages)}
+    return {
+        "name": name,
+        "candidates": candidates,
+        "scores": scores,
+        "limit": limit,
+        "reranked": _mmr_order(pages),
+        "ordered": [position[id(page)] for page, _ in ordered],
+    }
+
+
+def run():
+    rng = random.Random(29)
+    cases = [
+        _expected("same domain below a fresh domain", [
+            ["Alpha repo", "alpha project", "https://github.com/x/alpha"],
+            ["Beta repo", "beta project", "https://github.com/x/beta"],
+            ["Gamma site", "gamma encyclopedia entry", "https://example.org/gamma"],
+        ], [0.9, 0.8, 0.7], 100),
+        _expected("two candidates", [
+            ["a", "", "https://github.com/x/a"],
+            ["b", "", "https://github.com/x/b"],
+        ], [0.1, 0.2], 100),
+        _expected("identical candidates", [["same", "same text", "https://github.com/x"]] * 6, [0.5] * 6, 100),
+    ]
+    for size, limit in [(3, 100), (10, 100), (30, 100), (MMR_WINDOW, 100), (80, 100), (150, 100), (150, 40)]:
+        for repeat in range(2):
+            cases.append(_case(rng, f"random {size} limit {limit} #{repeat}", size, limit))
+    # After the random cases, so adding it left their draws - and the fixture - unchanged.
+    cases.append(_expected("bracketed IPv6 hosts", [
+        ["Local", "loopback page", "https://[::1]/a"],
+        ["Local port", "loopback page", "https://[::1]:8080/b"],
+        ["Local again", "another loopback page", "https://[::1]/c"],
+        ["Elsewhere", "a different page", "https://[2001:db8::1]/d"],
+    ], [0.4, 0.9, 0.6, 0.6], 100))
+
+    parameters = {"mmr_lambda": MMR_LAMBDA, "domain_similarity_weight": DOMAIN_SIMILARITY_WEIGHT, "window": MMR_WINDOW}
+    # One case per line keeps the file readable and its diffs small.
+    with open(GOLDEN_PATH, "w") as golden_file:
+        golden_file.write(json.dumps(parameters)[:-1] + ', "cases": [\n')
+        golden_file.write(",\n".join(json.dumps(case, ensure_ascii=False) for case in cases))
+        golden_file.write("\n]}\n")
+    print(f"Wrote {len(cases)} cases to {GOLDEN_PATH}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,348 @@
+"""
+Generate test/recipe_fixtures.json: a response for every HTML and JSON recipe, in
+recipes/ and recipes_reference/, and the documents the recipe engine found in it before
+recipes were compiled and HTML moved from BeautifulSoup's html.parser to lxml.
+
+There are no saved responses from the real sites, so each one is built from its recipe:
+a page (or payload) with result blocks that match the recipe's selectors (or paths),
+wrapped in the kind of things the real ones have around them - navigation, scripts,
+styles, comments, entities, nested inline markup, decoy elements that nearly match.
+The builder is seeded, so the file only changes when the recipes do.
+
+The documents are what the reference engine below - recipe.py's HTML and JSON parsing as
+it was, kept here unchanged - found, so test_super_search_recipes.py can check the
+compiled recipes find the same. analyse/recipe_parse_benchmark.py times both on them.
+Regenerate it when a recipe is added or changed:
+
+    python -m analyse.make_recipe_fixtures
+"""
+import json
+import os
+import random
+import re
+import string
+import sys
+from html import escape
+from pathlib import Path
+from urllib.parse import quote, urljoin
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mwmbl.settings_dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from mwmbl.tinysearchengine.indexer import Document  # noqa: E402
+from mwmbl.tinysearchengine.super_search_sources.recipe import RECIPES_DIR, load_recipes  # noqa: E402
+
+FIXTURES_PATH = Path(__file__).parent.parent / "test" / "recipe_fixtures.json"
+RECIPE_DIRS = [RECIPES_DIR, RECIPES_DIR.parent / "recipes_reference"]
+RESULTS_PER_PAGE = 8
+
+WORDS = ("python rust history guide recipe search engine museum café naïve Straße release notes "
+         "pokémon archive library &amp; <b>bold</b> <em>emphasis</em> &nbsp; &lt;tag&gt; 日本語").split()
+
+
+# ---------------------------------------------------------------------------
+# The reference engine: recipe.py before recipes were compiled
+# ---------------------------------------------------------------------------
+
+def _coerce_str(value, strip_html: bool = False) -> str:
+    if value is None:
+        return ""
+    text = str(value)
+    if strip_html:
+        text = BeautifulSoup(text, "html.parser").get_text(" ", strip=True)
+    return text.strip()
+
+
+def _fill_template(template: str, context: dict) -> str:
+    safe = {k: quote(str(v), safe="") for k, v in context.items() if v is not None}
+    try:
+        return template.format(**safe)
+    except (KeyError, IndexError):
+        return ""
+
+
+def _make_doc(values: dict, url: str):
+    if not url:
+        return None
+    return Document(title=values.get("title", ""), url=url, extract=values.get("extract", ""))
+
+
+def _walk(data, path: str):
+    if not path:
+        return data
+    current = data
+    for part in path.split("."):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        elif isinstance(current, list) and part.lstrip("-").isdigit():
+            try:
+                current = current[int(part)]
+            except IndexError:
+                return None
+        else:
+            return None
+    return current
+
+
+def reference_parse_json(payload, spec: dict) -> list:
+    items = _walk(payload, spec.get("results", "")) or []
+    fields = spec["fields"]
+    strip = set(spec.get("strip_html", []))
+    base_url = spec.get("base_url", "")
+    docs = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        values = {
+            name: _coerce_str(_walk(item, field_spec), name in strip)
+            for name, field_spec in fields.items()
+            if name != "url" and isinstance(field_spec, str)
+        }
+        doc = _make_doc(values, _resolve_url_json(fields.get("url"), item, values, base_url))
+        if doc is not None:
+            docs.append(doc)
+    return docs
+
+
+def _resolve_url_json(url_spec, item: dict, values: dict, base_url: str = "") -> str:
+    if url_spec is None:
+        return ""
+    if isinstance(url_spec, str):
+        url = _coerce_str(_walk(item, url_spec))
+    elif isinstance(url_spec, dict) and "template" in url_spec:
+        url = _fill_template(url_spec["template"], {**item, **values})
+    else:
+        return ""
+    return urljoin(base_url, url) if (url and base_url) else url
+
+
+def reference_parse_html(html_text: str, spec: dict) -> list:
+    soup = BeautifulSoup(html_text, "html.parser")
+    fields = spec["fields"]
+    strip = set(spec.get("strip_html", []))
+    base_url = spec.get("base_url", "")
+    docs = []
+    for el in soup.select(spec["results"]):
+        values = {
+            name: _select_html(el, field_spec, name in strip)
+            for name, field_spec in fields.items()
+            if name != "url"
+        }
+        doc = _make_doc(values, _resolve_url_html(fields.get("url"), el, base_url))
+        if doc is not None:
+            docs.append(doc)
+    return docs
+
+
+def _select_html(el, spec, strip_html: bool = False) -> str:
+    if spec is None:
+        return ""
+    if isinstance(spec, str):
+        spec = {"selector": spec}
+    target = el.select_one(spec["selector"]) if spec.get("selector") else el
+    if target is None:
+        return ""
+    attr = spec.get("attr")
+    value = target.get(attr, "") if attr else target.get_text(" ", strip=True)
+    if not isinstance(value, str):
+        return ""
+    if strip_html and value:
+        value = BeautifulSoup(value, "html.parser").get_text(" ", strip=True)
+    return value.strip()
+
+
+def _resolve_url_html(url_spec, el, base_url: str) -> str:
+    if url_spec is None:
+        return ""
+    href = _select_html(el, url_spec)
+    return urljoin(base_url, href) if (href and base_url) else href
+
+
+# ---------------------------------------------------------------------------
+# Building a response from a recipe
+# ---------------------------------------------------------------------------
+
+_COMPOUND_RE = re.compile(r"([a-zA-Z][\w-]*|\*)?((?:[#.][\w-]+|\[[^\]]*\])*)")
+_ATTRIBUTE_RE = re.compile(r"""\[\s*([\w-]+)\s*(?:([~|^$*]?=)\s*["']?([^"'\]]*)["']?)?\s*\]""")
+
+# Where an element has to be for html.parser and libxml2 alike to leave it where it is.
+_REQUIRED_PARENTS = {"tr": "tbody", "tbody": "table", "td": "tr", "li": "ul", "dt": "dl", "dd": "dl"}
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _compound(part: str) -> dict:
+    tag, rest = _COMPOUND_RE.fullmatch(part).groups()
+    element = {"tag": (tag or "div").replace("*", "div").lower(), "attrs": {}, "classes": [], "children": [],
+               "text": [], "key": part}
+    for token in re.findall(r"[#.][\w-]+|\[[^\]]*\]", rest or ""):
+        if token[0] == "#":
+            element["attrs"]["id"] = token[1:]
+        elif token[0] == ".":
+            element["classes"].append(token[1:])
+        else:
+            name, op, value = _ATTRIBUTE_RE.fullmatch(token).groups()
+            element["attrs"][name] = {"*=": f"./{value}?t=1", "^=": f"{value}/1", "$=": f"x/{value}"}.get(
+                op, value or name)
+    return element
+
+
+def _chain(css: str) -> list[str]:
+    """The compounds of the first selector in a list, outermost first."""
+    return css.split(",")[0].replace(">", " ").split()
+
+
+def _descend(node: dict, css: str) -> dict:
+    """The element ``css`` selects under ``node``, added if there is none yet."""
+    for part in _chain(css):
+        child = next((child for child in node["children"] if child["key"] == part), None)
+        if child is None:
+            child = _compound(part)
+            node["children"].append(child)
+        node = child
+    return node
+
+
+def _render(node: dict, rng: random.Random) -> str:
+    inner = "".join(node["text"]) + "".join(_render_child(node, child, rng) for child in node["children"])
+    classes = node["classes"] + (["js-" + rng.choice(["hover", "card", "row"])] if rng.random() < 0.5 else [])
+    attrs = dict(node["attrs"])
+    if classes:
+        attrs["class"] = " ".join(classes)
+    rendered = "".join(f' {name}="{escape(str(value))}"' for name, value in attrs.items())
+    return f"<{node['tag']}{rendered}>{inner}</{node['tag']}>"
+
+
+def _render_child(parent: dict, child: dict, rng: random.Random) -> str:
+    """Render ``child``, inside the parents HTML requires it to have."""
+    html = _render(child, rng)
+    tag = child["tag"]
+    while tag in _REQUIRED_PARENTS and _REQUIRED_PARENTS[tag] != parent["tag"]:
+        tag = _REQUIRED_PARENTS[tag]
+        html = f"<{tag}>{html}</{tag}>"
+    return html
+
+
+def _result(spec: dict, rng: random.Random, i: int) -> dict:
+    """One result element, with an element for each field."""
+    fields = spec["fields"]
+    result = _compound(_chain(spec["results"])[-1])
+    for name, field_spec in fields.items():
+        if name == "url" or field_spec is None:
+            continue
+        selector = field_spec if isinstance(field_spec, str) else field_spec.get("selector", "")
+        text = _text(rng, 4 if name == "title" else 16)
+        if rng.random() < 0.3:
+            text += " <!-- a comment --> <span>" + _text(rng, 2) + "</span>"
+        _descend(result, selector)["text"].append(text)
+
+    url_spec = fields.get("url")
+    if url_spec is not None:
+        selector = url_spec if isinstance(url_spec, str) else url_spec.get("selector", "")
+        target = _descend(result, selector)
+        if isinstance(url_spec, dict) and url_spec.get("attr"):
+            href = rng.choice([f"/items/{i}?q=a&b=2", f"https://example.org/items/{i}", f"items/{i}"])
+            # An attribute the selector itself asks for wins.
+            target["attrs"].setdefault(url_spec["attr"], href)
+        else:
+            target["text"].append(f"https://example.org/items/{i}")
+    if rng.random() < 0.3:
+        result["text"].append("<script>var tracking = '<a href=\"x\">';</script>")
+    return result
+
+
+def build_html(spec: dict, rng: random.Random) -> str:
+    chain = _chain(spec["results"])
+    container = {"tag": "main", "attrs": {}, "classes": [], "text": [], "children": [], "key": ""}
+    parent = container
+    for part in chain[:-1]:
+        parent = _descend(parent, part)
+    parent["children"] = [_result(spec, rng, i) for i in range(RESULTS_PER_PAGE)]
+    # A near miss: the result's tag without its classes or attributes.
+    decoy = _compound(parent["children"][0]["tag"])
+    decoy["classes"], decoy["text"] = ["sidebar"], [_text(rng, 5)]
+    parent["children"].insert(RESULTS_PER_PAGE // 2, decoy)
+    nav = "".join(f'<li><a href="/section/{i}">{_text(rng, 1)}</a></li>' for i in range(30))
+    return (
+        "<!DOCTYPE html>\n<html lang=\"en\"><head><meta charset=\"utf-8\"><title>Search results</title>"
+        "<style>body { margin: 0 } .result > a { color: red }</style>"
+        "<script>window.dataLayer = [{'page': '<div class=\"x\">'}];</script></head>\n"
+        f"<body><header><nav><ul>{nav}</ul></nav></header>\n"
+        f"{_render(container, rng)}\n"
+        f"<footer><p>{_text(rng, 20)}</p><!-- footer --></footer></body></html>\n"
+    )
+
+
+def _put(payload: dict, path: str, value) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        payload = payload.setdefault(part, {})
+    payload[parts[-1]] = value
+
+
+def build_json(spec: dict, rng: random.Random):
+    items = []
+    for i in range(RESULTS_PER_PAGE):
+        item = {}
+        for name, field_spec in spec["fields"].items():
+            if isinstance(field_spec, str):
+                value = _text(rng, 4 if name == "title" else 16) if name != "url" else f"/items/{i}"
+                _put(item, field_spec, value)
+            elif isinstance(field_spec, dict) and "template" in field_spec:
+                for _, key, _, _ in string.Formatter().parse(field_spec["template"]):
+                    if key and key not in spec["fields"]:
+                        item[key] = f"{_text(rng, 1)} {i}"
+        items.append(item)
+    items.insert(RESULTS_PER_PAGE // 2, "not a result")
+    results = spec.get("results", "")
+    if not results:
+        return items
+    payload = {}
+    path = results.split(".")
+    if path[-1].isdigit():
+        path = path[:-1]
+    _put(payload, ".".join(path), [items] if len(path) < len(results.split(".")) else items)
+    return payload
+
+
+def run():
+    rng = random.Random(47)
+    cases = []
+    for directory in RECIPE_DIRS:
+        for name, recipe in sorted(load_recipes(directory).items()):
+            spec = recipe.response
+            fmt = recipe.response_format
+            if fmt == "html":
+                body = build_html(spec, rng)
+                docs = reference_parse_html(body, spec)
+            elif fmt == "json":
+                body = build_json(spec, rng)
+                docs = reference_parse_json(body, spec)
+            else:
+                continue
+            cases.append({
+                "recipe": name,
+                "directory": directory.name,
+                "format": fmt,
+                "body": body,
+                "documents": [[doc.title, doc.url, doc.extract] for doc in docs],
+            })
+
+    empty = [case["recipe"] for case in cases if not case["documents"]]
+    if empty:
+        print(f"Warning: no documents from {', '.join(empty)}", file=sys.stderr)
+    # One case per line keeps the file's diffs small.
+    with open(FIXTURES_PATH, "w") as fixtures_file:
+        fixtures_file.write("[\n" + ",\n".join(json.dumps(case, ensure_ascii=False) for case in cases) + "\n]\n")
+    print(f"Wrote {len(cases)} cases to {FIXTURES_PATH}")
+
+
+if __name__ == "__main__":
+    run()
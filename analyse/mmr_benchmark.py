@@ -0,0 +1,77 @@
+"""
+End-to-end cost of ordering scored candidates and diversifying them with MMR, as Super
+Search does for its final results: sort by score, keep the top SUPER_SEARCH_FINAL_RESULTS_LIMIT
+and rerank. Compares the Python implementation with mwmbl_rank's native mmr_order, including
+the cost of handing the candidates over to Rust.
+
+    python -m analyse.mmr_benchmark [NUM_CANDIDATES]
+"""
+import sys
+import time
+from random import Random
+
+import numpy as np
+from django.conf import settings
+
+settings.configure()
+
+from mwmbl.tinysearchengine import mmr_rank
+from mwmbl.tinysearchengine.indexer import Document
+from mwmbl.tinysearchengine.mmr_rank import order_and_rerank
+
+LIMIT = 100
+REPEATS = 200
+
+WORDS = ("python rust search engine index crawler tutorial guide the a open source ranking model web "
+         "documentation reference release notes blog news wiki api library framework").split()
+DOMAINS = ["github.com", "en.wikipedia.org", "docs.python.org", "news.ycombinator.com", "stackoverflow.com",
+           "medium.com", "reddit.com", "example.org"] + [f"site{i}.com" for i in range(40)]
+
+
+def _candidates(rng: Random, count: int) -> tuple[list[Document], list[float]]:
+    pages = []
+    for i in range(count):
+        title = " ".join(rng.choices(WORDS, k=rng.randint(3, 10)))
+        extract = " ".join(rng.choices(WORDS, k=rng.randint(20, 40)))
+        pages.append(Document(title, f"https://{rng.choice(DOMAINS)}/page/{i}", extract))
+    scores = [float(np.float32(rng.random())) for _ in range(count)]
+    return pages, scores
+
+
+def _time(pages: list[Document], scores: list[float]) -> np.ndarray:
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        order_and_rerank(pages, scores, LIMIT)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def _report(name: str, timings: np.ndarray):
+    print(f"{name:>8}: p50 {np.percentile(timings, 50):.2f}ms, p99 {np.percentile(timings, 99):.2f}ms, "
+          f"mean {timings.mean():.2f}ms")
+
+
+def run():
+    num_candidates = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    pages, scores = _candidates(Random(29), num_candidates)
+    print(f"Ordering {num_candidates} candidates, keeping {LIMIT}, {REPEATS} repeats")
+
+    native = mmr_rank._native_mmr_order
+    if native is not None:
+        native_timings = _time(pages, scores)
+        _report("native", native_timings)
+    else:
+        print("  native: mwmbl_rank is not built with mmr_order (maturin develop --release)")
+
+    mmr_rank._native_mmr_order = None
+    python_timings = _time(pages, scores)
+    mmr_rank._native_mmr_order = native
+    _report("python", python_timings)
+
+    if native is not None:
+        print(f"Speedup at p50: {np.percentile(python_timings, 50) / np.percentile(native_timings, 50):.1f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,61 @@
+"""
+Cold-cache latency of a query's index page reads, one after another versus overlapped on
+Ranker's page read pool.
+
+Each simulated query reads PAGES_PER_QUERY random pages, roughly what a two or three word
+query with completions and bigrams reads. The index file is dropped from the page cache
+before every query, so every read goes to the disk. Run it against a copy of the real
+index to see the effect on production storage:
+
+    python -m analyse.page_read_latency ~/mwmbl-data/index-v2.tinysearch
+"""
+import os
+import sys
+import time
+from random import Random
+
+import numpy as np
+from django.conf import settings
+
+from mwmbl.tinysearchengine.indexer import TinyIndex, Document
+
+NUM_QUERIES = 200
+PAGES_PER_QUERY = 12
+
+random = Random(2)
+
+
+def drop_from_page_cache(index: TinyIndex):
+    os.posix_fadvise(index.index_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def serial(index: TinyIndex, pages: list[int]):
+    return [index.get_page(page) for page in pages]
+
+
+def concurrent(index: TinyIndex, pages: list[int]):
+    # Imported here because rank reads the settings, which are configured only when run as a script.
+    from mwmbl.tinysearchengine.rank import _PAGE_READ_EXECUTOR
+    return list(_PAGE_READ_EXECUTOR.map(index.get_page, pages))
+
+
+def run():
+    index_path = sys.argv[1]
+    with TinyIndex(Document, index_path) as index:
+        queries = [[random.randrange(index.num_pages) for _ in range(PAGES_PER_QUERY)] for _ in range(NUM_QUERIES)]
+
+        print("Method\tMean ms\tp50 ms\tp99 ms")
+        for method in [serial, concurrent]:
+            times = []
+            for pages in queries:
+                drop_from_page_cache(index)
+                start = time.perf_counter()
+                method(index, pages)
+                times.append((time.perf_counter() - start) * 1000)
+            print(f"{method.__name__}\t{np.mean(times):.2f}\t{np.percentile(times, 50):.2f}\t"
+                  f"{np.percentile(times, 99):.2f}")
+
+
+if __name__ == '__main__':
+    settings.configure()
+    run()
@@ -0,0 +1,62 @@
+"""
+Per-recipe parse time: the compiled recipe (lxml and XPath for HTML) against the engine it
+replaced (BeautifulSoup's html.parser and soupsieve, the recipe reinterpreted on every call),
+on the responses in test/recipe_fixtures.json - see analyse/make_recipe_fixtures.py.
+
+Only parsing is timed: building Documents from a response the source has already sent.
+
+    python -m analyse.recipe_parse_benchmark [REPEATS] [FORMAT]
+"""
+import json
+import sys
+import time
+
+import numpy as np
+
+from analyse.make_recipe_fixtures import (
+    FIXTURES_PATH, RECIPE_DIRS, load_recipes, reference_parse_html, reference_parse_json,
+)
+
+
+def _time(parse, body, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parse(body)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def run():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    only = sys.argv[2] if len(sys.argv) > 2 else None
+    recipes = {(directory.name, name): recipe
+               for directory in RECIPE_DIRS for name, recipe in load_recipes(directory).items()}
+    cases = json.loads(FIXTURES_PATH.read_text())
+
+    print(f"{'recipe':<40} {'format':<6} {'bytes':>7} {'before ms':>10} {'after ms':>9} {'speedup':>8}")
+    totals = {}
+    for case in cases:
+        fmt = case["format"]
+        if only and fmt != only:
+            continue
+        recipe = recipes[(case["directory"], case["recipe"])]
+        spec, parser, body = recipe.response, recipe.parser, case["body"]
+        if fmt == "html":
+            before = _time(lambda text: reference_parse_html(text, spec), body, repeats)
+            after = _time(parser.parse_text, body, repeats)
+            size = len(body.encode())
+        else:
+            before = _time(lambda payload: reference_parse_json(payload, spec), body, repeats)
+            after = _time(parser.parse_payload, body, repeats)
+            size = len(json.dumps(body).encode())
+        total_before, total_after = totals.get(fmt, (0.0, 0.0))
+        totals[fmt] = (total_before + before, total_after + after)
+        print(f"{case['recipe']:<40} {fmt:<6} {size:>7} {before:>10.3f} {after:>9.3f} {before / after:>7.1f}x")
+
+    for fmt, (before, after) in sorted(totals.items()):
+        print(f"All {fmt} recipes: {before:.1f}ms before, {after:.1f}ms after, {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,427 @@
+"""
+Load test of the search serving path against a synthetic index, needing nothing but
+localhost.
+
+load_test.py replays rankeval queries against whatever server is already running on
+port 5000, with whatever index it has, so two runs of it are not comparable. This builds
+its own TinyIndex, serves it with the same search, /complete and /raw routers the site
+uses, and replays a query mix drawn from a seed, so the same arguments give the same
+index and the same requests in the same order on every commit:
+
+    python -m analyse.search_load_test --seed 1 --requests 5000 --concurrency 8
+    python -m analyse.search_load_test --server gunicorn --workers 4 --json after.json
+    python -m analyse.search_load_test --server gunicorn --workers 4 --preload --model <model>
+
+The index holds a page of documents for each of the --vocabulary most common crawl terms
+(the ones the completer knows), a term's share of the documents falling off as a Zipf
+distribution with exponent --term-zipf. The queries are one to three of those terms, and
+how often each is asked again falls off with --query-zipf, as it does in the query log:
+a head of popular queries and a long tail. Each request goes to one of
+/api/v1/search/, /api/v2/search/ (unauthenticated), /complete (a prefix of the query, as
+typed) or /raw, in the proportions given by --mix.
+
+--server inprocess runs a single uvicorn server on a thread of this process, the ASGI
+application a production worker runs; --server gunicorn starts gunicorn on the same
+application with uvicorn workers, as main.run does. Ranking is the heuristic ranker
+unless --model gives an LTR model, in which case it is the production MMRRanker over
+LTRRanker, without live Wikipedia lookups. The search result cache and the ETags need
+Redis for the index generation counters, so they are off unless --redis-url is given.
+Blacklist filtering is off for the same reason. The client never sends If-None-Match.
+
+--preload builds the index and ranker once in the gunicorn master, as main.run does with
+SERVING_PRELOAD, and the workers are forked from it. For the comparison with and without
+it, the gunicorn report includes how long the server took to answer its first request
+and each worker's memory after the run, from /proc: proportional set size (PSS, shared
+pages split between the processes sharing them) and private, the pages no other process
+shares. The synthetic index is read through the page cache either way, so the difference
+is the model, completer and ranker - run it with --model to see the LTR model's share.
+
+The report is throughput and latency percentiles for each endpoint, measured by the
+client, and the median of each stage from the Server-Timing headers (see
+request_timing). --json writes the same, with the arguments, for comparing runs.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+
+import numpy as np
+import requests
+
+# Spelled out for gunicorn: run with -m, this module's __name__ is __main__.
+MODULE = "analyse.search_load_test"
+CONFIG_VARIABLE = "MWMBL_LOAD_TEST_CONFIG"
+ENDPOINTS = {
+    "search_v1": ("/api/v1/search/", "s"),
+    "search_v2": ("/api/v2/search/", "q"),
+    "complete": ("/api/v1/search/complete", "q"),
+    "raw": ("/api/v1/search/raw", "s"),
+}
+FILLER_WORDS = 30
+NUM_DOMAINS = 500
+SERVER_START_SECONDS = 60
+
+# Filled in by configure(); Django is given this module as its URLconf.
+urlpatterns = []
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pages", type=int, default=20_000, help="pages in the synthetic index")
+    parser.add_argument("--page-size", type=int, default=4096)
+    parser.add_argument("--vocabulary", type=int, default=5_000, help="terms with documents in the index")
+    parser.add_argument("--documents-per-term", type=int, default=200,
+                        help="documents for the most common term; pages keep as many as fit")
+    parser.add_argument("--term-zipf", type=float, default=1.0, help="how fast documents per term fall off")
+    parser.add_argument("--distinct-queries", type=int, default=2_000)
+    parser.add_argument("--query-zipf", type=float, default=1.1, help="how fast query popularity falls off")
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--warmup", type=int, default=200, help="requests sent first and not measured")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads, each one request at a time")
+    parser.add_argument("--mix", default="search_v1=0.35,search_v2=0.35,complete=0.2,raw=0.1")
+    parser.add_argument("--server", choices=["inprocess", "gunicorn"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() * 2 + 1, help="gunicorn workers")
+    parser.add_argument("--preload", action="store_true", help="build the serving state in the gunicorn master")
+    parser.add_argument("--model", help="LTR model to rank with instead of the heuristic ranker")
+    parser.add_argument("--redis-url", help="Redis for the search result cache; off without it")
+    parser.add_argument("--json", help="also write the results here")
+    return parser.parse_args(argv)
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r} in --mix, expected one of {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight)
+    total = sum(weights.values())
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def zipf_weights(count: int, exponent: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def load_vocabulary(size: int) -> list[str]:
+    from mwmbl.tinysearchengine.completer import load_terms
+    terms = sorted(load_terms(), key=lambda pair: (-pair[1], pair[0]))
+    return [term for term, _ in terms if term.isalpha()][:size]
+
+
+def build_index(path: str, args, vocabulary: list[str]) -> int:
+    """Write the synthetic index and return how many documents it holds."""
+    from mwmbl.tinysearchengine.indexer import TinyIndex, Document
+
+    rng = np.random.default_rng(args.seed)
+    word_weights = zipf_weights(len(vocabulary), args.term_zipf)
+    domains = [f"{vocabulary[i % len(vocabulary)]}{i}.example.com" for i in range(NUM_DOMAINS)]
+    domain_weights = zipf_weights(NUM_DOMAINS, 1.0)
+
+    pages = defaultdict(list)
+    TinyIndex.create(Document, path, args.pages, args.page_size)
+    with TinyIndex(Document, path, mode='w') as index:
+        for rank, word in enumerate(vocabulary):
+            num_documents = max(1, int(args.documents_per_term * word_weights[rank] / word_weights[0]))
+            fillers = rng.choice(len(vocabulary), size=(num_documents, FILLER_WORDS), p=word_weights)
+            document_domains = rng.choice(NUM_DOMAINS, size=num_documents, p=domain_weights)
+            scores = rng.random(num_documents)
+            for filler, domain, score in zip(fillers, document_domains, scores):
+                words = [vocabulary[i] for i in filler]
+                title = " ".join([word] + words[:4])
+                url = f"https://{domains[domain]}/{word}/{'-'.join(words[4:7])}"
+                extract = " ".join(words[7:] + [word])
+                pages[index.get_key_page_index(word)].append(Document(title, url, extract, float(score), term=word))
+        for page_index, documents in sorted(pages.items()):
+            index.store_in_page(page_index, documents)
+    return sum(len(documents) for documents in pages.values())
+
+
+def make_requests(args, vocabulary: list[str]) -> list[tuple[str, str]]:
+    """The (endpoint, query) pairs to send, warmup first, in order."""
+    rng = np.random.default_rng(args.seed + 1)
+    word_weights = zipf_weights(len(vocabulary), args.term_zipf)
+    queries = []
+    for _ in range(args.distinct_queries):
+        num_terms = rng.choice([1, 2, 3], p=[0.4, 0.4, 0.2])
+        queries.append(" ".join(vocabulary[i] for i in rng.choice(len(vocabulary), size=num_terms, p=word_weights)))
+
+    mix = parse_mix(args.mix)
+    endpoints = rng.choice(list(mix), size=args.warmup + args.requests, p=list(mix.values()))
+    picks = rng.choice(len(queries), size=args.warmup + args.requests,
+                       p=zipf_weights(len(queries), args.query_zipf))
+    sent = []
+    for endpoint, pick in zip(endpoints, picks):
+        query = queries[pick]
+        if endpoint == "complete":
+            query = query[:rng.integers(min(2, len(query)), len(query) + 1)]
+        sent.append((str(endpoint), query))
+    return sent
+
+
+def configure(config: dict) -> None:
+    """Set Django up to serve the synthetic index. Before any other mwmbl import."""
+    from django.conf import settings
+    from mwmbl import settings_common
+
+    # Every mwmbl setting as the site has it, then the differences for serving from here.
+    site_settings = {name: getattr(settings_common, name) for name in dir(settings_common) if name.isupper()}
+    settings.configure(**dict(
+        site_settings,
+        DEBUG=False,
+        ALLOWED_HOSTS=["127.0.0.1", "localhost"],
+        INSTALLED_APPS=["django.contrib.auth", "django.contrib.contenttypes", "django.contrib.postgres", "mwmbl"],
+        MIDDLEWARE=["mwmbl.request_timing.ServerTimingMiddleware", "django.middleware.common.CommonMiddleware"],
+        ROOT_URLCONF=sys.modules[__name__],
+        DATABASES={},
+        HAS_DATABASE=False,
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+        LOGGING={"version": 1, "disable_existing_loggers": False, "root": {"level": "ERROR"}},
+        DATA_PATH=str(Path(config["index_path"]).parent),
+        INDEX_NAME=Path(config["index_path"]).name,
+        NUM_PAGES=config["pages"],
+        REDIS_URL=config["redis_url"] or "redis://127.0.0.1:6379",
+        SEARCH_RESULT_CACHE_ENABLED=config["redis_url"] is not None,
+        SEARCH_ETAGS_ENABLED=config["redis_url"] is not None,
+        BLACKLIST_FILTER_AT_RETRIEVAL=False,
+    ))
+
+
+def make_application(config: dict):
+    """The ASGI application a worker serves: the site's search routers on the synthetic index."""
+    configure(config)
+    import django
+    django.setup()
+
+    from django.core.asgi import get_asgi_application
+    from django.urls import path
+    from ninja import NinjaAPI
+
+    from mwmbl.tinysearchengine import search
+    from mwmbl.tinysearchengine.completer import Completer
+    from mwmbl.tinysearchengine.indexer import TinyIndex, Document
+    from mwmbl.tinysearchengine.rank import HeuristicRanker
+
+    tiny_index = TinyIndex(Document, config["index_path"])
+    tiny_index.__enter__()
+    if config["model_path"] is None:
+        ranker = HeuristicRanker(tiny_index, Completer())
+    else:
+        from django.conf import settings
+        from mwmbl.tinysearchengine.ltr import RustXGBPipeline
+        from mwmbl.tinysearchengine.ltr_rank import LTRRanker
+        from mwmbl.tinysearchengine.mmr_rank import MMRRanker
+        model = RustXGBPipeline.from_model_path(config["model_path"], predict_threads=settings.LTR_PREDICT_THREADS)
+        ranker = MMRRanker(LTRRanker(tiny_index, Completer(), model, include_wiki=False))
+
+    search.init_router(ranker)
+    search.init_v2_router(ranker)
+    v1_api = NinjaAPI(urls_namespace="load-test-v1")
+    v1_api.add_router("/search/", search.router)
+    v2_api = NinjaAPI(urls_namespace="load-test-v2", version="2.0.0")
+    v2_api.add_router("/search/", search.v2_router)
+    urlpatterns[:] = [path("api/v1/", v1_api.urls), path("api/v2/", v2_api.urls)]
+    return get_asgi_application()
+
+
+def worker_application():
+    """Entry point for the gunicorn workers, configured by the parent through the environment.
+    Called once in the master instead with --preload."""
+    config = json.loads(os.environ[CONFIG_VARIABLE])
+    application = make_application(config)
+    if config["preload"]:
+        from mwmbl.main import preload_serving_state
+        preload_serving_state()
+    return application
+
+
+def free_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def wait_until_serving(base_url: str, server_process=None) -> None:
+    deadline = time.monotonic() + SERVER_START_SECONDS
+    while time.monotonic() < deadline:
+        if server_process is not None and server_process.poll() is not None:
+            raise RuntimeError(f"The server exited with code {server_process.returncode}")
+        try:
+            requests.get(f"{base_url}/api/v1/search/raw", params={"s": "a"}, timeout=5)
+            return
+        except requests.RequestException:
+            # Refused before gunicorn binds, and accepted but not answered while its workers boot
+            time.sleep(0.2)
+    raise RuntimeError(f"The server did not start within {SERVER_START_SECONDS}s")
+
+
+def start_inprocess(config: dict, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(make_application(config), host="127.0.0.1", port=port,
+                                          log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return stop
+
+
+def start_gunicorn(config: dict, port: int, workers: int):
+    environment = dict(os.environ, **{CONFIG_VARIABLE: json.dumps(config)})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", f"{MODULE}:worker_application()", "--bind", f"127.0.0.1:{port}",
+         "--workers", str(workers), "--worker-class", "uvicorn.workers.UvicornWorker",
+         "--log-level", "warning", "--timeout", "120"] + (["--preload"] if config["preload"] else []),
+        env=environment, cwd=Path(__file__).parent.parent)
+
+    def stop():
+        process.terminate()
+        process.wait()
+    return stop, process
+
+
+def worker_memory(master_pid: int) -> list[dict[str, float]]:
+    """PSS and private memory of each of the gunicorn master's workers, in MB. Linux only."""
+    try:
+        children = Path(f"/proc/{master_pid}/task/{master_pid}/children").read_text().split()
+    except OSError:
+        return []
+    workers = []
+    for pid in children:
+        try:
+            rollup = Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines()
+        except OSError:
+            continue
+        kilobytes = {line.split(":")[0]: int(line.split()[1]) for line in rollup if line.endswith(" kB")}
+        workers.append({"pss_mb": kilobytes["Pss"] / 1024,
+                        "private_mb": (kilobytes["Private_Clean"] + kilobytes["Private_Dirty"]) / 1024})
+    return workers
+
+
+_sessions = threading.local()
+
+
+def send(base_url: str, endpoint: str, query: str) -> tuple[str, float, bool, dict[str, float]]:
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    path, parameter = ENDPOINTS[endpoint]
+    started = time.perf_counter()
+    try:
+        response = session.get(f"{base_url}{path}", params={parameter: query}, timeout=30)
+        ok = response.status_code == 200
+        stages = dict((name, float(duration)) for name, _, duration in
+                      (entry.partition(";dur=") for entry in response.headers.get("Server-Timing", "").split(", ")
+                       if ";dur=" in entry))
+    except requests.RequestException:
+        ok, stages = False, {}
+    return endpoint, (time.perf_counter() - started) * 1000, ok, stages
+
+
+def replay(base_url: str, sent: list[tuple[str, str]], concurrency: int):
+    with ThreadPool(concurrency) as pool:
+        started = time.perf_counter()
+        responses = pool.starmap(send, [(base_url, endpoint, query) for endpoint, query in sent])
+        return responses, time.perf_counter() - started
+
+
+def summarise(responses, seconds: float) -> dict[str, dict]:
+    by_endpoint = defaultdict(list)
+    for response in responses:
+        by_endpoint[response[0]].append(response)
+        by_endpoint["all"].append(response)
+
+    summary = {}
+    for endpoint in list(ENDPOINTS) + ["all"]:
+        if endpoint not in by_endpoint:
+            continue
+        endpoint_responses = by_endpoint[endpoint]
+        latencies = np.array([latency for _, latency, _, _ in endpoint_responses])
+        stages = defaultdict(list)
+        for _, _, _, response_stages in endpoint_responses:
+            for name, duration in response_stages.items():
+                stages[name].append(duration)
+        summary[endpoint] = {
+            "requests": len(endpoint_responses),
+            "errors": sum(not ok for _, _, ok, _ in endpoint_responses),
+            "per_second": len(endpoint_responses) / seconds,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p90_ms": float(np.percentile(latencies, 90)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+            "stage_p50_ms": {name: float(np.median(durations)) for name, durations in stages.items()},
+        }
+    return summary
+
+
+def report(summary: dict[str, dict], seconds: float) -> None:
+    print(f"{summary['all']['requests']} requests in {seconds:.1f}s")
+    print("Endpoint\tRequests\tErrors\tReq/s\tp50 ms\tp90 ms\tp99 ms\tmax ms")
+    for endpoint, row in summary.items():
+        print(f"{endpoint}\t{row['requests']}\t{row['errors']}\t{row['per_second']:.1f}\t{row['p50_ms']:.2f}\t"
+              f"{row['p90_ms']:.2f}\t{row['p99_ms']:.2f}\t{row['max_ms']:.2f}")
+    print("Median stage ms (Server-Timing)")
+    for endpoint, row in summary.items():
+        if endpoint != "all" and row["stage_p50_ms"]:
+            stages = ", ".join(f"{name} {duration:.2f}" for name, duration in row["stage_p50_ms"].items())
+            print(f"{endpoint}\t{stages}")
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    vocabulary = load_vocabulary(args.vocabulary)
+    sent = make_requests(args, vocabulary)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path = str(Path(temp_dir) / "load-test.tinysearch")
+        num_documents = build_index(index_path, args, vocabulary)
+        print(f"Synthetic index: {args.pages} pages of {args.page_size} bytes, {len(vocabulary)} terms, "
+              f"{num_documents} documents (seed {args.seed})")
+
+        config = {"index_path": index_path, "pages": args.pages, "model_path": args.model,
+                  "redis_url": args.redis_url, "preload": args.preload}
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        started = time.monotonic()
+        if args.server == "inprocess":
+            stop, process = start_inprocess(config, port), None
+        else:
+            stop, process = start_gunicorn(config, port, args.workers)
+
+        workers = []
+        try:
+            wait_until_serving(base_url, process)
+            startup_seconds = time.monotonic() - started
+            replay(base_url, sent[:args.warmup], args.concurrency)
+            responses, seconds = replay(base_url, sent[args.warmup:], args.concurrency)
+            if process is not None:
+                workers = worker_memory(process.pid)
+        finally:
+            stop()
+
+    summary = summarise(responses, seconds)
+    report(summary, seconds)
+    print(f"First response {startup_seconds:.1f}s after starting the server")
+    if workers:
+        print(f"{len(workers)} workers: mean PSS {np.mean([w['pss_mb'] for w in workers]):.1f} MB, "
+              f"mean private {np.mean([w['private_mb'] for w in workers]):.1f} MB")
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"arguments": vars(args), "seconds": seconds, "startup_seconds": startup_seconds,
+                       "workers": workers, "endpoints": summary}, output, indent=2)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,50 @@
+"""
+Startup time and resident memory of the static ranking tables, loaded as Python dicts
+(the old way) versus opened as compiled tables (static_tables.py).
+
+Each method runs in a fresh interpreter so neither sees the other's allocations. Run the
+build step first so the compiled tables are measured rather than compiled:
+
+    python -m mwmbl.tinysearchengine.static_tables
+    python -m analyse.static_tables_memory
+"""
+import subprocess
+import sys
+
+MEASURE = """
+import json, time, psutil
+from mwmbl.tinysearchengine import static_tables  # numpy and mmh3 are needed either way
+process = psutil.Process()
+rss_before = process.memory_info().rss
+start = time.perf_counter()
+{load}
+elapsed = time.perf_counter() - start
+print(elapsed * 1000, (process.memory_info().rss - rss_before) / 2 ** 20)
+"""
+
+LOAD_DICTS = """
+wiki_scores = json.load(open(static_tables.WIKI_SCORES_SOURCE))
+document_frequencies = json.load(open(static_tables.DOCUMENT_FREQUENCIES_SOURCE))
+from mwmbl.hn_top_domains_filtered import DOMAINS
+"""
+
+LOAD_TABLES = """
+tables = [static_tables.get_table(name) for name in ("wiki_scores", "document_frequencies", "domains")]
+"""
+
+
+def measure(load: str) -> tuple[float, float]:
+    output = subprocess.check_output([sys.executable, "-c", MEASURE.format(load=load)], text=True)
+    milliseconds, megabytes = output.split()
+    return float(milliseconds), float(megabytes)
+
+
+def run():
+    print("Method\tLoad ms\tRSS increase MiB")
+    for name, load in [("dicts", LOAD_DICTS), ("tables", LOAD_TABLES)]:
+        milliseconds, megabytes = measure(load)
+        print(f"{name}\t{milliseconds:.1f}\t{megabytes:.1f}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,97 @@
+"""
+Throughput of the source-selection text projections (super_search_select/vectors.py): the
+per-item loop they replaced, against the batch API and the single-text functions built on
+it. The hash memo is cleared before each "cold" repeat, so those rows pay for every hash
+the way a fresh process does; "warm" rows reuse the vocabulary, as a long-running one does.
+Every output is checked bit-for-bit against the loop before anything is timed.
+
+The texts are seeded stand-ins for a site's result sample (profiles.sample_text): words
+drawn from a Zipfian vocabulary, WORDS_PER_TEXT of them.
+
+    python -m analyse.vector_projection_benchmark [TEXTS] [WORDS_PER_TEXT] [REPEATS]
+"""
+import sys
+import time
+
+import numpy as np
+
+from mwmbl.tinysearchengine.super_search_select import vectors
+
+DIM = 64
+SEED = 0
+
+
+def loop_projection(features, dim: int) -> np.ndarray:
+    vec = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        index, sign = vectors._hash_token(feature, dim)
+        vec[index] += sign
+    return vectors._l2_normalise(vec)
+
+
+def loop_bow(text: str, dim: int) -> np.ndarray:
+    return loop_projection(vectors._content_tokens(text, True), dim)
+
+
+def loop_char_ngrams(text: str, dim: int) -> np.ndarray:
+    grams = []
+    for token in vectors._content_tokens(text, True):
+        padded = f" {token} "
+        for n in range(3, 6):
+            grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return loop_projection(grams, dim)
+
+
+def make_texts(count: int, words_per_text: int) -> list[str]:
+    rng = np.random.default_rng(SEED)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    vocabulary = ["".join(rng.choice(letters, size=rng.integers(2, 11))) for _ in range(20_000)]
+    vocabulary[:len(vectors.STOP_WORDS)] = sorted(vectors.STOP_WORDS)
+    weights = 1 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+    return [" ".join(rng.choice(vocabulary, size=words_per_text, p=weights)) for _ in range(count)]
+
+
+def _time(project, texts, repeats: int, cold: bool) -> float:
+    timings = []
+    for _ in range(repeats):
+        if cold:
+            vectors._token_hash.cache_clear()
+        start = time.perf_counter()
+        project(texts)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def run():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    words = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    texts = make_texts(count, words)
+
+    kinds = {
+        "bow": (loop_bow, vectors.project_bow, vectors.project_bow_batch),
+        "char n-grams": (loop_char_ngrams, vectors.project_char_ngrams, vectors.project_char_ngrams_batch),
+    }
+    for name, (loop, single, batch) in kinds.items():
+        expected = np.stack([loop(text, DIM) for text in texts])
+        assert batch(texts, DIM).tobytes() == expected.tobytes(), f"{name}: batch differs from the loop"
+        assert np.stack([single(text, DIM) for text in texts]).tobytes() == expected.tobytes()
+
+    print(f"{count} texts of {words} words, dim {DIM}, median of {repeats}")
+    print(f"{'projection':<14} {'implementation':<20} {'texts/s':>9} {'speedup':>8}")
+    for name, (loop, single, batch) in kinds.items():
+        before = _time(lambda ts: [loop(text, DIM) for text in ts], texts, repeats, cold=False)
+        print(f"{name:<14} {'loop (before)':<20} {count / before:>9.0f} {1.0:>7.1f}x")
+        for label, project, cold in (
+            ("single, cold", lambda ts: [single(text, DIM) for text in ts], True),
+            ("single, warm", lambda ts: [single(text, DIM) for text in ts], False),
+            ("batch, cold", lambda ts: batch(ts, DIM), True),
+            ("batch, warm", lambda ts: batch(ts, DIM), False),
+        ):
+            elapsed = _time(project, texts, repeats, cold)
+            print(f"{name:<14} {label:<20} {count / elapsed:>9.0f} {before / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    run()
@@ -27,7 +27,7 @@ from mwmbl.indexer.blacklist_snapshot import get_snapshot_blacklist, refresh_sna
 from mwmbl.indexer.purge_blacklisted import purge_documents
 from mwmbl.indexer.purge_queue import drain_purge_queue, queue_size
 from mwmbl.models import OldIndex, UsageBucket
-from mwmbl.quota import MONTHLY_TTL, _monthly_key, get_all_monthly_keys
+from mwmbl.quota import MONTHLY_TTL, _monthly_key, add_active_users, backfill_active_users, get_all_monthly_keys
 from mwmbl.tinysearchengine.copy_index import copy_pages
 from mwmbl.tinysearchengine.indexer import Document, TinyIndex
 
@@ -106,7 +106,9 @@ def sync_search_counts():
     Bidirectional sync between Redis and UsageBucket, run once per hour.
 
     Step 1 (Postgres → Redis): seed any missing Redis keys from UsageBucket.
-    This restores counters after a Redis restart without persistence.
+    This restores counters after a Redis restart without persistence. Seeded users
+    are added to the month's active set, as are (once a month, by SCAN) users whose
+    counters predate the set, so step 2 sees their counters before they search again.
 
     Step 2 (Redis → Postgres): update UsageBucket with the live Redis counts
     so Postgres stays current as a durable backup.
@@ -118,6 +120,7 @@ def sync_search_counts():
     # a higher count we keep it. If Redis was cleared (restart), the Postgres
     # value restores the baseline; any requests made since the restart are
     # already counted in Redis and will be included via max().
+    seeded_user_ids = []
     for bucket in UsageBucket.objects.filter(year=now.year, month=now.month):
         key = _monthly_key(bucket.user_id, year=now.year, month=now.month)
         if not cache.add(key, bucket.count, timeout=MONTHLY_TTL):
@@ -125,6 +128,9 @@ def sync_search_counts():
             current = cache.get(key, default=0)
             if bucket.count > current:
                 cache.set(key, bucket.count, timeout=MONTHLY_TTL)
+        seeded_user_ids.append(bucket.user_id)
+    add_active_users(seeded_user_ids, year=now.year, month=now.month)
+    backfill_active_users()
 
     # Step 2: sync live Redis counters back to Postgres
     for key in get_all_monthly_keys():
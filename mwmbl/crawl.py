@@ -11,7 +11,9 @@ import requests
 from django.conf import settings
 from redis import Redis
 
-from mwmbl.crawler.env_vars import CRAWLER_WORKERS, CRAWL_DELAY_SECONDS, MWMBL_API_KEY, MWMBL_CONTACT_INFO
+from mwmbl.crawler.env_vars import (CRAWLER_WORKERS, CRAWL_DELAY_SECONDS, MWMBL_API_KEY, MWMBL_CONTACT_INFO,
+                                    CRAWLER_METRICS_ADDRESS, CRAWLER_METRICS_PORT)
+from mwmbl.metrics import BATCHES_PROCESSED, BATCH_PROCESSING_SECONDS, mark_process_dead, serve_metrics
 from mwmbl.rankeval.evaluation.remote_index import RemoteIndex
 from mwmbl.redis_url_queue import RedisURLQueue
 from mwmbl.tinysearchengine.indexer import TinyIndex, Document
@@ -142,6 +144,7 @@ class Crawler:
         Each batch is processed as a HashedBatch object containing metadata and crawl results.
         """
         user_id = "test"
+        started = time.monotonic()
         urls = self.url_queue.get_batch(user_id)
         logger.info(f"Processing batch of {len(urls)} URLs")
 
@@ -168,6 +171,8 @@ class Crawler:
         # Push the batch into the Redis queue
         batch_json = batch.json()
         self.redis.rpush(BATCH_QUEUE_KEY, batch_json)
+        BATCHES_PROCESSED.labels("crawled").inc()
+        BATCH_PROCESSING_SECONDS.labels("crawled").observe(time.monotonic() - started)
     
     def run_indexing(self):
         """
@@ -274,6 +279,9 @@ class Crawler:
         workers: int = CRAWLER_WORKERS
         assert workers > 0, f"Invalid value for CRAWLER_WORKERS: {workers}"
 
+        if CRAWLER_METRICS_PORT:
+            serve_metrics(CRAWLER_METRICS_PORT, CRAWLER_METRICS_ADDRESS)
+
         batch_processes: list[Process] = []
         for i in range(workers):
             process = Process(target=self.process_batch_continuously)
@@ -313,12 +321,14 @@ class Crawler:
 
                 logger.warning(f"Indexing process [pid={pid}] died with exit code {exit_code}, respawning. "
                              f"Crash count in last hour: {len(index_crash_history)}")
+                mark_process_dead(pid)
                 index_process = Process(target=self.run_indexing_continuously)
                 index_process.start()
 
             for i in range(workers):
                 if not batch_processes[i].is_alive():
                     logger.info(f"Batch process [pid={batch_processes[i].pid}] died, respawning.")
+                    mark_process_dead(batch_processes[i].pid)
                     batch_processes[i] = Process(target=self.process_batch_continuously)
                     batch_processes[i].start()
                     time.sleep(5)
@@ -22,6 +22,7 @@ from mwmbl.exceptions import InvalidRequest
 from mwmbl.indexer.batch_cache import BatchCache
 from mwmbl.indexer.index_batches import index_documents
 from mwmbl.indexer.indexdb import IndexDatabase, BatchInfo, BatchStatus
+from mwmbl.metrics import BATCHES_PROCESSED
 from mwmbl.models import ApiKey
 from mwmbl.redis_url_queue import RedisURLQueue
 from mwmbl.settings import (
@@ -120,6 +121,7 @@ def _register_routes(r: Router | NinjaAPI, batch_cache: BatchCache, queued_batch
         hashed_batch = HashedBatch(user_id_hash=user_id_hash, timestamp=epoch_time, items=batch.items)
 
         stats_manager.record_batch(hashed_batch)
+        BATCHES_PROCESSED.labels("received").inc()
 
         filename = upload_object(hashed_batch, now, user_id_hash, "batch")
 
@@ -12,6 +12,12 @@ CRAWL_THREADS = int(os.environ.get("CRAWL_THREADS", "20"))
 # Rate limiting configuration
 CRAWL_DELAY_SECONDS = float(os.environ.get("CRAWL_DELAY_SECONDS", "0.0"))
 
+# Port the crawler serves its Prometheus metrics on; 0 to turn it off
+CRAWLER_METRICS_PORT = int(os.environ.get("CRAWLER_METRICS_PORT", "9100"))
+# Address it listens on. Crawlers run on volunteers' machines, so only locally unless
+# they choose otherwise (0.0.0.0 for a scraper in another container or on the network)
+CRAWLER_METRICS_ADDRESS = os.environ.get("CRAWLER_METRICS_ADDRESS", "127.0.0.1")
+
 # API configuration
 MWMBL_API_KEY = os.environ.get("MWMBL_API_KEY", "")
 
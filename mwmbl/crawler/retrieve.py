@@ -1,6 +1,8 @@
+import asyncio
 import json
 import re
 import time
+from concurrent.futures import Executor
 from logging import getLogger
 from multiprocessing.pool import ThreadPool
 from ssl import SSLCertVerificationError
@@ -8,6 +10,7 @@ from typing import List, Optional
 from urllib.parse import urlparse, urlunsplit, urljoin
 from urllib.robotparser import RobotFileParser
 
+import httpx
 import requests
 from mwmbl.justext import core, utils
 from redis import Redis
@@ -15,7 +18,7 @@ from requests import ReadTimeout
 from urllib3.exceptions import NewConnectionError, MaxRetryError
 
 from mwmbl.crawler.env_vars import MWMBL_CONTACT_INFO
-from mwmbl.crawler.ssrf import UnsafeURLError, validate_url
+from mwmbl.crawler.ssrf import UnsafeURLError, validate_url, validate_url_async
 from mwmbl.justext.core import html_to_dom
 from mwmbl.justext.paragraph import Paragraph
 
@@ -24,6 +27,7 @@ from mwmbl.justext.paragraph import Paragraph
 # it explicitly for clarity: an SSRF-blocked URL is skipped like any other bad URL.
 ALLOWED_EXCEPTIONS = (ValueError, UnsafeURLError, ConnectionError, ReadTimeout, TimeoutError,
                       OSError, NewConnectionError, MaxRetryError, SSLCertVerificationError)
+ASYNC_ALLOWED_EXCEPTIONS = ALLOWED_EXCEPTIONS + (httpx.HTTPError, httpx.InvalidURL)
 
 POST_BATCH_URL = '/api/v1/crawler/batches/'
 POST_NEW_BATCH_URL = '/api/v1/crawler/batches/new'
@@ -94,60 +98,124 @@ def fetch(url):
     raise ValueError(f"Too many redirects for URL {url}")
 
 
-def robots_allowed(url: str, redis: Redis) -> bool:
+async def fetch_async(url: str, client: httpx.AsyncClient) -> tuple[int, bytes]:
+    """fetch, on an httpx client: the same SSRF check on every hop, timeout and size cap."""
+    headers = {"User-Agent": USER_AGENT}
+    for _ in range(MAX_REDIRECTS + 1):
+        await validate_url_async(url)
+        try:
+            async with asyncio.timeout(TIMEOUT_SECONDS):
+                async with client.stream("GET", url, headers=headers, follow_redirects=False,
+                                         timeout=TIMEOUT_SECONDS) as r:
+                    if r.is_redirect and "Location" in r.headers:
+                        url = urljoin(url, r.headers["Location"])
+                        continue
+
+                    content = b""
+                    async for chunk in r.aiter_bytes(1024):
+                        content += chunk
+                        if len(content) > MAX_FETCH_SIZE:
+                            logger.debug(f"Maximum size reached for URL {url}")
+                            break
+                    return r.status_code, content
+        except TimeoutError:
+            raise ValueError('Timeout reached')
+
+    raise ValueError(f"Too many redirects for URL {url}")
+
+
+def _robots_urls(url: str) -> Optional[tuple[str, str]]:
+    """The domain of a URL and the URL of its robots.txt, or None if it cannot be parsed."""
     try:
         parsed_url = urlparse(url)
     except ValueError:
         logger.info(f"Unable to parse URL: {url}")
-        return False
+        return None
+    return parsed_url.netloc, urlunsplit((parsed_url.scheme, parsed_url.netloc, 'robots.txt', '', ''))
 
-    domain = parsed_url.netloc
-    robots_url = urlunsplit((parsed_url.scheme, parsed_url.netloc, 'robots.txt', '', ''))
 
-    cached_content = _get_robots_from_cache(redis, domain)
-    if cached_content is not None:
-        logger.debug(f"Robots cache hit for {domain}")
-        parse_robots = RobotFileParser()
-        parse_robots.parse(cached_content)
-        allowed = parse_robots.can_fetch(USER_AGENT, url)
-        logger.debug(f"Robots allowed for {url} (cached): {allowed}")
-        return allowed
+def _can_fetch(robots_lines: List[str], url: str) -> bool:
+    parse_robots = RobotFileParser()
+    parse_robots.parse(robots_lines)
+    return parse_robots.can_fetch(USER_AGENT, url)
 
-    try:
-        status_code, content = fetch(robots_url)
-    except ALLOWED_EXCEPTIONS as e:
-        logger.debug(f"Robots error: {robots_url}, {e}")
-        _cache_robots_content(redis, domain, [], error=True)
-        return True
 
+def _decode_robots(robots_url: str, status_code: int, content: bytes) -> Optional[List[str]]:
+    """The lines of a fetched robots.txt, or None if there is no usable file."""
     if status_code != 200:
         logger.debug(f"Robots status code: {status_code}")
-        _cache_robots_content(redis, domain, [], error=True)
-        return True
+        return None
 
-    decoded = None
     for encoding in ['utf-8', 'iso-8859-1']:
         try:
-            decoded = content.decode(encoding).splitlines()
-            break
+            return content.decode(encoding).splitlines()
         except UnicodeDecodeError:
             pass
 
+    logger.info(f"Unable to decode robots file {robots_url}")
+    return None
+
+
+def _robots_allowed_from_response(url: str, redis: Redis, domain: str, robots_url: str,
+                                  status_code: int, content: bytes) -> bool:
+    decoded = _decode_robots(robots_url, status_code, content)
     if decoded is None:
-        logger.info(f"Unable to decode robots file {robots_url}")
         _cache_robots_content(redis, domain, [], error=True)
         return True
-    
-    parse_robots = RobotFileParser()
-    parse_robots.parse(decoded)
-    allowed = parse_robots.can_fetch(USER_AGENT, url)
-    
+
+    allowed = _can_fetch(decoded, url)
     _cache_robots_content(redis, domain, decoded, error=False)
-    
     logger.debug(f"Robots allowed for {url}: {allowed}")
     return allowed
 
 
+def robots_allowed(url: str, redis: Redis) -> bool:
+    urls = _robots_urls(url)
+    if urls is None:
+        return False
+    domain, robots_url = urls
+
+    cached_content = _get_robots_from_cache(redis, domain)
+    if cached_content is not None:
+        logger.debug(f"Robots cache hit for {domain}")
+        allowed = _can_fetch(cached_content, url)
+        logger.debug(f"Robots allowed for {url} (cached): {allowed}")
+        return allowed
+
+    try:
+        status_code, content = fetch(robots_url)
+    except ALLOWED_EXCEPTIONS as e:
+        logger.debug(f"Robots error: {robots_url}, {e}")
+        _cache_robots_content(redis, domain, [], error=True)
+        return True
+
+    return _robots_allowed_from_response(url, redis, domain, robots_url, status_code, content)
+
+
+async def robots_allowed_async(url: str, client: httpx.AsyncClient, redis: Redis) -> bool:
+    """robots_allowed, fetching robots.txt on an httpx client. The cache reads and writes
+    are short Redis round trips, run on a thread."""
+    urls = _robots_urls(url)
+    if urls is None:
+        return False
+    domain, robots_url = urls
+
+    cached_content = await asyncio.to_thread(_get_robots_from_cache, redis, domain)
+    if cached_content is not None:
+        logger.debug(f"Robots cache hit for {domain}")
+        return _can_fetch(cached_content, url)
+
+    try:
+        status_code, content = await fetch_async(robots_url, client)
+    except ASYNC_ALLOWED_EXCEPTIONS as e:
+        logger.debug(f"Robots error: {robots_url}, {e}")
+        await asyncio.to_thread(_cache_robots_content, redis, domain, [], True)
+        return True
+
+    return await asyncio.to_thread(_robots_allowed_from_response, url, redis, domain, robots_url,
+                                   status_code, content)
+
+
 def _get_robots_from_cache(redis: Redis, domain: str) -> Optional[List[str]]:
     cache_key = f"robots:{domain}"
     cached = redis.get(cache_key)
@@ -303,37 +371,68 @@ def _truncate(text: str, limit: int) -> str:
     return text[:limit - 1] + '…' if len(text) > limit else text
 
 
+def _robots_denied(url: str, js_timestamp: int) -> dict:
+    return {
+        'url': url,
+        'status': None,
+        'timestamp': js_timestamp,
+        'content': None,
+        'error': {
+            'name': 'RobotsDenied',
+            'message': 'Robots do not allow this URL',
+        }
+    }
+
+
+def _fetch_failed(url: str, js_timestamp: int, error: Exception) -> dict:
+    logger.debug(f"Exception crawling URl {url}: {error}")
+    return {
+        'url': url,
+        'status': None,
+        'timestamp': js_timestamp,
+        'content': None,
+        'error': {
+            'name': 'AbortError',
+            'message': str(error),
+        }
+    }
+
+
 def crawl_url(url, redis: Redis):
     logger.info(url)
     js_timestamp = int(time.time() * 1000)
     allowed = robots_allowed(url, redis)
     if not allowed:
-        return {
-            'url': url,
-            'status': None,
-            'timestamp': js_timestamp,
-            'content': None,
-            'error': {
-                'name': 'RobotsDenied',
-                'message': 'Robots do not allow this URL',
-            }
-        }
+        return _robots_denied(url, js_timestamp)
 
     try:
         status_code, content = fetch(url)
     except ALLOWED_EXCEPTIONS as e:
-        logger.debug(f"Exception crawling URl {url}: {e}")
-        return {
-            'url': url,
-            'status': None,
-            'timestamp': js_timestamp,
-            'content': None,
-            'error': {
-                'name': 'AbortError',
-                'message': str(e),
-            }
-        }
+        return _fetch_failed(url, js_timestamp, e)
+
+    return extract_page(url, status_code, content, js_timestamp)
+
+
+async def crawl_url_async(url: str, client: httpx.AsyncClient, redis: Redis, extract_executor: Executor) -> dict:
+    """crawl_url, for an event loop: the fetches are made on the httpx client, and only
+    extracting the page - parsing and classifying its paragraphs - takes a thread, from
+    extract_executor. Returns the same result as crawl_url."""
+    logger.info(url)
+    js_timestamp = int(time.time() * 1000)
+    if not await robots_allowed_async(url, client, redis):
+        return _robots_denied(url, js_timestamp)
+
+    try:
+        status_code, content = await fetch_async(url, client)
+    except ASYNC_ALLOWED_EXCEPTIONS as e:
+        return _fetch_failed(url, js_timestamp, e)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(extract_executor, extract_page, url, status_code, content, js_timestamp)
+
 
+def extract_page(url: str, status_code: int, content: bytes, js_timestamp: int) -> dict:
+    """The crawl result for a fetched page: its title, extract and links. CPU-bound."""
     if len(content) == 0:
         return {
             'url': url,
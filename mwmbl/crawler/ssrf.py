@@ -12,6 +12,7 @@ transport adapters and is left as a future hardening step. Callers that follow
 HTTP redirects must re-validate each hop, since a public URL can 3xx to an
 internal one.
 """
+import asyncio
 import ipaddress
 import socket
 from urllib.parse import urlparse
@@ -57,7 +58,10 @@ def is_safe_host(host: str) -> bool:
         infos = socket.getaddrinfo(host, None)
     except socket.gaierror:
         return False
+    return _addresses_are_safe(infos)
 
+
+def _addresses_are_safe(infos) -> bool:
     addresses = {info[4][0] for info in infos}
     if not addresses:
         return False
@@ -71,8 +75,24 @@ def is_safe_host(host: str) -> bool:
     return True
 
 
-def validate_url(url: str) -> None:
-    """Raise :class:`UnsafeURLError` if ``url`` is not safe to fetch."""
+async def is_safe_host_async(host: str) -> bool:
+    """is_safe_host, resolving the host without blocking the event loop."""
+    if not host:
+        return False
+
+    try:
+        return _ip_is_safe(ipaddress.ip_address(host))
+    except ValueError:
+        pass
+
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return _addresses_are_safe(infos)
+
+
+def _host_to_check(url: str) -> str:
     try:
         parsed = urlparse(url)
     except ValueError as e:
@@ -84,6 +104,16 @@ def validate_url(url: str) -> None:
     host = parsed.hostname
     if not host:
         raise UnsafeURLError(f"URL has no host: {url}")
+    return host
+
+
+def validate_url(url: str) -> None:
+    """Raise :class:`UnsafeURLError` if ``url`` is not safe to fetch."""
+    if not is_safe_host(_host_to_check(url)):
+        raise UnsafeURLError(f"Refusing to fetch internal/private address: {url}")
+
 
-    if not is_safe_host(host):
+async def validate_url_async(url: str) -> None:
+    """validate_url, for code running on an event loop."""
+    if not await is_safe_host_async(_host_to_check(url)):
         raise UnsafeURLError(f"Refusing to fetch internal/private address: {url}")
@@ -32,6 +32,7 @@ deploy instead of waiting for the next snapshot refresh. Evaluating them as
 `built_in_rules OR snapshot` reproduces CombinedBlacklistProvider's semantics exactly.
 """
 import hashlib
+import os
 import threading
 import time
 from logging import getLogger
@@ -257,6 +258,19 @@ class SnapshotBlacklist:
             self._loading = False
             logger.exception("Could not start the blacklist snapshot refresh thread")
 
+    def reset_after_fork(self):
+        """Start this process's refreshes afresh in a child forked from the one that loaded
+        the snapshot (gunicorn's preload mode - see mwmbl.main).
+
+        The child shares the parent's array, copy-on-write, but not its threads: a refresh
+        running in the parent at the fork would never clear _loading in the child, and its
+        lock could be copied held. The child's first query checks for a newer snapshot,
+        since a replacement worker may be forked from a master that loaded hours ago.
+        """
+        self._lock = threading.Lock()
+        self._loading = False
+        self._last_checked = 0.0
+
     def filter_blacklisted(self, domains: Iterable[str]) -> set[str]:
         """Return the subset of these domains that are blacklisted."""
         domains = list(dict.fromkeys(domains))  # de-duplicate, keeping order for zip below
@@ -311,3 +325,11 @@ def get_snapshot_blacklist() -> SnapshotBlacklist:
         _snapshot_blacklist = SnapshotBlacklist()
         _snapshot_blacklist.load_now()
     return _snapshot_blacklist
+
+
+def _reset_after_fork():
+    if _snapshot_blacklist is not None:
+        _snapshot_blacklist.reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -16,8 +16,10 @@ from mwmbl.indexer.batch_cache import BatchCache
 from mwmbl.indexer.blacklist_snapshot import get_snapshot_blacklist
 from mwmbl.indexer.index import tokenize_document, prepare_url_for_tokenizing
 from mwmbl.indexer.indexdb import BatchStatus
+from mwmbl.metrics import BATCHES_PROCESSED, BATCH_PROCESSING_SECONDS
 from mwmbl.tinysearchengine.indexer import Document, TinyIndex, DocumentState, CURATED_STATES
 from mwmbl.tinysearchengine.rank import score_result, DOCUMENT_FREQUENCIES, N_DOCUMENTS, HeuristicRanker
+from mwmbl.tinysearchengine.result_cache import bump_index_generation
 from mwmbl.tokenizer import tokenize, get_bigrams
 from mwmbl.utils import add_term_infos, get_domain
 
@@ -66,6 +68,8 @@ def index_batches(batch_data: Collection[HashedBatch], index_path: str) -> Count
     documents = list(get_documents_from_batches(batch_data))
     end_time, new_page_doc_counts = index_documents(documents, index_path)
     logger.info(f"Indexing took {end_time - start_time}")
+    BATCHES_PROCESSED.labels("indexed").inc(len(batch_data))
+    BATCH_PROCESSING_SECONDS.labels("indexed").observe((end_time - start_time).total_seconds())
     return new_page_doc_counts
 
 
@@ -122,6 +126,7 @@ def index_pages(index_path: str, page_documents: dict[int, list[Document]], mark
 
             term_new_doc_counts.update(document.term for document in combined_documents
                                        if document.state != DocumentState.SYNCED_WITH_MAIN_INDEX)
+    bump_index_generation(page_documents.keys())
     return term_new_doc_counts
 
 
@@ -1,7 +1,11 @@
+import gc
 import logging
 import multiprocessing
 import os
-from time import sleep
+import tempfile
+import uuid
+from pathlib import Path
+from time import monotonic, sleep
 
 import django
 from django.core.management import call_command
@@ -40,11 +44,65 @@ def run_background_tasks():
         sleep(TASK_QUEUE_RESTART_SECONDS)
 
 
+def prepare_metrics_directory(name: str = "mwmbl-metrics"):
+    """Where the gunicorn workers and the background task queue write their metrics, for
+    /metrics to add up (see mwmbl.metrics) - or, for the crawler, its worker and indexing
+    processes.
+
+    Has to run before anything imports prometheus_client, which django.setup() does. The
+    last run's files are deleted, or their values would be added in as though their
+    processes were still running.
+    """
+    directory = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                                      os.path.join(tempfile.gettempdir(), name))
+    os.makedirs(directory, exist_ok=True)
+    for path in Path(directory).glob("*.db"):
+        path.unlink(missing_ok=True)
+
+
+def preload_serving_state():
+    """Build the search serving state in the gunicorn master, before it forks the workers.
+
+    Importing the URLconf imports mwmbl.search_setup, which opens the index, maps the
+    completer, loads the LTR model and the blacklist snapshot and builds the ranker. Done
+    in each worker, that is (cpu_count * 2 + 1) copies loaded at once after every deploy,
+    and again whenever a worker is replaced. Done here, the workers are forked with it
+    already built and share its pages copy-on-write; a replacement worker is serving as
+    soon as it has forked.
+
+    Sharing only lasts while nothing writes to the pages. The collector writes to every
+    object it examines, so it is turned off in the master before the state is built, and
+    gc.freeze() moves what was built out of its sight; forked workers turn it back on.
+
+    Nothing may use the state in the master: it must not run a query, start a thread or
+    hold a connection, because the children inherit none of the threads and would share
+    the sockets. Postgres connections are closed here - migrate opened one. Redis clients
+    check the pid and reconnect in a child, and the thread pools and the blacklist
+    refresher reset themselves after a fork (os.register_at_fork in rank, super_search and
+    blacklist_snapshot). The Super Search judge and source model stay lazily loaded in
+    each worker: the ONNX runtime and XGBoost start thread pools when a model is loaded.
+    """
+    from django.db import connections
+    from django.urls import get_resolver
+
+    started = monotonic()
+    gc.disable()
+    # Imports the URLconf, and leaves the resolver the workers will use built.
+    get_resolver().url_patterns
+    connections.close_all()
+    gc.freeze()
+    os.register_at_fork(after_in_child=gc.enable)
+    logger.info("Preloaded the search serving state in %.1fs (%d objects frozen)",
+                monotonic() - started, gc.get_freeze_count())
+
+
 def run():
+    prepare_metrics_directory()
     django.setup()
 
     from django.conf import settings
     from mwmbl import background
+    from mwmbl.metrics import mark_process_dead
     from mwmbl.redis_url_queue import RedisURLQueue
     from mwmbl.count_urls import count_urls_continuously
     from mwmbl.indexer.update_urls import update_urls_continuously
@@ -91,6 +149,10 @@ def run():
             process.start()
             logger.info("Started the background task queue (pid %d)", process.pid)
 
+        # Inherited by every worker, so they share one cache warm per start (see warmer).
+        from mwmbl.tinysearchengine.warmer import BOOT_ID_VARIABLE
+        os.environ[BOOT_ID_VARIABLE] = uuid.uuid4().hex
+
         workers = multiprocessing.cpu_count() * 2 + 1
 
         class GunicornApp(BaseApplication):
@@ -100,9 +162,14 @@ def run():
                 self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
                 self.cfg.set("loglevel", "warning")
                 self.cfg.set("timeout", 120)
+                self.cfg.set("child_exit", lambda server, worker: mark_process_dead(worker.pid))
+                if settings.SERVING_PRELOAD:
+                    self.cfg.set("preload_app", True)
 
             def load(self):
                 from mwmbl.asgi import application
+                if settings.SERVING_PRELOAD:
+                    preload_serving_state()
                 return application
 
         GunicornApp().run()
@@ -110,5 +177,19 @@ def run():
         raise ValueError(f"Unknown MWMBL_APP: {mwmbl_app}")
 
 
+
+def run_crawler():
+    """Entry point of the standalone crawler (mwmbl-crawl).
+
+    Importing mwmbl.crawl sets Django up and imports prometheus_client, so the metrics
+    directory its processes share is prepared here, first. Importing the module alone,
+    as the tests do, leaves the environment and the last run's files as they were.
+    """
+    prepare_metrics_directory("mwmbl-crawler-metrics")
+
+    from mwmbl import crawl
+    crawl.run()
+
+
 if __name__ == "__main__":
     run()
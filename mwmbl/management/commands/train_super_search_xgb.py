@@ -34,14 +34,18 @@ def profiles_from_fetch(path: Path, dim: int) -> dict:
 
     prof_bow: dict[str, np.ndarray] = {}
     prof_cng: dict[str, np.ndarray] = {}
+    names, texts = [], []
     for line in path.read_text().splitlines():
         rec = json.loads(line)
         for name, docs in rec["docs"].items():
-            text = " ".join(f"{title or ''} {extract or ''}" for _, title, extract in docs)
-            prof_bow.setdefault(name, np.zeros(dim))
-            prof_cng.setdefault(name, np.zeros(dim))
-            prof_bow[name] += vectors.project_bow(text, dim)
-            prof_cng[name] += vectors.project_char_ngrams(text, dim)
+            names.append(name)
+            texts.append(" ".join(f"{title or ''} {extract or ''}" for _, title, extract in docs))
+    for name, bow, cng in zip(names, vectors.project_bow_batch(texts, dim),
+                              vectors.project_char_ngrams_batch(texts, dim)):
+        prof_bow.setdefault(name, np.zeros(dim))
+        prof_cng.setdefault(name, np.zeros(dim))
+        prof_bow[name] += bow
+        prof_cng[name] += cng
     return {name: (vectors._l2_normalise(prof_bow[name]),
                    vectors._l2_normalise(prof_cng[name]))
             for name in prof_bow}
@@ -0,0 +1,263 @@
+"""Prometheus metrics for the web app, the background tasks, the crawler and Super Search.
+
+Until now the only numbers were the daily counters StatsManager keeps in Redis and
+whatever made it into the logs. These are the standard Prometheus text format, served at
+/metrics by the web app and on CRAWLER_METRICS_PORT by the crawler, so anything that
+scrapes Prometheus can collect them - and so can curl. Nothing outside mwmbl is needed to
+read them.
+
+The processes are the hard part. The server is a gunicorn master, (cpu_count * 2 + 1)
+workers and the background task queue, and the crawler is a parent with a process per
+crawl worker and one for indexing. A counter kept in one process's memory would give a
+different answer depending on which worker served the scrape. So the entrypoints
+(main.run and main.run_crawler) set PROMETHEUS_MULTIPROC_DIR and clear out the last run's
+files before anything imports prometheus_client - it picks its storage at import time,
+and a file deleted after that would take the values this process had written with it.
+Every process then keeps its values in an mmapped file in that directory, and a scrape
+adds them up over all the files (prometheus_client's multiprocess mode). Gauges say how
+to combine processes: the thread pool gauges are summed over the processes that are
+still alive, which is why gunicorn's child_exit hook calls mark_process_dead(). Without the variable, in tests and `manage.py runserver`,
+everything stays in the one process.
+
+/metrics is not public: queue depths, cache hit rates and per-source failures say more
+about the service than its users need to know. The web app answers it only to a staff
+session or to a scraper sending `Authorization: Bearer <METRICS_BEARER_TOKEN>`; with no
+token configured, only staff can read it. Everyone else gets a 403. The crawler's port
+has no authentication, so it listens on 127.0.0.1 only, unless CRAWLER_METRICS_ADDRESS
+says otherwise.
+
+Some values are not a process's to count: the depths of the queues in Redis. The
+QueueDepthCollector reads them when a scrape asks, in the process serving it. Like every
+other Redis call outside the request path's own data, a failure there is logged and the
+metric is left out - a scrape never fails because Redis is down.
+"""
+import hmac
+import os
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from functools import partial
+from logging import getLogger
+from typing import Optional
+
+import redis
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess, start_http_server)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+logger = getLogger(__name__)
+
+
+MULTIPROCESS_DIR_VARIABLE = "PROMETHEUS_MULTIPROC_DIR"
+
+# prometheus_client chose how to store values when it was imported, just above; setting
+# the variable any later would only confuse the scrape.
+MULTIPROCESS = MULTIPROCESS_DIR_VARIABLE in os.environ
+
+# The Redis queues reported by QueueDepthCollector. The URL queue's domains
+# (redis_url_queue.DOMAIN_SCORE_KEY), the crawler's crawled batches waiting to be indexed
+# (crawl.BATCH_QUEUE_KEY) and the blacklist purge queue (purge_queue.PURGE_QUEUE_KEY).
+# Spelled out rather than imported: those modules bring the domain tables and, for the
+# crawler, its whole startup with them.
+DOMAIN_SCORE_KEY = "domain-scores"
+BATCH_QUEUE_KEY = "batch-queue"
+PURGE_QUEUE_KEY = "blacklist:purge-queue"
+
+_redis: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+# Stage durations run from tens of microseconds (a cache hit) to seconds (a cold LTR
+# model); matches request_timing.BUCKET_BOUNDS_MS.
+_STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1.0, 2.5, 5.0)
+_BATCH_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+_SOURCE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0)
+_FILL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+SEARCH_STAGE_SECONDS = Histogram(
+    "mwmbl_search_stage_seconds", "Time spent in each stage of a search request (see request_timing)",
+    ["stage"], buckets=_STAGE_BUCKETS)
+SEARCH_RESULT_CACHE_LOOKUPS = Counter(
+    "mwmbl_search_result_cache_lookups",
+    "Search result cache lookups, by outcome. A stale entry is counted as well as the lookup's outcome",
+    ["outcome"])
+
+INDEX_PAGES_READ = Counter("mwmbl_index_pages_read", "TinyIndex pages read")
+INDEX_BYTES_READ = Counter("mwmbl_index_bytes_read", "Bytes read from TinyIndex files")
+
+THREAD_POOL_TASKS = Gauge(
+    "mwmbl_thread_pool_tasks", "Tasks waiting for or running on a thread pool",
+    ["pool", "state"], multiprocess_mode="livesum")
+THREAD_POOL_WORKERS = Gauge(
+    "mwmbl_thread_pool_workers", "Threads in a thread pool", ["pool"], multiprocess_mode="livesum")
+# Only the process that claimed the warm sets these, so the max over processes is its value.
+SEARCH_WARM_QUERIES = Gauge(
+    "mwmbl_search_warm_queries", "Queries in this boot's cache warm set, and how many have been run",
+    ["state"], multiprocess_mode="livemax")
+
+BATCHES_PROCESSED = Counter(
+    "mwmbl_batches_processed", "Crawl batches received from crawlers, crawled, or indexed", ["stage"])
+BATCH_PROCESSING_SECONDS = Histogram(
+    "mwmbl_batch_processing_seconds", "Time to crawl a batch, or to index a group of batches",
+    ["stage"], buckets=_BATCH_BUCKETS)
+
+SUPER_SEARCH_STREAMS = Counter(
+    "mwmbl_super_search_streams", "Super Search streams, by how they ended", ["reason"])
+SUPER_SEARCH_SOURCE_SECONDS = Histogram(
+    "mwmbl_super_search_source_seconds", "Super Search source call latency, by outcome",
+    ["source", "outcome"], buckets=_SOURCE_BUCKETS)
+SUPER_SEARCH_SOURCE_SKIPS = Counter(
+    "mwmbl_super_search_source_skips", "Super Search source calls skipped because the source's circuit was open",
+    ["source"])
+SUPER_SEARCH_SOURCE_CACHE_LOOKUPS = Counter(
+    "mwmbl_super_search_source_cache_lookups", "Super Search source response cache lookups, by outcome",
+    ["source", "outcome"])
+SUPER_SEARCH_JUDGE_QUEUE_SECONDS = Histogram(
+    "mwmbl_super_search_judge_queue_seconds",
+    "Time a (query, document) pair waited for the relevance judge's batcher to run it",
+    buckets=_STAGE_BUCKETS)
+SUPER_SEARCH_JUDGE_BATCH_FILL = Histogram(
+    "mwmbl_super_search_judge_batch_fill", "Relevance judge batches, by the fraction of the batch size they held",
+    buckets=_FILL_BUCKETS)
+SUPER_SEARCH_JUDGE_SCORE_CACHE_LOOKUPS = Counter(
+    "mwmbl_super_search_judge_score_cache_lookups", "Relevance judge score cache lookups per pair, by outcome",
+    ["outcome"])
+
+
+class ThreadPoolTracker:
+    """Keeps mwmbl_thread_pool_tasks up to date for one pool.
+
+    Call submitted() as work is handed to the pool, and wrap the function the pool runs
+    with run(), or the work itself with running(); the difference between the two is the
+    backlog. Work that leaves the queue without running is withdrawn(). max_workers is
+    the size the pool was configured with, or None for a limit with no fixed size in the
+    process, such as Super Search's per-stream fetch budget.
+    """
+
+    def __init__(self, pool: str, max_workers: Optional[int]):
+        if max_workers is not None:
+            THREAD_POOL_WORKERS.labels(pool).set(max_workers)
+        self._queued = THREAD_POOL_TASKS.labels(pool, "queued")
+        self._running = THREAD_POOL_TASKS.labels(pool, "running")
+
+    def submitted(self, count: int = 1) -> None:
+        self._queued.inc(count)
+
+    def withdrawn(self, count: int = 1) -> None:
+        self._queued.dec(count)
+
+    @contextmanager
+    def running(self, count: int = 1):
+        self._queued.dec(count)
+        self._running.inc(count)
+        try:
+            yield
+        finally:
+            self._running.dec(count)
+
+    def run(self, function, *args):
+        with self.running():
+            return function(*args)
+
+
+class TrackedExecutor(Executor):
+    """An executor whose work is counted by a ThreadPoolTracker, for pools that are
+    handed to code that only knows about executors (loop.run_in_executor)."""
+
+    def __init__(self, executor: Executor, tracker: ThreadPoolTracker):
+        self.executor = executor
+        self.tracker = tracker
+
+    def submit(self, function, /, *args, **kwargs) -> Future:
+        self.tracker.submitted()
+        future = self.executor.submit(self.tracker.run, partial(function, *args, **kwargs))
+        future.add_done_callback(self._withdraw_if_cancelled)
+        return future
+
+    def _withdraw_if_cancelled(self, future: Future) -> None:
+        # Only a future that has not started can be cancelled, so run() never saw it.
+        if future.cancelled():
+            self.tracker.withdrawn()
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self.executor.shutdown(wait, cancel_futures=cancel_futures)
+
+
+class QueueDepthCollector(Collector):
+    """The lengths of the queues kept in Redis, read at scrape time."""
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        self._redis_client = redis_client
+
+    def collect(self):
+        try:
+            client = self._redis_client if self._redis_client is not None else get_redis()
+            pipeline = client.pipeline(transaction=False)
+            pipeline.zcard(DOMAIN_SCORE_KEY)
+            pipeline.llen(BATCH_QUEUE_KEY)
+            pipeline.scard(PURGE_QUEUE_KEY)
+            domains, batches, purges = pipeline.execute()
+        except Exception:
+            logger.warning("Could not read queue depths for metrics", exc_info=True)
+            return
+
+        depth = GaugeMetricFamily("mwmbl_queue_depth", "Items waiting in a Redis queue", labels=["queue"])
+        depth.add_metric(["url_queue_domains"], domains)
+        depth.add_metric(["crawled_batches"], batches)
+        depth.add_metric(["blacklist_purge"], purges)
+        yield depth
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop an exited process from the live gauges. For gunicorn's child_exit hook."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+def _process_registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics(redis_client: Optional[redis.Redis] = None) -> bytes:
+    """Every process's metrics, plus the queue depths, in the Prometheus text format."""
+    queues = CollectorRegistry(auto_describe=False)
+    queues.register(QueueDepthCollector(redis_client))
+    return generate_latest(_process_registry()) + generate_latest(queues)
+
+
+def _may_read_metrics(request) -> bool:
+    user = getattr(request, "user", None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    token = settings.METRICS_BEARER_TOKEN
+    header = request.headers.get("Authorization", "")
+    return bool(token) and header.startswith("Bearer ") and hmac.compare_digest(
+        header[len("Bearer "):].encode(), token.encode())
+
+
+def metrics_view(request):
+    if not _may_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
+
+
+def serve_metrics(port: int, address: str = "127.0.0.1") -> None:
+    """Serve the metrics over HTTP from a thread, for processes without a web server.
+    Unauthenticated, so local-only unless the caller passes a wider address."""
+    registry = _process_registry()
+    registry.register(QueueDepthCollector())
+    start_http_server(port, addr=address, registry=registry)
+    logger.info("Serving metrics on %s:%d", address, port)
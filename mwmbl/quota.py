@@ -2,15 +2,59 @@
 Quota and rate-limit helpers for the search API.
 
 All counters use the Django cache interface (django.core.cache.cache) so the
-backend can be swapped without changing this code.  The only Redis-specific
-call is get_all_monthly_keys(), which uses SCAN via django-redis and is only
-called by the background flush/reset jobs.
+backend can be swapped without changing this code.
+
+The exception is charging a request: charge_search() and charge_super_search() do the
+rate limit, the quota check and the quota increment in one Lua script when the cache is
+Redis. One round trip instead of the four or five the separate helpers take, and
+atomic, so concurrent requests cannot both squeeze under the quota. The keys are the
+cache's own (cache.make_key), so get_monthly_count() and the background jobs still see
+the same counters. With any other cache backend - locmem in tests and development - it
+falls back to those helpers.
+
+SEARCH_RATE_LIMIT_WINDOW picks the rate limit. "fixed" is the one-second window
+check_rate_limit() has always used, which lets a client make 2 * RATE_LIMIT requests
+across a window boundary. "sliding" estimates the count over the last second from this
+window's and the previous window's counts, weighting the previous by how much of it is
+still inside the last second, which holds bursts to about RATE_LIMIT at any point. It
+only counts requests it allows, so a client retrying too fast still gets through at the
+limit rather than locking itself out; it needs Redis, and falls back to the fixed window
+without it.
+
+Searches are not added to the monthly counter by that script. Each process counts them
+in memory (UsageAggregator) and adds them to Redis in one batch every
+SEARCH_USAGE_FLUSH_SECONDS, so a search's only Redis write is the rate limit's. The
+quota check adds this process's unflushed count to what Redis has, so a user can only
+overrun their quota by what the other processes have charged since their last flush -
+at RATE_LIMIT a second, a few requests in a monthly allowance of thousands - and a
+worker killed outright loses at most that much of its count. Super Search, with a
+monthly limit of 100, is still counted in Redis as it is charged. Set the interval to 0
+to count searches that way too.
+
+The flush also adds each user to the month's active set (search:active:{year}:{month}),
+which is how the hourly sync finds the counters to copy to Postgres without a SCAN over
+the keyspace. The sync adds the users whose counters it seeds from Postgres, and the
+first sync of each month SCANs once for counters written before the set existed, so no
+counter is missed until its user happens to search again.
 """
+import atexit
+import os
+import threading
+import time
+import weakref
+from dataclasses import dataclass
 from datetime import datetime, timezone
+from logging import getLogger
+from typing import Optional
+
+import redis
+from django.conf import settings
+from django.core.cache import cache, caches
 
-from django.core.cache import cache
+logger = getLogger(__name__)
 
 RATE_LIMIT = 5          # maximum requests per second (all tiers)
+RATE_WINDOW_MS = 1000
 MONTHLY_TTL = 60 * 60 * 24 * 35   # 35 days in seconds
 
 
@@ -32,10 +76,26 @@ def _super_search_monthly_key(user_id: int, year: int | None = None, month: int
     return f"super_search:monthly:{user_id}:{y}:{m:02d}"
 
 
+def _active_users_key(year: int | None = None, month: int | None = None) -> str:
+    now = datetime.now(timezone.utc)
+    y = year if year is not None else now.year
+    m = month if month is not None else now.month
+    return f"search:active:{y}:{m:02d}"
+
+
+def _super_search_active_users_key() -> str:
+    now = datetime.now(timezone.utc)
+    return f"super_search:active:{now.year}:{now.month:02d}"
+
+
 def _rate_key(user_id: int) -> str:
     return f"search:rate:{user_id}"
 
 
+def _sliding_rate_key(user_id: int, window: int) -> str:
+    return f"search:rate:{user_id}:{window}"
+
+
 # ---------------------------------------------------------------------------
 # Rate limiting (fixed-window, 5 req/s)
 # ---------------------------------------------------------------------------
@@ -62,8 +122,10 @@ def check_rate_limit(user_id: int) -> bool:
 # ---------------------------------------------------------------------------
 
 def get_monthly_count(user_id: int) -> int:
-    """Return the current monthly request count for a user (0 if not set)."""
-    return cache.get(_monthly_key(user_id), default=0)
+    """Return the current monthly request count for a user (0 if not set), including any
+    this process has charged and not yet flushed."""
+    key = _monthly_key(user_id)
+    return cache.get(key, default=0) + _usage.pending(cache.make_key(key))
 
 
 def increment_monthly(user_id: int) -> int:
@@ -83,43 +145,313 @@ def get_monthly_super_search_count(user_id: int) -> int:
     return cache.get(_super_search_monthly_key(user_id), default=0)
 
 
-def increment_monthly_super_search(user_id: int) -> int:
-    """Increment the monthly super-search counter and return the new value."""
-    key = _super_search_monthly_key(user_id)
-    if cache.add(key, 1, timeout=MONTHLY_TTL):
-        return 1
-    return cache.incr(key)
+# ---------------------------------------------------------------------------
+# Charging a request: rate limit and monthly quota in one round trip
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Charge:
+    """The outcome of charging a request. monthly_usage includes this request only if it
+    was charged (allowed and within_quota); otherwise it is the count as it stands."""
+    allowed: bool
+    within_quota: bool
+    monthly_usage: int
+
+
+# Each rate limit script leaves `allowed` set. The quota part then checks the monthly
+# counter, KEYS[1], plus ARGV[6] charged in this process and not yet flushed, against
+# ARGV[1]. If ARGV[7] is 1 it also charges the request there and then, recording the
+# user, ARGV[8], in the month's active set, KEYS[2]; otherwise the caller counts it in
+# the process's UsageAggregator. The script returns {allowed, within_quota, monthly_usage}.
+_FIXED_WINDOW_LUA = """
+local rate = redis.call('INCR', KEYS[3])
+if rate == 1 then
+    redis.call('PEXPIRE', KEYS[3], ARGV[4])
+end
+local allowed = rate <= tonumber(ARGV[3])
+"""
+
+# KEYS[3] counts this window, KEYS[4] the previous one; ARGV[5] is how far into this
+# window we are, in milliseconds.
+_SLIDING_WINDOW_LUA = """
+local current = tonumber(redis.call('GET', KEYS[3]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[4]) or '0')
+local window = tonumber(ARGV[4])
+local estimate = previous * (window - tonumber(ARGV[5])) / window + current
+local allowed = estimate < tonumber(ARGV[3])
+if allowed then
+    redis.call('INCR', KEYS[3])
+    redis.call('PEXPIRE', KEYS[3], 2 * window)
+end
+"""
+
+_QUOTA_LUA = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0') + tonumber(ARGV[6])
+if not allowed then
+    return {0, 0, used}
+end
+if used >= tonumber(ARGV[1]) then
+    return {1, 0, used}
+end
+if ARGV[7] ~= '1' then
+    return {1, 1, used + 1}
+end
+used = redis.call('INCR', KEYS[1])
+if used == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('SADD', KEYS[2], ARGV[8]) == 1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return {1, 1, used}
+"""
+
+_SCRIPTS = {
+    "fixed": _FIXED_WINDOW_LUA + _QUOTA_LUA,
+    "sliding": _SLIDING_WINDOW_LUA + _QUOTA_LUA,
+}
+
+# Adds a batch of pending counts: KEYS are (counter, active set) pairs, ARGV the TTL, then
+# each pair's count, then each pair's user ID.
+_FLUSH_LUA = """
+local count = #KEYS / 2
+for i = 1, count do
+    local delta = tonumber(ARGV[1 + i])
+    if redis.call('INCRBY', KEYS[2 * i - 1], delta) == delta then
+        redis.call('EXPIRE', KEYS[2 * i - 1], ARGV[1])
+    end
+    if redis.call('SADD', KEYS[2 * i], ARGV[1 + count + i]) == 1 then
+        redis.call('EXPIRE', KEYS[2 * i], ARGV[1])
+    end
+end
+return count
+"""
+
+
+def _cache_redis() -> Optional[redis.Redis]:
+    """The cache's Redis connection, or None if the cache is not Redis."""
+    from django_redis.cache import RedisCache
+    if not isinstance(caches["default"], RedisCache):
+        return None
+    from django_redis import get_redis_connection
+    return get_redis_connection("default")
+
+
+# Each client's registered Script objects, by source. register_script() builds a Script
+# and SHA-1s the source every time it is called; these are built once per client and
+# only EVALSHA'd from then on.
+_registered_scripts: "weakref.WeakKeyDictionary[redis.Redis, dict[str, object]]" = weakref.WeakKeyDictionary()
 
 
-def decrement_monthly_super_search(user_id: int) -> None:
-    """Refund one super-search increment (e.g. when the request is rejected over-limit).
+def _script(client: redis.Redis, source: str):
+    """The client's registered Script for this Lua source."""
+    scripts = _registered_scripts.get(client)
+    if scripts is None:
+        scripts = _registered_scripts[client] = {}
+    script = scripts.get(source)
+    if script is None:
+        script = scripts[source] = client.register_script(source)
+    return script
 
-    Never drops below 0. No-op if the counter is missing.
+
+class UsageAggregator:
+    """Monthly search counts charged in this process and not yet written to Redis.
+
+    A daemon thread, started by the first count in each process, flushes them every
+    SEARCH_USAGE_FLUSH_SECONDS in one script call, and whatever is left is flushed at
+    exit. A failed flush keeps the counts for the next one. The counts are keyed by the
+    full monthly key, so a flush that straddles the end of a month still adds each to the
+    month it was charged in.
     """
-    key = _super_search_monthly_key(user_id)
-    try:
-        if cache.get(key, default=0) > 0:
-            cache.decr(key)
-    except ValueError:
-        # decr() raises if the key vanished between the get and the decr; ignore.
-        pass
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # cache key of the counter -> [cache key of the active set, user ID, count]
+        self._pending: dict[str, list] = {}
+        self._pid: Optional[int] = None
+        self._redis_client: Optional[redis.Redis] = None
+
+    def pending(self, monthly_key: str) -> int:
+        entry = self._pending.get(monthly_key)
+        return 0 if entry is None or self._pid != os.getpid() else entry[2]
+
+    def add(self, monthly_key: str, active_key: str, user_id: int, redis_client: redis.Redis) -> None:
+        """Count a search, to be flushed to the Redis its quota was checked against."""
+        with self._lock:
+            self._redis_client = redis_client
+            if self._pid != os.getpid():
+                # A forked child must not flush its parent's counts a second time.
+                self._pending.clear()
+                self._pid = os.getpid()
+                self._start_flushing()
+            entry = self._pending.setdefault(monthly_key, [active_key, user_id, 0])
+            entry[2] += 1
+
+    def flush(self, redis_client: Optional[redis.Redis] = None) -> int:
+        """Write the pending counts to Redis. Returns how many counters were written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        entries = list(pending.items())
+        keys = [key for monthly_key, (active_key, _, _) in entries for key in (monthly_key, active_key)]
+        args = ([MONTHLY_TTL] + [count for _, (_, _, count) in entries]
+                + [user_id for _, (_, user_id, _) in entries])
+        try:
+            client = redis_client if redis_client is not None else self._redis_client
+            return _script(client, _FLUSH_LUA)(keys=keys, args=args)
+        except Exception:
+            logger.exception("Could not flush %d monthly usage counters; keeping them for the next flush",
+                             len(entries))
+            with self._lock:
+                for monthly_key, (active_key, user_id, count) in entries:
+                    self._pending.setdefault(monthly_key, [active_key, user_id, 0])[2] += count
+            return 0
+
+    def _start_flushing(self) -> None:
+        def flush_periodically():
+            while True:
+                time.sleep(settings.SEARCH_USAGE_FLUSH_SECONDS)
+                self.flush()
+
+        try:
+            threading.Thread(target=flush_periodically, name="usage-flush", daemon=True).start()
+        except RuntimeError:
+            logger.exception("Could not start the usage flush thread; counts will be flushed at exit")
+        atexit.register(self.flush)
+
+
+_usage = UsageAggregator()
+
+
+def _charge(user_id: int, monthly_key: str, active_key: str, monthly_limit: int,
+            redis_client: Optional[redis.Redis], aggregate: bool) -> Charge:
+    client = redis_client if redis_client is not None else _cache_redis()
+    if client is None:
+        return _charge_with_cache(user_id, monthly_key, monthly_limit)
+
+    now_ms = int(time.time() * 1000)
+    window = settings.SEARCH_RATE_LIMIT_WINDOW
+    if window == "sliding":
+        window_index = now_ms // RATE_WINDOW_MS
+        rate_keys = [_sliding_rate_key(user_id, window_index), _sliding_rate_key(user_id, window_index - 1)]
+    else:
+        rate_keys = [_rate_key(user_id)]
+    monthly_key, active_key, *rate_keys = [cache.make_key(key) for key in [monthly_key, active_key] + rate_keys]
+    aggregate = aggregate and settings.SEARCH_USAGE_FLUSH_SECONDS > 0
+    args = [monthly_limit, MONTHLY_TTL, RATE_LIMIT, RATE_WINDOW_MS, now_ms % RATE_WINDOW_MS,
+            _usage.pending(monthly_key), 0 if aggregate else 1, user_id]
+
+    allowed, within_quota, monthly_usage = _script(client, _SCRIPTS[window])(
+        keys=[monthly_key, active_key] + rate_keys, args=args)
+    if aggregate and allowed and within_quota:
+        _usage.add(monthly_key, active_key, user_id, client)
+    return Charge(bool(allowed), bool(within_quota), int(monthly_usage))
+
+
+def _charge_with_cache(user_id: int, monthly_key: str, monthly_limit: int) -> Charge:
+    """Charge through the cache interface, for backends that cannot run the script. Not
+    atomic: two requests racing for the last request of the quota can both get it."""
+    used = cache.get(monthly_key, default=0)
+    if not check_rate_limit(user_id):
+        return Charge(False, False, used)
+    if used >= monthly_limit:
+        return Charge(True, False, used)
+    if cache.add(monthly_key, 1, timeout=MONTHLY_TTL):
+        return Charge(True, True, 1)
+    return Charge(True, True, cache.incr(monthly_key))
+
+
+def charge_search(user_id: int, monthly_limit: int, redis_client: Optional[redis.Redis] = None) -> Charge:
+    """Rate limit a search and, if it is allowed and under monthly_limit, count it."""
+    return _charge(user_id, _monthly_key(user_id), _active_users_key(), monthly_limit, redis_client,
+                   aggregate=True)
+
+
+def charge_super_search(user_id: int, monthly_limit: int, redis_client: Optional[redis.Redis] = None) -> Charge:
+    """As charge_search(), against the Super Search monthly counter. Always counted in
+    Redis straight away: its monthly limit is small enough for a flush's worth of
+    requests to matter."""
+    return _charge(user_id, _super_search_monthly_key(user_id), _super_search_active_users_key(), monthly_limit,
+                   redis_client, aggregate=False)
+
+
+def flush_usage(redis_client: Optional[redis.Redis] = None) -> int:
+    """Write this process's pending monthly counts to Redis now."""
+    return _usage.flush(redis_client)
 
 
 # ---------------------------------------------------------------------------
-# Key scanning (used by background jobs only — requires django-redis)
+# Active users (used by background jobs only)
 # ---------------------------------------------------------------------------
 
+def get_active_user_ids(year: int | None = None, month: int | None = None,
+                        redis_client: Optional[redis.Redis] = None) -> list[int]:
+    """The users with a search counter this month, from the month's active set.
+
+    Only call this from background tasks, not from request handlers. Empty if the
+    cache is not Redis.
+    """
+    client = redis_client if redis_client is not None else _cache_redis()
+    if client is None:
+        return []
+    members = client.smembers(cache.make_key(_active_users_key(year, month)))
+    return sorted(int(member) for member in members)
+
+
+def add_active_users(user_ids: list[int], year: int | None = None, month: int | None = None,
+                     redis_client: Optional[redis.Redis] = None) -> None:
+    """Add users to the month's active set, as a flush does for the users it counts.
+    Does nothing if the cache is not Redis."""
+    client = redis_client if redis_client is not None else _cache_redis()
+    if client is None or not user_ids:
+        return
+    key = cache.make_key(_active_users_key(year, month))
+    if client.sadd(key, *user_ids):
+        client.expire(key, MONTHLY_TTL)
+
+
+def backfill_active_users(redis_client: Optional[redis.Redis] = None) -> int:
+    """
+    Add every user with a monthly counter this month to the month's active set, finding
+    the counters by SCAN. Counters written before the active set existed would otherwise
+    be left out of get_all_monthly_keys() until their user searched again. The SCAN runs
+    at most once a month - a marker key is set with the counters' TTL - since from then
+    on every counter is added to the set as it is written. Returns the number of users
+    added. Only call this from background tasks, not from request handlers.
+    """
+    client = redis_client if redis_client is not None else _cache_redis()
+    if client is None:
+        return 0
+    now = datetime.now(timezone.utc)
+    marker = cache.make_key(f"{_active_users_key(now.year, now.month)}:backfilled")
+    if not client.set(marker, 1, ex=MONTHLY_TTL, nx=True):
+        return 0
+
+    prefix = cache.make_key("search:monthly:")
+    pattern = cache.make_key(_monthly_key("*", now.year, now.month))
+    user_ids = set()
+    for key in client.scan_iter(match=pattern, count=1000):
+        key = key.decode() if isinstance(key, bytes) else key
+        user_id = key[len(prefix):].split(":")[0]
+        if user_id.isdigit():
+            user_ids.add(int(user_id))
+    active = set(get_active_user_ids(now.year, now.month, client))
+    missing = sorted(user_ids - active)
+    add_active_users(missing, now.year, now.month, client)
+    if missing:
+        logger.info("Added %d users with existing monthly counters to the active set", len(missing))
+    return len(missing)
+
+
 def get_all_monthly_keys() -> list[str]:
     """
-    Return all active monthly counter keys for the current month.
-    Uses the underlying Redis SCAN command via django-redis.
+    Return all active monthly counter keys for the current month, as passed to the
+    cache. Enumerated from the month's active set rather than by SCAN over the keyspace.
     Only call this from background tasks, not from request handlers.
     """
-    now = datetime.now(timezone.utc)
-    pattern = f"search:monthly:*:{now.year}:{now.month:02d}"
-    from django_redis import get_redis_connection
-    conn = get_redis_connection("default")
-    return [k.decode() if isinstance(k, bytes) else k for k in conn.scan_iter(pattern)]
+    return [_monthly_key(user_id) for user_id in get_active_user_ids()]
 
 
 def delete_all_monthly_keys() -> None:
@@ -129,4 +461,4 @@ def delete_all_monthly_keys() -> None:
     """
     keys = get_all_monthly_keys()
     if keys:
-        cache.delete_many(keys)
+        cache.delete_many(keys + [_active_users_key()])
@@ -37,7 +37,8 @@ from joblib import Memory  # noqa: E402
 from mwmbl.rankeval.evaluation.evaluate import RankingModel, evaluate  # noqa: E402
 from mwmbl.rankeval.paths import DATA_DIR  # noqa: E402
 from mwmbl.tinysearchengine.indexer import Document  # noqa: E402
-from mwmbl.tinysearchengine.super_search import _emit_final_results, _run_pipeline  # noqa: E402
+from mwmbl.tinysearchengine.super_search import (  # noqa: E402
+    FinalRanking, ResultsEmitter, _emit_final_results, _run_pipeline)
 from mwmbl.tinysearchengine.super_search_select.rewards import SelectionContext  # noqa: E402
 
 
@@ -67,16 +68,16 @@ async def _collect(query: str) -> list[Document]:
     ignore those and keep only the accumulated documents.
     """
     all_docs: list[Document] = []
-    last_results_key: list = [None]
-    lock = asyncio.Lock()
+    results = ResultsEmitter(query, all_docs, _noop_emit)
     ctx = SelectionContext()
     try:
         await asyncio.wait_for(
-            _run_pipeline(query, _noop_emit, all_docs, last_results_key, lock, ctx),
+            _run_pipeline(query, _noop_emit, all_docs, results, ctx),
             timeout=settings.SUPER_SEARCH_DEADLINE_SECONDS,
         )
     except asyncio.TimeoutError:
         pass
+    await results.close()
     return all_docs
 
 
@@ -94,10 +95,10 @@ def _collect_docs(query: str, selection_key: str = "") -> list[dict]:
 
 async def _rank(query: str, docs: list[Document]) -> list[str]:
     """Run the final LTR + MMR ranking over a document pool (cheap, not cached)."""
-    last_results_key: list = [None]
+    ranking = FinalRanking()
     lock = asyncio.Lock()
-    await _emit_final_results(query, docs, _noop_emit, last_results_key, lock)
-    return list(last_results_key[0] or ())
+    await _emit_final_results(query, docs, _noop_emit, ranking, lock)
+    return list(ranking.last_key or ())
 
 
 class SuperSearchRankingModel(RankingModel):
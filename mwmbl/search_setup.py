@@ -48,7 +48,8 @@ index_path = Path(settings.DATA_PATH) / settings.INDEX_NAME
 tiny_index = TinyIndex(item_factory=Document, index_path=index_path)
 tiny_index.__enter__()
 
-ltr_model = RustXGBPipeline.from_model_path(str(settings.RUST_MODEL_PATH))
+ltr_model = RustXGBPipeline.from_model_path(str(settings.RUST_MODEL_PATH),
+                                             predict_threads=settings.LTR_PREDICT_THREADS)
 # Diversity is applied by the wrapping MMRRanker, which demotes (rather than drops)
 # same-domain / near-duplicate results. Unwrap to disable diversity.
 ranker = MMRRanker(LTRRanker(tiny_index, completer, ltr_model, include_wiki=True, num_wiki_results=3))
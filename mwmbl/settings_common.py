@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "mwmbl.request_timing.ServerTimingMiddleware",
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -210,6 +211,12 @@ HAS_DATABASE = True
 # `dokku config:set <app> RUN_BACKGROUND_TASKS=true`.
 RUN_BACKGROUND_TASKS = os.environ.get("RUN_BACKGROUND_TASKS", "false").lower() == "true"
 
+# Whether the gunicorn master builds the search serving state - the index, completer, LTR
+# model, ranker and blacklist snapshot - once, before forking the workers, which then
+# share its pages copy-on-write instead of each loading their own (see mwmbl.main).
+# Turn it on with `dokku config:set <app> SERVING_PRELOAD=true`.
+SERVING_PRELOAD = os.environ.get("SERVING_PRELOAD", "false").lower() == "true"
+
 
 SENTRY_DSN = os.environ.get("SENTRY_DSN")
 
@@ -292,12 +299,32 @@ CURRENT_AGREEMENT_VERSIONS = {
 SUPER_SEARCH_MONTHLY_LIMIT = 100
 SUPER_SEARCH_TOP_K = 10          # promote sources in top-K seen so far for crawling
 SUPER_SEARCH_DEADLINE_SECONDS = 10.0
-SUPER_SEARCH_PER_SOURCE_TIMEOUT = 2.0
-SUPER_SEARCH_MAX_CONCURRENT_PER_HOST = 4
+SUPER_SEARCH_PER_SOURCE_TIMEOUT = 2.0             # the longest a source is waited for; see super_search_select/health.py
+SUPER_SEARCH_MIN_SOURCE_TIMEOUT = 0.5             # the shortest, however fast a source has been
+SUPER_SEARCH_SOURCE_TIMEOUT_P95_MULTIPLIER = 1.5  # a source's timeout, as a multiple of its p95 latency
+SUPER_SEARCH_SOURCE_MIN_OBSERVATIONS = 20         # calls before a source's timeout adapts
+SUPER_SEARCH_SOURCE_FAILURE_THRESHOLD = 5         # failures in a row that open a source's circuit
+SUPER_SEARCH_SOURCE_COOLDOWN_SECONDS = 60         # how long a source with an open circuit is skipped
+SUPER_SEARCH_MAX_CONCURRENT_PER_HOST = 24         # requests in flight to one host, across every stream; see super_search_http.py
+SUPER_SEARCH_MAX_CONNECTIONS = 100                # connections the shared client may open in one process
+SUPER_SEARCH_KEEPALIVE_CONNECTIONS = 40           # idle connections it keeps for the next search
+SUPER_SEARCH_KEEPALIVE_SECONDS = 30.0             # how long an idle connection is kept
+# Answers from each source are kept briefly (mwmbl/tinysearchengine/super_search_cache.py).
+SUPER_SEARCH_SOURCE_CACHE_ENABLED = os.environ.get("SUPER_SEARCH_SOURCE_CACHE_ENABLED", "true").lower() != "false"
+SUPER_SEARCH_SOURCE_CACHE_SHARED = os.environ.get("SUPER_SEARCH_SOURCE_CACHE_SHARED", "true").lower() != "false"
+SUPER_SEARCH_SOURCE_CACHE_MAX_ENTRIES = 5_000     # per-process LRU size
+SUPER_SEARCH_SOURCE_CACHE_TTL_SECONDS = 600       # how long a source's answer is kept
+SUPER_SEARCH_SOURCE_CACHE_EMPTY_TTL_SECONDS = 60  # ... and an empty answer, at most
+SUPER_SEARCH_SOURCE_CACHE_TTLS = {                # per-source TTLs; 0 turns the cache off for a source
+    "mwmbl": 60,   # Super Search indexes what it finds, so our own index moves fastest
+    "hn": 120,
+}
 SUPER_SEARCH_MAX_LINKS_PER_PAGE = 3
 SUPER_SEARCH_RESULTS_PER_SOURCE = 10
 SUPER_SEARCH_FINAL_RESULTS_LIMIT = 100
-SUPER_SEARCH_CRAWL_WORKERS = 8   # threads in the dedicated crawl pool
+SUPER_SEARCH_RESULTS_INTERVAL_SECONDS = 0.25  # at most one `results` frame per stream this often, plus a final one
+SUPER_SEARCH_EXTRACT_WORKERS = 4     # threads extracting crawled pages, shared by every stream in a process
+SUPER_SEARCH_FETCHES_PER_STREAM = 4  # pages one stream may be fetching or extracting at once
 # Fine-tuned relevance judge (dir with model.onnx + tokenizer.json; see
 # devdata/judge_train/RESULTS.md). If the artifact is missing, Super Search
 # falls back to LTR final ranking and top-K-survival bandit rewards.
@@ -305,6 +332,14 @@ SUPER_SEARCH_JUDGE_MODEL_DIR = os.environ.get(
     "SUPER_SEARCH_JUDGE_MODEL_DIR",
     str(Path(__file__).parent.parent / "devdata" / "judge_train" / "models"
         / "minilm-both-v1" / "onnx"))
+# Concurrent callers' pairs are scored together (see super_search_select/judge.py).
+# Off while the only caller is scripts/super_search_eval.py, which scores one query at a time.
+SUPER_SEARCH_JUDGE_BATCHING = False
+SUPER_SEARCH_JUDGE_BATCH_SIZE = 64             # pairs per forward pass
+SUPER_SEARCH_JUDGE_BATCH_WAIT_SECONDS = 0.005  # longest a pair waits for others to fill its batch
+# Known (query, document) scores are reused (see super_search_select/judge_cache.py).
+# Its SQLite tier keeps raw queries, so only offline scripts can turn it on.
+SUPER_SEARCH_JUDGE_SCORE_CACHE_MAX_ENTRIES = 50_000  # pairs kept per process; 0 turns the cache off
 
 # Super Search source selection (xgb contextual bandit over cosine-profile features)
 SUPER_SEARCH_SOURCES_TO_QUERY = 10   # max sources queried per search
@@ -332,3 +367,46 @@ BLACKLIST_SNAPSHOT_CHECK_SECONDS = 300     # how often a worker checks Redis for
 BLACKLIST_SNAPSHOT_REFRESH_SECONDS = 6 * 60 * 60   # how often the snapshot is rebuilt from the remote lists
 BLACKLIST_PURGE_INTERVAL_SECONDS = 300     # how often the purge queue is drained
 BLACKLIST_PURGE_BATCH_SIZE = 1000          # documents removed from the index per purge run
+
+# Prometheus scrapers authenticate to /metrics with this bearer token (see mwmbl/metrics.py);
+# unset, only staff sessions can read it.
+METRICS_BEARER_TOKEN = os.environ.get("METRICS_BEARER_TOKEN") or None
+
+# Search result cache (mwmbl/tinysearchengine/result_cache.py). Entries are invalidated by
+# index writes, so the TTL only bounds how stale live Wikipedia results can get.
+SEARCH_RESULT_CACHE_ENABLED = os.environ.get("SEARCH_RESULT_CACHE_ENABLED", "true").lower() != "false"
+SEARCH_RESULT_CACHE_SHARED = os.environ.get("SEARCH_RESULT_CACHE_SHARED", "true").lower() != "false"
+SEARCH_RESULT_CACHE_MAX_ENTRIES = 10_000      # per-process LRU size
+SEARCH_RESULT_CACHE_TTL_SECONDS = 300
+SEARCH_RESULT_CACHE_GENERATION_SLOTS = 65_536  # index pages share generation counters modulo this
+SEARCH_PAGE_READ_THREADS = 8                   # per-process pool overlapping a query's index page reads
+LTR_PREDICT_THREADS = 4                        # threads sharing LTR feature extraction for a large candidate set
+COMPLETE_MAX_PAGES = 6                         # index pages /complete reads per keystroke
+COMPLETE_LATENCY_SLO_MS = 20                   # /complete calls slower than this are logged
+
+# Conditional GET on the search endpoints (mwmbl/tinysearchengine/conditional.py). ETags
+# change with the index pages a query reads and with each deploy: dokku sets GIT_REV.
+SEARCH_ETAGS_ENABLED = os.environ.get("SEARCH_ETAGS_ENABLED", "true").lower() != "false"
+DEPLOY_REVISION = os.environ.get("GIT_REV", "")
+
+# Warming the most searched queries after a deploy (mwmbl/tinysearchengine/warmer.py).
+# Point the health check at /ready, with SEARCH_WARM_READY_PERCENT set, to hold traffic
+# back until the warm has run. The query log keeps normalised query text in Redis, in
+# one sorted set per hour that expires SEARCH_QUERY_LOG_HOURS + 1 hours after its last
+# write, and only for queries SEARCH_QUERY_LOG_MIN_CLIENTS distinct clients (API keys
+# or addresses) sent in that hour. Below that, only a keyed digest of the query and a
+# HyperLogLog of its clients are kept, for two hours.
+SEARCH_WARM_ENABLED = os.environ.get("SEARCH_WARM_ENABLED", "true").lower() != "false"
+SEARCH_QUERY_LOG_HOURS = 24                    # hours of query counts kept, and read for the warm set
+SEARCH_QUERY_LOG_MIN_CLIENTS = 5               # distinct clients a query needs in an hour to be logged at all
+SEARCH_QUERY_LOG_FLUSH_SECONDS = 10            # how often a worker adds its query counts to Redis
+SEARCH_WARM_QUERIES = 2000                     # most searched queries run after each deploy
+SEARCH_WARM_MIN_COUNT = 3                      # searches a query needs in the log to be warmed
+SEARCH_WARM_QUERIES_PER_SECOND = 20            # rate the one warming process runs them at
+SEARCH_WARM_READY_PERCENT = int(os.environ.get("SEARCH_WARM_READY_PERCENT", "0"))  # of the warm set; 0 to not wait
+SEARCH_WARM_READY_TIMEOUT_SECONDS = 300        # /ready stops waiting for the warm after this
+
+# Search API rate limit (mwmbl/quota.py): "fixed" one-second windows, or "sliding", which
+# does not allow a double burst across a window boundary.
+SEARCH_RATE_LIMIT_WINDOW = os.environ.get("SEARCH_RATE_LIMIT_WINDOW", "fixed")
+SEARCH_USAGE_FLUSH_SECONDS = 5                 # how often a worker adds its searches to the monthly counters; 0 for every search
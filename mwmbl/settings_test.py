@@ -19,6 +19,12 @@ CACHES = {
     }
 }
 
+# Tests mock the ranker per test, so results cached by one test would leak into the next.
+SEARCH_RESULT_CACHE_ENABLED = False
+SEARCH_ETAGS_ENABLED = False
+SEARCH_WARM_ENABLED = False
+SUPER_SEARCH_SOURCE_CACHE_ENABLED = False
+
 # Test bloom filter paths
 URLS_BLOOM_FILTER_PATH = "/tmp/test_urls-{year}-{month}.bloom"
 URLS_BLOOM_FILTER_FALLBACK_PATH = "/tmp/test_urls.bloom"
@@ -1,35 +1,224 @@
-from bisect import bisect_left, bisect_right
+"""Term completion from a compiled prefix trie shared between processes.
+
+The completer suggests the most frequent crawled terms (mwmbl-crawl-terms.csv, ~180,000
+terms) that start with what has been typed so far, and it runs on every keystroke. It used
+to load the CSV through pandas in every gunicorn worker and, per lookup, bisect a sorted
+list for the range of terms with the prefix and sort that whole range by count - for a one
+or two letter prefix, tens of thousands of terms to answer with three.
+
+Instead the terms are compiled into a byte-level trie that stores, at every node, the ids
+of the top num_matches terms below it. A lookup walks one node per byte of the prefix and
+reads the answer off the node it ends on, so its cost depends on the length of the prefix
+and not on how many terms share it. Like the static ranking tables (see static_tables.py)
+the trie is a flat file that every worker mmaps, so it is built once and shared through
+the page cache, and startup doesn't need pandas.
+
+File layout, in little-endian byte order:
+
+    HEADER                  magic, k, term/node counts, term bytes, source stamp (see _HEADER)
+    uint32[terms + 1]       offset of each term in the term bytes, plus the end
+    uint32[nodes + 1]       index of each node's first child, plus the end (see below)
+    uint32[nodes * k]       the ids of each node's top k terms, best first, padded with _NO_TERM
+    uint8[term bytes]       the terms, UTF-8 encoded, in sorted order; a term's id is its position
+    uint8[nodes]            the byte on the edge into each node (unused for the root, node 0)
+
+Nodes are numbered breadth first with each node's children in byte order, so a node's
+children are the contiguous run of nodes from its first child up to the next node's
+first child, and finding a child is a bisect over their labels. Terms are ranked as
+before: by count, then by the term itself, both descending.
+
+The build step is `python -m mwmbl.tinysearchengine.completer`, and as with the static
+tables a missing or out of date file is rebuilt by the first process to need it.
+"""
+import csv
+import heapq
+import struct
+from bisect import bisect_left
+from logging import getLogger
+from mmap import mmap, ACCESS_READ
 from pathlib import Path
+from typing import Iterable
 
-import pandas as pd
+import numpy as np
+
+from mwmbl.tinysearchengine.static_tables import source_stamp, write_compiled
+
+logger = getLogger(__name__)
 
 
 TERMS_PATH = Path(__file__).parent.parent / 'resources' / 'mwmbl-crawl-terms.csv'
+COMPILED_PATH = Path(__file__).parent.parent / 'resources' / 'mwmbl-crawl-terms.completions'
 
+_MAGIC = b"mwmbl-trie-v1\x00\x00\x00"
+# magic, k, number of terms, number of nodes, length of the term bytes, source size, source mtime (ns)
+_HEADER = struct.Struct("<16sIIIIQQ")
+_NO_TERM = 0xFFFFFFFF
 
-class Completer:
-    def __init__(self, num_matches: int = 3):
-        # Load term data
-        terms = self.get_terms()
+NUM_MATCHES = 3
+
+
+def load_terms(path: Path = TERMS_PATH) -> list[tuple[str, int]]:
+    """(term, count) pairs from the crawl terms CSV (columns: index, term, count)."""
+    with open(path, newline='') as terms_file:
+        return [(row['term'], int(row['count'])) for row in csv.DictReader(terms_file) if row['term']]
+
+
+def compile_completions(terms: Iterable[tuple[str, int]], k: int, stamp: tuple[int, int] = (0, 0)) -> bytes:
+    """Serialise (term, count) pairs into the compiled trie format. A repeated term keeps its last count."""
+    counts_by_term = dict(terms)
+    sorted_terms = sorted(counts_by_term)
+    encoded = [term.encode() for term in sorted_terms]
+    counts = [counts_by_term[term] for term in sorted_terms]
+
+    # Breadth first: a node is the run of sorted terms [lo, hi) sharing its `depth` byte
+    # prefix. Its children split that run by the next byte; the term that *is* the prefix,
+    # if there is one, sorts first and ends there.
+    labels = bytearray([0])
+    ranges = [(0, len(encoded), 0)]
+    first_child = []
+    terminal = []
+    for lo, hi, depth in ranges:
+        first_child.append(len(ranges))
+        if lo < hi and len(encoded[lo]) == depth:
+            terminal.append(lo)
+            lo += 1
+        else:
+            terminal.append(None)
+        while lo < hi:
+            byte = encoded[lo][depth]
+            end = lo + 1
+            while end < hi and encoded[end][depth] == byte:
+                end += 1
+            labels.append(byte)
+            ranges.append((lo, end, depth + 1))
+            lo = end
+    num_nodes = len(ranges)
+    first_child.append(num_nodes)
+
+    # Bottom up: a node's top k are the best of its own term and its children's top k.
+    rank_key = lambda term_id: (counts[term_id], term_id)
+    top: list[list[int]] = [[]] * num_nodes
+    for node in range(num_nodes - 1, -1, -1):
+        children = range(first_child[node], first_child[node + 1])
+        if terminal[node] is None and len(children) == 1:
+            top[node] = top[children[0]]
+            continue
+        candidates = [] if terminal[node] is None else [terminal[node]]
+        for child in children:
+            candidates += top[child]
+        top[node] = heapq.nlargest(k, candidates, key=rank_key)
+
+    top_ids = np.full((num_nodes, k), _NO_TERM, dtype='<u4')
+    for node, ids in enumerate(top):
+        top_ids[node, :len(ids)] = ids
+
+    term_bytes = b"".join(encoded)
+    term_offsets = np.zeros(len(encoded) + 1, dtype='<u4')
+    np.cumsum([len(term) for term in encoded], out=term_offsets[1:])
+
+    header = _HEADER.pack(_MAGIC, k, len(encoded), num_nodes, len(term_bytes), *stamp)
+    return b"".join([header, term_offsets.tobytes(), np.array(first_child, dtype='<u4').tobytes(),
+                     top_ids.tobytes(), term_bytes, bytes(labels)])
+
+
+class CompletionIndex:
+    """Read-only prefix -> top k terms lookups over a compiled trie."""
+
+    def __init__(self, data):
+        magic, self.k, num_terms, num_nodes, term_bytes_length, *_ = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a compiled completion index")
 
-        terms_dict = terms.sort_values('term').set_index('term')['count'].to_dict()
-        self.terms = list(terms_dict.keys())
-        self.counts = list(terms_dict.values())
+        view = memoryview(data)
+        position = _HEADER.size
+
+        def section(length: int) -> memoryview:
+            nonlocal position
+            start, position = position, position + length
+            return view[start:position]
+
+        self._term_offsets = section(4 * (num_terms + 1)).cast("I")
+        self._first_child = section(4 * (num_nodes + 1)).cast("I")
+        self._top = section(4 * num_nodes * self.k).cast("I")
+        self._term_bytes = section(term_bytes_length)
+        self._labels = section(num_nodes)
+
+    @classmethod
+    def open(cls, path: Path) -> "CompletionIndex":
+        with open(path, "rb") as index_file:
+            return cls(mmap(index_file.fileno(), 0, access=ACCESS_READ))
+
+    def _find(self, prefix: bytes):
+        node = 0
+        for byte in prefix:
+            start, end = self._first_child[node], self._first_child[node + 1]
+            node = bisect_left(self._labels, byte, start, end)
+            if node == end or self._labels[node] != byte:
+                return None
+        return node
+
+    def _term(self, term_id: int) -> str:
+        return bytes(self._term_bytes[self._term_offsets[term_id]:self._term_offsets[term_id + 1]]).decode()
+
+    def complete(self, prefix: str, num_matches: int) -> list[str]:
+        try:
+            node = self._find(prefix.encode())
+        except UnicodeEncodeError:
+            # A lone surrogate can't be in any term: the terms file is UTF-8.
+            return []
+        if node is None:
+            return []
+        start = node * self.k
+        return [self._term(term_id) for term_id in self._top[start:start + min(num_matches, self.k)]
+                if term_id != _NO_TERM]
+
+
+def _is_current(path: Path, source_path: Path, k: int) -> bool:
+    try:
+        with open(path, "rb") as index_file:
+            header = index_file.read(_HEADER.size)
+        magic, compiled_k, *_, size, mtime_ns = _HEADER.unpack(header)
+    except (OSError, struct.error):
+        return False
+    return magic == _MAGIC and compiled_k == k and (size, mtime_ns) == source_stamp(source_path)
+
+
+def build_completion_index(path: Path, source_path: Path, k: int) -> bytes:
+    data = compile_completions(load_terms(source_path), k, source_stamp(source_path))
+    write_compiled(path, data)
+    return data
+
+
+def load_completion_index(path: Path, source_path: Path, k: int) -> CompletionIndex:
+    """Open the compiled index, compiling it from the terms CSV first if it is out of date."""
+    if not _is_current(path, source_path, k):
+        logger.info("Compiling %s from %s", path.name, source_path.name)
+        data = build_completion_index(path, source_path, k)
+        if not _is_current(path, source_path, k):
+            return CompletionIndex(data)
+    return CompletionIndex.open(path)
+
+
+class Completer:
+    def __init__(self, num_matches: int = NUM_MATCHES):
         self.num_matches = num_matches
-        print("Terms", self.terms[:100], self.counts[:100])
-        
-    def get_terms(self):
-        return pd.read_csv(TERMS_PATH)
+        self.index = self.get_index()
+
+    def get_index(self) -> CompletionIndex:
+        return load_completion_index(COMPILED_PATH, TERMS_PATH, self.num_matches)
 
     def complete(self, term) -> list[str]:
-        term_length = len(term)
-        start_index = bisect_left(self.terms, term, key=lambda x: x[:term_length])
-        end_index = bisect_right(self.terms, term, key=lambda x: x[:term_length])
+        return self.index.complete(term, self.num_matches)
+
+
+def run():
+    """The build step: compile the completion index if it is missing or out of date."""
+    if _is_current(COMPILED_PATH, TERMS_PATH, NUM_MATCHES):
+        print("completions: up to date")
+        return
+    build_completion_index(COMPILED_PATH, TERMS_PATH, NUM_MATCHES)
+    print(f"completions: compiled {COMPILED_PATH} ({COMPILED_PATH.stat().st_size:,} bytes)")
 
-        matching_terms = zip(self.counts[start_index:end_index], self.terms[start_index:end_index])
-        top_terms = sorted(matching_terms, reverse=True)[:self.num_matches]
-        if not top_terms:
-            return []
 
-        counts, terms = zip(*top_terms)
-        return list(terms)
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,110 @@
+"""Conditional GET for the search endpoints: ETags, 304 Not Modified and Cache-Control.
+
+Search responses went out with no validators, so a browser, an extension polling the API
+or a proxy in front of us had no way to ask "has this changed?" - every repeat of a query
+was a full request, ranked again (or at best served from the result cache). The results
+for a query only change when the index pages it reads change, a blacklist snapshot is
+published, or a deploy changes the ranking, and the result cache already tracks the first
+two in its tag (see result_cache). So /search, /complete and /raw each get an ETag made
+from
+
+    the deploy (DEPLOY_REVISION), the endpoint, the normalised query, and the tag
+
+and a request whose If-None-Match holds it is answered with a 304 before anything is
+ranked: working out the query's pages and one HMGET, the same read the result cache would
+have made anyway. When the ETag does not match, the tag is handed on to the result cache,
+so a conditional request costs no extra round trip.
+
+The ETags are weak (W/"..."). Two responses with the same one hold the same results, but
+not necessarily the same bytes: results with live Wikipedia lookups can move without an
+index write, and a v2 response to an API key carries its monthly usage, which changes
+with every request. Weak validators are what If-None-Match compares, so they cost
+nothing for the 304s.
+
+Cache-Control is "public, no-cache": a browser or proxy may keep a response, but has to
+ask before every reuse. Serving one unchecked for even a minute would undo what the
+generations are for - a curation or a blacklisted domain showing at once - and asking is
+cheap, since the answer is usually a 304. v2 requests with an API key are
+"private, no-cache": each reuse is a request against the key's quota (the quota is
+charged before the ETag is checked - a 304 still counts), and v2 responses Vary on
+X-API-Key so a shared cache never serves one key's response to another caller.
+
+/complete runs on every keystroke, so its one read of the generations is also the one
+its result cache lookup uses: the suggestions go through cached_search_results() with
+the tag validate() read.
+
+If the generations cannot be read there is no ETag - a guess could send a 304 for results
+that have changed - and the response is built as before.
+"""
+import hashlib
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from mwmbl.request_timing import stage
+from mwmbl.tinysearchengine.result_cache import normalize_query, read_index_tag
+
+
+def search_etag(endpoint: str, query: str, tag: str) -> str:
+    """The weak ETag of a response from this endpoint, given the read_index_tag() of the
+    pages the query reads."""
+    validator = f"{settings.DEPLOY_REVISION}|{endpoint}|{normalize_query(query)}|{tag}"
+    return f'W/"{hashlib.blake2b(validator.encode(), digest_size=12).hexdigest()}"'
+
+
+def _weak(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(request: HttpRequest, etag: str) -> bool:
+    """Whether the request's If-None-Match holds this ETag, by weak comparison."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    candidates = parse_etags(header)
+    return "*" in candidates or _weak(etag) in {_weak(candidate) for candidate in candidates}
+
+
+@dataclass
+class Validation:
+    """What a search endpoint needs to answer a request conditionally."""
+    etag: Optional[str]
+    tag: Optional[str]
+    not_modified: bool
+    cache_control: str
+    vary: tuple[str, ...] = ()
+
+    def apply(self, response: HttpResponse) -> None:
+        if self.etag is not None:
+            response["ETag"] = self.etag
+        response["Cache-Control"] = self.cache_control
+        if self.vary:
+            patch_vary_headers(response, self.vary)
+
+    def not_modified_response(self) -> HttpResponse:
+        response = HttpResponseNotModified()
+        self.apply(response)
+        return response
+
+
+def validate(request: HttpRequest, endpoint: str, query: str, ranker, private: bool = False,
+             vary: tuple[str, ...] = ()) -> Validation:
+    """Work out this response's ETag, and whether the client already has it. Never raises.
+
+    `private` is for responses that belong to one caller and must be revalidated every
+    time they are reused.
+    """
+    cache_control = "private, no-cache" if private else "public, no-cache"
+    if not settings.SEARCH_ETAGS_ENABLED:
+        return Validation(None, None, False, cache_control, vary)
+
+    with stage("etag"):
+        tag = read_index_tag(ranker.get_index_pages(query))
+        if tag is None:
+            return Validation(None, None, False, cache_control, vary)
+        etag = search_etag(endpoint, query, tag)
+        return Validation(etag, tag, etag_matches(request, etag), cache_control, vary)
@@ -105,6 +105,9 @@ class RustXGBPipeline(BaseEstimator, RegressorMixin):
         XGBoost gamma (min_split_loss) hyperparameter (default None, uses XGBoost default of 0.0).
     subsample : float or None
         XGBoost subsample hyperparameter (default None, uses XGBoost default of 1.0).
+    predict_threads : int or None
+        Threads predict() may split feature extraction of a large batch across (default
+        None, up to 4). predict() releases the GIL either way.
     """
 
     def __init__(
@@ -117,6 +120,7 @@ class RustXGBPipeline(BaseEstimator, RegressorMixin):
         min_child_weight: float | None = None,
         gamma: float | None = None,
         subsample: float | None = None,
+        predict_threads: int | None = None,
     ):
         self.threshold = threshold
         self.scale_pos_weight = scale_pos_weight
@@ -126,6 +130,7 @@ class RustXGBPipeline(BaseEstimator, RegressorMixin):
         self.min_child_weight = min_child_weight
         self.gamma = gamma
         self.subsample = subsample
+        self.predict_threads = predict_threads
         self._inner = mwmbl_rank.RustXGBPipeline(
             threshold=self.threshold,
             scale_pos_weight=self.scale_pos_weight,
@@ -135,6 +140,7 @@ class RustXGBPipeline(BaseEstimator, RegressorMixin):
             min_child_weight=self.min_child_weight,
             gamma=self.gamma,
             subsample=self.subsample,
+            predict_threads=self.predict_threads,
         )
 
     @staticmethod
@@ -212,6 +218,7 @@ class RustXGBPipeline(BaseEstimator, RegressorMixin):
         min_child_weight: float | None = None,
         gamma: float | None = None,
         subsample: float | None = None,
+        predict_threads: int | None = None,
     ) -> 'RustXGBPipeline':
         """Load a pre-trained model from disk and return a ready-to-predict pipeline."""
         pipeline = cls(
@@ -223,6 +230,7 @@ class RustXGBPipeline(BaseEstimator, RegressorMixin):
             min_child_weight=min_child_weight,
             gamma=gamma,
             subsample=subsample,
+            predict_threads=predict_threads,
         )
         pipeline.load_model(path)
         return pipeline
@@ -236,5 +244,6 @@ class RustXGBPipeline(BaseEstimator, RegressorMixin):
             f"max_depth={self.max_depth}, "
             f"min_child_weight={self.min_child_weight}, "
             f"gamma={self.gamma}, "
-            f"subsample={self.subsample})"
+            f"subsample={self.subsample}, "
+            f"predict_threads={self.predict_threads})"
         )
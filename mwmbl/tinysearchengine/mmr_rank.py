@@ -6,15 +6,32 @@ search() output so near-duplicate / same-domain results are demoted rather than
 (the big search engines diversify the list instead of hard-capping one result per domain).
 It can wrap any ranker (LTRRanker, HeuristicRanker, ...), which also makes it easy to
 evaluate a ranker with and without diversity.
+
+The same algorithm is implemented natively in the mwmbl_rank crate (mwmbl_rank/src/mmr.rs),
+and when the extension is built mmr_rerank and order_and_rerank run there: the candidates
+cross into Rust once as plain strings and come back as an order, instead of every title
+and extract being re-tokenized into Python dicts. The Python implementation stays as the
+reference and the fallback. Both must produce exactly the same order - test/mmr_golden.json
+is generated from the Python implementation (analyse/make_mmr_golden.py) and both are
+tested against it, so any change to the algorithm or the constants below means changing
+mmr.rs and regenerating the fixture.
 """
 import math
 from collections import Counter
+from typing import Optional
 from urllib.parse import urlparse
 
+from mwmbl.request_timing import stage
 from mwmbl.tinysearchengine.indexer import Document
 from mwmbl.tinysearchengine.rank import Ranker
 from mwmbl.tokenizer import tokenize
 
+try:
+    from mwmbl_rank import mmr_order as _native_mmr_order
+except ImportError:
+    # The extension hasn't been built (or predates mmr.rs): use the Python implementation.
+    _native_mmr_order = None
+
 
 # MMR tuning parameters.
 MMR_LAMBDA = 0.7  # weight on relevance vs. diversity (1.0 = pure relevance, 0.0 = max diversity)
@@ -38,26 +55,14 @@ def _text_cosine(a: dict[str, float], b: dict[str, float]) -> float:
     return sum(weight * b[token] for token, weight in a.items() if token in b)
 
 
-def mmr_rerank(ranked_pages: list[Document]) -> list[Document]:
-    """Re-order a relevance-sorted list to demote near-duplicate / same-domain results.
-
-    Greedy Maximal Marginal Relevance with a domain-dominant kernel
-    (sim = w_domain * same_domain + (1 - w_domain) * bag-of-words cosine). Relevance is
-    rank-based (scale-invariant): the i-th most relevant page has relevance
-    (window - i) / window, so it does not depend on the model's compressed score
-    magnitudes. Each candidate is discounted by its greatest similarity to an
-    already-selected page, so e.g. the second result from a domain sinks below fresher
-    domains but is never dropped.
-
-    Only the top MMR_WINDOW candidates are diversified (O(window^2)); the long tail,
-    which is rarely seen, keeps plain relevance order so the cost stays bounded.
-    """
+def _mmr_order(ranked_pages: list[Document]) -> list[int]:
+    """The Python implementation of mmr_rerank: the positions of the pages in their new order."""
     n = len(ranked_pages)
     if n <= 2:
-        return ranked_pages
+        return list(range(n))
 
     window = min(n, MMR_WINDOW)
-    head, tail = ranked_pages[:window], ranked_pages[window:]
+    head = ranked_pages[:window]
 
     relevance = [(window - i) / window for i in range(window)]
     bows = [_normalized_bow(p) for p in head]
@@ -76,24 +81,77 @@ def mmr_rerank(ranked_pages: list[Document]) -> list[Document]:
             sim = domain_sim + (1 - DOMAIN_SIMILARITY_WEIGHT) * _text_cosine(best_bow, bows[j])
             if sim > max_sim[j]:
                 max_sim[j] = sim
-    return [head[i] for i in selected] + tail
+    return selected + list(range(window, n))
+
+
+def _native_order(pages: list[Document], scores: Optional[list[float]], limit: Optional[int]) -> Optional[list[int]]:
+    """The order from mwmbl_rank, or None if it isn't available for these pages."""
+    if _native_mmr_order is None:
+        return None
+    candidates = [(p.title or '', p.extract or '', p.url) for p in pages]
+    try:
+        return _native_mmr_order(candidates, scores, limit, MMR_LAMBDA, DOMAIN_SIMILARITY_WEIGHT, MMR_WINDOW)
+    except UnicodeEncodeError:
+        # A lone surrogate (e.g. from a crawled JSON extract) can't cross into a Rust
+        # String; tokenize() drops it in Python, so rank these pages there.
+        return None
+
+
+def mmr_rerank(ranked_pages: list[Document]) -> list[Document]:
+    """Re-order a relevance-sorted list to demote near-duplicate / same-domain results.
+
+    Greedy Maximal Marginal Relevance with a domain-dominant kernel
+    (sim = w_domain * same_domain + (1 - w_domain) * bag-of-words cosine). Relevance is
+    rank-based (scale-invariant): the i-th most relevant page has relevance
+    (window - i) / window, so it does not depend on the model's compressed score
+    magnitudes. Each candidate is discounted by its greatest similarity to an
+    already-selected page, so e.g. the second result from a domain sinks below fresher
+    domains but is never dropped.
+
+    Only the top MMR_WINDOW candidates are diversified (O(window^2)); the long tail,
+    which is rarely seen, keeps plain relevance order so the cost stays bounded.
+    """
+    if len(ranked_pages) <= 2:
+        return ranked_pages
+    order = _native_order(ranked_pages, None, None)
+    if order is None:
+        order = _mmr_order(ranked_pages)
+    return [ranked_pages[i] for i in order]
+
+
+def order_and_rerank(pages: list[Document], scores: list[float], limit: int) -> list[tuple[Document, float]]:
+    """Sort scored pages by descending score, keep the top `limit` and diversify them with MMR.
+
+    Equivalent to mmr_rerank(sorted(pages, key=-score)[:limit]), paired with the scores,
+    but with mwmbl_rank built the sort, the cut and the rerank are one native call.
+    """
+    order = _native_order(pages, scores, limit)
+    if order is None:
+        ranked = sorted(range(len(pages)), key=lambda i: -scores[i])[:limit]
+        order = [ranked[i] for i in _mmr_order([pages[i] for i in ranked])]
+    return [(pages[i], scores[i]) for i in order]
 
 
 class MMRRanker:
     """Decorator that applies MMR diversity re-ranking to a wrapped ranker's results.
 
-    Demotes (never drops) same-domain / near-duplicate results. Delegates completion and
-    raw retrieval unchanged.
+    Demotes (never drops) same-domain / near-duplicate results. Delegates completion,
+    raw retrieval and the page lookup for the result cache unchanged.
     """
 
     def __init__(self, ranker: Ranker):
         self.ranker = ranker
 
     def search(self, s: str, additional_results: list[Document]) -> list[Document]:
-        return mmr_rerank(self.ranker.search(s, additional_results))
+        results = self.ranker.search(s, additional_results)
+        with stage("mmr"):
+            return mmr_rerank(results)
 
     def complete(self, q: str):
         return self.ranker.complete(q)
 
     def get_raw_results(self, query: str):
         return self.ranker.get_raw_results(query)
+
+    def get_index_pages(self, q: str) -> set[int]:
+        return self.ranker.get_index_pages(q)
@@ -1,16 +1,18 @@
 import html
-import json
 import math
+import os
 import re
 import threading
 import time
 import urllib
 from abc import abstractmethod
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import timedelta
+from itertools import repeat
 from logging import getLogger
 from operator import itemgetter
-from pathlib import Path
 from urllib.parse import urlparse
 
 import numpy as np
@@ -19,11 +21,13 @@ from requests.adapters import HTTPAdapter, Retry
 from requests.exceptions import RetryError
 
 from mwmbl.format import get_query_regex
-from mwmbl.hn_top_domains_filtered import DOMAINS
 from mwmbl.indexer.blacklist_snapshot import get_snapshot_blacklist
 from mwmbl.indexer.purge_queue import enqueue_for_purge
+from mwmbl.metrics import ThreadPoolTracker
+from mwmbl.request_timing import stage
 from mwmbl.tinysearchengine.completer import Completer
 from mwmbl.tinysearchengine.indexer import TinyIndex, Document, DocumentState
+from mwmbl.tinysearchengine.static_tables import get_table
 from mwmbl.tokenizer import tokenize, get_bigrams
 from mwmbl.utils import get_domain, request_cache
 
@@ -38,10 +42,43 @@ LENGTH_PENALTY = 0.04
 MATCH_EXPONENT = 2
 DOMAIN_SCORE_SMOOTHING = 0.1
 HTTPS_STRING = 'https://'
-WIKI_SCORES = json.load(open(Path(__file__).parent.parent / "resources" / "wiki_stats.json"))
-WIKI_MAX_SCORE = next(iter(WIKI_SCORES.values()))
-DOCUMENT_FREQUENCIES = json.load(open(Path(__file__).parent.parent / "resources" / "document_counts.json"))
-N_DOCUMENTS = max(DOCUMENT_FREQUENCIES.values())
+GOOGLE_SEARCH_PREFIX = 'search: google.com '
+# Compiled, mmapped tables shared by every worker - see static_tables.
+WIKI_SCORES = get_table("wiki_scores")
+WIKI_MAX_SCORE = WIKI_SCORES.first_value
+DOCUMENT_FREQUENCIES = get_table("document_frequencies")
+N_DOCUMENTS = DOCUMENT_FREQUENCIES.max_value
+DOMAINS = get_table("domains")
+
+# A query reads one index page per term, completion and bigram - typically ten or more
+# random 4K reads from a 400G file. Cold, each is a disk seek, and done one after another
+# the query waits for all of them in turn. Reading them on this pool overlaps the seeks;
+# TinyIndex reads with pread, which releases the GIL, so the threads really do wait on
+# the disk in parallel. It is shared by every query in the process, which bounds the
+# number of reads in flight at once however many requests arrive together.
+def _page_read_executor() -> tuple[ThreadPoolExecutor, ThreadPoolTracker]:
+    threads = getattr(settings, "SEARCH_PAGE_READ_THREADS", 8)
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="page-read")
+    return executor, ThreadPoolTracker("page_read", threads)
+
+
+_PAGE_READ_EXECUTOR, _PAGE_READ_POOL = _page_read_executor()
+
+
+def _replace_page_read_executor_after_fork():
+    # A forked child gets a copy of the executor but none of its threads. If the parent
+    # had started any, the copy counts them towards max_workers, never starts its own,
+    # and every query would wait forever on reads nothing is running.
+    global _PAGE_READ_EXECUTOR, _PAGE_READ_POOL
+    _PAGE_READ_EXECUTOR, _PAGE_READ_POOL = _page_read_executor()
+
+
+os.register_at_fork(after_in_child=_replace_page_read_executor_after_fork)
+
+# /complete runs on every keystroke, so it reads a bounded number of pages and never runs
+# the full ranker - see Ranker.complete.
+COMPLETE_MAX_PAGES = getattr(settings, "COMPLETE_MAX_PAGES", 6)
+COMPLETE_LATENCY_SLO_MS = getattr(settings, "COMPLETE_LATENCY_SLO_MS", 20)
 
 
 def score_result(terms: list[str], result: Document, is_complete: bool):
@@ -172,15 +209,16 @@ def get_features(terms, title, url, extract, score, is_complete):
     return features
 
 
-DOMAIN_MAX_SCORE = max(DOMAINS.values())
-DOMAIN_MIN_SCORE = min(DOMAINS.values())
+DOMAIN_MAX_SCORE = DOMAINS.max_value
+DOMAIN_MIN_SCORE = DOMAINS.min_value
 
 
 def get_domain_score(url):
     domain = urlparse(url).netloc
 
-    if domain in DOMAINS:
-        normalised_score = (DOMAINS[domain] - DOMAIN_MIN_SCORE) / (DOMAIN_MAX_SCORE - DOMAIN_MIN_SCORE)
+    domain_score = DOMAINS.get(domain)
+    if domain_score is not None:
+        normalised_score = (domain_score - DOMAIN_MIN_SCORE) / (DOMAIN_MAX_SCORE - DOMAIN_MIN_SCORE)
         return normalised_score
 
     return 0.0
@@ -268,10 +306,35 @@ def remove_curate_state(state: DocumentState):
     return state
 
 
+@dataclass
+class PageReadTimings:
+    """Where one query's page reads spent their time.
+
+    `cpu_seconds` is decompressing and parsing, summed over the reading threads;
+    `waiting_seconds` is the rest of their time, almost all of it blocked on the disk when
+    the page cache is cold. `wall_seconds` is what the query itself waited, which is less
+    than the sum of the two whenever the reads overlapped.
+    """
+    pages: int
+    wall_seconds: float
+    cpu_seconds: float
+    waiting_seconds: float
+
+
+def _timed_retrieve(tiny_index: TinyIndex, term: str) -> tuple[list[Document], float, float]:
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    items = tiny_index.retrieve(term)
+    cpu = time.thread_time() - cpu_started
+    return items, cpu, time.perf_counter() - started - cpu
+
+
 class Ranker:
     def __init__(self, tiny_index: TinyIndex, completer: Completer):
         self.tiny_index = tiny_index
         self.completer = completer
+        # The last query's lookup terms, per thread (see _get_lookup_terms).
+        self._last_lookup = threading.local()
 
     @abstractmethod
     def order_results(self, terms: list[str], pages: list[Document], is_complete: bool):
@@ -292,51 +355,93 @@ class Ranker:
         return ranked_results
 
     def complete(self, q: str):
-        # Autocomplete fires on every keystroke, so it must never trigger external_search
-        # (e.g. a live Wikipedia lookup) - that would multiply outbound requests by the
-        # length of every query typed and can get us rate-limited (see fix-wiki-overuse).
-        ordered_results, terms, completions = self.get_results(q, [], use_external_search=False)
+        """Suggestions for a partial query: a URL to go straight to, then completions of
+        the last term, or Google searches if the index has nothing for it.
+
+        This runs on every keystroke - several times for every search - so instead of
+        calling get_results(), which reads a page for every term, completion and bigram,
+        it reads at most COMPLETE_MAX_PAGES pages, most specific first: the query as typed
+        (where curated results live), the terms already typed in full, latest first, the
+        completions of the last term in the completer's order, then the last term itself.
+        What is on them is ordered and deduplicated as get_results() would, and the
+        suggestion is picked the same way: the first of the top five results whose https
+        URL contains every term, with Google searches when there are no results at all.
+
+        It must never trigger external_search (e.g. a live Wikipedia lookup) - that would
+        multiply outbound requests by the length of every query typed and can get us
+        rate-limited (see fix-wiki-overuse).
+        """
+        started = time.perf_counter()
+        terms = tokenize(q)
+        is_complete = q.endswith(' ')
+        completions, _ = self._get_lookup_terms(terms, is_complete)
+
+        curation_term = " ".join(terms)
+        page_terms = [curation_term] + terms[-2::-1] + completions + terms[-1:]
+        page_terms = list(dict.fromkeys(page_terms))[:COMPLETE_MAX_PAGES]
+        candidates, curated_items = [], []
+        if len(terms) > 0:
+            term_items = self._retrieve_all(set(page_terms))
+            candidates, curated_items = self._collect_pages(term_items, page_terms, curation_term)
+            candidates, curated_items = self._remove_blacklisted(candidates, curated_items, index_items=candidates)
+        ordered_results = deduplicate(curated_items + self.order_results(terms, candidates, is_complete), set())
+
         if len(ordered_results) == 0:
             # There are no results so suggest Google searches instead
             completion_queries = [' '.join(terms[:-1] + [t]) for t in completions]
             adjusted_completions = completion_queries if q in completion_queries else [q] + completion_queries
-            completed = ["search: google.com " + t for t in adjusted_completions]
-            return [q, completed]
+            completed = [GOOGLE_SEARCH_PREFIX + t for t in adjusted_completions]
         else:
             adjusted_completions = [c for c in completions if c != terms[-1]]
 
             urls = ["go: " + item.url[len(HTTPS_STRING):].rstrip('/') for item in ordered_results[:5]
                     if item.url.startswith(HTTPS_STRING) and all(term in item.url for term in terms)][:1]
-            completed = [' '.join(terms[:-1] + [t]) for t in adjusted_completions]
-            return [q, urls + completed]
+            completed = urls + [' '.join(terms[:-1] + [t]) for t in adjusted_completions]
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms > COMPLETE_LATENCY_SLO_MS:
+            logger.warning("Completing a %d-term query took %.1fms, over the %dms SLO (%d pages, %d candidates)",
+                           len(terms), elapsed_ms, COMPLETE_LATENCY_SLO_MS, len(page_terms), len(candidates))
+        return [q, completed]
 
     def get_results(self, q: str, additional_results: list[Document], use_external_search: bool = True):
         logger.info(f"Get results with {len(additional_results)} additional results")
         terms = tokenize(q)
 
         is_complete = q.endswith(' ')
-        if len(terms) > 0 and not is_complete:
-            completions = self.completer.complete(terms[-1])
-            retrieval_terms = set(terms + completions)
-        else:
-            completions = []
-            retrieval_terms = set(terms)
+        completions, lookup_terms = self._get_lookup_terms(terms, is_complete)
 
         # Check for curation
         curation_term = " ".join(terms)
-        curation_items = self.tiny_index.retrieve(curation_term)
+        term_items = self._retrieve_all(lookup_terms | {curation_term})
+        pages, curated_items = self._collect_pages(term_items, lookup_terms, curation_term)
+
+        with stage("wiki"):
+            external_search_items = self.external_search(q) if use_external_search else []
+        candidates = pages + additional_results + external_search_items
+        with stage("blacklist"):
+            candidates, curated_items = self._remove_blacklisted(candidates, curated_items, index_items=pages)
+
+        with stage("rank"):
+            ordered_results = self.order_results(terms, candidates, is_complete)
+        deduplicated_results = deduplicate(curated_items + ordered_results, set())
+        state_fixed = [fix_document_state(result) for result in deduplicated_results]
+        return state_fixed, terms, completions
+
+    @staticmethod
+    def _collect_pages(term_items: dict[str, list[Document]], lookup_terms,
+                       curation_term: str) -> tuple[list[Document], list[Document]]:
+        """The documents on the lookup terms' pages, and those curated for the query itself."""
+        curation_items = term_items[curation_term]
         curated_items = [d for d in curation_items if d.state is not None
                          and d.term == curation_term]
 
-        bigrams = set(get_bigrams(len(terms), terms))
-
         pages = []
-        for term in retrieval_terms | bigrams:
-            # An optimisation - we have already retrieved this, so make use of it
+        for term in lookup_terms:
             if term == curation_term:
                 items = curation_items
             else:
-                items_wrong_state = self.tiny_index.retrieve(term)
+                items_wrong_state = term_items[term]
                 # If this is not a curation term, it is not curated for the current term
                 items = [Document(result.title,
                                   result.url,
@@ -348,15 +453,62 @@ class Ranker:
 
             if items is not None:
                 pages += items
+        return pages, curated_items
+
+    def _retrieve_all(self, terms: set[str]) -> dict[str, list[Document]]:
+        """Retrieve the index page for each term, overlapping the reads on _PAGE_READ_EXECUTOR."""
+        terms = list(terms)
+        started = time.perf_counter()
+        with stage("pages"):
+            if len(terms) > 1:
+                _PAGE_READ_POOL.submitted(len(terms))
+                retrieved = list(_PAGE_READ_EXECUTOR.map(_PAGE_READ_POOL.run, repeat(_timed_retrieve),
+                                                         repeat(self.tiny_index), terms))
+            else:
+                retrieved = [_timed_retrieve(self.tiny_index, term) for term in terms]
+
+        timings = PageReadTimings(
+            pages=len(terms),
+            wall_seconds=time.perf_counter() - started,
+            cpu_seconds=sum(cpu for _, cpu, _ in retrieved),
+            waiting_seconds=sum(waiting for _, _, waiting in retrieved),
+        )
+        logger.debug("Read %d pages in %.1fms: %.1fms CPU, %.1fms waiting on I/O",
+                    timings.pages, timings.wall_seconds * 1000, timings.cpu_seconds * 1000,
+                    timings.waiting_seconds * 1000)
+        return {term: items for term, (items, _, _) in zip(terms, retrieved)}
+
+    def _get_lookup_terms(self, terms: list[str], is_complete: bool) -> tuple[list[str], set[str]]:
+        """Completions of the last term, and every term get_results retrieves a page for.
+
+        A search request wants these for its ETag, its result cache lookup and, on a miss,
+        get_results() itself, all on the thread serving it. So the last query's are kept
+        per thread and the completer runs once per request, not three times.
+        """
+        key = (tuple(terms), is_complete)
+        last = getattr(self._last_lookup, "value", None)
+        if last is not None and last[0] == key:
+            _, completions, lookup_terms = last
+            return list(completions), set(lookup_terms)
 
-        external_search_items = self.external_search(q) if use_external_search else []
-        candidates = pages + additional_results + external_search_items
-        candidates, curated_items = self._remove_blacklisted(candidates, curated_items, index_items=pages)
+        if len(terms) > 0 and not is_complete:
+            completions = self.completer.complete(terms[-1])
+            retrieval_terms = set(terms + completions)
+        else:
+            completions = []
+            retrieval_terms = set(terms)
 
-        ordered_results = self.order_results(terms, candidates, is_complete)
-        deduplicated_results = deduplicate(curated_items + ordered_results, set())
-        state_fixed = [fix_document_state(result) for result in deduplicated_results]
-        return state_fixed, terms, completions
+        bigrams = set(get_bigrams(len(terms), terms))
+        lookup_terms = retrieval_terms | bigrams
+        self._last_lookup.value = (key, tuple(completions), frozenset(lookup_terms))
+        return completions, lookup_terms
+
+    def get_index_pages(self, q: str) -> set[int]:
+        """The index pages get_results reads for this query, for the search result cache."""
+        terms = tokenize(q)
+        _, lookup_terms = self._get_lookup_terms(terms, q.endswith(' '))
+        curation_term = " ".join(terms)
+        return {self.tiny_index.get_key_page_index(term) for term in lookup_terms | {curation_term}}
 
     @staticmethod
     def _remove_blacklisted(candidates: list[Document], curated_items: list[Document],
@@ -0,0 +1,338 @@
+"""A cache of formatted search results that is never stale with respect to the index.
+
+Search traffic is heavily skewed towards a small head of queries, and nothing between the
+/search routers and Ranker.search remembers anything: every repeat of a popular query
+reads the same index pages, runs the same LTR model and the same MMR pass and formats the
+same results again. This caches the formatted response, keyed by the normalised query and
+the API version (v1 and v2 format the same documents differently).
+
+The difficulty is not the caching, it is knowing when an entry is wrong. Results change
+when the pages a query reads change - a crawl batch is indexed, or someone curates a term
+- and a cache that serves the old ranking for minutes after a curation makes the curation
+UI look broken. So every entry is tagged with an *index generation*:
+
+  * The writers that change what a query sees (index_pages, and the curation paths in
+    views.py) call bump_index_generation() for the pages they stored.
+  * Generations live in one Redis hash shared by every process, so a write in the
+    background indexer is seen by every gunicorn worker. A page's counter lives in slot
+    `page % SEARCH_RESULT_CACHE_GENERATION_SLOTS`: there are 102,400,000 pages in the
+    production index and a field per page would grow the hash without bound. Sharing a
+    slot can only cause a spurious miss, never a stale hit.
+  * A lookup works out which pages the query reads (Ranker.get_index_pages - the curation
+    term, the terms and their completions, and the bigrams), fetches their generations
+    with one HMGET and only serves an entry whose recorded generations still match.
+    The generations are read *before* computing a result, so an entry can only ever be
+    tagged older than the pages it was built from, which again errs towards a miss.
+
+The tag also carries the blacklist snapshot version this worker has loaded, because a
+newly blacklisted domain must disappear from cached results as promptly as it does from
+freshly ranked ones.
+
+There are two tiers. A small in-process LRU serves the head of the distribution without
+leaving the worker. With SEARCH_RESULT_CACHE_SHARED set, entries are also written to
+Redis so the (cpu_count * 2 + 1) workers share their misses; it is fetched in the same
+round trip as the generations, so a shared lookup costs nothing extra.
+
+The same tag is what the search endpoints' ETags are made from (see conditional), which
+read it first and hand it in, so a conditional request that is not answered with a 304
+still costs one round trip here.
+
+Like the purge queue, none of this may affect a search response. If the generations
+cannot be read the cache is bypassed for that request - serving without them could be
+serving stale results - and a failed write is logged and dropped. Results that include
+live Wikipedia lookups can go out of date without any index write, which is what the TTL
+is for: SEARCH_RESULT_CACHE_TTL_SECONDS is the longest anything can be served from here.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Callable, Iterable, Optional
+
+import redis
+from django.conf import settings
+
+from mwmbl.indexer.blacklist_snapshot import get_snapshot_blacklist
+from mwmbl.metrics import SEARCH_RESULT_CACHE_LOOKUPS
+from mwmbl.request_timing import stage
+from mwmbl.tokenizer import tokenize
+
+logger = getLogger(__name__)
+
+
+GENERATION_KEY = "search:index-generation"
+SHARED_KEY_PREFIX = "search:results"
+
+# How often, in lookups, a worker logs its hit rates. Frequent enough to watch a deploy
+# warm up, rare enough not to matter in the logs.
+_LOG_STATS_EVERY = 10_000
+
+
+_redis: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+def generation_slot(page_index: int) -> int:
+    return page_index % settings.SEARCH_RESULT_CACHE_GENERATION_SLOTS
+
+
+def bump_index_generation(page_indexes: Iterable[int], redis_client: Optional[redis.Redis] = None) -> None:
+    """Invalidate cached results that read any of these pages. Never raises.
+
+    Call this *after* the pages have been stored: a search that reads the new generation
+    must also read the new page contents.
+    """
+    slots = sorted({generation_slot(page_index) for page_index in page_indexes})
+    if not slots:
+        return
+
+    try:
+        client = redis_client if redis_client is not None else get_redis()
+        pipeline = client.pipeline(transaction=False)
+        for slot in slots:
+            pipeline.hincrby(GENERATION_KEY, slot, 1)
+        pipeline.execute()
+    except Exception:
+        # Cached results for these pages stay valid until they expire, so a curation may
+        # not show for up to SEARCH_RESULT_CACHE_TTL_SECONDS. The index write itself is fine.
+        logger.warning("Could not bump the index generation for %d pages", len(slots), exc_info=True)
+
+
+def normalize_query(query: str) -> str:
+    """The part of a query that decides its results.
+
+    Ranking and formatting only ever see tokenize(query), plus whether the query ends in
+    a space - that decides whether the last term is completed - so "Python  Tutorial" and
+    "python tutorial" share an entry but "python" and "python " do not.
+    """
+    normalized = " ".join(tokenize(query))
+    return normalized + " " if query.endswith(" ") else normalized
+
+
+def _blacklist_version() -> Optional[str]:
+    return get_snapshot_blacklist().loaded_version
+
+
+def _generation_slots(page_indexes: Iterable[int]) -> list[int]:
+    return sorted({generation_slot(page_index) for page_index in page_indexes})
+
+
+def _format_tag(slots: list[int], generations: list) -> str:
+    formatted = ",".join(f"{slot}={int(generation or 0)}" for slot, generation in zip(slots, generations))
+    return f"{_blacklist_version()}|{formatted}"
+
+
+def read_index_tag(page_indexes: Iterable[int], redis_client: Optional[redis.Redis] = None) -> Optional[str]:
+    """The blacklist version and generations of these pages: it changes whenever results
+    read from them could. None if the generations cannot be read. Never raises."""
+    slots = _generation_slots(page_indexes)
+    try:
+        client = redis_client if redis_client is not None else get_redis()
+        generations = client.hmget(GENERATION_KEY, slots)
+    except Exception:
+        logger.warning("Could not read index generations", exc_info=True)
+        return None
+    return _format_tag(slots, generations)
+
+
+class SearchResultCache:
+    def __init__(self, max_entries: int, ttl_seconds: float, shared: bool,
+                 redis_client: Optional[redis.Redis] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self._redis_client = redis_client
+        self._entries: "OrderedDict[tuple[str, str], tuple[float, str, list]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.bypassed = 0
+
+    @property
+    def redis_client(self) -> redis.Redis:
+        return self._redis_client if self._redis_client is not None else get_redis()
+
+    def get_or_compute(self, version: str, query: str, page_indexes: Iterable[int],
+                       compute: Callable[[], list], tag: Optional[str] = None) -> list:
+        """Return the cached results for this query, or compute() them and cache them.
+
+        `page_indexes` are the index pages the query reads; the entry is served only while
+        none of them has been written since it was stored. `tag` is their read_index_tag(),
+        if the caller has already read it.
+        """
+        key = (version, normalize_query(query))
+        with stage("cache"):
+            local = self._get_local(key)
+            if tag is None:
+                tag, shared_entry = self._read_tag(key, page_indexes, want_shared=local is None)
+            else:
+                shared_entry = self._read_shared(key) if local is None else None
+
+        if tag is None:
+            self._count("bypassed")
+            return compute()
+
+        if local is not None:
+            local_tag, results = local
+            if local_tag == tag:
+                self._count("local_hits")
+                return results
+            # Counted on top of the outcome below: how often the index moved under an entry.
+            self.stale += 1
+            SEARCH_RESULT_CACHE_LOOKUPS.labels("stale").inc()
+
+        if shared_entry is not None and shared_entry.get("tag") == tag:
+            results = shared_entry["results"]
+            self._put_local(key, tag, results)
+            self._count("shared_hits")
+            return results
+
+        self._count("misses")
+        results = compute()
+        with stage("cache"):
+            self._put_local(key, tag, results)
+            self._put_shared(key, tag, results)
+        return results
+
+    def _get_local(self, key: tuple[str, str]) -> Optional[tuple[str, list]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, tag, results = entry
+            if now - stored_at >= self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return tag, results
+
+    def _put_local(self, key: tuple[str, str], tag: str, results: list) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), tag, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _shared_key(key: tuple[str, str]) -> str:
+        version, normalized = key
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        return f"{SHARED_KEY_PREFIX}:{version}:{digest}"
+
+    def _read_tag(self, key: tuple[str, str], page_indexes: Iterable[int],
+                  want_shared: bool) -> tuple[Optional[str], Optional[dict]]:
+        """The current tag for these pages, and the shared entry if one was asked for.
+
+        Returns (None, None) if the generations cannot be read.
+        """
+        slots = _generation_slots(page_indexes)
+        fetch_shared = want_shared and self.shared
+        try:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            pipeline.hmget(GENERATION_KEY, slots)
+            if fetch_shared:
+                pipeline.get(self._shared_key(key))
+            replies = pipeline.execute()
+        except Exception:
+            logger.warning("Could not read index generations; bypassing the result cache", exc_info=True)
+            return None, None
+
+        tag = _format_tag(slots, replies[0])
+        shared_entry = self._parse_shared(key, replies[1]) if fetch_shared else None
+        return tag, shared_entry
+
+    def _read_shared(self, key: tuple[str, str]) -> Optional[dict]:
+        if not self.shared:
+            return None
+        try:
+            payload = self.redis_client.get(self._shared_key(key))
+        except Exception:
+            logger.warning("Could not read from the shared result cache", exc_info=True)
+            return None
+        return self._parse_shared(key, payload)
+
+    @staticmethod
+    def _parse_shared(key: tuple[str, str], payload: Optional[str]) -> Optional[dict]:
+        if payload is None:
+            return None
+        try:
+            return json.loads(payload)
+        except ValueError:
+            logger.warning("Discarding unreadable shared result cache entry for %r", key)
+            return None
+
+    def _put_shared(self, key: tuple[str, str], tag: str, results: list) -> None:
+        if not self.shared:
+            return
+        try:
+            payload = json.dumps({"tag": tag, "results": results})
+            self.redis_client.set(self._shared_key(key), payload, ex=max(1, int(self.ttl_seconds)))
+        except Exception:
+            logger.warning("Could not write to the shared result cache", exc_info=True)
+
+    def _count(self, outcome: str) -> None:
+        # Plain attribute increments: a lost update under contention only blurs a metric.
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        SEARCH_RESULT_CACHE_LOOKUPS.labels(outcome).inc()
+        if self.lookups % _LOG_STATS_EVERY == 0:
+            logger.info("Search result cache: %r", self.stats())
+
+    @property
+    def lookups(self) -> int:
+        return self.local_hits + self.shared_hits + self.misses + self.bypassed
+
+    def stats(self) -> dict:
+        lookups = self.lookups
+        hits = self.local_hits + self.shared_hits
+        return {
+            "lookups": lookups,
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "bypassed": self.bypassed,
+            "entries": len(self._entries),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "local_hit_rate": self.local_hits / lookups if lookups else 0.0,
+            "shared_hit_rate": self.shared_hits / lookups if lookups else 0.0,
+        }
+
+
+_result_cache: Optional[SearchResultCache] = None
+
+
+def get_result_cache() -> SearchResultCache:
+    """The per-process cache used by the search routers."""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = SearchResultCache(
+            max_entries=settings.SEARCH_RESULT_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.SEARCH_RESULT_CACHE_TTL_SECONDS,
+            shared=settings.SEARCH_RESULT_CACHE_SHARED,
+        )
+    return _result_cache
+
+
+def cached_search_results(version: str, query: str, ranker, compute: Callable[[], list],
+                          tag: Optional[str] = None) -> list:
+    """compute() the formatted results for a query, through the result cache if it is on.
+    `tag` is the read_index_tag() of the pages it reads, if the caller has it."""
+    if not settings.SEARCH_RESULT_CACHE_ENABLED:
+        return compute()
+    with stage("cache"):
+        page_indexes = ranker.get_index_pages(query)
+    return get_result_cache().get_or_compute(version, query, page_indexes, compute, tag)
@@ -2,16 +2,21 @@ import dataclasses
 from logging import getLogger
 from typing import Optional
 
+from django.http import HttpResponse
 from ninja import NinjaAPI, Router, Schema
 from ninja.errors import HttpError
 
 from mwmbl import pricing
 from mwmbl.format import format_result, format_result_v2
 from mwmbl.models import ApiKey, MwmblUser
-from mwmbl.quota import check_rate_limit, get_monthly_count, increment_monthly
+from mwmbl.quota import charge_search
+from mwmbl.request_timing import stage
 from mwmbl.search_auth import SearchApiKeyAuth
+from mwmbl.tinysearchengine.conditional import validate
 from mwmbl.tinysearchengine.indexer import Document
-from mwmbl.tinysearchengine.rank import HeuristicRanker
+from mwmbl.tinysearchengine.rank import GOOGLE_SEARCH_PREFIX, HeuristicRanker
+from mwmbl.tinysearchengine.result_cache import cached_search_results, normalize_query
+from mwmbl.tinysearchengine.warmer import record_query
 
 logger = getLogger(__name__)
 
@@ -244,9 +249,19 @@ def _register_search_v1(r: Router | NinjaAPI, ranker: HeuristicRanker):
             ]
         },
     )
-    def search(request, s: str):
-        results = ranker.search(s, [])
-        return [format_result(result, s) for result in results]
+    def search(request, s: str, response: HttpResponse):
+        record_query(s, request)
+        validation = validate(request, "search-v1", s, ranker)
+        if validation.not_modified:
+            return validation.not_modified_response()
+        validation.apply(response)
+
+        def compute():
+            results = ranker.search(s, [])
+            with stage("format"):
+                return [format_result(result, s) for result in results]
+
+        return cached_search_results("v1", s, ranker, compute, validation.tag)
 
 
 def _register_search_v2(r: Router | NinjaAPI, ranker: HeuristicRanker):
@@ -289,11 +304,12 @@ def _register_search_v2(r: Router | NinjaAPI, ranker: HeuristicRanker):
             ]
         },
     )
-    def search(request, q: str):
+    def search(request, q: str, response: HttpResponse):
         raw_key = request.headers.get("X-API-Key")
         api_key = None
         if raw_key:
-            api_key = SearchApiKeyAuth().authenticate(request, raw_key)
+            with stage("auth"):
+                api_key = SearchApiKeyAuth().authenticate(request, raw_key)
             if api_key is None:
                 raise HttpError(401, "Invalid API key.")
 
@@ -303,28 +319,40 @@ def _register_search_v2(r: Router | NinjaAPI, ranker: HeuristicRanker):
             spend_cents = billing.max_monthly_spend_cents if billing else 0
             monthly_limit = pricing.effective_monthly_request_cap(spend_cents)
 
-            if not check_rate_limit(user.id):
+            with stage("quota"):
+                charge = charge_search(user.id, monthly_limit)
+            if not charge.allowed:
                 raise HttpError(
                     429,
                     "Rate limit exceeded: maximum 5 requests per second. Please slow down.",
                 )
-
-            current_count = get_monthly_count(user.id)
-            if current_count >= monthly_limit:
+            if not charge.within_quota:
                 msg = (
                     f"Monthly quota exceeded: your account allows {monthly_limit:,} requests "
-                    f"per month at your current spend limit and you have used {current_count:,}. "
+                    f"per month at your current spend limit and you have used {charge.monthly_usage:,}. "
                     f"{_upgrade_message(spend_cents)}"
                 )
                 raise HttpError(429, msg)
-
-            monthly_usage = increment_monthly(user.id)
+            monthly_usage = charge.monthly_usage
         else:
             monthly_limit = None
             monthly_usage = None
 
-        raw_results = ranker.search(q, [])
-        formatted = [format_result_v2(r, i + 1, q) for i, r in enumerate(raw_results)]
+        record_query(q, request)
+
+        # Quota is checked and charged above, before the ETag and the cache: a 304 or a
+        # cached response is still a request against the caller's monthly allowance.
+        validation = validate(request, "search-v2", q, ranker, private=api_key is not None, vary=("X-API-Key",))
+        if validation.not_modified:
+            return validation.not_modified_response()
+        validation.apply(response)
+
+        def compute():
+            raw_results = ranker.search(q, [])
+            with stage("format"):
+                return [format_result_v2(r, i + 1, q) for i, r in enumerate(raw_results)]
+
+        formatted = cached_search_results("v2", q, ranker, compute, validation.tag)
         return SearchResponse(
             query=q,
             number_of_results=len(formatted),
@@ -400,8 +428,23 @@ def _register_common_routes(r: Router | NinjaAPI, ranker: HeuristicRanker):
             }
         },
     )
-    def complete(request, q: str):
-        return ranker.complete(q)
+    def complete(request, q: str, response: HttpResponse):
+        validation = validate(request, "complete", q, ranker)
+        if validation.not_modified:
+            return validation.not_modified_response()
+        validation.apply(response)
+        # Suggestions depend only on the normalised query, so they go through the result
+        # cache, which is handed the generations validate() read: a keystroke makes one
+        # round trip to Redis, and a repeated prefix is not completed again.
+        normalized = normalize_query(q)
+        suggestions = cached_search_results(
+            "complete", q, ranker, lambda: ranker.complete(normalized)[1], validation.tag)
+        if q != normalized and suggestions and suggestions[0].startswith(GOOGLE_SEARCH_PREFIX):
+            # The Google searches suggested when nothing matches include the query as typed,
+            # which an entry shared by every spelling of it cannot, so those are worked out
+            # again for this one.
+            suggestions = ranker.complete(q)[1]
+        return [q, suggestions]
 
     @r.get(
         "/raw",
@@ -434,7 +477,11 @@ def _register_common_routes(r: Router | NinjaAPI, ranker: HeuristicRanker):
             ]
         },
     )
-    def raw(request, s: str):
+    def raw(request, s: str, response: HttpResponse):
+        validation = validate(request, "raw", s, ranker)
+        if validation.not_modified:
+            return validation.not_modified_response()
+        validation.apply(response)
         results = ranker.get_raw_results(s)
         return {"query": s, "results": [dataclasses.asdict(result) for result in results]}
 
@@ -0,0 +1,212 @@
+"""Read-only ranking tables shared between processes through the page cache.
+
+rank.py used to load three static tables at import: the Wikipedia page view counts
+(wiki_stats.json, ~500,000 titles), the term document frequencies (document_counts.json)
+and the Hacker News domain scores (hn_top_domains_filtered.DOMAINS). As Python dicts every
+gunicorn worker parsed them on startup and held its own copy, and there are
+(cpu_count * 2 + 1) workers. The tables never change while the server is running, so they
+are compiled once into a flat binary file and every worker mmaps the same file: startup
+cost is an open() and the memory is shared through the OS page cache instead of
+duplicated per process.
+
+File layout, in little-endian byte order (the memoryview casts below assume a
+little-endian host, which every machine this runs on is):
+
+    HEADER          magic, entry count, first/min/max value, source stamp (see _HEADER)
+    uint64[count]   sorted mmh3 hashes of the keys
+    float64[count]  the value for each hash, in the same order
+
+A lookup hashes the key and binary searches the hash array. As with the blacklist snapshot,
+storing 64-bit hashes rather than the keys is what keeps the file small and fixed-width; the
+chance of any lookup colliding with one of ~500,000 entries is ~3e-14. Values are stored as
+float64, which holds the integer counts exactly, so lookups return what the dicts did.
+
+The build step is `python -m mwmbl.tinysearchengine.static_tables`, run in the Docker image
+after install. A compiled file records the size and mtime of the source it came from, and
+load_table() rebuilds it if that has changed or the file is missing - so a dev checkout
+or a refreshed wiki_stats.json just works, at the cost of one parse in the first process
+to need it. If the file cannot be written the table is built in memory instead, which is
+no worse than before.
+"""
+import json
+import os
+import struct
+from bisect import bisect_left
+from logging import getLogger
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from typing import Callable, Optional
+
+import mmh3
+import numpy as np
+
+logger = getLogger(__name__)
+
+
+RESOURCES_PATH = Path(__file__).parent.parent / "resources"
+
+_MAGIC = b"mwmbl-table-v1\x00\x00"
+# magic, count, first value, min value, max value, source size, source mtime (ns)
+_HEADER = struct.Struct("<16sQdddQQ")
+_HASH_DTYPE = np.dtype(np.uint64).newbyteorder('<')
+_VALUE_DTYPE = np.dtype(np.float64).newbyteorder('<')
+
+
+def _hash_key(key: str) -> int:
+    # mmh3 would encode a str itself, and crashes the interpreter on a lone surrogate - which
+    # a URL path can carry. Valid UTF-8 encodes the same either way, so compiled files still
+    # match.
+    return mmh3.hash64(key.encode("utf-8", "surrogatepass"), signed=False)[0]
+
+
+class StaticTable:
+    """A read-only str -> float mapping over a compiled table."""
+
+    def __init__(self, data):
+        magic, count, self.first_value, self.min_value, self.max_value, *_ = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a compiled ranking table")
+        # memoryviews rather than numpy arrays: bisect over a memoryview is ~4x faster than
+        # np.searchsorted for a single key, because it skips numpy's per-call overhead. The
+        # views keep the mmap alive for as long as the table is.
+        view = memoryview(data)
+        hashes_end = _HEADER.size + count * _HASH_DTYPE.itemsize
+        self._hashes = view[_HEADER.size:hashes_end].cast("Q")
+        self._values = view[hashes_end:hashes_end + count * _VALUE_DTYPE.itemsize].cast("d")
+
+    @classmethod
+    def open(cls, path: Path) -> "StaticTable":
+        with open(path, "rb") as table_file:
+            return cls(mmap(table_file.fileno(), 0, access=ACCESS_READ))
+
+    def _position(self, key: str) -> Optional[int]:
+        key_hash = _hash_key(key)
+        position = bisect_left(self._hashes, key_hash)
+        if position < len(self._hashes) and self._hashes[position] == key_hash:
+            return position
+        return None
+
+    def get(self, key: str, default=None):
+        position = self._position(key)
+        return default if position is None else self._values[position]
+
+    def __getitem__(self, key: str) -> float:
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        return self._values[position]
+
+    def __contains__(self, key: str) -> bool:
+        return self._position(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+
+def compile_table(mapping: dict[str, float], source_stamp: tuple[int, int] = (0, 0)) -> bytes:
+    """Serialise a mapping into the compiled table format."""
+    if not mapping:
+        raise ValueError("Cannot compile an empty table")
+
+    # If two keys ever did collide, the first one wins - the same as a lookup would see.
+    by_hash = {}
+    for key, value in mapping.items():
+        by_hash.setdefault(_hash_key(key), float(value))
+
+    hashes = np.fromiter(by_hash.keys(), dtype=_HASH_DTYPE, count=len(by_hash))
+    values = np.fromiter(by_hash.values(), dtype=_VALUE_DTYPE, count=len(by_hash))
+    order = np.argsort(hashes, kind="stable")
+
+    first_value = float(next(iter(mapping.values())))
+    header = _HEADER.pack(_MAGIC, len(hashes), first_value, float(values.min()), float(values.max()),
+                          *source_stamp)
+    return header + hashes[order].tobytes() + values[order].tobytes()
+
+
+def source_stamp(source_path: Path) -> tuple[int, int]:
+    """What a compiled file records about its source, to tell when it is out of date."""
+    stat = source_path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _is_current(table_path: Path, source_path: Path) -> bool:
+    try:
+        with open(table_path, "rb") as table_file:
+            header = table_file.read(_HEADER.size)
+        magic, *_, size, mtime_ns = _HEADER.unpack(header)
+    except (OSError, struct.error):
+        return False
+    return magic == _MAGIC and (size, mtime_ns) == source_stamp(source_path)
+
+
+def write_compiled(path: Path, data: bytes) -> None:
+    """Replace path with data atomically, or log and leave it if it cannot be written."""
+    # Several workers can start at once and all find the file missing; writing to a
+    # per-process file and renaming means each of them sees either no file or a whole one.
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+    except OSError:
+        logger.warning("Could not write compiled file %s; using it from memory", path, exc_info=True)
+        temp_path.unlink(missing_ok=True)
+
+
+def build_table(table_path: Path, source_path: Path, load_source: Callable[[], dict[str, float]]) -> bytes:
+    """Compile the source into table_path, replacing it atomically. Returns the table."""
+    data = compile_table(load_source(), source_stamp(source_path))
+    write_compiled(table_path, data)
+    return data
+
+
+def load_table(table_path: Path, source_path: Path, load_source: Callable[[], dict[str, float]]) -> StaticTable:
+    """Open the compiled table, compiling it from the source first if it is out of date."""
+    if not _is_current(table_path, source_path):
+        logger.info("Compiling %s from %s", table_path.name, source_path.name)
+        data = build_table(table_path, source_path, load_source)
+        if not _is_current(table_path, source_path):
+            return StaticTable(data)
+    return StaticTable.open(table_path)
+
+
+def _load_json(path: Path) -> Callable[[], dict[str, float]]:
+    def load():
+        with open(path) as source_file:
+            return json.load(source_file)
+    return load
+
+
+def _load_domains() -> dict[str, float]:
+    from mwmbl.hn_top_domains_filtered import DOMAINS
+    return DOMAINS
+
+
+WIKI_SCORES_SOURCE = RESOURCES_PATH / "wiki_stats.json"
+DOCUMENT_FREQUENCIES_SOURCE = RESOURCES_PATH / "document_counts.json"
+DOMAINS_SOURCE = Path(__file__).parent.parent / "hn_top_domains_filtered.py"
+
+# name -> (compiled path, source path, source loader)
+TABLES = {
+    "wiki_scores": (RESOURCES_PATH / "wiki_stats.table", WIKI_SCORES_SOURCE, _load_json(WIKI_SCORES_SOURCE)),
+    "document_frequencies": (RESOURCES_PATH / "document_counts.table", DOCUMENT_FREQUENCIES_SOURCE,
+                             _load_json(DOCUMENT_FREQUENCIES_SOURCE)),
+    "domains": (RESOURCES_PATH / "hn_top_domains.table", DOMAINS_SOURCE, _load_domains),
+}
+
+
+def get_table(name: str) -> StaticTable:
+    return load_table(*TABLES[name])
+
+
+def run():
+    """The build step: compile every table that is missing or out of date."""
+    for name, (table_path, source_path, load_source) in TABLES.items():
+        if _is_current(table_path, source_path):
+            print(f"{name}: up to date")
+            continue
+        build_table(table_path, source_path, load_source)
+        print(f"{name}: compiled {table_path} ({table_path.stat().st_size:,} bytes)")
+
+
+if __name__ == "__main__":
+    run()
@@ -12,11 +12,13 @@ and used to generate the OpenAPI documentation, so the two cannot drift.
 See plan: /api/v2/super-search/
 """
 import asyncio
+import bisect
 import copy
 import heapq
 from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
+import os
 import re
 import time
 from typing import Any, Literal
@@ -31,19 +33,22 @@ from ninja import Router, Schema
 from ninja.errors import HttpError
 from pydantic import BaseModel, Field
 
-from mwmbl.crawler.retrieve import crawl_url
+from mwmbl.crawler.retrieve import crawl_url_async
 from mwmbl.indexer.index_batches import index_results_against_query
-from mwmbl.quota import (
-    check_rate_limit,
-    decrement_monthly_super_search,
-    increment_monthly_super_search,
-)
+from mwmbl.metrics import (SUPER_SEARCH_SOURCE_SECONDS, SUPER_SEARCH_SOURCE_SKIPS, SUPER_SEARCH_STREAMS,
+                           ThreadPoolTracker, TrackedExecutor)
+from mwmbl.quota import charge_super_search
 from mwmbl.search_auth import authenticate_user
 from mwmbl.search_setup import index_path, ltr_model
 from mwmbl.tinysearchengine.indexer import Document
 from mwmbl.tinysearchengine.ltr_rank import score_documents
-from mwmbl.tinysearchengine.mmr_rank import mmr_rerank
+from mwmbl.tinysearchengine.mmr_rank import order_and_rerank
 from mwmbl.tinysearchengine.rank import find_blacklisted_urls, score_result_whole
+from mwmbl.tinysearchengine.super_search_cache import cached_answer, store_answer
+from mwmbl.tinysearchengine.super_search_http import (
+    SourceThrottled, shared_client, track_host_queue_wait, wait_for_source,
+)
+from mwmbl.tinysearchengine.super_search_select import health as source_health
 from mwmbl.tinysearchengine.super_search_sources import SOURCES
 from mwmbl.tokenizer import tokenize
 
@@ -52,19 +57,35 @@ logger = logging.getLogger(__name__)
 router = Router(tags=["Super Search"])
 
 KEEPALIVE_INTERVAL = 5.0  # seconds between idle keepalive comments
-HTTP_USER_AGENT = "mwmbl-super-search/0.1 (+https://mwmbl.org)"
 _SENTINEL: object = object()
 _URL_EXT_RE = re.compile(r"\.\w{1,5}$")
 _URL_TOKEN_RE = re.compile(r"[-_+]+")
 
-# Dedicated, bounded pool for the (synchronous, self-timeout-bounded) crawl_url
-# calls. Keeping crawls off the default executor stops a burst of page fetches
-# from starving the threads used by score_documents / the ORM, and caps how many
-# crawl threads can keep running after the pipeline deadline fires.
-_CRAWL_EXECUTOR = ThreadPoolExecutor(
-    max_workers=getattr(settings, "SUPER_SEARCH_CRAWL_WORKERS", 8),
-    thread_name_prefix="ss-crawl",
-)
+# Pages are fetched on the stream's httpx client; only extracting them - parsing the
+# HTML and classifying its paragraphs, which is CPU-bound - takes a thread, from this
+# pool. It is shared by every stream in the process and sized for the CPU rather than
+# for the number of pages waiting on the network, and it is not the default executor,
+# so a burst of extraction cannot starve score_documents or the ORM.
+def _extract_executor() -> TrackedExecutor:
+    workers = settings.SUPER_SEARCH_EXTRACT_WORKERS
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ss-extract")
+    return TrackedExecutor(executor, ThreadPoolTracker("super_search_extract", workers))
+
+
+_EXTRACT_EXECUTOR = _extract_executor()
+
+
+def _replace_extract_executor_after_fork():
+    # The parent's extraction threads do not survive a fork; see rank._PAGE_READ_EXECUTOR.
+    global _EXTRACT_EXECUTOR
+    _EXTRACT_EXECUTOR = _extract_executor()
+
+
+os.register_at_fork(after_in_child=_replace_extract_executor_after_fork)
+
+# Fetches waiting for, and holding, a slot in their stream's budget, over every stream in
+# the process. The budget is per stream, so the total has no fixed size.
+_FETCH_BUDGET = ThreadPoolTracker("super_search_fetch", None)
 
 # Redis connection for caching robots.txt
 _redis = None
@@ -78,10 +99,30 @@ def _get_redis() -> redis.Redis:
     return _redis
 
 
-async def _crawl(url: str):
-    """Run the synchronous crawl_url on the dedicated crawl executor."""
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(_CRAWL_EXECUTOR, crawl_url, url, _get_redis())
+class PageFetcher:
+    """Crawls pages for one stream, at most SUPER_SEARCH_FETCHES_PER_STREAM at a time.
+
+    The budget is per stream, so a query whose promoted pages have many links to
+    follow waits on its own fetches rather than filling the extraction pool and the
+    network for every other Super Search in the process.
+    """
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self._budget = asyncio.Semaphore(settings.SUPER_SEARCH_FETCHES_PER_STREAM)
+
+    async def crawl(self, url: str) -> dict:
+        _FETCH_BUDGET.submitted()
+        try:
+            await self._budget.acquire()
+        except BaseException:
+            _FETCH_BUDGET.withdrawn()
+            raise
+        try:
+            with _FETCH_BUDGET.running():
+                return await crawl_url_async(url, self.client, _get_redis(), _EXTRACT_EXECUTOR)
+        finally:
+            self._budget.release()
 
 
 # ---------------------------------------------------------------------------
@@ -140,11 +181,15 @@ class SourceReturnedEvent(Schema):
 
 
 class SourceFailedEvent(Schema):
-    """`source_failed` — a source errored or timed out and contributed nothing."""
+    """`source_failed` — a source errored, timed out or was skipped, and contributed nothing."""
     source: str = Field(description="Name of the source that failed.", examples=["arxiv"])
     error: str = Field(
-        description="Failure reason: `\"timeout\"` or an exception message.",
-        examples=["timeout"],
+        description=(
+            "Failure reason: `\"timeout\"`, `\"circuit_open\"` (the source has been "
+            "failing, and is not queried until it has had time to recover) or an "
+            "exception message."
+        ),
+        examples=["timeout", "circuit_open"],
     )
 
 
@@ -352,31 +397,176 @@ def _title_from_url(url: str) -> str:
 # Pipeline
 # ---------------------------------------------------------------------------
 
-async def _call_source(name: str, fn, client: httpx.AsyncClient, query: str, limit: int):
+class FinalRanking:
+    """The final ranking of one Super Search, kept up to date as documents arrive.
+
+    Documents are only ever appended to a search's all_docs, the first document with a
+    given URL is the one that counts, and the LTR model scores each document on its own
+    features (score_documents gives a document the same score in any batch). So each
+    document only needs scoring once: the first time it is seen. Between calls this
+    keeps how far into all_docs it has read, the URLs seen so far and the best
+    `limit` scored documents, in the order a stable sort by descending score over all of
+    them would give. Each `results` frame then costs scoring the new documents and the
+    MMR over at most `limit`, rather than rescoring everything found so far - which,
+    over the hundreds of documents a search collects, made the frames quadratic.
+    """
+
+    def __init__(self):
+        self.last_key: tuple[str, ...] | None = None
+        self._read = 0
+        self._seen_urls: set[str] = set()
+        self._added = 0
+        self._taken: tuple[int, set[str]] = (0, set())
+        # (-score, position, doc), best first: the tuple order is the stable sort's.
+        self._top: list[tuple[float, int, Document]] = []
+
+    def take_new(self, all_docs: list[Document], terms: list[str]) -> list[Document]:
+        """The documents appended to all_docs since the last call that need scoring.
+
+        They count as seen once add() has their scores: a call cancelled while scoring
+        them leaves them for the next one.
+        """
+        urls: set[str] = set()
+        new = []
+        for doc in all_docs[self._read:]:
+            if doc.url and doc.title and doc.url not in self._seen_urls and doc.url not in urls:
+                urls.add(doc.url)
+                if not terms or _doc_passes_term_filter(doc, terms):
+                    new.append(doc)
+        self._taken = (len(all_docs), urls)
+        if not new:
+            self._commit()
+        return new
+
+    def _commit(self) -> None:
+        self._read, urls = self._taken
+        self._seen_urls |= urls
+
+    def add(self, docs: list[Document], scores: list[float], limit: int) -> None:
+        """Rank the documents the last take_new() returned, with their scores."""
+        self._commit()
+        for doc, score in zip(docs, scores):
+            entry = (-score, self._added, doc)
+            self._added += 1
+            if len(self._top) < limit:
+                bisect.insort(self._top, entry)
+            elif entry < self._top[-1]:
+                bisect.insort(self._top, entry)
+                self._top.pop()
+
+    def ranked(self, limit: int) -> list[tuple[Document, float]]:
+        # Already in score order, so this is only the MMR.
+        return order_and_rerank([doc for _, _, doc in self._top], [-score for score, _, _ in self._top], limit)
+
+
+class ResultsEmitter:
+    """Coalesces the requests for a new `results` frame during one Super Search.
+
+    Every source that returns and every page whose links have been followed adds
+    documents, and followed pages finish in bursts. Each used to rank and emit on its
+    own, queueing behind the lock for a ranking most of them would then drop as
+    unchanged. Now they only mark the results dirty: one task ranks, at most once every
+    SUPER_SEARCH_RESULTS_INTERVAL_SECONDS, everything that has arrived since it last
+    did. The first frame is not delayed, and flush() ranks once more before `done`, so
+    the last frame still has every document - what a search spends on ranking depends
+    on how long it runs, not on how many links it follows.
+    """
+
+    def __init__(self, query: str, all_docs: list[Document], emit, interval: float | None = None):
+        self.query = query
+        self.all_docs = all_docs
+        self.emit = emit
+        self.interval = settings.SUPER_SEARCH_RESULTS_INTERVAL_SECONDS if interval is None else interval
+        self.ranking = FinalRanking()
+        self.lock = asyncio.Lock()
+        self._dirty = False
+        self._sleeping = False
+        self._last_ranked = float("-inf")
+        self._task: asyncio.Task | None = None
+
+    def mark_dirty(self) -> None:
+        """Ask for a `results` frame with the documents added so far."""
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._rank_while_dirty())
+
+    async def _rank_while_dirty(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._dirty:
+            wait = self._last_ranked + self.interval - loop.time()
+            if wait > 0:
+                self._sleeping = True
+                try:
+                    await asyncio.sleep(wait)
+                finally:
+                    self._sleeping = False
+            self._dirty = False
+            self._last_ranked = loop.time()
+            try:
+                await _emit_final_results(self.query, self.all_docs, self.emit, self.ranking, self.lock)
+            except Exception:
+                # Nothing awaits this task until the end; the next frame, or the flush,
+                # ranks the same documents again.
+                logger.exception("super-search failed to emit results")
+
+    async def flush(self) -> None:
+        """Emit the final ranking now, rather than waiting out the interval."""
+        await self.close(wait=True)
+        await _emit_final_results(self.query, self.all_docs, self.emit, self.ranking, self.lock)
+
+    async def close(self, wait: bool = False) -> None:
+        """Stop ranking. A ranking in progress is finished if `wait`, else abandoned."""
+        task, self._task = self._task, None
+        self._dirty = False
+        if task is None or task.done():
+            return
+        if self._sleeping or not wait:
+            task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+async def _call_source(name: str, fn, client: httpx.AsyncClient, query: str, limit: int, timeout: float):
+    cached = await cached_answer(name, query, limit)
+    if cached is not None:
+        return name, cached, None
+
+    wait = track_host_queue_wait()
+    started = time.monotonic()
     try:
-        docs = await asyncio.wait_for(
-            fn(client, query, limit),
-            timeout=settings.SUPER_SEARCH_PER_SOURCE_TIMEOUT,
-        )
-        return name, docs, None
+        docs = await wait_for_source(fn(client, query, limit), timeout, wait)
+        outcome, result = "ok", (name, docs, None)
+    except SourceThrottled:
+        # Out of time while still waiting for the host is this worker's doing, not the source's.
+        outcome, result = "throttled", (name, [], "throttled")
     except asyncio.TimeoutError:
-        return name, [], "timeout"
+        outcome, result = "timeout", (name, [], "timeout")
     except Exception as e:  # noqa: BLE001 — adapters shouldn't raise but be defensive
+        outcome = "error"
         logger.info("super-search source %s raised: %s", name, e)
-        return name, [], str(e)
+        result = (name, [], str(e))
+    elapsed = time.monotonic() - started
+    SUPER_SEARCH_SOURCE_SECONDS.labels(name, outcome).observe(elapsed)
+    if outcome != "throttled":
+        await asyncio.to_thread(source_health.record, name, max(0.0, elapsed - wait.waited), outcome == "ok")
+    if outcome == "ok":
+        await store_answer(name, query, limit, result[1])
+    return result
 
 
 async def _follow_links(
-    parent: Document, query: str, emit, all_docs: list[Document],
-    last_results_key: list, lock: asyncio.Lock,
+    parent: Document, query: str, emit, all_docs: list[Document], results: ResultsEmitter,
+    fetcher: PageFetcher,
 ) -> None:
     """Crawl the parent URL, score its outbound links, and collect the best for final ranking."""
     max_links = settings.SUPER_SEARCH_MAX_LINKS_PER_PAGE
 
     try:
-        result = await _crawl(parent.url)
+        result = await fetcher.crawl(parent.url)
     except Exception as e:  # noqa: BLE001
-        logger.info("crawl_url failed for %s: %s", parent.url, e)
+        logger.info("crawl_url_async failed for %s: %s", parent.url, e)
         return
 
     content = result.get("content") if isinstance(result, dict) else None
@@ -393,7 +583,7 @@ async def _follow_links(
         all_docs.append(Document(title=parent_title, url=parent.url, extract=parent_extract))
 
     if not raw_links:
-        await _emit_final_results(query, all_docs, emit, last_results_key, lock)
+        results.mark_dirty()
         return
 
     terms = tokenize(query)
@@ -407,7 +597,7 @@ async def _follow_links(
         return
 
     fetches = await asyncio.gather(
-        *[_crawl(d.url) for d, _ in ranked],
+        *[fetcher.crawl(d.url) for d, _ in ranked],
         return_exceptions=True,
     )
 
@@ -429,44 +619,35 @@ async def _follow_links(
                 extract=c.get("extract") or "",
             ))
 
-    await _emit_final_results(query, all_docs, emit, last_results_key, lock)
+    results.mark_dirty()
 
 
 async def _emit_final_results(
-    query: str, all_docs: list[Document], emit, last_results_key: list, lock: asyncio.Lock
+    query: str, all_docs: list[Document], emit, ranking: FinalRanking, lock: asyncio.Lock
 ) -> None:
     terms = tokenize(query)
     final_limit = getattr(settings, "SUPER_SEARCH_FINAL_RESULTS_LIMIT", 100)
 
     # Serialize the score → dedup-check → emit sequence: concurrent secondary
     # tasks would otherwise both pass the dedup check before either updates the
-    # key, emitting duplicate identical `results` frames and re-scoring the same
-    # set in parallel.
+    # key, emitting duplicate identical `results` frames and scoring the same
+    # documents in parallel.
     async with lock:
-        seen: set[str] = set()
-        unique: list[Document] = []
-        for doc in all_docs:
-            if doc.url and doc.title and doc.url not in seen:
-                seen.add(doc.url)
-                unique.append(doc)
-
-        if terms:
-            unique = [doc for doc in unique if _doc_passes_term_filter(doc, terms)]
-
-        if not unique:
+        new_docs = ranking.take_new(all_docs, terms)
+        if not new_docs:
+            # Nothing the ranking has not already seen, so it cannot have changed.
             return
 
-        final_scores = await asyncio.to_thread(score_documents, ltr_model, query, unique)
-        ranked = sorted(zip(unique, final_scores), key=lambda x: -x[1])[:final_limit]
-        # Diversify with MMR (demotes, never drops, same-domain / near-duplicate
-        # results) to match standard search — see MMRRanker in search_setup.py.
-        score_by_url = {doc.url: score for doc, score in ranked}
-        diversified = mmr_rerank([doc for doc, _ in ranked])
-        ranked = [(doc, score_by_url[doc.url]) for doc in diversified]
+        new_scores = await asyncio.to_thread(score_documents, ltr_model, query, new_docs)
+        ranking.add(new_docs, new_scores, final_limit)
+        # Keep the best final_limit and diversify them with MMR (demotes, never drops,
+        # same-domain / near-duplicate results) to match standard search — see
+        # MMRRanker in search_setup.py.
+        ranked = ranking.ranked(final_limit)
         key = tuple(doc.url for doc, _ in ranked)
-        if key == last_results_key[0]:
+        if key == ranking.last_key:
             return
-        last_results_key[0] = key
+        ranking.last_key = key
         await emit("results", ResultsEvent(
             results=[_result_payload(doc, score, "", "final") for doc, score in ranked],
             count=len(ranked),
@@ -490,13 +671,9 @@ async def _index_results(query: str, docs: list[Document]) -> int:
         return 0
 
 
-async def _run_pipeline(
-    query: str, emit, all_docs: list[Document], last_results_key: list, lock: asyncio.Lock
-) -> None:
+async def _run_pipeline(query: str, emit, all_docs: list[Document], results: ResultsEmitter) -> None:
     per_source_limit = settings.SUPER_SEARCH_RESULTS_PER_SOURCE
     top_k = getattr(settings, "SUPER_SEARCH_TOP_K", 10)
-    limits = httpx.Limits(max_connections=20, max_keepalive_connections=10)
-    timeout = httpx.Timeout(settings.SUPER_SEARCH_PER_SOURCE_TIMEOUT)
 
     # Min-heap tracking top-K seen so far: (score, counter, doc).
     # A doc enters the top-K when the heap has < k entries or its score beats
@@ -519,20 +696,22 @@ async def _run_pipeline(
         _promoted_urls.add(doc.url)
         return True
 
-    async with httpx.AsyncClient(
-        limits=limits,
-        timeout=timeout,
-        follow_redirects=True,
-        headers={"User-Agent": HTTP_USER_AGENT},
-    ) as client:
-        source_tasks = []
+    # Borrowed, not closed: its connections are kept for the next search.
+    client = shared_client()
+    fetcher = PageFetcher(client)
+    source_tasks: list[asyncio.Task] = []
+    secondary: list[asyncio.Task] = []
+    try:
+        health = await asyncio.to_thread(source_health.get_health, list(SOURCES))
+        now = time.time()
         for name, fn in SOURCES.items():
+            if health[name].is_open(now):
+                SUPER_SEARCH_SOURCE_SKIPS.labels(name).inc()
+                await emit("source_failed", SourceFailedEvent(source=name, error="circuit_open"))
+                continue
             await emit("source_started", SourceStartedEvent(source=name))
-            source_tasks.append(
-                asyncio.create_task(_call_source(name, fn, client, query, per_source_limit))
-            )
-
-        secondary: list[asyncio.Task] = []
+            source_tasks.append(asyncio.create_task(
+                _call_source(name, fn, client, query, per_source_limit, health[name].timeout())))
 
         for completed in asyncio.as_completed(source_tasks):
             name, docs, error = await completed
@@ -551,16 +730,21 @@ async def _run_pipeline(
                 if _maybe_promote(doc, score):
                     await emit("result_promoted", _result_payload(doc, score, name, "direct"))
                     secondary.append(
-                        asyncio.create_task(_follow_links(doc, query, emit, all_docs, last_results_key, lock))
+                        asyncio.create_task(_follow_links(doc, query, emit, all_docs, results, fetcher))
                     )
             if all_docs:
-                await _emit_final_results(query, all_docs, emit, last_results_key, lock)
+                results.mark_dirty()
 
         if secondary:
-            results = await asyncio.gather(*secondary, return_exceptions=True)
-            for exc in results:
+            outcomes = await asyncio.gather(*secondary, return_exceptions=True)
+            for exc in outcomes:
                 if isinstance(exc, Exception):
                     logger.exception("super-search secondary task failed", exc_info=exc)
+    finally:
+        # The client outlives the stream now, so closing it no longer stops what the
+        # stream left running: a search cut short by its deadline cancels its requests.
+        for task in source_tasks + secondary:
+            task.cancel()
 
 
 # ---------------------------------------------------------------------------
@@ -573,17 +757,17 @@ async def _sse_stream(query: str, monthly_usage: int, monthly_limit: int):
     reason = "complete"
     pages_indexed = 0
     all_docs: list[Document] = []
-    last_results_key: list = [None]
-    results_lock = asyncio.Lock()
 
     async def emit(event_type: str, data: Any) -> None:
         await queue.put((event_type, data))
 
+    results = ResultsEmitter(query, all_docs, emit)
+
     async def producer():
         nonlocal reason, pages_indexed
         try:
             await asyncio.wait_for(
-                _run_pipeline(query, emit, all_docs, last_results_key, results_lock),
+                _run_pipeline(query, emit, all_docs, results),
                 timeout=settings.SUPER_SEARCH_DEADLINE_SECONDS,
             )
         except asyncio.TimeoutError:
@@ -596,12 +780,15 @@ async def _sse_stream(query: str, monthly_usage: int, monthly_limit: int):
             reason = "error"
             await queue.put(("error", ErrorEvent(message=str(e))))
         finally:
+            SUPER_SEARCH_STREAMS.labels(reason).inc()
             if reason in ("complete", "timed_out"):
                 try:
-                    await _emit_final_results(query, all_docs, emit, last_results_key, results_lock)
+                    await results.flush()
                 except Exception:
                     logger.exception("super-search failed to emit final results")
                 pages_indexed = await _index_results(query, all_docs)
+            else:
+                await results.close()
             await queue.put(_SENTINEL)
 
     task = asyncio.create_task(producer())
@@ -662,7 +849,7 @@ def init_router() -> None:
             "|---|---|---|\n"
             "| `source_started` | `{source}` | A source's query task was launched (one per source). |\n"
             "| `source_returned` | `{source, count}` | A source finished; `count` is the number of raw results it returned. |\n"
-            "| `source_failed` | `{source, error}` | A source errored or timed out; `error` is `\"timeout\"` or an exception message. |\n"
+            "| `source_failed` | `{source, error}` | A source errored, timed out or was skipped; `error` is `\"timeout\"`, `\"circuit_open\"` (a source that has been failing, skipped without a `source_started`) or an exception message. |\n"
             "| `result_promoted` | result item (`origin=\"direct\"`) | A result entered the live top-K and will have its outbound links followed. |\n"
             "| `page_fetched` | `{url, links}` | A promoted page was crawled; `links` is the number of outbound links found. |\n"
             "| `link_followed` | `{url, from}` | An outbound link from a crawled page was fetched and added to the candidate pool. |\n"
@@ -697,16 +884,14 @@ def init_router() -> None:
     async def super_search(request, q: str):
         user = await authenticate_user(request)
 
-        if not await sync_to_async(check_rate_limit)(user.id):
-            raise HttpError(429, "Rate limit exceeded: maximum 5 requests per second.")
-
         monthly_limit = settings.SUPER_SEARCH_MONTHLY_LIMIT
-        # Increment first, then check: this makes the quota check atomic under
-        # concurrent requests (a check-then-increment would let racing requests
-        # both pass). Refund the increment if the caller is over the limit.
-        monthly_usage = await sync_to_async(increment_monthly_super_search)(user.id)
-        if monthly_usage > monthly_limit:
-            await sync_to_async(decrement_monthly_super_search)(user.id)
+        # The rate limit, quota check and increment are one atomic step, so racing
+        # requests cannot both take the last request of the quota.
+        charge = await sync_to_async(charge_super_search)(user.id, monthly_limit)
+        if not charge.allowed:
+            raise HttpError(429, "Rate limit exceeded: maximum 5 requests per second.")
+        monthly_usage = charge.monthly_usage
+        if not charge.within_quota:
             raise HttpError(
                 429,
                 f"Super Search monthly quota exceeded: {monthly_limit} requests per month "
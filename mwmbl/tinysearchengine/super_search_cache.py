@@ -0,0 +1,203 @@
+"""A short-lived cache of what each Super Search source answered for a query.
+
+Super Search is bursty in the way search is: a popular query is searched again within
+seconds or minutes - by other people, by the same person refining the query, or by the
+same page reloaded - and every time every source was called again, spending its rate
+limit and the stream's time on an answer the source gave a moment ago. The external
+APIs do not change their answers that quickly, so the answers are kept for a while:
+
+    the key         (source, normalised query, limit). The query is lower-cased and its
+                    whitespace collapsed, which is as far as the sources themselves can
+                    be relied on to ignore differences; anything more and two queries a
+                    source answers differently would share an entry.
+
+    TTLs            SUPER_SEARCH_SOURCE_CACHE_TTL_SECONDS, or the source's own entry in
+                    SUPER_SEARCH_SOURCE_CACHE_TTLS - shorter for sources whose answers
+                    move, such as Hacker News or our own index, which Super Search adds
+                    to. A TTL of 0 turns the cache off for that source.
+
+    empty answers   Cached too, for at most SUPER_SEARCH_SOURCE_CACHE_EMPTY_TTL_SECONDS.
+                    A query a source has nothing for is usually asked again just as
+                    uselessly, but the adapters answer an empty list when they fail as
+                    well, so an empty answer is not trusted for long. Timeouts and
+                    errors are never cached.
+
+There are two tiers, like the search result cache: a per-process LRU of
+SUPER_SEARCH_SOURCE_CACHE_MAX_ENTRIES, and with SUPER_SEARCH_SOURCE_CACHE_SHARED a
+Redis tier shared by every worker, keyed by a hash of the normalised query. Entries
+hold the documents' tuples and every hit builds new Documents, so no two streams ever
+share one.
+
+A source answered from here goes through the stream exactly as a called one does -
+``source_started``, then ``source_returned`` with its documents - so clients cannot tell
+the difference; only its latency does not count towards the source's health, which is
+about the source. None of this may fail a search: if Redis cannot be read or written
+the shared tier is skipped for that call and the error logged.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Optional
+
+import redis
+from django.conf import settings
+
+from mwmbl.metrics import SUPER_SEARCH_SOURCE_CACHE_LOOKUPS
+from mwmbl.tinysearchengine.indexer import Document
+
+logger = getLogger(__name__)
+
+
+SHARED_KEY_PREFIX = "ss:source-cache"
+
+_redis: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+def normalize_source_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def source_ttl(source: str, empty: bool) -> float:
+    """How long an answer from this source is kept; 0 if it is not."""
+    ttl = settings.SUPER_SEARCH_SOURCE_CACHE_TTLS.get(source, settings.SUPER_SEARCH_SOURCE_CACHE_TTL_SECONDS)
+    if empty:
+        ttl = min(ttl, settings.SUPER_SEARCH_SOURCE_CACHE_EMPTY_TTL_SECONDS)
+    return max(0.0, ttl)
+
+
+class SourceResponseCache:
+    def __init__(self, max_entries: int, shared: bool, redis_client: Optional[redis.Redis] = None):
+        self.max_entries = max_entries
+        self.shared = shared
+        self._redis_client = redis_client
+        self._entries: "OrderedDict[tuple[str, str, int], tuple[float, list]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def redis_client(self) -> redis.Redis:
+        return self._redis_client if self._redis_client is not None else get_redis()
+
+    @staticmethod
+    def _key(source: str, query: str, limit: int) -> tuple[str, str, int]:
+        return source, normalize_source_query(query), limit
+
+    @staticmethod
+    def _shared_key(key: tuple[str, str, int]) -> str:
+        source, normalized, limit = key
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        return f"{SHARED_KEY_PREFIX}:{source}:{limit}:{digest}"
+
+    def get_local(self, source: str, query: str, limit: int) -> Optional[list[Document]]:
+        key = self._key(source, query, limit)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, rows = entry
+            if now >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return [Document(*row) for row in rows]
+
+    def _put_local(self, key: tuple[str, str, int], rows: list, ttl: float) -> None:
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_shared(self, source: str, query: str, limit: int) -> Optional[list[Document]]:
+        """The Redis tier's answer, copied into this process's tier. Blocks on Redis."""
+        if not self.shared:
+            return None
+        key = self._key(source, query, limit)
+        try:
+            payload = self.redis_client.get(self._shared_key(key))
+        except Exception:
+            logger.warning("Could not read from the shared source cache", exc_info=True)
+            return None
+        if payload is None:
+            return None
+        try:
+            entry = json.loads(payload)
+            rows = [tuple(row) for row in entry["rows"]]
+            ttl = float(entry["expires"]) - time.time()
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Discarding unreadable shared source cache entry for %s", source)
+            return None
+        if ttl <= 0:
+            return None
+        self._put_local(key, rows, ttl)
+        return [Document(*row) for row in rows]
+
+    def put(self, source: str, query: str, limit: int, docs: list[Document]) -> list:
+        """Keep an answer in this process's tier. Returns what put_shared() stores."""
+        ttl = source_ttl(source, empty=not docs)
+        rows = [doc.as_tuple() for doc in docs]
+        self._put_local(self._key(source, query, limit), rows, ttl)
+        return rows
+
+    def put_shared(self, source: str, query: str, limit: int, rows: list) -> None:
+        """Keep an answer in the Redis tier. Blocks on Redis; never raises."""
+        ttl = source_ttl(source, empty=not rows)
+        if not self.shared or ttl <= 0:
+            return
+        try:
+            payload = json.dumps({"expires": time.time() + ttl, "rows": rows})
+            key = self._shared_key(self._key(source, query, limit))
+            self.redis_client.set(key, payload, ex=max(1, int(ttl)))
+        except Exception:
+            logger.warning("Could not write to the shared source cache", exc_info=True)
+
+
+_source_cache: Optional[SourceResponseCache] = None
+
+
+def get_source_cache() -> SourceResponseCache:
+    """The per-process cache used by Super Search."""
+    global _source_cache
+    if _source_cache is None:
+        _source_cache = SourceResponseCache(
+            max_entries=settings.SUPER_SEARCH_SOURCE_CACHE_MAX_ENTRIES,
+            shared=settings.SUPER_SEARCH_SOURCE_CACHE_SHARED,
+        )
+    return _source_cache
+
+
+async def cached_answer(source: str, query: str, limit: int) -> Optional[list[Document]]:
+    """What the source answered for this query a moment ago, or None to call it."""
+    if not settings.SUPER_SEARCH_SOURCE_CACHE_ENABLED or source_ttl(source, empty=False) <= 0:
+        return None
+    cache = get_source_cache()
+    docs = cache.get_local(source, query, limit)
+    outcome = "local_hit"
+    if docs is None and cache.shared:
+        docs = await asyncio.to_thread(cache.get_shared, source, query, limit)
+        outcome = "shared_hit"
+    SUPER_SEARCH_SOURCE_CACHE_LOOKUPS.labels(source, outcome if docs is not None else "miss").inc()
+    return docs
+
+
+async def store_answer(source: str, query: str, limit: int, docs: list[Document]) -> None:
+    """Keep a source's successful answer for the next stream to ask it the same thing."""
+    if not settings.SUPER_SEARCH_SOURCE_CACHE_ENABLED or source_ttl(source, empty=not docs) <= 0:
+        return
+    cache = get_source_cache()
+    rows = cache.put(source, query, limit, docs)
+    if cache.shared:
+        await asyncio.to_thread(cache.put_shared, source, query, limit, rows)
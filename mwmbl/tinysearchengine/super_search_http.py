@@ -0,0 +1,221 @@
+"""The httpx client Super Search queries its sources and fetches pages with.
+
+Each stream used to open its own ``httpx.AsyncClient`` and close it at the end, so
+every search paid a TCP and TLS handshake to each source - the same dozen API hosts,
+search after search - before it could send a single request, and then threw the
+connections away. The handshakes were often a large part of a source's latency, and
+with it of the adaptive timeouts in super_search_select/health.py.
+
+Now one client is kept per event loop - under uvicorn, one per worker process - and
+every stream borrows it:
+
+    connections     SUPER_SEARCH_MAX_CONNECTIONS at most, across every stream in the
+                    process, and at most SUPER_SEARCH_MAX_CONCURRENT_PER_HOST requests
+                    to any one host at a time. httpx only limits the pool as a whole, so
+                    the per-host limit is a semaphore per host around the transport,
+                    held until the response is closed; a host nobody is waiting on is
+                    forgotten, so the pages Super Search follows links to do not
+                    accumulate. The limit is per process, so it has to cover the streams
+                    a worker serves at once, each calling most sources.
+
+    queueing        Time spent waiting for a host's slot is not the source's fault.
+                    A source call in super_search._call_source is tracked with
+                    track_host_queue_wait(): the transport adds what the call's requests
+                    waited to it, the call's timeout is extended by that much (up to the
+                    timeout again), and only the rest counts as the source's latency in
+                    super_search_select/health.py. A call that runs out of time while
+                    still queued ends as ``throttled`` and is left out of the health
+                    statistics, so a busy worker cannot open a healthy source's circuit.
+
+    keep-alive      SUPER_SEARCH_KEEPALIVE_CONNECTIONS idle connections are kept, each
+                    for SUPER_SEARCH_KEEPALIVE_SECONDS - long enough to span the gap
+                    between searches, short enough to be closed before the servers that
+                    close idle connections after a minute or so do it first.
+
+    HTTP/2          Used to the hosts that offer it. ``h2`` comes with the
+                    ``httpx[http2]`` dependency; an environment installed without the
+                    extra falls back to HTTP/1.1, which is what every stream used before.
+
+A client belongs to the loop it was created on - its connections cannot be used from
+another - so a loop gets its own, and a forked child never uses its parent's. The
+clients are never closed by a stream: the connections are the point. A loop that is
+closed takes its client with it, and the sockets are closed when it is collected.
+"""
+import asyncio
+import os
+import time
+import weakref
+from contextvars import ContextVar
+from typing import Optional
+
+import httpx
+from django.conf import settings
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+HTTP_USER_AGENT = "mwmbl-super-search/0.1 (+https://mwmbl.org)"
+
+
+class HostQueueWait:
+    """How long one source call's requests have waited for their hosts' slots."""
+
+    def __init__(self):
+        self._done = 0.0
+        self._since: list[float] = []   # when each request still waiting began to
+
+    @property
+    def waiting(self) -> int:
+        return len(self._since)
+
+    @property
+    def waited(self) -> float:
+        now = time.monotonic()
+        return self._done + sum(now - since for since in self._since)
+
+    def started(self) -> float:
+        since = time.monotonic()
+        self._since.append(since)
+        return since
+
+    def finished(self, since: float) -> None:
+        self._since.remove(since)
+        self._done += time.monotonic() - since
+
+
+_host_queue_wait: ContextVar[Optional[HostQueueWait]] = ContextVar("host_queue_wait", default=None)
+
+
+def track_host_queue_wait() -> HostQueueWait:
+    """Count the queueing of requests made from here on in this context, and in tasks it starts."""
+    wait = HostQueueWait()
+    _host_queue_wait.set(wait)
+    return wait
+
+
+class SourceThrottled(asyncio.TimeoutError):
+    """A source call ran out of time while its requests were still waiting for their host."""
+
+
+async def wait_for_source(coro, timeout: float, wait: HostQueueWait):
+    """Like asyncio.wait_for, but time queued for a host (up to `timeout` more) does not count.
+
+    Raises SourceThrottled rather than asyncio.TimeoutError if a request is still queued
+    when the time runs out.
+    """
+    task = asyncio.ensure_future(coro)
+    started = time.monotonic()
+    try:
+        while True:
+            remaining = started + timeout + min(wait.waited, timeout) - time.monotonic()
+            if remaining <= 0:
+                raise SourceThrottled if wait.waiting else asyncio.TimeoutError
+            done, _ = await asyncio.wait({task}, timeout=remaining)
+            if done:
+                return task.result()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """A response body that gives its host's slot back when it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class PerHostLimitTransport(httpx.AsyncBaseTransport):
+    """Lets at most `limit` requests to each host be in flight at once."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limit: int):
+        self._transport = transport
+        self._limit = limit
+        self._hosts: dict[tuple, asyncio.Semaphore] = {}
+        self._users: dict[tuple, int] = {}
+
+    def _release(self, host: tuple) -> None:
+        self._hosts[host].release()
+        self._users[host] -= 1
+        if not self._users[host]:
+            del self._users[host]
+            del self._hosts[host]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = (request.url.scheme, request.url.host, request.url.port)
+        semaphore = self._hosts.setdefault(host, asyncio.Semaphore(self._limit))
+        self._users[host] = self._users.get(host, 0) + 1
+        wait = _host_queue_wait.get()
+        since = wait.started() if wait is not None else None
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            self._users[host] -= 1
+            if not self._users[host]:
+                del self._users[host]
+                del self._hosts[host]
+            raise
+        finally:
+            if wait is not None:
+                wait.finished(since)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._release(host)
+            raise
+        response.stream = _ReleasingStream(response.stream, lambda: self._release(host))
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def new_client() -> httpx.AsyncClient:
+    """A client set up as the shared ones are; the caller closes it."""
+    limits = httpx.Limits(
+        max_connections=settings.SUPER_SEARCH_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.SUPER_SEARCH_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.SUPER_SEARCH_KEEPALIVE_SECONDS,
+    )
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=HTTP2_AVAILABLE)
+    return httpx.AsyncClient(
+        transport=PerHostLimitTransport(transport, settings.SUPER_SEARCH_MAX_CONCURRENT_PER_HOST),
+        timeout=httpx.Timeout(settings.SUPER_SEARCH_PER_SOURCE_TIMEOUT),
+        follow_redirects=True,
+        headers={"User-Agent": HTTP_USER_AGENT},
+    )
+
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_clients_pid: Optional[int] = None
+
+
+def shared_client() -> httpx.AsyncClient:
+    """The running loop's client, created on first use. Borrow it; do not close it."""
+    global _clients, _clients_pid
+    if _clients_pid != os.getpid():
+        # A forked child must not share its parent's sockets.
+        _clients = weakref.WeakKeyDictionary()
+        _clients_pid = os.getpid()
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = new_client()
+    return client
@@ -11,6 +11,7 @@ Modules:
 - ``profiles``  — per-site content-profile read/update in Redis.
 - ``features``  — build the context feature vector for a (query, site) pair.
 - ``rstats``    — per-source reward EMA in Redis (the contribution_ema feature).
+- ``health``    — per-source latency and failure stats in Redis: timeouts, circuit breaker.
 - ``xgb_model`` — the contextual-bandit reward model: training, artifact, serving.
 - ``policy``    — epsilon-greedy selection over the model's predicted rewards.
 - ``registry``  — site metadata (field, popularity, domain) for features/priors.
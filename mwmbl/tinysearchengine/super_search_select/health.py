@@ -0,0 +1,131 @@
+"""Per-source latency and failure statistics in Redis: adaptive timeouts and a circuit breaker.
+
+Every source used to get the same SUPER_SEARCH_PER_SOURCE_TIMEOUT, so a source that
+was timing out for everyone still held a connection and the stream's deadline budget on
+every search. This keeps, per source and in the same decaying style as ``rstats``:
+
+- ``latency_ema`` — decaying mean of the call latency;
+- ``p95`` — a running estimate of the 95th percentile latency, moved up by
+  ``DECAY * latency_ema * 0.95`` by a slower call and down by ``DECAY * latency_ema *
+  0.05`` by a faster one, which settles where 5% of calls are slower;
+- ``error_ema`` — decaying failure rate (timeouts and raised errors);
+- ``consecutive_failures`` and ``open_until`` — the circuit breaker.
+
+A source's timeout is its p95 times SUPER_SEARCH_SOURCE_TIMEOUT_P95_MULTIPLIER, never
+below SUPER_SEARCH_MIN_SOURCE_TIMEOUT and never above SUPER_SEARCH_PER_SOURCE_TIMEOUT,
+which is used as it is until a source has SUPER_SEARCH_SOURCE_MIN_OBSERVATIONS calls
+behind it. A call that times out counts as taking its timeout, so a source that keeps
+timing out climbs back to the ceiling. After SUPER_SEARCH_SOURCE_FAILURE_THRESHOLD
+failures in a row the circuit opens: the source is skipped, and reported as failed,
+for SUPER_SEARCH_SOURCE_COOLDOWN_SECONDS. The first call after that is a trial - one
+more failure opens it again straight away, a success closes it.
+
+The statistics are shared by every worker through Redis, so a source going down is
+noticed once rather than once per process. The updates are read-modify-write, like
+``rstats``: two workers recording at once may lose one observation, which the decay
+makes up for. If Redis is down every source gets the flat timeout and nothing is
+skipped. Aggregate per-source statistics only — nothing query-derived is stored here.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import asdict, dataclass, fields
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_HEALTH = "ss:health:{site}"
+
+# Weight of the newest observation, as for the reward EMAs.
+DECAY = 0.1
+QUANTILE = 0.95
+
+_redis: redis.Redis | None = None
+
+
+def _get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.from_url(settings.REDIS_URL)
+    return _redis
+
+
+@dataclass
+class SourceHealth:
+    latency_ema: float = 0.0
+    p95: float = 0.0
+    error_ema: float = 0.0
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+    observations: int = 0
+
+    def timeout(self) -> float:
+        """How long to wait for this source."""
+        ceiling = settings.SUPER_SEARCH_PER_SOURCE_TIMEOUT
+        if self.observations < settings.SUPER_SEARCH_SOURCE_MIN_OBSERVATIONS:
+            return ceiling
+        adaptive = self.p95 * settings.SUPER_SEARCH_SOURCE_TIMEOUT_P95_MULTIPLIER
+        return min(ceiling, max(settings.SUPER_SEARCH_MIN_SOURCE_TIMEOUT, adaptive))
+
+    def is_open(self, now: float) -> bool:
+        """Whether the circuit is open: the source is to be skipped."""
+        return now < self.open_until
+
+    def observe(self, seconds: float, ok: bool, now: float) -> None:
+        """Fold in one call that took `seconds` and succeeded or not."""
+        if self.observations == 0:
+            self.latency_ema = self.p95 = seconds
+        else:
+            self.latency_ema = (1.0 - DECAY) * self.latency_ema + DECAY * seconds
+            step = DECAY * self.latency_ema
+            self.p95 = max(0.0, self.p95 + step * (QUANTILE if seconds > self.p95 else QUANTILE - 1.0))
+        self.error_ema = (1.0 - DECAY) * self.error_ema + DECAY * (0.0 if ok else 1.0)
+        self.observations += 1
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= settings.SUPER_SEARCH_SOURCE_FAILURE_THRESHOLD:
+            self.open_until = now + settings.SUPER_SEARCH_SOURCE_COOLDOWN_SECONDS
+
+
+_FIELD_TYPES = {field.name: (int if field.type == "int" else float) for field in fields(SourceHealth)}
+
+
+def _parse(stored: dict) -> SourceHealth:
+    values = {}
+    for key, value in stored.items():
+        name = key.decode() if isinstance(key, bytes) else key
+        if name in _FIELD_TYPES:
+            values[name] = _FIELD_TYPES[name](float(value))
+    return SourceHealth(**values)
+
+
+def get_health(sites: list[str]) -> dict[str, SourceHealth]:
+    """Each source's statistics; fresh ones for sources never called, or if Redis is down."""
+    try:
+        pipe = _get_redis().pipeline()
+        for site in sites:
+            pipe.hgetall(_HEALTH.format(site=site))
+        stored = pipe.execute()
+    except redis.RedisError:
+        logger.warning("Could not read Super Search source health; using the flat timeout", exc_info=True)
+        return {site: SourceHealth() for site in sites}
+    return {site: _parse(values) for site, values in zip(sites, stored)}
+
+
+def record(site: str, seconds: float, ok: bool) -> SourceHealth | None:
+    """Fold one call into a source's statistics. Returns them, or None if Redis is down."""
+    key = _HEALTH.format(site=site)
+    try:
+        r = _get_redis()
+        health = _parse(r.hgetall(key))
+        health.observe(seconds, ok, time.time())
+        r.hset(key, mapping={name: repr(value) for name, value in asdict(health).items()})
+    except redis.RedisError:
+        logger.warning("Could not record a call to Super Search source %s", site, exc_info=True)
+        return None
+    return health
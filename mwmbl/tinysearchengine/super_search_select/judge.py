@@ -12,22 +12,57 @@ or onnxruntime is unavailable the judge is disabled — ``get_judge()``
 returns None and callers fall back to LTR ranking / survival rewards — so
 deploys without the model artifact keep working unchanged.
 
-Queries pass through this module in memory only; nothing is persisted.
+Concurrent Super Searches each want a handful of documents scored, and one
+forward pass over a few pairs costs nearly as much as one over a full batch:
+the session's fixed per-run cost and its CPU threads are spent on whoever
+happens to call. So with ``SUPER_SEARCH_JUDGE_BATCHING`` on, ``get_judge()``
+hands out a ``JudgeBatcher`` in front of the model. Callers block in ``score()`` as before, but their (query, doc
+text) pairs go onto one queue, and a single worker thread runs them in
+batches of ``SUPER_SEARCH_JUDGE_BATCH_SIZE`` pairs - as soon as that many are
+waiting, or once the oldest has waited ``SUPER_SEARCH_JUDGE_BATCH_WAIT_SECONDS``.
+A batch may hold pairs from several queries (padding is per batch, and the
+attention mask keeps them apart); each score goes back to the caller that
+asked for it, in its order. The wait is the price a lone caller pays for
+sharing, so keep it well under the time a batch takes. Time on the queue
+and how full the batches run are reported as
+``mwmbl_super_search_judge_queue_seconds`` and
+``mwmbl_super_search_judge_batch_fill``. Batching is off by default: the one
+caller today, scripts/super_search_eval.py, scores a query at a time, and a
+lone caller only pays the wait. Turn it on once judge scores are asked for
+from concurrent requests. In front of the batcher, scores
+already known are answered from a cache (super_search_select/judge_cache.py).
+
+In the web app, queries pass through this module and the score cache in memory
+only. The cache's persistent tier keeps raw queries in an SQLite file, so it is
+off unless an offline script turns it on with ``use_persistent_score_cache()``
+(scripts/super_search_eval.py --judge-cache); no setting or environment variable
+can turn it on in a web process.
 """
 from __future__ import annotations
 
 import logging
+import os
 import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import numpy as np
 from django.conf import settings
 
+from mwmbl.metrics import SUPER_SEARCH_JUDGE_BATCH_FILL, SUPER_SEARCH_JUDGE_QUEUE_SECONDS, ThreadPoolTracker
+from mwmbl.tinysearchengine.super_search_select.judge_cache import (
+    CachingJudge, JudgeScoreCache, model_fingerprint,
+)
+
 logger = logging.getLogger(__name__)
 
 DOC_CHARS = 1000   # matches judge training (scripts/judge_bakeoff.py DOC_CHARS)
 MAX_TOKENS = 256   # matches training max_length
 BATCH_SIZE = 64
+WORKER_CHECK_SECONDS = 1.0  # how often a caller waiting on the batcher checks its worker is alive
 
 
 def doc_text(title: str | None, extract: str | None) -> str:
@@ -52,27 +87,166 @@ class Judge:
         scores: list[float] = []
         for start in range(0, len(doc_texts), BATCH_SIZE):
             batch = doc_texts[start:start + BATCH_SIZE]
-            encodings = self.tokenizer.encode_batch([(query, text) for text in batch])
-            feed = {
-                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
-                "attention_mask": np.array([e.attention_mask for e in encodings],
-                                           dtype=np.int64),
-            }
-            if "token_type_ids" in self.input_names:
-                feed["token_type_ids"] = np.array([e.type_ids for e in encodings],
-                                                  dtype=np.int64)
-            logits = self.session.run(None, feed)[0][:, 0].astype(np.float64)
-            scores.extend(float(s) for s in 1 / (1 + np.exp(-logits)))
+            scores.extend(self.score_pairs([(query, text) for text in batch]))
         return scores
 
+    def score_pairs(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """One forward pass over (query, doc text) pairs, which may be for different queries."""
+        encodings = self.tokenizer.encode_batch(pairs)
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings],
+                                       dtype=np.int64),
+        }
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.array([e.type_ids for e in encodings],
+                                              dtype=np.int64)
+        logits = self.session.run(None, feed)[0][:, 0].astype(np.float64)
+        return [float(s) for s in 1 / (1 + np.exp(-logits))]
+
+
+@dataclass
+class _Request:
+    """One caller's score() call: its scores fill in as the batches holding its pairs finish."""
+    scores: list[float]
+    remaining: int
+    future: Future = field(default_factory=Future)
+
+    def set_score(self, index: int, score: float) -> None:
+        self.scores[index] = score
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.future.set_result(self.scores)
+
+
+@dataclass
+class _Pair:
+    request: _Request
+    index: int
+    pair: tuple[str, str]
+    enqueued_at: float
+
+
+class JudgeBatcher:
+    """Runs the pairs of every concurrent score() call through the judge together.
+
+    Anything with ``score_pairs()`` can be batched, which is how the tests and
+    analyse/judge_batching_benchmark.py stand in for the model.
+    """
+
+    def __init__(self, judge, batch_size: int = BATCH_SIZE, max_wait: float = 0.005):
+        self.judge = judge
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self._start_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._pending: deque[_Pair] = deque()
+        self._pid: int | None = None
+        self._worker: threading.Thread | None = None
+        # Counted in pairs, on the one worker thread.
+        self._tracker = ThreadPoolTracker("judge_batcher", 1)
 
-_judge: Judge | None = None
+    def score(self, query: str, doc_texts: list[str]) -> list[float]:
+        """Relevance of each doc text to the query, each in [0, 1]. Blocks until scored,
+        or raises RuntimeError if the worker thread dies first."""
+        if not doc_texts:
+            return []
+        worker = self._ensure_worker()
+        request = _Request(scores=[0.0] * len(doc_texts), remaining=len(doc_texts))
+        now = time.monotonic()
+        self._tracker.submitted(len(doc_texts))
+        with self._condition:
+            self._pending.extend(_Pair(request, index, (query, text), now)
+                                 for index, text in enumerate(doc_texts))
+            self._condition.notify()
+        while True:
+            try:
+                return request.future.result(timeout=WORKER_CHECK_SECONDS)
+            except TimeoutError:
+                if not worker.is_alive():
+                    raise RuntimeError("the judge batcher's worker thread died") from None
+
+    def _ensure_worker(self) -> threading.Thread:
+        # A forked child has the queue but not the thread serving it, and a worker that
+        # died leaves its queue unserved: either way, start afresh with a new one.
+        pid = os.getpid()
+        worker = self._worker
+        if self._pid == pid and worker.is_alive():
+            return worker
+        with self._start_lock:
+            if self._pid == pid and self._worker.is_alive():
+                return self._worker
+            if self._pid == pid:
+                logger.error("judge batcher worker died; restarting it")
+                self._tracker.withdrawn(len(self._pending))
+            self._condition = threading.Condition()
+            self._pending = deque()
+            self._worker = threading.Thread(target=self._run, name="judge-batcher", daemon=True)
+            self._worker.start()
+            self._pid = pid
+            return self._worker
+
+    def _next_batch(self) -> list[_Pair]:
+        with self._condition:
+            while True:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = self._pending[0].enqueued_at + self.max_wait
+                while len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                taken = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                # The rest of a request whose earlier batch failed has no one waiting for it.
+                batch = [item for item in taken if not item.request.future.done()]
+                if len(batch) < len(taken):
+                    self._tracker.withdrawn(len(taken) - len(batch))
+                if batch:
+                    return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            for item in batch:
+                SUPER_SEARCH_JUDGE_QUEUE_SECONDS.observe(started - item.enqueued_at)
+            SUPER_SEARCH_JUDGE_BATCH_FILL.observe(len(batch) / self.batch_size)
+            try:
+                with self._tracker.running(len(batch)):
+                    scores = self.judge.score_pairs([item.pair for item in batch])
+            except Exception as e:
+                for item in batch:
+                    if not item.request.future.done():
+                        item.request.future.set_exception(e)
+                continue
+            for item, score in zip(batch, scores):
+                item.request.set_score(item.index, score)
+
+
+_judge: Judge | JudgeBatcher | CachingJudge | None = None
 _load_attempted = False
 _lock = threading.Lock()
+_persistent_score_cache_path: Path | None = None
+
+
+def use_persistent_score_cache(path: str | Path) -> None:
+    """Keep judge scores in an SQLite file at ``path`` too, for offline evaluation
+    reruns. Call it before the judge is first loaded; never from the web app."""
+    global _persistent_score_cache_path
+    with _lock:
+        if _load_attempted:
+            raise RuntimeError("the relevance judge is already loaded without a persistent score cache")
+        _persistent_score_cache_path = Path(path)
+
 
+def get_judge() -> Judge | JudgeBatcher | CachingJudge | None:
+    """Lazily load the shared judge; None (memoized) if unavailable.
 
-def get_judge() -> Judge | None:
-    """Lazily load the shared judge; None (memoized) if unavailable."""
+    Batched across callers if SUPER_SEARCH_JUDGE_BATCHING is on, and
+    behind the score cache unless it is sized 0 and no offline script has
+    called use_persistent_score_cache().
+    """
     global _judge, _load_attempted
     if _load_attempted:
         return _judge
@@ -83,6 +257,16 @@ def get_judge() -> Judge | None:
         try:
             if (model_dir / "model.onnx").exists():
                 _judge = Judge(model_dir)
+                if getattr(settings, "SUPER_SEARCH_JUDGE_BATCHING", False):
+                    _judge = JudgeBatcher(
+                        _judge,
+                        batch_size=getattr(settings, "SUPER_SEARCH_JUDGE_BATCH_SIZE", BATCH_SIZE),
+                        max_wait=getattr(settings, "SUPER_SEARCH_JUDGE_BATCH_WAIT_SECONDS", 0.005))
+                max_entries = getattr(settings, "SUPER_SEARCH_JUDGE_SCORE_CACHE_MAX_ENTRIES", 0)
+                path = _persistent_score_cache_path
+                if max_entries > 0 or path:
+                    _judge = CachingJudge(_judge, JudgeScoreCache(
+                        max_entries, path, model_id=model_fingerprint(model_dir) if path else ""))
                 logger.info("relevance judge loaded from %s", model_dir)
             else:
                 logger.warning(
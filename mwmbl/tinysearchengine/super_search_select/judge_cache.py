@@ -0,0 +1,183 @@
+"""Cache of relevance-judge scores, keyed by the query and the document text.
+
+The cross-encoder is the most expensive thing done per document: tokenizing the
+pair, then a forward pass. The same pairs keep coming back - a popular query is
+searched again and its sources answer with mostly the same documents, and offline
+evaluation (scripts/super_search_eval.py --reward judge) scores the same query
+file run after run. A score depends only on the model, the query and the text
+the judge is given (``judge.doc_text(title, extract)``), so it can be kept:
+
+    the key         The query exactly as scored - the judge sees its case and
+                    spacing, so no normalisation - and the SHA-1 of the doc
+                    text, which keeps a 1000-character extract out of memory.
+
+    local tier      A per-process LRU of SUPER_SEARCH_JUDGE_SCORE_CACHE_MAX_ENTRIES
+                    pairs. 0 turns the cache off.
+
+    persistent      An SQLite file behind the LRU, for offline evaluation
+                    reruns. Rows also carry a fingerprint of model.onnx and
+                    tokenizer.json, so a retrained judge never reads its
+                    predecessor's scores. It is meant for one process at a
+                    time. It holds raw queries, so only an offline script can
+                    turn it on, through judge.use_persistent_score_cache();
+                    there is no setting for it that a web process could read.
+
+``get_judge()`` puts a ``CachingJudge`` in front of everything else, so only the
+misses reach JudgeBatcher and the model. Lookups are counted per pair in
+``mwmbl_super_search_judge_score_cache_lookups`` by outcome, and ``stats()`` gives
+the same counts and the hit rate to offline scripts. As with every other cache,
+a persistent tier that cannot be read or written is logged and skipped, and the
+pairs are scored instead.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from mwmbl.metrics import SUPER_SEARCH_JUDGE_SCORE_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+SQLITE_MAX_PARAMETERS = 500   # per IN (...) lookup, well under SQLite's limit
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha1(text.encode()).digest()
+
+
+def model_fingerprint(model_dir: Path) -> str:
+    """SHA-1 over the judge's model and tokenizer files."""
+    digest = hashlib.sha1()
+    for name in ("model.onnx", "tokenizer.json"):
+        with open(model_dir / name, "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JudgeScoreCache:
+    def __init__(self, max_entries: int, path: str | Path | None = None, model_id: str = ""):
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self.model_id = model_id
+        self._entries: OrderedDict[tuple[str, bytes], float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+        self._connection_pid: int | None = None
+        self._counts = {"local_hit": 0, "persistent_hit": 0, "miss": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None or self._connection_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS judge_scores ("
+                "model TEXT NOT NULL, query TEXT NOT NULL, doc_hash BLOB NOT NULL, score REAL NOT NULL, "
+                "PRIMARY KEY (model, query, doc_hash))")
+            self._connection, self._connection_pid = connection, os.getpid()
+        return self._connection
+
+    def _get_persistent(self, query: str, digests: list[bytes]) -> dict[bytes, float]:
+        found = {}
+        try:
+            with self._db_lock:
+                connection = self._connect()
+                for start in range(0, len(digests), SQLITE_MAX_PARAMETERS):
+                    chunk = digests[start:start + SQLITE_MAX_PARAMETERS]
+                    rows = connection.execute(
+                        "SELECT doc_hash, score FROM judge_scores WHERE model = ? AND query = ? "
+                        f"AND doc_hash IN ({', '.join('?' * len(chunk))})",
+                        (self.model_id, query, *chunk))
+                    found.update(rows)
+        except (sqlite3.Error, OSError):
+            logger.warning("Could not read the persistent judge score cache at %s", self.path, exc_info=True)
+        return found
+
+    def _put_persistent(self, query: str, items: list[tuple[bytes, float]]) -> None:
+        try:
+            with self._db_lock:
+                connection = self._connect()
+                with connection:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO judge_scores (model, query, doc_hash, score) VALUES (?, ?, ?, ?)",
+                        [(self.model_id, query, digest, score) for digest, score in items])
+        except (sqlite3.Error, OSError):
+            logger.warning("Could not write the persistent judge score cache at %s", self.path, exc_info=True)
+
+    def _put_local(self, query: str, items: list[tuple[bytes, float]]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for digest, score in items:
+                self._entries[(query, digest)] = score
+                self._entries.move_to_end((query, digest))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, query: str, digests: list[bytes]) -> list[float | None]:
+        """The cached score for each digest, None where there is none."""
+        scores: list[float | None] = []
+        with self._lock:
+            for digest in digests:
+                key = (query, digest)
+                score = self._entries.get(key)
+                if score is not None:
+                    self._entries.move_to_end(key)
+                scores.append(score)
+        local_hits = sum(score is not None for score in scores)
+        persistent_hits = 0
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if missing and self.path is not None:
+            found = self._get_persistent(query, list({digests[index] for index in missing}))
+            for index in missing:
+                if digests[index] in found:
+                    scores[index] = found[digests[index]]
+                    persistent_hits += 1
+            self._put_local(query, list(found.items()))
+        self._count("local_hit", local_hits)
+        self._count("persistent_hit", persistent_hits)
+        self._count("miss", len(digests) - local_hits - persistent_hits)
+        return scores
+
+    def put(self, query: str, items: list[tuple[bytes, float]]) -> None:
+        self._put_local(query, items)
+        if self.path is not None and items:
+            self._put_persistent(query, items)
+
+    def _count(self, outcome: str, count: int) -> None:
+        if count:
+            with self._lock:
+                self._counts[outcome] += count
+            SUPER_SEARCH_JUDGE_SCORE_CACHE_LOOKUPS.labels(outcome).inc(count)
+
+    def stats(self) -> dict:
+        """Pairs looked up since this process started, by outcome, and the hit rate."""
+        lookups = sum(self._counts.values())
+        hits = lookups - self._counts["miss"]
+        return {**self._counts, "lookups": lookups, "hit_rate": hits / lookups if lookups else 0.0}
+
+
+class CachingJudge:
+    """Answers from the cache what it can and scores the rest with the judge behind it."""
+
+    def __init__(self, judge, cache: JudgeScoreCache):
+        self.judge = judge
+        self.cache = cache
+
+    def score(self, query: str, doc_texts: list[str]) -> list[float]:
+        """Relevance of each doc text to the query, each in [0, 1]."""
+        digests = [text_digest(text) for text in doc_texts]
+        scores = self.cache.get(query, digests)
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if missing:
+            fresh = self.judge.score(query, [doc_texts[index] for index in missing])
+            self.cache.put(query, [(digests[index], score) for index, score in zip(missing, fresh)])
+            for index, score in zip(missing, fresh):
+                scores[index] = score
+        return scores
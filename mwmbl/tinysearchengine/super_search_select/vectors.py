@@ -9,10 +9,21 @@ dependency), which makes it deterministic and reproducible across processes.
 Vectors are dense ``numpy`` float32 arrays, L2-normalised so cosine similarity
 is a plain dot product. ``to_bytes`` / ``from_bytes`` give a compact Redis
 representation.
+
+Hashing is the cost: two mmh3 calls per token or n-gram, and a page sample has
+thousands of n-grams. ``project_bow_batch`` / ``project_char_ngrams_batch`` take
+many texts at once: every token is hashed once per process (``_token_hash`` is
+memoised, and vocabularies repeat heavily), and the signs are scattered into an
+``(n_texts, dim)`` matrix with one ``np.bincount``. The single-text functions are
+batches of one. Each bucket is a sum of +-1, which is exact in float64 and in
+float32 alike (up to 2**24 per bucket), and each row is normalised as before, so
+the vectors are bit-identical to the one-element-at-a-time loop they replace -
+profiles already in Redis stay comparable with new ones.
 """
 from __future__ import annotations
 
 import hashlib
+from functools import lru_cache
 
 import mmh3
 import numpy as np
@@ -47,11 +58,26 @@ _SIGN_SEED = 1
 
 
 def _hash_token(token: str, dim: int) -> tuple[int, float]:
+    """A token's bucket and sign, as the projection was first written. Not used here: it is
+    the reference that the tests and analyse/vector_projection_benchmark.py check
+    ``_token_hash`` against."""
     index = mmh3.hash(token, _INDEX_SEED, signed=False) % dim
     sign = 1.0 if (mmh3.hash(token, _SIGN_SEED, signed=False) & 1) else -1.0
     return index, sign
 
 
+@lru_cache(maxsize=1 << 18)
+def _token_hash(token: str) -> int:
+    """``_hash_token`` for any dim, packed: the index hash shifted left, the sign bit below it.
+
+    It hashes the token's UTF-8 bytes, which are what mmh3 hashes a str as, so the hashes are
+    unchanged. With "surrogatepass", a lone surrogate is hashed too, where mmh3 raises
+    UnicodeEncodeError for it.
+    """
+    key = token.encode("utf-8", "surrogatepass")
+    return (mmh3.hash(key, _INDEX_SEED, signed=False) << 1) | (mmh3.hash(key, _SIGN_SEED, signed=False) & 1)
+
+
 def _l2_normalise(vec: np.ndarray) -> np.ndarray:
     norm = float(np.linalg.norm(vec))
     if norm > 0.0:
@@ -66,13 +92,45 @@ def _content_tokens(text: str, remove_stop_words: bool) -> list[str]:
     return tokens
 
 
+def _project_features(features: list[list[str]], dim: int) -> np.ndarray:
+    """Hash each row's features into ``dim`` signed buckets; one L2-normalised row per list."""
+    counts = np.fromiter((len(row) for row in features), dtype=np.int64, count=len(features))
+    packed = np.fromiter((_token_hash(feature) for row in features for feature in row),
+                         dtype=np.int64, count=int(counts.sum()))
+    buckets = np.repeat(np.arange(len(features), dtype=np.int64) * dim, counts) + (packed >> 1) % dim
+    signs = np.where(packed & 1, 1.0, -1.0)
+    matrix = np.bincount(buckets, weights=signs, minlength=len(features) * dim)
+    matrix = matrix.astype(np.float32).reshape(len(features), dim)
+    for row in range(len(features)):
+        # A fresh array, normalised exactly as project_bow always has.
+        matrix[row] = _l2_normalise(matrix[row].copy())
+    return matrix
+
+
+def _char_ngrams(tokens: list[str], n_min: int, n_max: int) -> list[str]:
+    # Each token is padded with spaces so word-boundary n-grams are captured.
+    return [padded[i:i + n]
+            for padded in (f" {token} " for token in tokens)
+            for n in range(n_min, n_max + 1)
+            for i in range(len(padded) - n + 1)]
+
+
+def project_bow_batch(texts: list[str], dim: int, *, remove_stop_words: bool = True) -> np.ndarray:
+    """``project_bow`` of each text, as the rows of an ``(len(texts), dim)`` float32 matrix."""
+    return _project_features([_content_tokens(text, remove_stop_words) for text in texts], dim)
+
+
+def project_char_ngrams_batch(
+    texts: list[str], dim: int, *, n_min: int = 3, n_max: int = 5, remove_stop_words: bool = True
+) -> np.ndarray:
+    """``project_char_ngrams`` of each text, as the rows of an ``(len(texts), dim)`` float32 matrix."""
+    return _project_features(
+        [_char_ngrams(_content_tokens(text, remove_stop_words), n_min, n_max) for text in texts], dim)
+
+
 def project_bow(text: str, dim: int, *, remove_stop_words: bool = True) -> np.ndarray:
     """Project a bag-of-words of ``text`` into ``dim`` dimensions, L2-normalised."""
-    vec = np.zeros(dim, dtype=np.float32)
-    for token in _content_tokens(text, remove_stop_words):
-        index, sign = _hash_token(token, dim)
-        vec[index] += sign
-    return _l2_normalise(vec)
+    return project_bow_batch([text], dim, remove_stop_words=remove_stop_words)[0]
 
 
 def project_char_ngrams(
@@ -84,14 +142,8 @@ def project_char_ngrams(
     (mirrors scikit-learn's ``char_wb`` analyzer). Robust to morphology, code
     identifiers and non-English text where whole-word BoW is brittle.
     """
-    vec = np.zeros(dim, dtype=np.float32)
-    for token in _content_tokens(text, remove_stop_words):
-        padded = f" {token} "
-        for n in range(n_min, n_max + 1):
-            for i in range(len(padded) - n + 1):
-                index, sign = _hash_token(padded[i:i + n], dim)
-                vec[index] += sign
-    return _l2_normalise(vec)
+    return project_char_ngrams_batch(
+        [text], dim, n_min=n_min, n_max=n_max, remove_stop_words=remove_stop_words)[0]
 
 
 def cosine(a: np.ndarray | None, b: np.ndarray | None) -> float:
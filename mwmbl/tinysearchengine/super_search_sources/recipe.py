@@ -13,21 +13,44 @@ orchestrator.
 
 See ``recipes/*.yaml`` for examples covering JSON APIs (Wiktionary,
 archive.org) and HTML scraping (Project Gutenberg).
+
+A recipe's ``response`` section is compiled once, when the recipe is loaded, into
+a parser holding its selectors and field extractors, rather than reinterpreted on
+every call. HTML and XML are parsed with lxml, the engine ``mwmbl/justext``
+already uses, instead of BeautifulSoup's pure-Python ``html.parser`` and the
+stdlib ElementTree:
+
+- CSS selectors are compiled to XPath. Only the subset recipes use is supported -
+  type, ``#id``, ``.class`` and ``[attr]`` / ``[attr=value]`` (also ``~= |= ^=
+  $= *=``) compounds, joined by descendant and ``>`` combinators, in ``,``
+  lists. Anything else (pseudo-classes, sibling combinators) makes the recipe
+  malformed, so it is skipped at load like any other.
+- Text is every text node under the element, stripped and joined by spaces,
+  leaving out comments and ``<script>``, ``<style>`` and ``<template>`` - what
+  BeautifulSoup's ``get_text(" ", strip=True)`` gives.
+- XML keeps defusedxml's guarantees: entities are never resolved, nothing is
+  fetched, and a document that declares an entity is rejected with defusedxml's
+  ``EntitiesForbidden``.
+
+libxml2 repairs broken HTML differently from ``html.parser`` (it closes an open
+``<p>`` at a block element, for one), so on a malformed page a selector can match
+a little differently than it used to; on well-formed markup the two agree.
 """
 from __future__ import annotations
 
 import logging
+import re
 from dataclasses import dataclass
+from functools import cached_property
 from pathlib import Path
 from typing import Any, Callable, Coroutine
 from urllib.parse import quote, urljoin
-from xml.etree.ElementTree import Element, ParseError
 
 import httpx
 import yaml
 from bs4 import BeautifulSoup
-from defusedxml.common import DefusedXmlException
-from defusedxml.ElementTree import fromstring
+from defusedxml.common import DefusedXmlException, EntitiesForbidden
+from lxml import etree
 
 from mwmbl.tinysearchengine.indexer import Document
 
@@ -50,10 +73,16 @@ class Recipe:
     def response_format(self) -> str:
         return self.response.get("format", "json")
 
+    @cached_property
+    def parser(self) -> ResponseParser | None:
+        """The compiled ``response`` section; None for an unknown format. Raises
+        ValueError or KeyError if it is malformed."""
+        return compile_response(self.response)
+
 
 def load_recipe(path: Path | str) -> Recipe:
     data = yaml.safe_load(Path(path).read_text())
-    return Recipe(
+    recipe = Recipe(
         name=data["name"],
         domain=data["domain"],
         field=data["field"],
@@ -61,6 +90,8 @@ def load_recipe(path: Path | str) -> Recipe:
         response=data["response"],
         smoke=data["smoke"],
     )
+    recipe.parser  # compile now, so a malformed response section fails the load
+    return recipe
 
 
 def load_recipes(directory: Path | str = RECIPES_DIR) -> dict[str, Recipe]:
@@ -79,7 +110,7 @@ def load_recipes(directory: Path | str = RECIPES_DIR) -> dict[str, Recipe]:
     for path in sorted(directory.glob("*.yaml")):
         try:
             recipe = load_recipe(path)
-        except (KeyError, yaml.YAMLError, OSError) as e:
+        except (KeyError, ValueError, yaml.YAMLError, OSError) as e:
             logger.warning("Skipping malformed recipe %s: %s", path.name, e)
             continue
         recipes[recipe.name] = recipe
@@ -106,16 +137,12 @@ async def search_with_recipe(
             method, req["url"], params=params, headers=headers, json=json_body
         )
         response.raise_for_status()
-        fmt = recipe.response_format
-        if fmt == "json":
-            return _parse_json(response.json(), recipe.response)
-        if fmt == "html":
-            return _parse_html(response.text, recipe.response)
-        if fmt == "xml":
-            return _parse_xml(response.text, recipe.response)
-        logger.warning("Recipe %s: unknown response format %r", recipe.name, fmt)
-        return []
-    except (httpx.HTTPError, ValueError, ParseError, DefusedXmlException) as e:
+        parser = recipe.parser
+        if parser is None:
+            logger.warning("Recipe %s: unknown response format %r", recipe.name, recipe.response_format)
+            return []
+        return parser.parse(response)
+    except (httpx.HTTPError, KeyError, ValueError, etree.LxmlError, DefusedXmlException) as e:
         logger.info("Recipe source %s failed: %s", recipe.name, e)
         return []
 
@@ -142,12 +169,19 @@ def _build_params(params: dict | None, query: str, limit: int) -> dict:
 # Shared helpers
 # ---------------------------------------------------------------------------
 
+def _strip_html(text: str) -> str:
+    if "<" not in text and "&" not in text:
+        # Nothing to strip or unescape: BeautifulSoup would hand the string back.
+        return text.strip()
+    return BeautifulSoup(text, "html.parser").get_text(" ", strip=True)
+
+
 def _coerce_str(value, strip_html: bool = False) -> str:
     if value is None:
         return ""
     text = str(value)
     if strip_html:
-        text = BeautifulSoup(text, "html.parser").get_text(" ", strip=True)
+        text = _strip_html(text)
     return text.strip()
 
 
@@ -166,157 +200,378 @@ def _make_doc(values: dict, url: str) -> Document | None:
     return Document(title=values.get("title", ""), url=url, extract=values.get("extract", ""))
 
 
+class ResponseParser:
+    """A recipe's compiled ``response`` section."""
+
+    def __init__(self, spec: dict):
+        self.fields = spec["fields"]
+        self.strip = set(spec.get("strip_html", []))
+        self.base_url = spec.get("base_url", "")
+
+    def parse(self, response: httpx.Response) -> list[Document]:
+        raise NotImplementedError
+
+
+def compile_response(spec: dict) -> ResponseParser | None:
+    """Compile a recipe's ``response`` section; None for an unknown format."""
+    parsers = {"json": JsonParser, "html": HtmlParser, "xml": XmlParser}
+    parser = parsers.get(spec.get("format", "json"))
+    return parser(spec) if parser is not None else None
+
+
 # ---------------------------------------------------------------------------
 # JSON
 # ---------------------------------------------------------------------------
 
-def _walk(data, path: str):
-    """Walk a dotted path through nested dicts/lists; None if absent.
+class JsonPath:
+    """A dotted path through nested dicts/lists, split once.
 
     A path segment that is an integer (e.g. ``data.0.items``) indexes a list,
     so APIs that wrap results in a single-element list or a fixed slot can be
     expressed without Python.
     """
-    if not path:
-        return data
-    current = data
-    for part in path.split("."):
-        if isinstance(current, dict) and part in current:
-            current = current[part]
-        elif isinstance(current, list) and part.lstrip("-").isdigit():
-            try:
-                current = current[int(part)]
-            except IndexError:
+
+    def __init__(self, path: str):
+        self.parts = tuple(path.split(".")) if path else ()
+
+    def get(self, data):
+        """The value at the path; None if absent."""
+        current = data
+        for part in self.parts:
+            if isinstance(current, dict) and part in current:
+                current = current[part]
+            elif isinstance(current, list) and part.lstrip("-").isdigit():
+                try:
+                    current = current[int(part)]
+                except IndexError:
+                    return None
+            else:
                 return None
-        else:
-            return None
-    return current
-
-
-def _parse_json(payload, spec: dict) -> list[Document]:
-    items = _walk(payload, spec.get("results", "")) or []
-    fields = spec["fields"]
-    strip = set(spec.get("strip_html", []))
-    base_url = spec.get("base_url", "")
-    docs: list[Document] = []
-    for item in items:
-        if not isinstance(item, dict):
-            continue
-        values = {
-            name: _coerce_str(_walk(item, field_spec), name in strip)
-            for name, field_spec in fields.items()
-            if name != "url" and isinstance(field_spec, str)
-        }
-        doc = _make_doc(values, _resolve_url_json(fields.get("url"), item, values, base_url))
-        if doc is not None:
-            docs.append(doc)
-    return docs
+        return current
 
 
-def _resolve_url_json(url_spec, item: dict, values: dict, base_url: str = "") -> str:
-    # A JSON API often returns a relative path (e.g. gov.uk's "/contact-hmrc"); join
-    # it onto ``base_url`` to produce the canonical absolute URL, mirroring HTML.
-    if url_spec is None:
-        return ""
-    if isinstance(url_spec, str):
-        url = _coerce_str(_walk(item, url_spec))
-    elif isinstance(url_spec, dict) and "template" in url_spec:
-        url = _fill_template(url_spec["template"], {**item, **values})
-    else:
-        return ""
-    return urljoin(base_url, url) if (url and base_url) else url
+class JsonParser(ResponseParser):
+    def __init__(self, spec: dict):
+        super().__init__(spec)
+        self.results = JsonPath(spec.get("results", ""))
+        self.values = [
+            (name, JsonPath(field_spec), name in self.strip)
+            for name, field_spec in self.fields.items()
+            if name != "url" and isinstance(field_spec, str)
+        ]
+        url_spec = self.fields.get("url")
+        self.url_path = JsonPath(url_spec) if isinstance(url_spec, str) else None
+        self.url_template = (
+            url_spec["template"] if isinstance(url_spec, dict) and "template" in url_spec else None
+        )
+
+    def parse(self, response: httpx.Response) -> list[Document]:
+        return self.parse_payload(response.json())
+
+    def parse_payload(self, payload) -> list[Document]:
+        docs: list[Document] = []
+        for item in self.results.get(payload) or []:
+            if not isinstance(item, dict):
+                continue
+            values = {name: _coerce_str(path.get(item), strip) for name, path, strip in self.values}
+            doc = _make_doc(values, self._url(item, values))
+            if doc is not None:
+                docs.append(doc)
+        return docs
+
+    def _url(self, item: dict, values: dict) -> str:
+        # A JSON API often returns a relative path (e.g. gov.uk's "/contact-hmrc"); join
+        # it onto ``base_url`` to produce the canonical absolute URL, mirroring HTML.
+        if self.url_path is not None:
+            url = _coerce_str(self.url_path.get(item))
+        elif self.url_template is not None:
+            url = _fill_template(self.url_template, {**item, **values})
+        else:
+            return ""
+        return urljoin(self.base_url, url) if (url and self.base_url) else url
 
 
 # ---------------------------------------------------------------------------
 # HTML
 # ---------------------------------------------------------------------------
 
-def _parse_html(html_text: str, spec: dict) -> list[Document]:
-    soup = BeautifulSoup(html_text, "html.parser")
-    fields = spec["fields"]
-    strip = set(spec.get("strip_html", []))
-    base_url = spec.get("base_url", "")
-    docs: list[Document] = []
-    for el in soup.select(spec["results"]):
-        values = {
-            name: _select_html(el, field_spec, name in strip)
-            for name, field_spec in fields.items()
-            if name != "url"
-        }
-        doc = _make_doc(values, _resolve_url_html(fields.get("url"), el, base_url))
-        if doc is not None:
-            docs.append(doc)
-    return docs
-
-
-def _select_html(el, spec, strip_html: bool = False) -> str:
-    if spec is None:
-        return ""
-    if isinstance(spec, str):
-        spec = {"selector": spec}
-    target = el.select_one(spec["selector"]) if spec.get("selector") else el
-    if target is None:
-        return ""
-    attr = spec.get("attr")
-    value = target.get(attr, "") if attr else target.get_text(" ", strip=True)
-    if not isinstance(value, str):
-        return ""
-    if strip_html and value:
-        value = BeautifulSoup(value, "html.parser").get_text(" ", strip=True)
-    return value.strip()
-
-
-def _resolve_url_html(url_spec, el, base_url: str) -> str:
-    if url_spec is None:
-        return ""
-    href = _select_html(el, url_spec)
-    return urljoin(base_url, href) if (href and base_url) else href
+_SELECTOR_TOKEN_RE = re.compile(r"""
+    \s*(?P<combinator>[>,])\s*
+  | (?P<space>\s+)
+  | (?P<tag>[a-zA-Z][\w-]*|\*)
+  | \#(?P<id>[\w-]+)
+  | \.(?P<cls>[\w-]+)
+  | \[\s*(?P<attr>[\w-]+)\s*(?:(?P<op>[~|^$*]?=)\s*(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<bare>[\w-]+))\s*)?\]
+""", re.VERBOSE)
+
+
+def _xpath_literal(value: str) -> str:
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    return "concat(" + ", \"'\", ".join(f"'{part}'" for part in value.split("'")) + ")"
+
+
+def _attr_predicate(name: str, op: str | None, value: str) -> str:
+    attr, literal = f"@{name.lower()}", _xpath_literal(value)
+    if op is None:
+        return attr
+    if op == "=":
+        return f"{attr} = {literal}"
+    if op == "~=":
+        return f"contains(concat(' ', normalize-space({attr}), ' '), concat(' ', {literal}, ' '))"
+    if op == "|=":
+        return f"({attr} = {literal} or starts-with({attr}, concat({literal}, '-')))"
+    # Like CSS, an empty value never matches these three.
+    if op == "^=":
+        return f"({literal} != '' and starts-with({attr}, {literal}))"
+    if op == "$=":
+        return (f"({literal} != '' and substring({attr}, string-length({attr}) - "
+                f"string-length({literal}) + 1) = {literal})")
+    return f"({literal} != '' and contains({attr}, {literal}))"
+
+
+def _css_to_xpath(css: str, axis: str) -> str:
+    """Translate a CSS selector to XPath, matching along ``axis`` from the context node.
+
+    A compound ``A B > C`` becomes ``axis::C[parent::B[ancestor::A]]``: the
+    ancestors a selector names may lie above the context node, as in CSS.
+    Raises ValueError for a selector outside the supported subset.
+    """
+    groups: list[list[tuple[str | None, str, list[str]]]] = [[]]
+    combinator: str | None = None
+    compound: tuple[str, list[str]] | None = None
+    position = 0
+
+    def end_compound():
+        nonlocal compound, combinator
+        if compound is not None:
+            groups[-1].append((combinator, *compound))
+            compound, combinator = None, " "
+
+    css = css.strip()
+    while position < len(css):
+        match = _SELECTOR_TOKEN_RE.match(css, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"unsupported CSS selector {css!r} at {css[position:]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        if kind in ("combinator", "space"):
+            if compound is None:
+                raise ValueError(f"unsupported CSS selector {css!r}")
+            token = match.group("combinator") or " "
+            end_compound()
+            if token == ",":
+                groups.append([])
+                combinator = None
+            else:
+                combinator = token
+            continue
+        if compound is None:
+            compound = ("*", [])
+        if kind == "tag":
+            if compound[1] or compound[0] != "*":
+                raise ValueError(f"unsupported CSS selector {css!r}")
+            compound = (match.group("tag").lower(), compound[1])
+        elif kind == "id":
+            compound[1].append(f"@id = {_xpath_literal(match.group('id'))}")
+        elif kind == "cls":
+            compound[1].append(
+                f"contains(concat(' ', normalize-space(@class), ' '), ' {match.group('cls')} ')")
+        else:
+            value = next((v for v in match.group("dq", "sq", "bare") if v is not None), "")
+            compound[1].append(_attr_predicate(match.group("attr"), match.group("op"), value))
+    if compound is None:
+        raise ValueError(f"unsupported CSS selector {css!r}")
+    end_compound()
+
+    def step(chain: list, index: int) -> str:
+        _, tag, predicates = chain[index]
+        expression = tag + "".join(f"[{predicate}]" for predicate in predicates)
+        if index > 0:
+            relation = "parent" if chain[index][0] == ">" else "ancestor"
+            expression += f"[{relation}::{step(chain, index - 1)}]"
+        return expression
+
+    return " | ".join(f"{axis}::{step(chain, len(chain) - 1)}" for chain in groups)
+
+
+class Selector:
+    """A CSS selector, compiled to XPath for lxml."""
+
+    def __init__(self, css: str):
+        self.css = css
+        self._descendants = etree.XPath(_css_to_xpath(css, "descendant"))
+        self._first = etree.XPath(f"({_css_to_xpath(css, 'descendant')})[1]")
+
+    def select(self, element) -> list:
+        """Every matching descendant of ``element``, in document order."""
+        return self._descendants(element)
+
+    def select_one(self, element):
+        """The first matching descendant of ``element``, or None."""
+        found = self._first(element)
+        return found[0] if found else None
+
+
+# The text BeautifulSoup's get_text() reads: text nodes - not comments, which are kept
+# in the tree so the text either side of one stays two strings - and not what is inside
+# <script>, <style> or <template>.
+_TEXT = etree.XPath(
+    "descendant-or-self::text()[not(ancestor::script or ancestor::style or ancestor::template)]",
+    smart_strings=False,
+)
+
+
+def _html_text(element) -> str:
+    return " ".join(text for text in (node.strip() for node in _TEXT(element)) if text)
+
+
+class HtmlField:
+    """Extracts one field from a result element: a sub-selector, then an attribute or text."""
+
+    def __init__(self, spec, strip_html: bool = False):
+        if isinstance(spec, str):
+            spec = {"selector": spec}
+        self.selector = Selector(spec["selector"]) if spec.get("selector") else None
+        self.attr = spec.get("attr")
+        self.strip_html = strip_html
+
+    def extract(self, element) -> str:
+        target = self.selector.select_one(element) if self.selector is not None else element
+        if target is None:
+            return ""
+        value = target.get(self.attr, "") if self.attr else _html_text(target)
+        if self.strip_html and value:
+            value = _strip_html(value)
+        return value.strip()
+
+
+_HTML_PARSER = etree.HTMLParser(encoding="utf-8", no_network=True)
+
+
+def _parse_html_document(html_text: str):
+    # Encoded, so a page that declares another encoding is still read as the text it is.
+    return etree.fromstring(html_text.encode("utf-8", "surrogatepass"), _HTML_PARSER)
+
+
+class HtmlParser(ResponseParser):
+    def __init__(self, spec: dict):
+        super().__init__(spec)
+        # The results may be the root element itself, as with soup.select().
+        self.results = etree.XPath(_css_to_xpath(spec["results"], "descendant-or-self"))
+        self.values = [
+            (name, HtmlField(field_spec, name in self.strip))
+            for name, field_spec in self.fields.items()
+            if name != "url" and field_spec is not None
+        ]
+        self.empty = [name for name, field_spec in self.fields.items() if name != "url" and field_spec is None]
+        url_spec = self.fields.get("url")
+        self.url = HtmlField(url_spec) if url_spec is not None else None
+
+    def parse(self, response: httpx.Response) -> list[Document]:
+        return self.parse_text(response.text)
+
+    def parse_text(self, html_text: str) -> list[Document]:
+        root = _parse_html_document(html_text)
+        if root is None:
+            return []
+        docs: list[Document] = []
+        for element in self.results(root):
+            values = {name: field.extract(element) for name, field in self.values}
+            values.update((name, "") for name in self.empty)
+            doc = _make_doc(values, self._url(element))
+            if doc is not None:
+                docs.append(doc)
+        return docs
+
+    def _url(self, element) -> str:
+        if self.url is None:
+            return ""
+        href = self.url.extract(element)
+        return urljoin(self.base_url, href) if (href and self.base_url) else href
 
 
 # ---------------------------------------------------------------------------
 # XML
 # ---------------------------------------------------------------------------
 
-def _parse_xml(xml_text: str, spec: dict) -> list[Document]:
-    root = fromstring(xml_text)
-    results_path = spec.get("results", "")
-    # Optional XML namespace prefix map, e.g. {atom: "http://www.w3.org/2005/Atom"},
-    # so namespaced feeds (Atom/arXiv-style) can be expressed as pure recipes.
-    namespaces = spec.get("namespaces") or None
-    items = root.findall(results_path, namespaces) if results_path else [root]
-    fields = spec["fields"]
-    strip = set(spec.get("strip_html", []))
-    docs: list[Document] = []
-    for item in items:
-        values = {
-            name: _select_xml(item, field_spec, name in strip, namespaces)
-            for name, field_spec in fields.items()
+# What defusedxml guarantees, on lxml: no entity is ever expanded, no DTD or
+# external entity is fetched, and (below) a document declaring entities is refused.
+_XML_PARSER = etree.XMLParser(
+    encoding="utf-8", resolve_entities=False, load_dtd=False, no_network=True,
+    remove_comments=True, remove_pis=True, huge_tree=False,
+)
+
+
+def _parse_xml_document(xml_text: str):
+    root = etree.fromstring(xml_text.encode("utf-8", "surrogatepass"), _XML_PARSER)
+    dtd = root.getroottree().docinfo.internalDTD
+    if dtd is not None:
+        for entity in dtd.iterentities():
+            raise EntitiesForbidden(entity.name, entity.content, None, entity.system_url, None, None)
+    return root
+
+
+class XmlField:
+    def __init__(self, spec, strip_html: bool = False, namespaces: dict | None = None):
+        self.path = self.attr = self.selector = None
+        if isinstance(spec, str):
+            self.path = spec
+        elif isinstance(spec, dict):
+            self.attr, self.selector = spec.get("attr"), spec.get("selector")
+        self.is_set = isinstance(spec, (str, dict))
+        self.strip_html = strip_html
+        self.namespaces = namespaces
+
+    def extract(self, item) -> str:
+        value = ""
+        if self.path is not None:
+            child = item.find(self.path, self.namespaces)
+            value = (child.text or "") if child is not None else ""
+        elif self.is_set:
+            target = item.find(self.selector, self.namespaces) if self.selector else item
+            if target is not None:
+                value = target.get(self.attr, "") if self.attr else (target.text or "")
+        if self.strip_html and value:
+            value = _strip_html(value)
+        return value.strip()
+
+
+class XmlParser(ResponseParser):
+    def __init__(self, spec: dict):
+        super().__init__(spec)
+        self.results = spec.get("results", "")
+        # Optional XML namespace prefix map, e.g. {atom: "http://www.w3.org/2005/Atom"},
+        # so namespaced feeds (Atom/arXiv-style) can be expressed as pure recipes.
+        self.namespaces = spec.get("namespaces") or None
+        self.values = [
+            (name, XmlField(field_spec, name in self.strip, self.namespaces))
+            for name, field_spec in self.fields.items()
             if name != "url"
-        }
-        doc = _make_doc(values, _resolve_url_xml(fields.get("url"), item, values, namespaces))
-        if doc is not None:
-            docs.append(doc)
-    return docs
-
-
-def _select_xml(item: Element, spec, strip_html: bool = False, namespaces: dict | None = None) -> str:
-    value = ""
-    if isinstance(spec, str):
-        child = item.find(spec, namespaces)
-        value = (child.text or "") if child is not None else ""
-    elif isinstance(spec, dict):
-        attr, selector = spec.get("attr"), spec.get("selector")
-        target = item.find(selector, namespaces) if selector else item
-        if target is not None:
-            value = target.get(attr, "") if attr else (target.text or "")
-    if strip_html and value:
-        value = BeautifulSoup(value, "html.parser").get_text(" ", strip=True)
-    return value.strip()
-
-
-def _resolve_url_xml(url_spec, item: Element, values: dict, namespaces: dict | None = None) -> str:
-    if url_spec is None:
-        return ""
-    if isinstance(url_spec, dict) and "template" in url_spec:
-        return _fill_template(url_spec["template"], {**item.attrib, **values})
-    return _select_xml(item, url_spec, namespaces=namespaces)
+        ]
+        url_spec = self.fields.get("url")
+        self.url_template = (
+            url_spec["template"] if isinstance(url_spec, dict) and "template" in url_spec else None
+        )
+        self.url = XmlField(url_spec, namespaces=self.namespaces) if url_spec is not None else None
+
+    def parse(self, response: httpx.Response) -> list[Document]:
+        return self.parse_text(response.text)
+
+    def parse_text(self, xml_text: str) -> list[Document]:
+        root = _parse_xml_document(xml_text)
+        items = root.findall(self.results, self.namespaces) if self.results else [root]
+        docs: list[Document] = []
+        for item in items:
+            values = {name: field.extract(item) for name, field in self.values}
+            doc = _make_doc(values, self._url(item, values))
+            if doc is not None:
+                docs.append(doc)
+        return docs
+
+    def _url(self, item, values: dict) -> str:
+        if self.url_template is not None:
+            return _fill_template(self.url_template, {**item.attrib, **values})
+        return self.url.extract(item) if self.url is not None else ""
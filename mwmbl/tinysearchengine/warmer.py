@@ -0,0 +1,359 @@
+"""Warming the index pages of the most searched queries after a deploy.
+
+A deploy starts new containers with nothing in memory: the index is mmapped, so the
+first search for each term waits on the disk for its page, and the blacklist snapshot
+and the ranking models are loaded by whichever request needs them first. For the few
+minutes after each deploy the head of the query distribution - the queries people send
+over and over - pays for that, one cold page at a time.
+
+So the searches are counted, and after a deploy the most frequent ones are run again
+before (or while) the users arrive:
+
+    the query log   Each v1 and v2 search adds its normalised query (see
+                    result_cache.normalize_query) to a count in this process, and a daemon
+                    thread flushes the counts every SEARCH_QUERY_LOG_FLUSH_SECONDS into a
+                    sorted set per hour in Redis, kept for SEARCH_QUERY_LOG_HOURS. A query's
+                    text is only written there once SEARCH_QUERY_LOG_MIN_CLIENTS distinct
+                    clients have sent it in the hour; until then Redis holds a HyperLogLog
+                    of its clients under a keyed digest of the query, which gives back
+                    neither the query nor the clients, and the searches counted before
+                    the query was admitted are not carried over. So a query one person
+                    types - a name, an address, anything private - is never stored, and
+                    nothing is kept with a query but its count: no user, key, address or
+                    time finer than the hour. A flush that fails is dropped rather than
+                    retried - these are approximate counts, not a ledger.
+
+    the warm set    The SEARCH_WARM_QUERIES most searched queries over those hours, among
+                    those searched at least SEARCH_WARM_MIN_COUNT times, so a query only
+                    one person sends is never replayed.
+
+    the warmer      The first search (or readiness check) in each process starts a thread
+                    that tries to claim the warm for this boot. One process per boot wins
+                    the claim - the others have the same index and the same page cache -
+                    and runs Ranker.get_results for the warm set, without the Wikipedia
+                    lookups, at most SEARCH_WARM_QUERIES_PER_SECOND so the warm never
+                    crowds out the searches it is warming for.
+
+A boot is the deploy revision plus an ID main.run() sets before gunicorn starts, so a
+restart or an index swap - the index is opened once per process, so swapping it means a
+restart - warms again, and the workers of one server share a warm. Progress is kept in
+a Redis hash for the boot and in the mwmbl_search_warm_queries gauge, and /ready reports
+it. With SEARCH_WARM_READY_PERCENT set, /ready answers 503 until that much of the warm
+set has run, so a health check pointed at it holds traffic back from a cold container;
+it gives up waiting after SEARCH_WARM_READY_TIMEOUT_SECONDS, and if Redis cannot be read
+it does not wait at all - a warm is an optimisation, never a reason to stay out of
+service.
+"""
+import atexit
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import Optional
+
+import redis
+from django.conf import settings
+from django.http import JsonResponse
+
+from mwmbl.metrics import SEARCH_WARM_QUERIES
+from mwmbl.tinysearchengine.result_cache import normalize_query
+
+logger = getLogger(__name__)
+
+
+QUERY_LOG_KEY_PREFIX = "search:queries"
+WARM_KEY_PREFIX = "search:warm"
+BOOT_ID_VARIABLE = "MWMBL_BOOT_ID"
+
+MAX_QUERY_CHARS = 100          # longer queries are not logged: they are never the head
+MAX_PENDING_QUERIES = 10_000   # distinct queries a process holds between flushes
+WARM_PROGRESS_TTL = 86_400
+
+_redis: Optional[redis.Redis] = None
+
+# How long readiness waits for the warm is counted from here, when the search code is
+# first imported - before gunicorn forks the workers if the app is preloaded.
+_started = time.monotonic()
+
+
+def get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+def _hour_key(when: datetime) -> str:
+    return f"{QUERY_LOG_KEY_PREFIX}:{when:%Y%m%d%H}"
+
+
+def _digest(value: str) -> str:
+    """A digest of a query or a client that cannot be reversed without SECRET_KEY, even
+    for the few likely values a short query has."""
+    return hmac.new(settings.SECRET_KEY.encode(), value.encode("utf-8", "surrogatepass"),
+                    hashlib.sha256).hexdigest()[:16]
+
+
+def _clients_key(hour_key: str, query: str) -> str:
+    return f"{hour_key}:clients:{_digest(query)}"
+
+
+def client_of(request) -> str:
+    """Who sent a search, for counting the distinct clients of a query: the API key if
+    there is one, otherwise the address the proxy saw."""
+    api_key = request.headers.get("X-API-Key")
+    if api_key:
+        return f"key:{api_key}"
+    forwarded = request.headers.get("X-Forwarded-For", "").split(",")[0].strip()
+    return f"address:{forwarded or request.META.get('REMOTE_ADDR', '')}"
+
+
+def _logged_hours(now: Optional[datetime] = None) -> list[str]:
+    now = now or datetime.now(timezone.utc)
+    return [_hour_key(now - timedelta(hours=hour)) for hour in range(settings.SEARCH_QUERY_LOG_HOURS)]
+
+
+class QueryLog:
+    """Searches counted in this process and not yet added to the hourly counts in Redis.
+
+    A daemon thread, started by the first search in each process, flushes them every
+    SEARCH_QUERY_LOG_FLUSH_SECONDS, and whatever is left is flushed at exit. Once
+    MAX_PENDING_QUERIES distinct queries are waiting, new ones are not counted until the
+    next flush. Each query also holds the digests of up to SEARCH_QUERY_LOG_MIN_CLIENTS
+    of its clients, which is all the admission check needs.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        self._lock = threading.Lock()
+        self._pending: Counter = Counter()
+        self._clients: dict[str, set[str]] = {}
+        self._pid: Optional[int] = None
+        self._redis_client = redis_client
+
+    def add(self, query: str, client: str) -> None:
+        if len(query) > MAX_QUERY_CHARS:
+            return
+        normalized = normalize_query(query)
+        if not normalized.strip():
+            return
+        client_digest = _digest(client)
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child must not flush its parent's counts a second time.
+                self._pending.clear()
+                self._clients.clear()
+                self._pid = os.getpid()
+                self._start_flushing()
+            if normalized in self._pending or len(self._pending) < MAX_PENDING_QUERIES:
+                self._pending[normalized] += 1
+                clients = self._clients.setdefault(normalized, set())
+                if len(clients) < settings.SEARCH_QUERY_LOG_MIN_CLIENTS:
+                    clients.add(client_digest)
+
+    def flush(self) -> int:
+        """Add the pending counts to this hour's, for the queries enough clients have
+        sent. Returns how many queries were written."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            clients, self._clients = self._clients, {}
+        if not pending:
+            return 0
+
+        key = _hour_key(datetime.now(timezone.utc))
+        ttl = (settings.SEARCH_QUERY_LOG_HOURS + 1) * 3600
+        queries = list(pending)
+        try:
+            client = self._redis_client or get_redis()
+            pipeline = client.pipeline(transaction=False)
+            for query in queries:
+                clients_key = _clients_key(key, query)
+                pipeline.pfadd(clients_key, *clients[query])
+                # Only the hour is needed to admit; the hour after is margin for the flush.
+                pipeline.expire(clients_key, 7200)
+                pipeline.pfcount(clients_key)
+            seen_by = pipeline.execute()[2::3]
+
+            admitted = [query for query, count in zip(queries, seen_by)
+                        if count >= settings.SEARCH_QUERY_LOG_MIN_CLIENTS]
+            if admitted:
+                pipeline = client.pipeline(transaction=False)
+                for query in admitted:
+                    pipeline.zincrby(key, pending[query], query)
+                pipeline.expire(key, ttl)
+                pipeline.execute()
+        except Exception:
+            logger.warning("Could not flush %d query counts; dropping them", len(pending), exc_info=True)
+            return 0
+        return len(admitted)
+
+    def _start_flushing(self) -> None:
+        def flush_periodically():
+            while True:
+                time.sleep(settings.SEARCH_QUERY_LOG_FLUSH_SECONDS)
+                self.flush()
+
+        try:
+            threading.Thread(target=flush_periodically, name="query-log-flush", daemon=True).start()
+        except RuntimeError:
+            logger.exception("Could not start the query log flush thread; counts will be flushed at exit")
+        atexit.register(self.flush)
+
+
+def top_queries(limit: int, redis_client: Optional[redis.Redis] = None) -> list[str]:
+    """The most searched queries over the logged hours, most searched first.
+
+    Each hour contributes only its own top `limit`, so the counts of queries near the
+    cut-off are underestimates; the head, which is what is warmed, is barely affected.
+    """
+    client = redis_client or get_redis()
+    pipeline = client.pipeline(transaction=False)
+    for key in _logged_hours():
+        pipeline.zrevrange(key, 0, limit - 1, withscores=True)
+    counts = Counter()
+    for hour in pipeline.execute():
+        for query, count in hour:
+            counts[query] += count
+    return [query for query, count in counts.most_common(limit) if count >= settings.SEARCH_WARM_MIN_COUNT]
+
+
+def boot_id() -> str:
+    """This boot: the deploy, and the server start main.run() recorded for its processes."""
+    return f"{settings.DEPLOY_REVISION}:{os.environ.get(BOOT_ID_VARIABLE) or f'pid{os.getpid()}'}"
+
+
+def _progress_key() -> str:
+    return f"{WARM_KEY_PREFIX}:{boot_id()}"
+
+
+class CacheWarmer:
+    """Runs this boot's warm set through the ranker, in whichever process claims it."""
+
+    def __init__(self, ranker, redis_client: Optional[redis.Redis] = None):
+        self.ranker = ranker
+        self._redis_client = redis_client
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def ensure_started(self) -> None:
+        """Start the warm thread, once per process."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            try:
+                threading.Thread(target=self.run, name="cache-warmer", daemon=True).start()
+            except RuntimeError:
+                logger.exception("Could not start the cache warmer")
+
+    def run(self) -> bool:
+        """Warm, unless another process has claimed this boot's warm. Returns whether this
+        process warmed."""
+        key = _progress_key()
+        try:
+            client = self._redis_client or get_redis()
+            if not client.hsetnx(key, "state", "warming"):
+                return False
+            queries = top_queries(settings.SEARCH_WARM_QUERIES, client)
+            client.hset(key, mapping={"total": len(queries), "done": 0, "failed": 0})
+            client.expire(key, WARM_PROGRESS_TTL)
+        except Exception:
+            logger.warning("Could not start the cache warm", exc_info=True)
+            return False
+
+        logger.info("Warming %d queries for boot %s", len(queries), boot_id())
+        SEARCH_WARM_QUERIES.labels("total").set(len(queries))
+        interval = 1 / settings.SEARCH_WARM_QUERIES_PER_SECOND
+        next_query_at = time.monotonic()
+        failed = 0
+        for done, query in enumerate(queries, 1):
+            delay = next_query_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_query_at = max(next_query_at, time.monotonic()) + interval
+            try:
+                self.ranker.get_results(query, [], use_external_search=False)
+            except Exception:
+                failed += 1
+                logger.warning("Could not warm %r", query, exc_info=True)
+            SEARCH_WARM_QUERIES.labels("done").set(done)
+            try:
+                client.hset(key, mapping={"done": done, "failed": failed})
+            except Exception:
+                logger.warning("Could not record the warm's progress", exc_info=True)
+
+        try:
+            client.hset(key, "state", "warm")
+        except Exception:
+            logger.warning("Could not record the end of the warm", exc_info=True)
+        logger.info("Warmed %d queries (%d failed) for boot %s", len(queries), failed, boot_id())
+        return True
+
+
+def warm_progress(redis_client: Optional[redis.Redis] = None) -> dict:
+    """How far this boot's warm has got. Never raises: the state is "unknown" if Redis
+    cannot be read."""
+    progress = {"boot": boot_id(), "state": "unknown", "total": 0, "done": 0, "failed": 0, "percent": 0.0}
+    try:
+        stored = (redis_client or get_redis()).hgetall(_progress_key())
+    except Exception:
+        logger.warning("Could not read the warm's progress", exc_info=True)
+        return progress
+
+    progress["state"] = stored.get("state", "pending")
+    for field in ("total", "done", "failed"):
+        progress[field] = int(stored.get(field, 0))
+    if progress["total"]:
+        progress["percent"] = round(100 * progress["done"] / progress["total"], 1)
+    elif progress["state"] != "pending" and "total" in stored:
+        # Nothing to warm counts as warm.
+        progress["percent"] = 100.0
+    return progress
+
+
+def is_ready(progress: dict) -> bool:
+    """Whether this process should take traffic, given warm_progress()."""
+    required = settings.SEARCH_WARM_READY_PERCENT
+    if not settings.SEARCH_WARM_ENABLED or required <= 0 or progress["state"] == "unknown":
+        return True
+    if time.monotonic() - _started >= settings.SEARCH_WARM_READY_TIMEOUT_SECONDS:
+        return True
+    return progress["percent"] >= required
+
+
+_query_log = QueryLog()
+_warmer: Optional[CacheWarmer] = None
+
+
+def init_warmer(ranker) -> None:
+    """Set the ranker the warm runs through. The thread itself starts with the first
+    search or readiness check in each process, never in a preloading master."""
+    global _warmer
+    _warmer = CacheWarmer(ranker)
+
+
+def _ensure_warmer_started() -> None:
+    if settings.SEARCH_WARM_ENABLED and _warmer is not None:
+        _warmer.ensure_started()
+
+
+def record_query(query: str, request) -> None:
+    """Count a search towards the warm set, and start this process's warmer."""
+    if not settings.SEARCH_WARM_ENABLED:
+        return
+    _query_log.add(query, client_of(request))
+    _ensure_warmer_started()
+
+
+def ready_view(request):
+    if not settings.SEARCH_WARM_ENABLED:
+        return JsonResponse({"boot": boot_id(), "state": "disabled", "ready": True})
+    _ensure_warmer_started()
+    progress = warm_progress()
+    ready = is_ready(progress)
+    return JsonResponse({**progress, "ready": ready}, status=200 if ready else 503)
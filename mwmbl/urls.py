@@ -22,8 +22,9 @@ from debug_toolbar.toolbar import debug_toolbar_urls
 import mwmbl.crawler.app as crawler
 from mwmbl.admin_views import blacklist_status_view
 from mwmbl.api import api as v1_api, v2_api, register_routers
+from mwmbl.metrics import metrics_view
 from mwmbl.search_setup import queued_batches, ranker, batch_cache
-from mwmbl.tinysearchengine import search
+from mwmbl.tinysearchengine import search, warmer
 from mwmbl.views import home_fragment, add_url, index, approve, revert_current_curation, CurationDetailView, \
     flag_curation, CurationFlagListView, flag_curation_update, domains_view, domain_view, CurationsView, submit_domain, \
     DomainSubmissionListView, memory_view
@@ -31,6 +32,7 @@ from mwmbl.views import home_fragment, add_url, index, approve, revert_current_c
 # Initialise the unified v1 API by registering all sub-routers with their runtime dependencies.
 # This must be called before urlpatterns is evaluated.
 register_routers(ranker=ranker, batch_cache=batch_cache, queued_batches=queued_batches)
+warmer.init_warmer(ranker)
 
 
 def trigger_error(request):
@@ -42,6 +44,8 @@ urlpatterns = [
     # staff_member_required on the view, matching the rest of the admin.
     path('admin/blacklist-status/', blacklist_status_view, name="blacklist_status"),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name="metrics"),
+    path('ready', warmer.ready_view, name="ready"),
     path('accounts/', include('allauth.urls')),
 
     path('', index, name="index"),
@@ -30,6 +30,7 @@ from mwmbl.search_setup import ranker, index_path
 from mwmbl.settings import NUM_EXTRACT_CHARS
 from mwmbl.tinysearchengine.indexer import Document, DocumentState, TinyIndex
 from mwmbl.tinysearchengine.rank import fix_document_state
+from mwmbl.tinysearchengine.result_cache import bump_index_generation
 from mwmbl.tokenizer import tokenize
 from mwmbl.utils import add_term_infos, parse_url, validate_domain, float_or_none
 
@@ -315,6 +316,8 @@ def _revert_curation(curation):
 
         indexer.store_in_page(page_index, all_documents)
 
+    bump_index_generation([page_index])
+
 
 def _get_curation(request, query, documents, reranked_documents):
     curation_id = request.POST.get("curation_id")
@@ -415,6 +418,8 @@ def _save_to_index(query: str, new_results: list[Document]):
         logger.info(f"Storing {len(all_documents)} documents at page {page_index}")
         indexer.store_in_page(page_index, all_documents)
 
+    # Outside the `with`, so the page is written before cached results for it are dropped.
+    bump_index_generation([page_index])
     return {"curation": "ok"}
 
 
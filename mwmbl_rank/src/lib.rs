@@ -1,11 +1,12 @@
 /// mwmbl_rank: Rust extension module for Mwmbl learning-to-rank.
 ///
-/// Exposes RustXGBPipeline to Python via PyO3.
+/// Exposes RustXGBPipeline and MMR reranking (mmr_order) to Python via PyO3.
 /// Build with: maturin develop  (or maturin build --release)
 
 mod domain;
 mod features;
 mod idf;
+mod mmr;
 mod pipeline;
 mod text;
 mod wiki;
@@ -46,8 +47,10 @@ fn py_dict_to_record(obj: &Bound<'_, PyAny>) -> PyResult<DocumentRecord> {
 ///
 /// Each record dict must have keys: query, url, title, extract, score.
 ///
-/// XGBPipeline implements Send (see pipeline.rs), so this class is safe to use
-/// from multiple Python threads (e.g. Django worker threads).
+/// XGBPipeline implements Send and Sync (see pipeline.rs), so this class is safe to use
+/// from multiple Python threads (e.g. Django worker threads). predict() releases the GIL
+/// while it extracts features and evaluates the trees, so those threads - and the event
+/// loop, when it is called through asyncio.to_thread - keep running meanwhile.
 #[pyclass(name = "RustXGBPipeline")]
 pub struct PyXGBPipeline {
     inner: XGBPipeline,
@@ -66,8 +69,10 @@ impl PyXGBPipeline {
     ///     min_child_weight: XGBoost min_child_weight (default None → XGBoost default of 1.0)
     ///     gamma: XGBoost gamma / min_split_loss (default None → XGBoost default of 0.0)
     ///     subsample: XGBoost subsample (default None → XGBoost default of 1.0)
+    ///     predict_threads: threads predict() may split feature extraction of a large
+    ///         batch across (default None → up to 4, fewer on smaller machines)
     #[new]
-    #[pyo3(signature = (threshold=0.0, scale_pos_weight=0.1, reg_lambda=2.0, num_rounds=100, max_depth=None, min_child_weight=None, gamma=None, subsample=None))]
+    #[pyo3(signature = (threshold=0.0, scale_pos_weight=0.1, reg_lambda=2.0, num_rounds=100, max_depth=None, min_child_weight=None, gamma=None, subsample=None, predict_threads=None))]
     fn new(
         threshold: f32,
         scale_pos_weight: f32,
@@ -77,13 +82,16 @@ impl PyXGBPipeline {
         min_child_weight: Option<f32>,
         gamma: Option<f32>,
         subsample: Option<f32>,
+        predict_threads: Option<usize>,
     ) -> Self {
-        PyXGBPipeline {
-            inner: XGBPipeline::with_params(
-                threshold, scale_pos_weight, reg_lambda, num_rounds,
-                max_depth, min_child_weight, gamma, subsample,
-            ),
+        let mut inner = XGBPipeline::with_params(
+            threshold, scale_pos_weight, reg_lambda, num_rounds,
+            max_depth, min_child_weight, gamma, subsample,
+        );
+        if let Some(threads) = predict_threads {
+            inner.predict_threads = threads.max(1);
         }
+        PyXGBPipeline { inner }
     }
 
     /// Train the model.
@@ -115,9 +123,13 @@ impl PyXGBPipeline {
     ///     records: list of dicts with keys query, url, title, extract, score
     ///
     /// Returns list of float probabilities in [0, 1].
-    fn predict(&self, records: &Bound<'_, PyAny>) -> PyResult<Vec<f32>> {
+    ///
+    /// The records are converted while holding the GIL; everything after that runs
+    /// without it.
+    fn predict(&self, py: Python<'_>, records: &Bound<'_, PyAny>) -> PyResult<Vec<f32>> {
         let doc_records = self.extract_records(records)?;
-        self.inner.predict(&doc_records)
+        let inner = &self.inner;
+        py.allow_threads(|| inner.predict(&doc_records))
             .map_err(|e| PyValueError::new_err(e))
     }
 
@@ -147,7 +159,7 @@ impl PyXGBPipeline {
 
     fn __repr__(&self) -> String {
         format!(
-            "RustXGBPipeline(threshold={}, scale_pos_weight={}, reg_lambda={}, num_rounds={}, max_depth={:?}, min_child_weight={:?}, gamma={:?}, subsample={:?})",
+            "RustXGBPipeline(threshold={}, scale_pos_weight={}, reg_lambda={}, num_rounds={}, max_depth={:?}, min_child_weight={:?}, gamma={:?}, subsample={:?}, predict_threads={})",
             self.inner.threshold,
             self.inner.scale_pos_weight,
             self.inner.reg_lambda,
@@ -156,6 +168,7 @@ impl PyXGBPipeline {
             self.inner.min_child_weight,
             self.inner.gamma,
             self.inner.subsample,
+            self.inner.predict_threads,
         )
     }
 }
@@ -194,11 +207,42 @@ fn get_features_py(
     features::get_features(&term_refs, title, url, extract, score, is_complete)
 }
 
+/// Order candidates and diversify them with Maximal Marginal Relevance.
+/// The native implementation of mwmbl/tinysearchengine/mmr_rank.py - see mmr.rs.
+///
+/// Args:
+///     candidates: list of (title, extract, url) tuples
+///     scores: per-candidate scores to sort by (descending), or None if the candidates
+///         are already in relevance order
+///     limit: keep only the first `limit` after sorting, or None to keep them all
+///     mmr_lambda, domain_similarity_weight, window: the MMR tuning constants
+///
+/// Returns the positions in `candidates` of the kept candidates, in their final order.
+#[pyfunction]
+#[pyo3(signature = (candidates, scores, limit, mmr_lambda, domain_similarity_weight, window))]
+fn mmr_order(
+    py: Python<'_>,
+    candidates: Vec<(String, String, String)>,
+    scores: Option<Vec<f64>>,
+    limit: Option<usize>,
+    mmr_lambda: f64,
+    domain_similarity_weight: f64,
+    window: usize,
+) -> PyResult<Vec<usize>> {
+    let candidates: Vec<mmr::Candidate> = candidates.into_iter()
+        .map(|(title, extract, url)| mmr::Candidate { title, extract, url })
+        .collect();
+    let params = mmr::MMRParams { lambda: mmr_lambda, domain_similarity_weight, window };
+    py.allow_threads(|| mmr::order_and_rerank(&candidates, scores.as_deref(), limit, &params))
+        .map_err(|e| PyValueError::new_err(e))
+}
+
 /// The mwmbl_rank Python extension module.
 #[pymodule]
 fn mwmbl_rank(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<PyXGBPipeline>()?;
     m.add_function(wrap_pyfunction!(get_features_py, m)?)?;
+    m.add_function(wrap_pyfunction!(mmr_order, m)?)?;
     m.add("NUM_FEATURES", features::NUM_FEATURES)?;
     m.add("FEATURE_NAMES", features::FEATURE_NAMES.to_vec())?;
     Ok(())
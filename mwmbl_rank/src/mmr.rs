@@ -0,0 +1,284 @@
+/// Maximal Marginal Relevance diversity reranking.
+/// Ports mwmbl/tinysearchengine/mmr_rank.py, and must return exactly the order it does:
+/// test/mmr_golden.json is generated from the Python implementation and both are tested
+/// against it (see the tests below and test/test_mmr_rank.py).
+///
+/// Exact parity rules out reusing two helpers from the rest of the crate:
+/// - text::tokenize splits on char::is_whitespace, but Python's str.split() also splits on
+///   the separators \x1c-\x1f, and when the text ends in '…' Python drops the last two
+///   tokens even if that leaves none.
+/// - domain::get_netloc uses url::Url's host, which is lowercased, IDNA-encoded and
+///   without the port or userinfo. MMR compares urlparse(url).netloc, which is none of
+///   those, so netloc() below follows urlsplit instead.
+///
+/// Floating point is computed in the same order as Python so the scores - and the ties
+/// between them - are bit-identical: sums run left to right over tokens in first-seen
+/// order, and ties between candidates go to the most relevant one, as max() over a set of
+/// small ints does.
+
+use std::cmp::Ordering;
+use std::collections::HashMap;
+
+/// A candidate page: the only fields MMR looks at.
+pub struct Candidate {
+    pub title: String,
+    pub extract: String,
+    pub url: String,
+}
+
+/// The tuning constants, passed in from mmr_rank.py so that it stays the one place they are set.
+pub struct MMRParams {
+    /// Weight on relevance vs. diversity (MMR_LAMBDA).
+    pub lambda: f64,
+    /// Within the kernel, weight on same-domain vs. text overlap (DOMAIN_SIMILARITY_WEIGHT).
+    pub domain_similarity_weight: f64,
+    /// Only the top `window` candidates are diversified (MMR_WINDOW).
+    pub window: usize,
+}
+
+/// str.isspace(): char::is_whitespace plus the information separators \x1c-\x1f.
+fn is_python_whitespace(c: char) -> bool {
+    c.is_whitespace() || ('\u{1c}'..='\u{1f}').contains(&c)
+}
+
+/// mwmbl/tokenizer.py::tokenize, exactly.
+fn tokenize(text: &str) -> Vec<String> {
+    let mut tokens: Vec<String> = text
+        .to_lowercase()
+        .split(is_python_whitespace)
+        .filter(|token| !token.is_empty())
+        .map(|token| token.to_string())
+        .collect();
+    if text.ends_with('…') {
+        tokens.truncate(tokens.len().saturating_sub(2));
+    }
+    tokens
+}
+
+/// urllib.parse.urlsplit(url).netloc.
+///
+/// Errors where urlsplit raises for unbalanced IPv6 brackets. urlsplit also validates the
+/// address inside balanced brackets and rejects some non-ASCII netlocs; those URLs cannot
+/// be crawled or indexed, so they are not replicated here.
+pub fn netloc(url: &str) -> Result<String, String> {
+    let url: String = url
+        .trim_start_matches(|c: char| c <= ' ')
+        .chars()
+        .filter(|c| !matches!(c, '\t' | '\r' | '\n'))
+        .collect();
+
+    let mut rest = url.as_str();
+    if let Some(colon) = rest.find(':') {
+        let scheme = &rest[..colon];
+        let starts_with_letter = scheme.chars().next().map_or(false, |c| c.is_ascii_alphabetic());
+        if starts_with_letter && scheme.chars().all(|c| c.is_ascii_alphanumeric() || matches!(c, '+' | '-' | '.')) {
+            rest = &rest[colon + 1..];
+        }
+    }
+
+    let Some(after_slashes) = rest.strip_prefix("//") else {
+        return Ok(String::new());
+    };
+    let end = after_slashes.find(|c| matches!(c, '/' | '?' | '#')).unwrap_or(after_slashes.len());
+    let netloc = &after_slashes[..end];
+    if netloc.contains('[') != netloc.contains(']') {
+        return Err("Invalid IPv6 URL".to_string());
+    }
+    Ok(netloc.to_string())
+}
+
+/// An L2-normalised bag of words, so cosine is a plain dot product.
+///
+/// Tokens are interned to ids shared by every candidate in the call, and each bag keeps a
+/// dense row of weights by id: the O(window^2) cosines then cost an array index per
+/// token instead of hashing a string.
+struct Bow {
+    /// Token ids in the order they were first seen, which is the order Python sums in.
+    ids: Vec<usize>,
+    /// Weight by token id, 0.0 for tokens not in this bag.
+    weights: Vec<f64>,
+}
+
+impl Bow {
+    fn build_all(candidates: &[&Candidate]) -> Vec<Bow> {
+        let mut vocabulary: HashMap<String, usize> = HashMap::new();
+        // By token id: the last candidate it was seen in, and its position in that bag.
+        let mut last_seen: Vec<(usize, usize)> = Vec::new();
+        let mut bags: Vec<(Vec<usize>, Vec<u64>)> = Vec::with_capacity(candidates.len());
+        for (candidate_index, candidate) in candidates.iter().enumerate() {
+            let mut ids: Vec<usize> = Vec::new();
+            let mut counts: Vec<u64> = Vec::new();
+            for token in tokenize(&format!("{} {}", candidate.title, candidate.extract)) {
+                let next_id = vocabulary.len();
+                let id = *vocabulary.entry(token).or_insert(next_id);
+                if id == last_seen.len() {
+                    last_seen.push((usize::MAX, 0));
+                }
+                let (seen_in, position) = last_seen[id];
+                if seen_in == candidate_index {
+                    counts[position] += 1;
+                } else {
+                    last_seen[id] = (candidate_index, ids.len());
+                    ids.push(id);
+                    counts.push(1);
+                }
+            }
+            bags.push((ids, counts));
+        }
+
+        bags.into_iter().map(|(ids, counts)| {
+            let sum_of_squares: u64 = counts.iter().map(|count| count * count).sum();
+            let norm = (sum_of_squares as f64).sqrt();
+            let mut weights = vec![0.0; vocabulary.len()];
+            for (&id, &count) in ids.iter().zip(&counts) {
+                weights[id] = count as f64 / norm;
+            }
+            Bow { ids, weights }
+        }).collect()
+    }
+
+    fn cosine(&self, other: &Bow) -> f64 {
+        let (a, b) = if self.ids.len() > other.ids.len() { (other, self) } else { (self, other) };
+        // A token missing from b adds a.weight * 0.0 = +0.0 to a non-negative total, which
+        // leaves it unchanged: the same sum as Python's, which skips the token.
+        let mut total = 0.0;
+        for &id in &a.ids {
+            total += a.weights[id] * b.weights[id];
+        }
+        total
+    }
+}
+
+/// mmr_rank.py::_mmr_order: the positions of the relevance-sorted candidates in their
+/// diversified order.
+pub fn rerank(candidates: &[&Candidate], params: &MMRParams) -> Result<Vec<usize>, String> {
+    let n = candidates.len();
+    if n <= 2 {
+        return Ok((0..n).collect());
+    }
+
+    let window = n.min(params.window);
+    let head = &candidates[..window];
+
+    let relevance: Vec<f64> = (0..window).map(|i| (window - i) as f64 / window as f64).collect();
+    let bows = Bow::build_all(head);
+    let netlocs = head.iter().map(|candidate| netloc(&candidate.url)).collect::<Result<Vec<_>, _>>()?;
+
+    let mut remaining = vec![true; window];
+    let mut max_sim = vec![0.0_f64; window];
+    let mut selected: Vec<usize> = Vec::with_capacity(n);
+    for _ in 0..window {
+        let mut best: Option<(usize, f64)> = None;
+        for i in (0..window).filter(|&i| remaining[i]) {
+            let score = params.lambda * relevance[i] - (1.0 - params.lambda) * max_sim[i];
+            if best.map_or(true, |(_, best_score)| score > best_score) {
+                best = Some((i, score));
+            }
+        }
+        let (best, _) = best.expect("a candidate remains on every iteration");
+        selected.push(best);
+        remaining[best] = false;
+
+        let best_netloc = &netlocs[best];
+        for j in (0..window).filter(|&j| remaining[j]) {
+            let domain_sim = if !best_netloc.is_empty() && *best_netloc == netlocs[j] {
+                params.domain_similarity_weight
+            } else {
+                0.0
+            };
+            let sim = domain_sim + (1.0 - params.domain_similarity_weight) * bows[best].cosine(&bows[j]);
+            if sim > max_sim[j] {
+                max_sim[j] = sim;
+            }
+        }
+    }
+    selected.extend(window..n);
+    Ok(selected)
+}
+
+/// Order the candidates and diversify them in one pass: sort by descending score if scores
+/// are given (stably, like Python's sorted), keep the first `limit`, then rerank.
+/// Returns positions in `candidates`.
+pub fn order_and_rerank(
+    candidates: &[Candidate],
+    scores: Option<&[f64]>,
+    limit: Option<usize>,
+    params: &MMRParams,
+) -> Result<Vec<usize>, String> {
+    let mut order: Vec<usize> = (0..candidates.len()).collect();
+    if let Some(scores) = scores {
+        if scores.len() != candidates.len() {
+            return Err(format!("Got {} scores for {} candidates", scores.len(), candidates.len()));
+        }
+        order.sort_by(|&a, &b| scores[b].partial_cmp(&scores[a]).unwrap_or(Ordering::Equal));
+    }
+    if let Some(limit) = limit {
+        order.truncate(limit);
+    }
+
+    let ranked: Vec<&Candidate> = order.iter().map(|&i| &candidates[i]).collect();
+    Ok(rerank(&ranked, params)?.into_iter().map(|i| order[i]).collect())
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    static GOLDEN_JSON: &str = include_str!("../../test/mmr_golden.json");
+
+    fn candidate(title: &str, extract: &str, url: &str) -> Candidate {
+        Candidate { title: title.to_string(), extract: extract.to_string(), url: url.to_string() }
+    }
+
+    #[test]
+    fn test_matches_python_golden_fixture() {
+        let golden: serde_json::Value = serde_json::from_str(GOLDEN_JSON).unwrap();
+        let params = MMRParams {
+            lambda: golden["mmr_lambda"].as_f64().unwrap(),
+            domain_similarity_weight: golden["domain_similarity_weight"].as_f64().unwrap(),
+            window: golden["window"].as_u64().unwrap() as usize,
+        };
+        let positions = |value: &serde_json::Value| -> Vec<usize> {
+            value.as_array().unwrap().iter().map(|i| i.as_u64().unwrap() as usize).collect()
+        };
+
+        for case in golden["cases"].as_array().unwrap() {
+            let name = case["name"].as_str().unwrap();
+            let candidates: Vec<Candidate> = case["candidates"].as_array().unwrap().iter()
+                .map(|c| candidate(c[0].as_str().unwrap(), c[1].as_str().unwrap(), c[2].as_str().unwrap()))
+                .collect();
+            let scores: Vec<f64> = case["scores"].as_array().unwrap().iter().map(|s| s.as_f64().unwrap()).collect();
+            let limit = case["limit"].as_u64().unwrap() as usize;
+
+            let reranked = order_and_rerank(&candidates, None, None, &params).unwrap();
+            assert_eq!(reranked, positions(&case["reranked"]), "reranked: {}", name);
+            let ordered = order_and_rerank(&candidates, Some(&scores), Some(limit), &params).unwrap();
+            assert_eq!(ordered, positions(&case["ordered"]), "ordered: {}", name);
+        }
+    }
+
+    #[test]
+    fn test_tokenize_matches_python_split() {
+        assert_eq!(tokenize("Hello\u{1c}World\u{3000}foo"), vec!["hello", "world", "foo"]);
+        assert_eq!(tokenize("one…"), Vec::<String>::new());
+        assert_eq!(tokenize("a b c d…"), vec!["a", "b"]);
+    }
+
+    #[test]
+    fn test_netloc_matches_urlsplit() {
+        assert_eq!(netloc("https://GitHub.com:443/x").unwrap(), "GitHub.com:443");
+        assert_eq!(netloc("https://user@example.org/x#y").unwrap(), "user@example.org");
+        assert_eq!(netloc("  ht\ttps://example.org?q").unwrap(), "example.org");
+        assert_eq!(netloc("//example.org/x").unwrap(), "example.org");
+        assert_eq!(netloc("example.org/x").unwrap(), "");
+        assert_eq!(netloc("1http://example.org/x").unwrap(), "");
+        assert!(netloc("https://[::1/x").is_err());
+    }
+
+    #[test]
+    fn test_short_lists_are_unchanged() {
+        let candidates = vec![candidate("a", "", "https://github.com/x/a"), candidate("b", "", "https://github.com/x/b")];
+        let params = MMRParams { lambda: 0.7, domain_similarity_weight: 0.8, window: 50 };
+        assert_eq!(order_and_rerank(&candidates, None, None, &params).unwrap(), vec![0, 1]);
+    }
+}
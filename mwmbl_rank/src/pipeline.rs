@@ -4,6 +4,8 @@
 ///
 /// Uses the xgb 3.0.5 crate (prebuilt XGBoost binaries, same API as xgboost 0.1.4).
 
+use std::collections::HashMap;
+
 use xgb::{parameters, Booster, DMatrix};
 
 use crate::features::{get_features_with_regex, MATCH_TERMS_INDEX, NUM_FEATURES, NUM_TERMS_INDEX};
@@ -32,23 +34,30 @@ struct QueryCache {
 }
 
 pub fn extract_features_batch(records: &[DocumentRecord]) -> Vec<f32> {
-    use std::collections::HashMap;
+    extract_features_with_cache(records, &build_query_cache(records))
+}
 
-    // Build a per-query cache of tokenized terms and compiled regexes.
-    // This means each unique query compiles its regexes exactly once,
-    // regardless of how many records share that query.
+/// Build a per-query cache of tokenized terms and compiled regexes.
+/// This means each unique query compiles its regexes exactly once,
+/// regardless of how many records share that query.
+fn build_query_cache(records: &[DocumentRecord]) -> HashMap<&str, QueryCache> {
     let mut query_cache: HashMap<&str, QueryCache> = HashMap::new();
-
-    let mut flat: Vec<f32> = Vec::with_capacity(records.len() * NUM_FEATURES);
     for rec in records {
-        let entry = query_cache.entry(rec.query.as_str()).or_insert_with(|| {
+        query_cache.entry(rec.query.as_str()).or_insert_with(|| {
             let terms = tokenize(&rec.query.to_lowercase());
             let term_refs: Vec<&str> = terms.iter().map(|s| s.as_str()).collect();
             let re_text = build_query_regex(&term_refs, true, false);
             let re_url  = build_query_regex(&term_refs, true, true);
             QueryCache { terms, re_text, re_url }
         });
+    }
+    query_cache
+}
 
+fn extract_features_with_cache(records: &[DocumentRecord], query_cache: &HashMap<&str, QueryCache>) -> Vec<f32> {
+    let mut flat: Vec<f32> = Vec::with_capacity(records.len() * NUM_FEATURES);
+    for rec in records {
+        let entry = &query_cache[rec.query.as_str()];
         let terms: Vec<&str> = entry.terms.iter().map(|s| s.as_str()).collect();
         let row = get_features_with_regex(
             &terms,
@@ -64,14 +73,75 @@ pub fn extract_features_batch(records: &[DocumentRecord]) -> Vec<f32> {
     flat
 }
 
+/// Below this many records per thread, feature extraction stays on the calling thread:
+/// starting a thread costs more than the extraction it would take over.
+pub const MIN_RECORDS_PER_THREAD: usize = 64;
+
+/// The default number of threads predict() shares feature extraction between. Kept small
+/// because every gunicorn worker process has its own, and XGBoost already evaluates the
+/// trees on its own OpenMP threads.
+pub fn default_predict_threads() -> usize {
+    std::thread::available_parallelism().map_or(1, |n| n.get()).min(4)
+}
+
+/// extract_features_batch, split into contiguous chunks across up to `threads` threads.
+/// Each record's features depend only on that record, so the output is identical.
+///
+/// The threads are scoped to the call rather than taken from a persistent pool such as
+/// rayon's. Spawning and joining a scoped thread costs about 18µs, against about 200µs to
+/// extract the smallest chunk one is started for (MIN_RECORDS_PER_THREAD records), so a
+/// pool would save under a tenth of the work it hands out. Scoped threads borrow the
+/// records and the query cache directly, where a pool's jobs would need them copied or
+/// shared behind Arcs. They also add no dependency. The number of threads stays bounded:
+/// one predict() uses at most `predict_threads` threads (4 by default), so a process has
+/// at most that many per predict() running at the same time.
+pub fn extract_features_parallel(records: &[DocumentRecord], threads: usize) -> Vec<f32> {
+    let threads = threads.min(records.len() / MIN_RECORDS_PER_THREAD).max(1);
+    if threads == 1 {
+        return extract_features_batch(records);
+    }
+
+    // Compiling the query regexes is a large part of the cost for a single query's
+    // candidates, so it is done once here rather than once per chunk.
+    let query_cache = build_query_cache(records);
+    let query_cache = &query_cache;
+    let chunk_size = records.len().div_ceil(threads);
+    std::thread::scope(|scope| {
+        let handles: Vec<_> = records.chunks(chunk_size)
+            .map(|chunk| scope.spawn(move || extract_features_with_cache(chunk, query_cache)))
+            .collect();
+        let mut flat: Vec<f32> = Vec::with_capacity(records.len() * NUM_FEATURES);
+        for handle in handles {
+            let chunk_features = handle.join().unwrap_or_else(|panic| std::panic::resume_unwind(panic));
+            flat.extend_from_slice(&chunk_features);
+        }
+        flat
+    })
+}
+
 /// The Rust XGBoost pipeline.
 /// Holds the trained booster and hyperparameters.
 ///
 /// # Safety
-/// `xgb::Booster` wraps a raw C pointer (`BoosterHandle`) which is `!Send` by default.
-/// XGBoost's C API is documented to be safe for concurrent read-only access (prediction),
-/// and we only mutate the booster during `fit()` / `load_model()`, which are called
-/// single-threadedly before the object is shared.  We therefore assert `Send` manually.
+/// `xgb::Booster` wraps a raw C pointer (`BoosterHandle`), so the compiler cannot tell
+/// whether it may cross or be shared between threads. It may:
+///
+/// - `Send`: an XGBoost booster is not tied to the thread that created it. Any thread may
+///   use or free the handle, one at a time.
+/// - `Sync`: the Python class releases the GIL during predict(), so several threads can
+///   predict with one pipeline at once. `py.allow_threads` needs the `&XGBPipeline` it
+///   borrows to be `Send`, which means `XGBPipeline: Sync`. Through `&self`, the booster
+///   is only predicted with, or read by `save_model()` to write the model out. Since
+///   XGBoost 1.4, prediction on a gbtree or dart booster has been documented as
+///   thread-safe; this pipeline always trains gbtree, and the xgb crate links XGBoost 3.0.
+///   The per-call buffers, the features and the DMatrix, belong to the calling thread,
+///   and the other fields are plain values that are read but never written.
+///
+/// The booster is only trained or replaced by `fit()` and `load_model()`, which take
+/// `&mut self`. That borrow is exclusive: Rust guarantees it within the crate, and for the
+/// Python class PyO3's runtime borrow flag does, because predict() holds its `PyRef` for as
+/// long as it runs without the GIL. A fit() or load_model() called meanwhile fails with
+/// "Already borrowed" instead of racing the prediction.
 pub struct XGBPipeline {
     pub threshold: f32,
     pub scale_pos_weight: f32,
@@ -81,11 +151,15 @@ pub struct XGBPipeline {
     pub min_child_weight: Option<f32>,
     pub gamma: Option<f32>,
     pub subsample: Option<f32>,
+    /// Threads predict() may split feature extraction across (see extract_features_parallel).
+    pub predict_threads: usize,
     booster: Option<Booster>,
 }
 
-// SAFETY: see doc-comment on XGBPipeline above.
+// SAFETY: see the # Safety section of XGBPipeline's doc comment above.
 unsafe impl Send for XGBPipeline {}
+// SAFETY: as above - &self methods only predict with or read the booster; mutation needs &mut self.
+unsafe impl Sync for XGBPipeline {}
 
 impl XGBPipeline {
     pub fn new(threshold: f32, scale_pos_weight: f32, reg_lambda: f32, num_rounds: u32) -> Self {
@@ -98,6 +172,7 @@ impl XGBPipeline {
             min_child_weight: None,
             gamma: None,
             subsample: None,
+            predict_threads: default_predict_threads(),
             booster: None,
         }
     }
@@ -121,6 +196,7 @@ impl XGBPipeline {
             min_child_weight,
             gamma,
             subsample,
+            predict_threads: default_predict_threads(),
             booster: None,
         }
     }
@@ -257,6 +333,8 @@ impl XGBPipeline {
 
     /// Predict probabilities for a batch of records.
     /// Returns a Vec<f32> of class-1 probabilities (one per record).
+    ///
+    /// Large batches have their features extracted on up to `predict_threads` threads.
     pub fn predict(&self, records: &[DocumentRecord]) -> Result<Vec<f32>, String> {
         let booster = self.booster.as_ref()
             .ok_or_else(|| "Model has not been trained yet. Call fit() first.".to_string())?;
@@ -265,7 +343,7 @@ impl XGBPipeline {
             return Ok(vec![]);
         }
 
-        let flat_features = extract_features_batch(records);
+        let flat_features = extract_features_parallel(records, self.predict_threads);
         let n_rows = records.len();
 
         let dmat = DMatrix::from_dense(&flat_features, n_rows)
@@ -346,6 +424,28 @@ mod tests {
         assert_eq!(flat.len(), 5 * NUM_FEATURES);
     }
 
+    #[test]
+    fn test_parallel_extraction_matches_serial() {
+        let records = make_records(MIN_RECORDS_PER_THREAD * 4 + 7);
+        let serial = extract_features_batch(&records);
+        for threads in [1, 2, 3, 4, 16] {
+            assert_eq!(extract_features_parallel(&records, threads), serial, "threads={}", threads);
+        }
+    }
+
+    #[test]
+    fn test_parallel_predict_matches_serial() {
+        let records = make_records(300);
+        let labels: Vec<f32> = (0..300).map(|i| if i % 3 == 0 { 1.0 } else { 0.0 }).collect();
+        let mut pipeline = XGBPipeline::new(0.0, 0.1, 2.0, 10);
+        pipeline.fit(&records, &labels, None).unwrap();
+
+        pipeline.predict_threads = 1;
+        let serial = pipeline.predict(&records).unwrap();
+        pipeline.predict_threads = 4;
+        assert_eq!(pipeline.predict(&records).unwrap(), serial);
+    }
+
     #[test]
     fn test_pipeline_fit_predict() {
         let records = make_records(20);
@@ -161,7 +161,7 @@ def _judge_rewards(query: str, docs_by_source: dict, s_index: dict, R, qi: int)
 
 
 def build_matrix(queries: list[str], out: str, reward: str = "survival",
-                 checkpoint: str | None = None):
+                 checkpoint: str | None = None, judge_cache: str | None = None):
     from django.conf import settings
     from mwmbl.tinysearchengine.super_search_sources import SOURCES
     from mwmbl.tinysearchengine.super_search_select import vectors
@@ -171,6 +171,9 @@ def build_matrix(queries: list[str], out: str, reward: str = "survival",
     from mwmbl.tinysearchengine.super_search_select.registry import get_meta
     from mwmbl.tinysearchengine.super_search_select.evaluation import RewardMatrix
 
+    if judge_cache:
+        from mwmbl.tinysearchengine.super_search_select.judge import use_persistent_score_cache
+        use_persistent_score_cache(judge_cache)
     sources = list(SOURCES.keys())
     s_index = {name: i for i, name in enumerate(sources)}
     limit = settings.SUPER_SEARCH_RESULTS_PER_SOURCE
@@ -184,11 +187,15 @@ def build_matrix(queries: list[str], out: str, reward: str = "survival",
     fetched = _fetch_all_queries(queries, cp, limit)
     prof_bow = {n: np.zeros(dim) for n in sources}
     prof_cng = {n: np.zeros(dim) for n in sources}
+    names, texts = [], []
     for query in queries:
         for name, docs in fetched[query].items():
-            text = " ".join(f"{title or ''} {extract or ''}" for _, title, extract in docs)
-            prof_bow[name] += vectors.project_bow(text, dim)
-            prof_cng[name] += vectors.project_char_ngrams(text, dim)
+            names.append(name)
+            texts.append(" ".join(f"{title or ''} {extract or ''}" for _, title, extract in docs))
+    for name, bow, cng in zip(names, vectors.project_bow_batch(texts, dim),
+                              vectors.project_char_ngrams_batch(texts, dim)):
+        prof_bow[name] += bow
+        prof_cng[name] += cng
     profile = {n: (vectors._l2_normalise(prof_bow[n]), vectors._l2_normalise(prof_cng[n]))
                for n in sources}
 
@@ -218,6 +225,19 @@ def build_matrix(queries: list[str], out: str, reward: str = "survival",
     matrix.save(out)
     print(f"Wrote matrix {out}.npz/.json ({reward} rewards): {Q} queries x {S} sources, "
           f"{int(mask.sum())} filled cells.")
+    if reward == "judge":
+        _print_judge_cache_stats()
+
+
+def _print_judge_cache_stats() -> None:
+    from mwmbl.tinysearchengine.super_search_select.judge import get_judge
+    from mwmbl.tinysearchengine.super_search_select.judge_cache import CachingJudge
+
+    judge = get_judge()
+    if isinstance(judge, CachingJudge):
+        stats = judge.cache.stats()
+        print(f"Judge score cache: {stats['lookups']} pairs, {stats['local_hit']} in memory, "
+              f"{stats['persistent_hit']} on disk, hit rate {stats['hit_rate']:.1%}")
 
 
 # ---------------------------------------------------------------------------
@@ -434,6 +454,8 @@ def main():
     p_build.add_argument("--reward", choices=["survival", "judge"], default="survival")
     p_build.add_argument("--checkpoint", default=None,
                          help="fetch checkpoint JSONL (default: <out>.fetch.jsonl)")
+    p_build.add_argument("--judge-cache", default=None,
+                         help="SQLite file keeping judge scores between runs (--reward judge)")
 
     p_gold = sub.add_parser("build-gold-matrix")
     p_gold.add_argument("--out", default="devdata/ss_gold_matrix")
@@ -467,7 +489,8 @@ def main():
 
     if args.command == "build-matrix":
         queries = [ln.strip() for ln in Path(args.queries).read_text().splitlines() if ln.strip()]
-        build_matrix(queries, args.out, reward=args.reward, checkpoint=args.checkpoint)
+        build_matrix(queries, args.out, reward=args.reward, checkpoint=args.checkpoint,
+                     judge_cache=args.judge_cache)
     elif args.command == "build-gold-matrix":
         build_gold_matrix(args.out)
     elif args.command == "select":
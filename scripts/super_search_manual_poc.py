@@ -35,6 +35,7 @@ from mwmbl.rankeval.evaluation.evaluate_super_search import (  # noqa: E402
     _dict_to_doc,
     _emit_final_results,
 )
+from mwmbl.tinysearchengine.super_search import FinalRanking  # noqa: E402
 from mwmbl.rankeval.paths import RANKINGS_DATASET_TRAIN_PATH  # noqa: E402
 from mwmbl.search_setup import ranker  # noqa: E402  (local index + LTR + MMR + wiki)
 
@@ -61,7 +62,7 @@ def collect_super_search(query: str) -> list[dict]:
                 })
 
     async def run():
-        await _emit_final_results(query, docs, emit, [None], asyncio.Lock())
+        await _emit_final_results(query, docs, emit, FinalRanking(), asyncio.Lock())
 
     asyncio.run(run())
     return captured
@@ -1,12 +1,12 @@
-import pandas as pd
-from mwmbl import tinysearchengine
-from mwmbl.tinysearchengine.completer import Completer
+from mwmbl.tinysearchengine.completer import (
+    Completer, CompletionIndex, compile_completions, load_completion_index,
+)
 
 
 def mockCompleterData(mocker, data):
-    testDataFrame = pd.DataFrame(data, columns=['','term','count'])
-    mocker.patch('mwmbl.tinysearchengine.completer.Completer.get_terms', 
-                 return_value = testDataFrame)
+    index = CompletionIndex(compile_completions([(term, count) for _, term, count in data], 3))
+    mocker.patch('mwmbl.tinysearchengine.completer.Completer.get_index',
+                 return_value = index)
 
 
 def test_correctCompletions(mocker):
@@ -81,4 +81,35 @@ def test_idempotencyWithSameScoreCompletions(mocker):
         # Results expected in reverse order
         expected = ['buildings','builder','build']
         assert expected == completion
-    
\ No newline at end of file
+    
+
+def test_completions_are_the_top_k_below_the_prefix():
+    terms = [("a", 1), ("ab", 5), ("abc", 2), ("abd", 7), ("abde", 7), ("b", 100), ("café", 3), ("cafés", 4)]
+    index = CompletionIndex(compile_completions(terms, 3))
+
+    assert index.complete("", 3) == ["b", "abde", "abd"]
+    assert index.complete("a", 3) == ["abde", "abd", "ab"]
+    assert index.complete("abc", 3) == ["abc"]
+    assert index.complete("abcd", 3) == []
+    assert index.complete("caf", 3) == ["cafés", "café"]
+    assert index.complete("café", 1) == ["cafés"]
+    assert index.complete("\ud800", 3) == []
+
+
+def test_a_repeated_term_keeps_its_last_count():
+    index = CompletionIndex(compile_completions([("build", 1), ("builder", 2), ("build", 3)], 3))
+    assert index.complete("bu", 3) == ["build", "builder"]
+
+
+def test_compiled_index_is_rebuilt_when_the_terms_change(tmp_path):
+    terms_path = tmp_path / "terms.csv"
+    terms_path.write_text(",term,count\n0,build,4\n1,builder,3\n")
+    index_path = tmp_path / "terms.completions"
+
+    assert load_completion_index(index_path, terms_path, 3).complete("bu", 3) == ["build", "builder"]
+    assert index_path.exists()
+
+    terms_path.write_text(",term,count\n0,build,4\n1,builder,3\n2,building,9\n")
+    assert load_completion_index(index_path, terms_path, 3).complete("bu", 3) == ["building", "build", "builder"]
+    # A different k needs a different index too.
+    assert load_completion_index(index_path, terms_path, 1).complete("bu", 1) == ["building"]
@@ -0,0 +1,157 @@
+import fakeredis
+import pytest
+from django.test import RequestFactory
+from ninja import Router
+from ninja.testing import TestClient
+from redis import RedisError
+
+from mwmbl.tinysearchengine import result_cache
+from mwmbl.tinysearchengine.conditional import etag_matches, search_etag, validate
+from mwmbl.tinysearchengine.indexer import Document
+from mwmbl.tinysearchengine.result_cache import bump_index_generation
+from mwmbl.tinysearchengine.search import _register_common_routes, _register_search_v2, create_router
+
+PAGE = 3
+
+
+class _Ranker:
+    def __init__(self):
+        self.calls = 0
+
+    def get_index_pages(self, q):
+        return {PAGE}
+
+    def search(self, s, additional_results):
+        self.calls += 1
+        return [Document("Python", "https://python.org/", "The Python language", 1.0)]
+
+    def complete(self, q):
+        self.calls += 1
+        return [q, ["python"]]
+
+    def get_raw_results(self, s):
+        self.calls += 1
+        return [Document("Python", "https://python.org/", "The Python language", 1.0)]
+
+
+class _BrokenRedis:
+    def hmget(self, key, fields):
+        raise RedisError("connection refused")
+
+
+ranker = _Ranker()
+v1_client = TestClient(create_router(ranker, "conditional-test"))
+v2_router = Router()
+_register_search_v2(v2_router, ranker)
+_register_common_routes(v2_router, ranker)
+v2_client = TestClient(v2_router)
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch, settings):
+    settings.SEARCH_ETAGS_ENABLED = True
+    ranker.calls = 0
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(result_cache, "_redis", client)
+    monkeypatch.setattr(result_cache, "_blacklist_version", lambda: "v1")
+    return client
+
+
+@pytest.mark.parametrize("client, path", [
+    (v1_client, "?s=python"),
+    (v2_client, "?q=python"),
+    (v1_client, "/complete?q=pyth"),
+    (v1_client, "/raw?s=python"),
+])
+def test_a_repeat_with_the_etag_is_not_modified_and_not_ranked(client, path):
+    first = client.get(path)
+    assert first.status_code == 200
+    assert first["ETag"].startswith('W/"')
+    assert first["Cache-Control"] == "public, no-cache"
+
+    second = client.get(path, headers={"If-None-Match": first["ETag"]})
+
+    assert second.status_code == 304
+    assert second["ETag"] == first["ETag"]
+    assert second.content == b""
+    assert ranker.calls == 1
+
+
+def test_a_keystroke_reads_the_generations_once_for_the_etag_and_the_result_cache(
+        redis_client, monkeypatch, settings):
+    settings.SEARCH_RESULT_CACHE_ENABLED = True
+    monkeypatch.setattr(result_cache, "_result_cache", None)
+    reads = []
+    hmget = redis_client.hmget
+    monkeypatch.setattr(redis_client, "hmget", lambda *args: reads.append(args) or hmget(*args))
+
+    first = v1_client.get("/complete?q=Pyth")
+    second = v1_client.get("/complete?q=pyth")
+
+    assert first.json() == ["Pyth", ["python"]]
+    assert second.json() == ["pyth", ["python"]]
+    assert len(reads) == 2
+    assert ranker.calls == 1
+
+
+def test_google_suggestions_keep_the_query_as_typed(monkeypatch, settings):
+    settings.SEARCH_RESULT_CACHE_ENABLED = True
+    monkeypatch.setattr(result_cache, "_result_cache", None)
+    monkeypatch.setattr(ranker, "complete", lambda q: [q, ["search: google.com " + q]])
+
+    assert v1_client.get("/complete?q=zebr").json() == ["zebr", ["search: google.com zebr"]]
+    assert v1_client.get("/complete?q=Zebr").json() == ["Zebr", ["search: google.com Zebr"]]
+    assert v1_client.get("/complete?q=zebr").json() == ["zebr", ["search: google.com zebr"]]
+
+
+def test_writing_a_page_the_query_reads_changes_the_etag(redis_client):
+    etag = v1_client.get("?s=python")["ETag"]
+    bump_index_generation([PAGE], redis_client)
+
+    response = v1_client.get("?s=python", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+    assert ranker.calls == 2
+
+
+def test_each_endpoint_and_deploy_has_its_own_etag(settings):
+    assert search_etag("raw", "python", "v1|3=0") != search_etag("search-v1", "python", "v1|3=0")
+    assert search_etag("raw", "Python ", "v1|3=0") == search_etag("raw", "python ", "v1|3=0")
+    before = search_etag("raw", "python", "v1|3=0")
+    settings.DEPLOY_REVISION = "abc123"
+    assert search_etag("raw", "python", "v1|3=0") != before
+
+
+def test_v2_responses_vary_on_the_api_key():
+    response = v2_client.get("?q=python")
+
+    assert response["Vary"] == "X-API-Key"
+
+
+def test_responses_to_an_api_key_are_revalidated_every_time():
+    request = RequestFactory().get("/api/v2/search/", {"q": "python"})
+
+    validation = validate(request, "search-v2", "python", ranker, private=True)
+
+    assert validation.cache_control == "private, no-cache"
+
+
+def test_without_the_generations_there_is_no_etag(monkeypatch):
+    monkeypatch.setattr(result_cache, "_redis", _BrokenRedis())
+
+    response = v1_client.get("?s=python", headers={"If-None-Match": "*"})
+
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert ranker.calls == 1
+
+
+def test_if_none_match_uses_weak_comparison_over_a_list():
+    def matches(header):
+        return etag_matches(RequestFactory().get("/", HTTP_IF_NONE_MATCH=header), 'W/"abc"')
+
+    assert matches('"xyz", W/"abc"')
+    assert matches('"abc"')
+    assert matches("*")
+    assert not matches('W/"xyz"')
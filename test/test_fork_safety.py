@@ -0,0 +1,61 @@
+"""The serving state a preloading gunicorn master hands its workers (see mwmbl.main)."""
+import os
+import pickle
+
+import fakeredis
+
+from mwmbl.indexer import blacklist_snapshot
+from mwmbl.indexer.blacklist_snapshot import SnapshotBlacklist
+from mwmbl.tinysearchengine import rank
+
+
+def _in_child(function):
+    """Run function in a forked child and return what it returned there."""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            result = function()
+        except BaseException as error:
+            result = error
+        with os.fdopen(write_end, "wb") as pipe:
+            pickle.dump(result, pipe)
+        os._exit(0)
+
+    os.close(write_end)
+    with os.fdopen(read_end, "rb") as pipe:
+        result = pickle.load(pipe)
+    os.waitpid(pid, 0)
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def test_page_reads_run_in_a_child_forked_after_the_pool_started():
+    # Starts every one of the parent's page read threads, none of which the child gets.
+    workers = rank._PAGE_READ_EXECUTOR._max_workers
+    assert list(rank._PAGE_READ_EXECUTOR.map(abs, range(-workers, 0))) == list(range(workers, 0, -1))
+
+    def read_in_child():
+        return rank._PAGE_READ_EXECUTOR.submit(abs, -1).result(timeout=5)
+
+    assert _in_child(read_in_child) == 1
+
+
+def test_blacklist_refresh_restarts_in_a_forked_child(monkeypatch):
+    snapshot = SnapshotBlacklist(redis_client=fakeredis.FakeRedis())
+    monkeypatch.setattr(blacklist_snapshot, "_snapshot_blacklist", snapshot)
+    snapshot._last_checked = 1e12
+    # As if the parent forked while a refresh thread was loading the snapshot.
+    snapshot._loading = True
+    snapshot._lock.acquire()
+
+    def refresh_state_in_child():
+        return snapshot._loading, snapshot._lock.acquire(timeout=1), snapshot._last_checked
+
+    try:
+        assert _in_child(refresh_state_in_child) == (False, True, 0.0)
+    finally:
+        snapshot._lock.release()
+    assert snapshot._loading
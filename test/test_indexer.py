@@ -18,6 +18,16 @@ def test_create_index():
                 page = indexer.get_page(i)
                 assert page == []
 
+def test_get_page_sees_pages_stored_through_the_mmap():
+    with TemporaryDirectory() as temp_dir:
+        index_path = Path(temp_dir) / 'temp-index.tinysearch'
+        TinyIndex.create(Document, str(index_path), num_pages=10, page_size=4096)
+        document = Document(title='Bananas', url='https://example.com/', extract='bananas', score=1.0)
+        with TinyIndex(Document, str(index_path), 'w') as indexer:
+            indexer.store_in_page(3, [document])
+            assert indexer.get_page(3) == [document]
+            assert indexer.get_page(4) == []
+
 def test_binary_search_fitting_size_all_fit():
     items = [1,2,3,4,5,6,7,8,9]
     compressor = ZstdCompressor()
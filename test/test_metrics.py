@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from unittest.mock import patch
+
+import fakeredis
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from redis import RedisError
+
+from mwmbl import metrics
+from mwmbl.indexer.purge_queue import PURGE_QUEUE_KEY
+from mwmbl.metrics import (QueueDepthCollector, ThreadPoolTracker, THREAD_POOL_TASKS, SEARCH_STAGE_SECONDS,
+                           TrackedExecutor, metrics_view, render_metrics)
+from mwmbl.redis_url_queue import DOMAIN_SCORE_KEY
+
+
+class _BrokenRedis:
+    def pipeline(self, transaction=True):
+        raise RedisError("connection refused")
+
+
+def test_queue_keys_match_the_queues():
+    assert metrics.DOMAIN_SCORE_KEY == DOMAIN_SCORE_KEY
+    assert metrics.PURGE_QUEUE_KEY == PURGE_QUEUE_KEY
+
+
+def test_queue_depths_are_read_from_redis():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    client.zadd(DOMAIN_SCORE_KEY, {"a.com": 1.0, "b.com": 2.0, "c.com": 3.0})
+    client.rpush(metrics.BATCH_QUEUE_KEY, "{}", "{}")
+    client.sadd(PURGE_QUEUE_KEY, "https://spam.example/")
+
+    [family] = QueueDepthCollector(client).collect()
+
+    depths = {sample.labels["queue"]: sample.value for sample in family.samples}
+    assert depths == {"url_queue_domains": 3, "crawled_batches": 2, "blacklist_purge": 1}
+
+
+def test_a_redis_failure_leaves_the_queue_depths_out():
+    assert list(QueueDepthCollector(_BrokenRedis()).collect()) == []
+
+    text = render_metrics(_BrokenRedis()).decode()
+
+    assert "mwmbl_queue_depth" not in text
+    assert "mwmbl_index_pages_read_total" in text
+
+
+def test_rendered_metrics_include_the_search_stages():
+    SEARCH_STAGE_SECONDS.labels("pages").observe(0.002)
+
+    text = render_metrics(fakeredis.FakeRedis(decode_responses=True)).decode()
+
+    assert 'mwmbl_search_stage_seconds_count{stage="pages"}' in text
+    assert 'mwmbl_queue_depth{queue="url_queue_domains"} 0.0' in text
+
+
+def test_thread_pool_tracker_counts_queued_and_running_tasks():
+    tracker = ThreadPoolTracker("test_pool", 4)
+    queued = THREAD_POOL_TASKS.labels("test_pool", "queued")
+    running = THREAD_POOL_TASKS.labels("test_pool", "running")
+
+    tracker.submitted(3)
+    assert queued._value.get() == 3
+
+    def work():
+        assert running._value.get() == 1
+        return "done"
+
+    assert tracker.run(work) == "done"
+    assert queued._value.get() == 2
+    assert running._value.get() == 0
+
+
+class _Staff:
+    is_active = True
+    is_staff = True
+
+
+def _metrics_request(user=None, **headers):
+    request = RequestFactory().get("/metrics", **headers)
+    request.user = user or AnonymousUser()
+    return request
+
+
+def test_metrics_are_refused_to_anonymous_requests(settings, monkeypatch):
+    settings.METRICS_BEARER_TOKEN = "scrape-secret"
+    monkeypatch.setattr(metrics, "render_metrics", lambda: b"metrics")
+
+    assert metrics_view(_metrics_request()).status_code == 403
+    assert metrics_view(_metrics_request(HTTP_AUTHORIZATION="Bearer wrong")).status_code == 403
+    assert metrics_view(_metrics_request(HTTP_AUTHORIZATION="Bearer scrape-secret")).status_code == 200
+    assert metrics_view(_metrics_request(user=_Staff())).status_code == 200
+
+    settings.METRICS_BEARER_TOKEN = None
+    assert metrics_view(_metrics_request(HTTP_AUTHORIZATION="Bearer ")).status_code == 403
+
+
+def test_only_the_crawler_entrypoint_prepares_the_metrics_directory(monkeypatch, tmp_path):
+    stale = tmp_path / "counter_1.db"
+    stale.write_bytes(b"")
+    monkeypatch.setenv(metrics.MULTIPROCESS_DIR_VARIABLE, str(tmp_path))
+
+    from mwmbl import crawl, main
+    assert stale.exists()
+
+    with patch.object(crawl, "run") as run:
+        main.run_crawler()
+
+    run.assert_called_once_with()
+    assert not stale.exists()
+
+
+def test_the_crawler_metrics_server_listens_locally_by_default():
+    with patch("mwmbl.metrics.start_http_server") as start:
+        metrics.serve_metrics(9100)
+
+    assert start.call_args.kwargs["addr"] == "127.0.0.1"
+
+
+def test_a_tracked_executor_counts_its_work_and_withdraws_cancelled_work():
+    release = Event()
+    queued = THREAD_POOL_TASKS.labels("tracked_pool", "queued")
+    running = THREAD_POOL_TASKS.labels("tracked_pool", "running")
+    executor = TrackedExecutor(ThreadPoolExecutor(max_workers=1), ThreadPoolTracker("tracked_pool", 1))
+
+    first = executor.submit(release.wait)
+    second = executor.submit(lambda: "never")
+    assert second.cancel()
+    assert (queued._value.get(), running._value.get()) in ((0, 1), (1, 0))
+
+    release.set()
+    first.result()
+    executor.shutdown()
+    assert (queued._value.get(), running._value.get()) == (0, 0)
@@ -1,5 +1,16 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from mwmbl.tinysearchengine import mmr_rank
 from mwmbl.tinysearchengine.indexer import Document
-from mwmbl.tinysearchengine.mmr_rank import MMR_WINDOW, MMRRanker, mmr_rerank
+from mwmbl.tinysearchengine.mmr_rank import (
+    DOMAIN_SIMILARITY_WEIGHT, MMR_LAMBDA, MMR_WINDOW, MMRRanker, mmr_rerank, order_and_rerank,
+)
+
+# Generated from the Python implementation by analyse/make_mmr_golden.py.
+GOLDEN = json.loads((Path(__file__).parent / "mmr_golden.json").read_text())
 
 
 def _doc(title, url, extract=""):
@@ -56,6 +67,60 @@ def test_mmr_caps_work_to_window_and_keeps_tail():
     assert reranked[MMR_WINDOW:] == pages[MMR_WINDOW:]
 
 
+@pytest.fixture(params=["python", "native"])
+def implementation(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(mmr_rank, "_native_mmr_order", None)
+    elif mmr_rank._native_mmr_order is None:
+        pytest.skip("mwmbl_rank is not built with mmr_order")
+    return request.param
+
+
+def _golden_pages(case):
+    return [Document(title, url, extract) for title, extract, url in case["candidates"]]
+
+
+def test_golden_fixture_is_for_the_current_constants():
+    # If a constant changed, regenerate the fixture and check mmr.rs still matches it.
+    assert (GOLDEN["mmr_lambda"], GOLDEN["domain_similarity_weight"], GOLDEN["window"]) == (
+        MMR_LAMBDA, DOMAIN_SIMILARITY_WEIGHT, MMR_WINDOW)
+
+
+@pytest.mark.parametrize("case", GOLDEN["cases"], ids=lambda case: case["name"])
+def test_mmr_rerank_matches_golden_fixture(implementation, case):
+    pages = _golden_pages(case)
+    assert mmr_rerank(pages) == [pages[i] for i in case["reranked"]]
+
+
+@pytest.mark.parametrize("case", GOLDEN["cases"], ids=lambda case: case["name"])
+def test_order_and_rerank_matches_golden_fixture(implementation, case):
+    pages = _golden_pages(case)
+    ranked = order_and_rerank(pages, case["scores"], case["limit"])
+    assert ranked == [(pages[i], case["scores"][i]) for i in case["ordered"]]
+
+
+def test_order_and_rerank_is_rerank_of_the_sorted_top(implementation):
+    pages = [_doc(f"t{i}", f"https://site{i % 3}.com/{i}", f"content {i % 4}") for i in range(20)]
+    scores = [(i * 7 % 11) / 10 for i in range(20)]
+
+    ranked = order_and_rerank(pages, scores, 12)
+
+    top = sorted(zip(pages, scores), key=lambda x: -x[1])[:12]
+    score_by_url = {page.url: score for page, score in top}
+    assert ranked == [(page, score_by_url[page.url]) for page in mmr_rerank([page for page, _ in top])]
+
+
+def test_pages_that_cannot_cross_into_rust_use_python(monkeypatch):
+    def native(*args):
+        raise UnicodeEncodeError("utf-8", "\ud800", 0, 1, "surrogates not allowed")
+    monkeypatch.setattr(mmr_rank, "_native_mmr_order", native)
+
+    a = _doc("Alpha repo", "https://github.com/x/alpha", "alpha \ud800 project")
+    b = _doc("Beta repo", "https://github.com/x/beta", "beta project")
+    c = _doc("Gamma site", "https://example.org/gamma", "gamma encyclopedia entry")
+    assert mmr_rerank([a, b, c]) == [a, c, b]
+
+
 class _FakeRanker:
     """Minimal ranker stub exposing the methods MMRRanker delegates to."""
 
@@ -0,0 +1,169 @@
+from unittest.mock import patch
+
+import fakeredis
+import pytest
+from django.core.cache import cache
+from redis import RedisError
+
+from mwmbl import quota
+from mwmbl.quota import (MONTHLY_TTL, RATE_LIMIT, Charge, UsageAggregator, _monthly_key, _super_search_monthly_key,
+                         backfill_active_users, charge_search, charge_super_search, flush_usage, get_active_user_ids,
+                         get_monthly_count)
+
+USER_ID = 4242
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def usage(monkeypatch, settings):
+    settings.SEARCH_USAGE_FLUSH_SECONDS = 3600
+    aggregator = UsageAggregator()
+    monkeypatch.setattr(quota, "_usage", aggregator)
+    return aggregator
+
+
+class _BrokenRedis:
+    def register_script(self, script):
+        def run(keys, args):
+            raise RedisError("connection refused")
+        return run
+
+
+def _charge_at(seconds: float, redis_client, monthly_limit: int = 1000) -> Charge:
+    with patch("mwmbl.quota.time.time", return_value=seconds):
+        return charge_search(USER_ID, monthly_limit, redis_client)
+
+
+def test_fixed_window_allows_up_to_the_rate_limit(redis_client):
+    charges = [_charge_at(NOW, redis_client) for _ in range(RATE_LIMIT + 1)]
+
+    assert [charge.allowed for charge in charges] == [True] * RATE_LIMIT + [False]
+    assert [charge.monthly_usage for charge in charges] == list(range(1, RATE_LIMIT + 1)) + [RATE_LIMIT]
+    assert not charges[-1].within_quota
+
+
+def test_a_request_over_quota_is_not_charged(redis_client):
+    monthly_key = cache.make_key(_monthly_key(USER_ID))
+    redis_client.set(monthly_key, 9)
+
+    first = charge_search(USER_ID, 10, redis_client)
+    second = charge_search(USER_ID, 10, redis_client)
+
+    assert first == Charge(allowed=True, within_quota=True, monthly_usage=10)
+    assert second == Charge(allowed=True, within_quota=False, monthly_usage=10)
+    flush_usage()
+    assert int(redis_client.get(monthly_key)) == 10
+
+
+def test_counters_expire(redis_client):
+    charge_search(USER_ID, 10, redis_client)
+    flush_usage()
+
+    assert 0 < redis_client.ttl(cache.make_key(_monthly_key(USER_ID))) <= MONTHLY_TTL
+    assert 0 < redis_client.pttl(cache.make_key(f"search:rate:{USER_ID}")) <= 1000
+
+
+def test_super_search_has_its_own_counter(redis_client):
+    charge_search(USER_ID, 10, redis_client)
+    charge = charge_super_search(USER_ID, 10, redis_client)
+
+    assert charge.monthly_usage == 1
+    assert int(redis_client.get(cache.make_key(_super_search_monthly_key(USER_ID)))) == 1
+
+
+def test_sliding_window_stops_a_burst_across_the_boundary(redis_client, settings):
+    settings.SEARCH_RATE_LIMIT_WINDOW = "sliding"
+    end_of_window = [_charge_at(NOW + 0.9, redis_client) for _ in range(RATE_LIMIT)]
+    start_of_next = [_charge_at(NOW + 1.1, redis_client) for _ in range(RATE_LIMIT)]
+
+    assert all(charge.allowed for charge in end_of_window)
+    # 90% of the previous window is still inside the last second: 4.5 requests, room for one more.
+    assert [charge.allowed for charge in start_of_next] == [True] + [False] * (RATE_LIMIT - 1)
+    # Once the previous window has passed, the full rate is available again.
+    assert all(_charge_at(NOW + 2.0, redis_client).allowed for _ in range(RATE_LIMIT - 1))
+
+
+def test_fixed_window_allows_a_double_burst_across_the_boundary(redis_client):
+    end_of_window = [_charge_at(NOW + 0.9, redis_client) for _ in range(RATE_LIMIT)]
+    with patch("mwmbl.quota.time.time", return_value=NOW + 1.1):
+        redis_client.delete(cache.make_key(f"search:rate:{USER_ID}"))  # the one-second TTL has passed
+        start_of_next = [charge_search(USER_ID, 1000, redis_client) for _ in range(RATE_LIMIT)]
+
+    assert all(charge.allowed for charge in end_of_window + start_of_next)
+
+
+def test_without_redis_the_cache_is_used():
+    cache.set(_monthly_key(USER_ID), 9)
+
+    assert charge_search(USER_ID, 10) == Charge(allowed=True, within_quota=True, monthly_usage=10)
+    assert charge_search(USER_ID, 10) == Charge(allowed=True, within_quota=False, monthly_usage=10)
+    assert cache.get(_monthly_key(USER_ID)) == 10
+
+
+def test_searches_are_added_to_redis_when_flushed(redis_client):
+    monthly_key = cache.make_key(_monthly_key(USER_ID))
+    for _ in range(3):
+        charge_search(USER_ID, 10, redis_client)
+
+    assert redis_client.get(monthly_key) is None
+    assert get_monthly_count(USER_ID) == 3
+
+    assert flush_usage() == 1
+    assert int(redis_client.get(monthly_key)) == 3
+    assert get_active_user_ids(redis_client=redis_client) == [USER_ID]
+    assert flush_usage() == 0
+
+
+def test_a_failed_flush_keeps_the_counts(redis_client):
+    charge_search(USER_ID, 10, redis_client)
+
+    assert flush_usage(_BrokenRedis()) == 0
+    assert get_monthly_count(USER_ID) == 1
+
+    flush_usage(redis_client)
+    assert int(redis_client.get(cache.make_key(_monthly_key(USER_ID)))) == 1
+
+
+def test_without_a_flush_interval_searches_are_counted_in_redis(redis_client, settings):
+    settings.SEARCH_USAGE_FLUSH_SECONDS = 0
+
+    charge_search(USER_ID, 10, redis_client)
+
+    assert int(redis_client.get(cache.make_key(_monthly_key(USER_ID)))) == 1
+    assert get_active_user_ids(redis_client=redis_client) == [USER_ID]
+    assert flush_usage() == 0
+
+
+def test_counters_from_before_the_active_set_are_backfilled_once(redis_client):
+    redis_client.set(cache.make_key(_monthly_key(USER_ID)), 7)
+    redis_client.set(cache.make_key(_monthly_key(USER_ID + 1, year=2000, month=1)), 3)
+    redis_client.set(cache.make_key(_super_search_monthly_key(USER_ID + 2)), 1)
+
+    assert backfill_active_users(redis_client) == 1
+    assert get_active_user_ids(redis_client=redis_client) == [USER_ID]
+
+    redis_client.set(cache.make_key(_monthly_key(USER_ID + 3)), 1)
+    assert backfill_active_users(redis_client) == 0
+    assert get_active_user_ids(redis_client=redis_client) == [USER_ID]
+
+
+def test_scripts_are_registered_once_per_client(redis_client):
+    with patch.object(redis_client, "register_script", wraps=redis_client.register_script) as register:
+        for _ in range(3):
+            charge_search(USER_ID, 10, redis_client)
+            flush_usage(redis_client)
+
+    assert register.call_count == 2
+    assert int(redis_client.get(cache.make_key(_monthly_key(USER_ID)))) == 3
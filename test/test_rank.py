@@ -1,3 +1,4 @@
+import threading
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -5,7 +6,7 @@ from requests.exceptions import RetryError
 from urllib3.exceptions import MaxRetryError, ResponseError
 
 from mwmbl.tinysearchengine import rank
-from mwmbl.tinysearchengine.indexer import Document
+from mwmbl.tinysearchengine.indexer import Document, DocumentState
 from mwmbl.tinysearchengine.rank import HeuristicRanker, get_wiki_results
 
 
@@ -54,6 +55,99 @@ def test_search_still_triggers_external_search():
     assert ranker.external_search_calls == ["some query"]
 
 
+class _BarrierIndex:
+    """Every retrieve blocks until `parties` retrieves are in flight at once."""
+
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties, timeout=5)
+
+    def retrieve(self, key):
+        self.barrier.wait()
+        return [Document(title=key, url=f"https://example.com/{key}", extract=key, score=1.0)]
+
+
+def test_page_reads_for_a_query_overlap():
+    # "apple banana" reads three pages: both terms and the bigram. A serial read path
+    # would leave the first retrieve waiting at the barrier until it timed out.
+    completer = MagicMock()
+    completer.complete.return_value = []
+    ranker = HeuristicRanker(_BarrierIndex(parties=3), completer)
+
+    results, _, _ = ranker.get_results("apple banana ", [], use_external_search=False)
+
+    assert {r.title for r in results} <= {"apple", "banana", "apple banana"}
+
+
+class _DictIndex:
+    """Pages by term, recording which terms were read."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.retrieved = []
+
+    def retrieve(self, key):
+        self.retrieved.append(key)
+        return list(self.pages.get(key, []))
+
+
+def _completion_ranker(pages, completions):
+    completer = MagicMock()
+    completer.complete.return_value = completions
+    return HeuristicRanker(_DictIndex(pages), completer)
+
+
+def test_complete_reads_a_bounded_number_of_pages():
+    completions = [f"pytho{suffix}" for suffix in "nabcdefg"]
+    pages = {"python": [Document("Python", "https://python.org/", "the python language", 1.0)]}
+    ranker = _completion_ranker(pages, completions)
+
+    q, suggestions = ranker.complete("pytho")
+
+    assert q == "pytho"
+    assert len(ranker.tiny_index.retrieved) <= rank.COMPLETE_MAX_PAGES
+    assert "pytho" in ranker.tiny_index.retrieved and "python" in ranker.tiny_index.retrieved
+    assert suggestions[0] == "go: python.org"
+
+
+def test_complete_picks_the_url_get_results_would_when_every_page_is_read():
+    pages = {
+        "rust": [Document("Rust", "https://rust-lang.org/", "the rust language", 1.0),
+                 Document("Rust book", "https://doc.rust-lang.org/book/", "the rust book", 2.0)],
+        "rust book": [Document("The book", "https://rust-book.example/rust", "rust book online", 1.0)],
+        "book": [Document("Books", "https://books.example/", "book shop", 1.0)],
+    }
+    ranker = _completion_ranker(pages, ["book", "books"])
+
+    ordered_results, terms, _ = ranker.get_results("rust boo", [], use_external_search=False)
+    expected = ["go: " + item.url[len(rank.HTTPS_STRING):].rstrip('/') for item in ordered_results[:5]
+                if item.url.startswith(rank.HTTPS_STRING) and all(term in item.url for term in terms)][:1]
+
+    assert ranker.complete("rust boo")[1] == expected + ["rust book", "rust books"]
+
+
+def test_complete_prefers_curated_urls_then_the_best_ranked():
+    curated = Document("Docs", "https://docs.python.org/3/", "python docs", 1.0,
+                       term="python docs", state=DocumentState.ORGANIC_APPROVED)
+    pages = {
+        "python docs": [curated],
+        "docs": [Document("Python docs", "https://python.org/docs", "python docs", 1.0)],
+    }
+    ranker = _completion_ranker(pages, [])
+
+    assert ranker.complete("python docs")[1] == ["go: docs.python.org/3"]
+
+    pages["python docs"] = []
+    assert ranker.complete("python docs")[1] == ["go: python.org/docs"]
+
+
+def test_complete_suggests_google_searches_when_nothing_matches():
+    pages = {"zebra": [Document("Horses", "https://horses.example/", "all about horses", 1.0)]}
+    ranker = _completion_ranker(pages, ["zebra", "zebras"])
+
+    assert ranker.complete("zebr") == ["zebr", ["search: google.com zebr", "search: google.com zebra",
+                                                "search: google.com zebras"]]
+
+
 def _make_retry_error(status_code: int) -> RetryError:
     reason = ResponseError(f"too many {status_code} error responses")
     max_retry_error = MaxRetryError(
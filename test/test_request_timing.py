@@ -0,0 +1,78 @@
+import pytest
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from mwmbl import request_timing
+from mwmbl.request_timing import Histogram, RequestTimings, ServerTimingMiddleware, stage, stage_histograms
+
+
+@pytest.fixture(autouse=True)
+def empty_histograms():
+    request_timing.reset_histograms()
+    yield
+    request_timing.reset_histograms()
+
+
+def _view(request):
+    with stage("auth"):
+        pass
+    with stage("pages"):
+        pass
+    with stage("auth"):
+        pass
+    return HttpResponse("ok")
+
+
+def test_stage_outside_a_timed_request_does_nothing():
+    with stage("pages"):
+        pass
+    assert stage_histograms() == {}
+
+
+def test_search_responses_carry_a_server_timing_header():
+    middleware = ServerTimingMiddleware(_view)
+
+    response = middleware(RequestFactory().get("/api/v2/search/", {"q": "python"}))
+
+    entries = [entry.split(";dur=") for entry in response["Server-Timing"].split(", ")]
+    assert [name for name, _ in entries] == ["auth", "pages", "total"]
+    assert all(float(duration) >= 0.0 for _, duration in entries)
+
+
+def test_other_paths_are_not_timed():
+    middleware = ServerTimingMiddleware(_view)
+
+    response = middleware(RequestFactory().get("/accounts/login/"))
+
+    assert "Server-Timing" not in response
+    assert stage_histograms() == {}
+
+
+def test_stages_are_recorded_in_the_histograms():
+    middleware = ServerTimingMiddleware(_view)
+    for _ in range(3):
+        middleware(RequestFactory().get("/search/complete", {"q": "pyth"}))
+
+    histograms = stage_histograms()
+    assert set(histograms) == {"auth", "pages", "total"}
+    assert all(histogram["count"] == 3 for histogram in histograms.values())
+
+
+def test_repeated_stages_add_up():
+    timings = RequestTimings()
+    timings.add("quota", 1_000_000)
+    timings.add("quota", 500_000)
+
+    assert timings.header(2_000_000) == "quota;dur=1.50, total;dur=2.00"
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(bounds=(1, 10, 100))
+    for value in [0.5, 5, 5, 50, 500]:
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(560.5)
+    assert histogram.quantile(0.5) == 10
+    assert histogram.quantile(1.0) == float("inf")
@@ -0,0 +1,198 @@
+from unittest.mock import MagicMock
+
+import fakeredis
+import pytest
+from redis import RedisError
+
+from mwmbl.tinysearchengine import result_cache
+from mwmbl.tinysearchengine.indexer import Document
+from mwmbl.tinysearchengine.rank import HeuristicRanker
+from mwmbl.tinysearchengine.result_cache import (
+    GENERATION_KEY,
+    SearchResultCache,
+    bump_index_generation,
+    normalize_query,
+    read_index_tag,
+)
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture(autouse=True)
+def blacklist_version(monkeypatch):
+    versions = ["v1"]
+    monkeypatch.setattr(result_cache, "_blacklist_version", lambda: versions[-1])
+    return versions
+
+
+class _Computer:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return [{"url": "https://example.com/", "call": self.calls}]
+
+
+def _cache(redis_client, shared=False):
+    return SearchResultCache(max_entries=100, ttl_seconds=300, shared=shared, redis_client=redis_client)
+
+
+def test_normalize_query_keeps_only_what_ranking_sees():
+    assert normalize_query("Python  Tutorial") == normalize_query("python tutorial")
+    # A trailing space stops the last term being completed, so it changes the results.
+    assert normalize_query("python ") != normalize_query("python")
+
+
+def test_repeat_query_is_served_locally(redis_client):
+    cache = _cache(redis_client)
+    compute = _Computer()
+
+    first = cache.get_or_compute("v1", "python", [3], compute)
+    second = cache.get_or_compute("v1", "Python", [3], compute)
+
+    assert first == second
+    assert compute.calls == 1
+    assert cache.stats()["local_hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_versions_are_cached_separately(redis_client):
+    cache = _cache(redis_client)
+    compute = _Computer()
+
+    cache.get_or_compute("v1", "python", [3], compute)
+    cache.get_or_compute("v2", "python", [3], compute)
+
+    assert compute.calls == 2
+
+
+def test_writing_a_page_the_query_reads_invalidates_it(redis_client):
+    cache = _cache(redis_client)
+    compute = _Computer()
+
+    cache.get_or_compute("v1", "python", [3, 7], compute)
+    bump_index_generation([7], redis_client)
+    result = cache.get_or_compute("v1", "python", [3, 7], compute)
+
+    assert result[0]["call"] == 2
+    assert cache.stats()["stale"] == 1
+
+
+def test_writing_an_unrelated_page_does_not_invalidate(redis_client):
+    cache = _cache(redis_client)
+    compute = _Computer()
+
+    cache.get_or_compute("v1", "python", [3, 7], compute)
+    bump_index_generation([5], redis_client)
+    cache.get_or_compute("v1", "python", [3, 7], compute)
+
+    assert compute.calls == 1
+
+
+def test_pages_share_generation_slots(redis_client, settings):
+    settings.SEARCH_RESULT_CACHE_GENERATION_SLOTS = 4
+    bump_index_generation([1, 5, 9], redis_client)
+    assert redis_client.hgetall(GENERATION_KEY) == {"1": "1"}
+
+
+def test_a_new_blacklist_snapshot_invalidates(redis_client, blacklist_version):
+    cache = _cache(redis_client)
+    compute = _Computer()
+
+    cache.get_or_compute("v1", "python", [3], compute)
+    blacklist_version.append("v2")
+    cache.get_or_compute("v1", "python", [3], compute)
+
+    assert compute.calls == 2
+
+
+def test_shared_tier_serves_other_workers(redis_client):
+    compute = _Computer()
+    _cache(redis_client, shared=True).get_or_compute("v1", "python", [3], compute)
+
+    other_worker = _cache(redis_client, shared=True)
+    result = other_worker.get_or_compute("v1", "python", [3], compute)
+
+    assert compute.calls == 1
+    assert result == [{"url": "https://example.com/", "call": 1}]
+    assert other_worker.stats()["shared_hits"] == 1
+
+
+def test_shared_entry_is_not_served_after_a_write(redis_client):
+    compute = _Computer()
+    _cache(redis_client, shared=True).get_or_compute("v1", "python", [3], compute)
+    bump_index_generation([3], redis_client)
+
+    _cache(redis_client, shared=True).get_or_compute("v1", "python", [3], compute)
+
+    assert compute.calls == 2
+
+
+def test_a_tag_read_by_the_caller_is_used_with_the_shared_tier(redis_client):
+    compute = _Computer()
+    _cache(redis_client, shared=True).get_or_compute("v1", "python", [3], compute)
+    tag = read_index_tag([3], redis_client)
+
+    other_worker = _cache(redis_client, shared=True)
+    other_worker.get_or_compute("v1", "python", [3], compute, tag)
+    other_worker.get_or_compute("v1", "python", [3], compute, tag)
+
+    assert compute.calls == 1
+    assert other_worker.stats()["shared_hits"] == 1
+    assert other_worker.stats()["local_hits"] == 1
+
+
+def test_expired_entries_are_recomputed(redis_client):
+    cache = SearchResultCache(max_entries=100, ttl_seconds=0, shared=False, redis_client=redis_client)
+    compute = _Computer()
+
+    cache.get_or_compute("v1", "python", [3], compute)
+    cache.get_or_compute("v1", "python", [3], compute)
+
+    assert compute.calls == 2
+
+
+def test_unreadable_generations_bypass_the_cache():
+    broken = MagicMock()
+    broken.pipeline.return_value.execute.side_effect = RedisError("down")
+    cache = _cache(broken)
+    compute = _Computer()
+
+    cache.get_or_compute("v1", "python", [3], compute)
+    cache.get_or_compute("v1", "python", [3], compute)
+
+    assert compute.calls == 2
+    assert cache.stats()["bypassed"] == 2
+
+
+def test_bump_never_raises():
+    broken = MagicMock()
+    broken.pipeline.return_value.execute.side_effect = RedisError("down")
+    bump_index_generation([3], broken)
+
+
+def test_index_pages_cover_curation_term_completions_and_bigrams():
+    tiny_index = MagicMock()
+    tiny_index.get_key_page_index.side_effect = lambda term: term
+    completer = MagicMock()
+    completer.complete.return_value = ["tutorials"]
+    ranker = HeuristicRanker(tiny_index, completer)
+
+    pages = ranker.get_index_pages("python tutor")
+
+    assert pages == {"python tutor", "python", "tutor", "tutorials"}
+
+    tiny_index.retrieve.return_value = [Document("t", "https://example.com/", "e", 1.0)]
+    ranker.get_results("python tutor", [], use_external_search=False)
+    retrieved = {call.args[0] for call in tiny_index.retrieve.call_args_list}
+    assert retrieved == pages
+    # The cache lookup's completions are reused by get_results, not worked out again.
+    completer.complete.assert_called_once_with("tutor")
+
+    ranker.get_index_pages("python tutorial")
+    assert completer.complete.call_count == 2
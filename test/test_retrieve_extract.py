@@ -5,7 +5,11 @@ justext yields no 'good' content for JS-first pages and for non-English pages
 falls back, in order, to Open Graph tags, the meta description, and the first
 substantive paragraph. These tests cover the helpers and that fallback chain.
 """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 import fakeredis
+import httpx
 
 from mwmbl.crawler import retrieve
 from mwmbl.crawler.retrieve import (
@@ -91,3 +95,30 @@ def test_crawl_url_prefers_og_description(monkeypatch):
             "</head><body><p>Some other first paragraph text here.</p></body></html>")
     content = _crawl_html(monkeypatch, html)["content"]
     assert content["extract"] == "The OG summary."
+
+
+def test_crawl_url_async_gives_the_crawl_url_result(monkeypatch):
+    html = ('<html><head><title>Async page</title>'
+            '<meta name="description" content="The meta summary.">'
+            '</head><body><p>Some other first paragraph text here.</p>'
+            '<a href="/next"><img src="i.png"></a></body></html>')
+    url = "http://93.184.216.34/page"
+
+    def handler(request):
+        if request.url.path == "/robots.txt":
+            return httpx.Response(200, text="User-agent: *\nDisallow: /private\n")
+        return httpx.Response(200, content=html.encode("utf8"))
+
+    async def crawl(page_url):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            with ThreadPoolExecutor(1) as executor:
+                return await retrieve.crawl_url_async(page_url, client, fakeredis.FakeStrictRedis(), executor)
+
+    result = asyncio.run(crawl(url))
+    expected = retrieve.extract_page(url, 200, html.encode("utf8"), result["timestamp"])
+    assert result == expected
+    assert result["content"]["title"] == "Async page"
+    assert result["content"]["extra_links"] == ["http://93.184.216.34/next"]
+
+    denied = asyncio.run(crawl("http://93.184.216.34/private/page"))
+    assert denied["error"]["name"] == "RobotsDenied"
@@ -164,6 +164,33 @@ class TestRustXGBPipelineFitPredict:
         assert not np.any(np.isnan(preds))
 
 
+class TestRustXGBPipelineParallelPredict:
+    @pytest.fixture(scope="class")
+    def model_path(self, tmp_path_factory):
+        pipeline = RustXGBPipeline(num_rounds=20)
+        pipeline.fit(make_dataframe(40), make_labels(40))
+        path = str(tmp_path_factory.mktemp("model") / "model.xgb")
+        pipeline.save_model(path)
+        return path
+
+    def test_threaded_extraction_gives_the_same_predictions(self, model_path):
+        X = make_dataframe(1000)
+        serial = RustXGBPipeline.from_model_path(model_path, predict_threads=1).predict(X)
+        parallel = RustXGBPipeline.from_model_path(model_path, predict_threads=4).predict(X)
+        np.testing.assert_array_equal(serial, parallel)
+
+    def test_concurrent_predicts_on_one_pipeline(self, model_path):
+        from concurrent.futures import ThreadPoolExecutor
+
+        pipeline = RustXGBPipeline.from_model_path(model_path)
+        X = make_dataframe(300)
+        expected = pipeline.predict(X)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: pipeline.predict(X), range(32)))
+        for preds in results:
+            np.testing.assert_array_equal(preds, expected)
+
+
 class TestRustXGBPipelinePersistence:
     def test_save_and_load(self):
         X = make_dataframe(30)
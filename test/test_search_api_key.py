@@ -12,6 +12,7 @@ Covers:
 from datetime import datetime, timezone as stdlib_timezone
 from unittest.mock import patch
 
+import fakeredis
 import pytest
 from allauth.account.models import EmailAddress
 from django.contrib.auth import get_user_model
@@ -25,7 +26,8 @@ from django.conf import settings
 from mwmbl import pricing
 from mwmbl.background import sync_search_counts
 from mwmbl.models import ApiKey, AgreementType, MwmblUser, UsageBucket, UserAgreement, UserBilling, generate_api_key
-from mwmbl.quota import RATE_LIMIT, _monthly_key, check_rate_limit, get_monthly_count, increment_monthly
+from mwmbl.quota import (RATE_LIMIT, Charge, _monthly_key, check_rate_limit, get_all_monthly_keys, get_monthly_count,
+                         increment_monthly)
 
 User = get_user_model()
 
@@ -347,9 +349,7 @@ def test_search_crawl_scoped_key_rejected(api_client, crawl_api_key):
 
 @pytest.mark.django_db
 def test_search_with_valid_key(api_client, search_api_key):
-    with patch("mwmbl.tinysearchengine.search.check_rate_limit", return_value=True), \
-         patch("mwmbl.tinysearchengine.search.get_monthly_count", return_value=0), \
-         patch("mwmbl.tinysearchengine.search.increment_monthly", return_value=1):
+    with patch("mwmbl.tinysearchengine.search.charge_search", return_value=Charge(allowed=True, within_quota=True, monthly_usage=1)):
         response = api_client.get(
             "/api/v2/search/?q=python",
             **api_key_header(search_api_key.raw_key),
@@ -360,9 +360,7 @@ def test_search_with_valid_key(api_client, search_api_key):
 @pytest.mark.django_db
 def test_search_response_includes_usage_fields(api_client, search_api_key):
     """When quota helpers are mocked, the response includes monthly_usage and monthly_limit."""
-    with patch("mwmbl.tinysearchengine.search.check_rate_limit", return_value=True), \
-         patch("mwmbl.tinysearchengine.search.get_monthly_count", return_value=5), \
-         patch("mwmbl.tinysearchengine.search.increment_monthly", return_value=6), \
+    with patch("mwmbl.tinysearchengine.search.charge_search", return_value=Charge(allowed=True, within_quota=True, monthly_usage=6)), \
          patch("mwmbl.tinysearchengine.rank.HeuristicRanker.search", return_value=[]):
         response = api_client.get(
             "/api/v2/search/?q=python",
@@ -381,7 +379,7 @@ def test_search_response_includes_usage_fields(api_client, search_api_key):
 
 @pytest.mark.django_db
 def test_search_rate_limit_exceeded(api_client, search_api_key):
-    with patch("mwmbl.tinysearchengine.search.check_rate_limit", return_value=False):
+    with patch("mwmbl.tinysearchengine.search.charge_search", return_value=Charge(allowed=False, within_quota=False, monthly_usage=0)):
         response = api_client.get(
             "/api/v2/search/?q=python",
             **api_key_header(search_api_key.raw_key),
@@ -393,8 +391,7 @@ def test_search_rate_limit_exceeded(api_client, search_api_key):
 @pytest.mark.django_db
 def test_search_monthly_quota_exceeded(api_client, search_api_key):
     limit = pricing.FREE_KEYED_MONTHLY_LIMIT
-    with patch("mwmbl.tinysearchengine.search.check_rate_limit", return_value=True), \
-         patch("mwmbl.tinysearchengine.search.get_monthly_count", return_value=limit):
+    with patch("mwmbl.tinysearchengine.search.charge_search", return_value=Charge(allowed=True, within_quota=False, monthly_usage=limit)):
         response = api_client.get(
             "/api/v2/search/?q=python",
             **api_key_header(search_api_key.raw_key),
@@ -408,9 +405,8 @@ def test_search_monthly_quota_exceeded(api_client, search_api_key):
 @pytest.mark.django_db
 def test_search_keyed_default_zero_spend_cap_is_free_allowance(api_client, search_api_key):
     """A fresh account with no UserBilling row defaults to the free-only cap."""
-    with patch("mwmbl.tinysearchengine.search.check_rate_limit", return_value=True), \
-         patch("mwmbl.tinysearchengine.search.get_monthly_count", return_value=pricing.FREE_KEYED_MONTHLY_LIMIT - 1), \
-         patch("mwmbl.tinysearchengine.search.increment_monthly", return_value=pricing.FREE_KEYED_MONTHLY_LIMIT):
+    with patch("mwmbl.tinysearchengine.search.charge_search",
+               return_value=Charge(allowed=True, within_quota=True, monthly_usage=pricing.FREE_KEYED_MONTHLY_LIMIT)):
         response = api_client.get(
             "/api/v2/search/?q=python",
             **api_key_header(search_api_key.raw_key),
@@ -426,21 +422,21 @@ def test_search_keyed_with_spend_limit_raises_cap(api_client, search_api_key, ve
     cap = pricing.effective_monthly_request_cap(1_000)
     assert cap == pricing.FREE_KEYED_MONTHLY_LIMIT + 2_000
 
-    with patch("mwmbl.tinysearchengine.search.check_rate_limit", return_value=True), \
-         patch("mwmbl.tinysearchengine.search.get_monthly_count", return_value=cap - 1):
-        response = api_client.get(
-            "/api/v2/search/?q=python",
-            **api_key_header(search_api_key.raw_key),
-        )
+    # The real charge, against the cache: one request left under the raised cap.
+    cache.set(_monthly_key(verified_user.id), cap - 1)
+    response = api_client.get(
+        "/api/v2/search/?q=python",
+        **api_key_header(search_api_key.raw_key),
+    )
     assert response.status_code == 200
+    assert response.json()["monthly_usage"] == cap
 
-    with patch("mwmbl.tinysearchengine.search.check_rate_limit", return_value=True), \
-         patch("mwmbl.tinysearchengine.search.get_monthly_count", return_value=cap):
-        response = api_client.get(
-            "/api/v2/search/?q=python",
-            **api_key_header(search_api_key.raw_key),
-        )
+    response = api_client.get(
+        "/api/v2/search/?q=python",
+        **api_key_header(search_api_key.raw_key),
+    )
     assert response.status_code == 429
+    cache.delete(_monthly_key(verified_user.id))
 
 
 # ---------------------------------------------------------------------------
@@ -639,6 +635,25 @@ def test_sync_search_counts_keeps_redis_value_when_higher(verified_user):
     cache.delete(key)
 
 
+@pytest.mark.django_db
+def test_sync_search_counts_marks_seeded_users_active(verified_user):
+    """A user seeded from Postgres is in the active set, so the next sync copies their
+    counter back even if they have not searched since."""
+
+    now = datetime.utcnow()
+    key = _monthly_key(verified_user.id)
+    redis_client = fakeredis.FakeRedis()
+    UsageBucket.objects.create(user=verified_user, year=now.year, month=now.month, count=99)
+    cache.delete(key)
+
+    with patch("mwmbl.quota._cache_redis", return_value=redis_client):
+        sync_search_counts.now()
+
+        assert get_all_monthly_keys() == [key]
+
+    cache.delete(key)
+
+
 # ---------------------------------------------------------------------------
 # Subscription endpoint — GET /api/v1/platform/billing/subscription
 # ---------------------------------------------------------------------------
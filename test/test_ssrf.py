@@ -1,6 +1,8 @@
 """Tests for the SSRF guard and its wiring into fetch() and add_url()."""
+import asyncio
 import socket
 
+import httpx
 import pytest
 from allauth.account.models import EmailAddress
 from django.contrib.auth import get_user_model
@@ -147,3 +149,35 @@ def test_add_url_rejects_internal_url(monkeypatch):
     client.force_login(user)
     response = client.post(reverse("add_url"), {"new_url": "http://169.254.169.254/", "query": "x"})
     assert response.status_code == 400
+
+
+def _async_fetch(url, handler):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await retrieve.fetch_async(url, client)
+    return asyncio.run(run())
+
+
+def test_fetch_async_blocks_redirect_to_internal():
+    calls = []
+
+    def handler(request):
+        calls.append(str(request.url))
+        return httpx.Response(301, headers={"Location": "http://127.0.0.1/"})
+
+    with pytest.raises(UnsafeURLError):
+        _async_fetch("http://93.184.216.34/start", handler)
+    assert calls == ["http://93.184.216.34/start"]
+
+
+def test_fetch_async_follows_public_redirects_and_caps_the_size(monkeypatch):
+    monkeypatch.setattr(retrieve, "MAX_FETCH_SIZE", 4096)
+
+    def handler(request):
+        if request.url.path == "/start":
+            return httpx.Response(302, headers={"Location": "/page"})
+        return httpx.Response(200, content=b"x" * 100_000)
+
+    status, content = _async_fetch("http://93.184.216.34/start", handler)
+    assert status == 200
+    assert 4096 < len(content) < 100_000
@@ -0,0 +1,88 @@
+import json
+import os
+
+import pytest
+
+from mwmbl.hn_top_domains_filtered import DOMAINS
+from mwmbl.tinysearchengine import rank
+from mwmbl.tinysearchengine.static_tables import StaticTable, compile_table, load_table
+
+
+def test_lookups_match_the_source_mapping():
+    mapping = {"Banana": 200, "Python_(programming_language)": 1000, "Apple": 100.5}
+    table = StaticTable(compile_table(mapping))
+
+    assert len(table) == 3
+    for key, value in mapping.items():
+        assert key in table
+        assert table[key] == value
+    assert table.get("Cherry", 0.0) == 0.0
+    assert "Cherry" not in table
+    with pytest.raises(KeyError):
+        table["Cherry"]
+
+
+def test_keys_with_lone_surrogates_are_looked_up_not_crashed_on():
+    table = StaticTable(compile_table({"Apple": 100, "x\ud800": 3}))
+
+    assert table.get("x\ud800") == 3
+    assert table.get("y\udfff", 0.0) == 0.0
+    assert rank.get_wiki_score("https://a.com/x\ud800") == 0.0
+    assert rank.get_domain_score("https://x\ud800.com/") == rank.get_domain_score("https://unknown.example/")
+
+
+def test_summary_values_are_kept_in_the_header():
+    table = StaticTable(compile_table({"b": 3, "a": 7, "c": 1}))
+    # first_value is in source order: wiki_stats.json is sorted by views, so it is the max.
+    assert table.first_value == 3
+    assert table.min_value == 1
+    assert table.max_value == 7
+
+
+def test_load_compiles_once_and_then_mmaps(tmp_path):
+    source_path = tmp_path / "counts.json"
+    source_path.write_text(json.dumps({"the": 1000, "python": 5}))
+    table_path = tmp_path / "counts.table"
+    loads = []
+
+    def load_source():
+        loads.append(1)
+        return json.loads(source_path.read_text())
+
+    assert load_table(table_path, source_path, load_source)["python"] == 5
+    assert load_table(table_path, source_path, load_source)["python"] == 5
+    assert len(loads) == 1
+    assert table_path.exists()
+
+
+def test_load_recompiles_when_the_source_changes(tmp_path):
+    source_path = tmp_path / "counts.json"
+    source_path.write_text(json.dumps({"python": 5}))
+    table_path = tmp_path / "counts.table"
+    load_source = lambda: json.loads(source_path.read_text())
+
+    load_table(table_path, source_path, load_source)
+    source_path.write_text(json.dumps({"python": 6, "rust": 2}))
+
+    table = load_table(table_path, source_path, load_source)
+    assert table["python"] == 6
+    assert table["rust"] == 2
+
+
+@pytest.mark.skipif(os.geteuid() == 0, reason="root can write to a read-only directory")
+def test_load_falls_back_to_memory_when_the_table_cannot_be_written(tmp_path):
+    source_path = tmp_path / "counts.json"
+    source_path.write_text(json.dumps({"python": 5}))
+    read_only = tmp_path / "read-only"
+    read_only.mkdir(mode=0o500)
+
+    table = load_table(read_only / "counts.table", source_path, lambda: json.loads(source_path.read_text()))
+    assert table["python"] == 5
+
+
+def test_domain_scores_match_the_domains_dict():
+    domain_min, domain_max = min(DOMAINS.values()), max(DOMAINS.values())
+    for domain in list(DOMAINS)[:100]:
+        expected = (DOMAINS[domain] - domain_min) / (domain_max - domain_min)
+        assert rank.get_domain_score(f"https://{domain}/page") == expected
+    assert rank.get_domain_score("https://not-a-top-domain.test/") == 0.0
@@ -95,6 +95,16 @@ def _stub_sources(monkeypatch, by_source: dict[str, list[Document]]):
     monkeypatch.setattr(ss, "SOURCES", new_sources)
 
 
+def _stub_crawl(monkeypatch, crawl):
+    """Replace page crawling with crawl(url, redis), returning a crawl_url result."""
+    import mwmbl.tinysearchengine.super_search as ss
+
+    async def fake_crawl_url_async(url, client, redis, extract_executor):
+        return crawl(url, redis)
+
+    monkeypatch.setattr(ss, "crawl_url_async", fake_crawl_url_async)
+
+
 def _stub_scoring(monkeypatch, scores: list[float]):
     """Stub both the promotion scorer (_heuristic_score_docs) and the LTR final
     ranker (score_documents) to consume from a single shared score iterator.
@@ -183,7 +193,7 @@ def test_promoted_results_use_top_k(client, api_key, monkeypatch):
     def fake_crawl(url, redis):
         return {"url": url, "status": 200, "timestamp": 0, "content": None, "error": None}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get(
         "/api/v2/super-search/?q=python",
@@ -225,7 +235,7 @@ def test_heap_replacement_promotes_better_late_doc(client, api_key, monkeypatch)
     def fake_crawl(url, redis):
         return {"url": url, "status": 200, "timestamp": 0, "content": None, "error": None}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get(
         "/api/v2/super-search/?q=python",
@@ -257,7 +267,7 @@ def test_heap_equal_score_does_not_enter_full_heap(client, api_key, monkeypatch)
     def fake_crawl(url, redis):
         return {"url": url, "status": 200, "timestamp": 0, "content": None, "error": None}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get(
         "/api/v2/super-search/?q=python",
@@ -283,7 +293,7 @@ def test_final_results_event_emitted(client, api_key, monkeypatch):
     def fake_crawl(url, redis):
         return {"url": url, "status": 200, "timestamp": 0, "content": None, "error": None}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get(
         "/api/v2/super-search/?q=python",
@@ -322,14 +332,15 @@ def test_final_results_are_mmr_diversified(client, api_key, monkeypatch):
                      extract="python gamma guide"),
         ],
     })
-    # Promotion scores, then descending final-ranking scores (consumed once per
-    # _emit_final_results call) all in the same a > b > c order.
+    # Promotion scores, then descending final-ranking scores (each document is
+    # scored once, by the first _emit_final_results call to see it) all in the
+    # same a > b > c order.
     _stub_scoring(monkeypatch, [0.9, 0.8, 0.7] * 4 + [0.0] * 30)
 
     def fake_crawl(url, redis):
         return {"url": url, "status": 200, "content": None}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get("/api/v2/super-search/?q=python", HTTP_X_API_KEY=api_key.raw_key)
     assert response.status_code == 200
@@ -358,9 +369,9 @@ def test_done_reports_pages_indexed(client, api_key, monkeypatch):
         "hn": [Document(title="Python intro", url="https://py.example/", extract="A guide")],
     })
     _stub_scoring(monkeypatch, [0.5] + [0.0] * 20)
-    monkeypatch.setattr(
-        "mwmbl.tinysearchengine.super_search.crawl_url",
-        lambda url: {"url": url, "status": 200, "timestamp": 0, "content": None, "error": None},
+    _stub_crawl(
+        monkeypatch,
+        lambda url, redis: {"url": url, "status": 200, "timestamp": 0, "content": None, "error": None},
     )
 
     captured = {}
@@ -405,6 +416,68 @@ def test_source_failure_emits_source_failed(client, api_key, monkeypatch):
     assert types[-1] == "done"
 
 
+@pytest.mark.django_db
+@override_settings(SUPER_SEARCH_SOURCE_FAILURE_THRESHOLD=2)
+def test_failing_source_is_skipped_once_its_circuit_opens(client, api_key, monkeypatch):
+    import fakeredis
+
+    import mwmbl.tinysearchengine.super_search as ss
+    from mwmbl.tinysearchengine.super_search_select import health
+
+    monkeypatch.setattr(health, "_redis", fakeredis.FakeRedis())
+    calls = []
+
+    async def bad_source(client, query, limit):
+        calls.append(query)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(ss, "SOURCES", {"hn": bad_source})
+
+    for _ in range(3):
+        cache.delete(_super_search_monthly_key(api_key.user.id))
+        response = client.get("/api/v2/super-search/?q=python", HTTP_X_API_KEY=api_key.raw_key)
+        events = _parse_sse(_read_stream(response))
+
+    assert len(calls) == 2
+    assert ("source_failed", {"source": "hn", "error": "circuit_open"}) in events
+    assert "source_started" not in [t for t, _ in events]
+
+
+@pytest.mark.django_db
+@override_settings(SUPER_SEARCH_SOURCE_CACHE_ENABLED=True)
+def test_a_repeated_search_is_answered_from_the_source_cache(client, api_key, monkeypatch):
+    import fakeredis
+
+    import mwmbl.tinysearchengine.super_search as ss
+    from mwmbl.tinysearchengine import super_search_cache
+    from mwmbl.tinysearchengine.super_search_select import health
+
+    monkeypatch.setattr(health, "_redis", fakeredis.FakeRedis())
+    monkeypatch.setattr(super_search_cache, "_source_cache", super_search_cache.SourceResponseCache(
+        max_entries=100, shared=True, redis_client=fakeredis.FakeRedis(decode_responses=True)))
+    _stub_crawl(monkeypatch, lambda url, redis: {"url": url, "status": 200, "content": None})
+    calls = []
+
+    async def hn(client, query, limit):
+        calls.append(query)
+        return [Document(title="Python intro", url="https://py.example/", extract="A guide")]
+
+    monkeypatch.setattr(ss, "SOURCES", {"hn": hn})
+
+    def source_events(q):
+        cache.delete(_super_search_monthly_key(api_key.user.id))
+        response = client.get(f"/api/v2/super-search/?q={q}", HTTP_X_API_KEY=api_key.raw_key)
+        events = _parse_sse(_read_stream(response))
+        return [(t, d) for t, d in events if t.startswith("source_") or t == "result_promoted"]
+
+    first = source_events("python")
+    again = source_events("Python")
+
+    assert calls == ["python"]
+    assert again == first
+    assert ("source_returned", {"source": "hn", "count": 1}) in again
+
+
 @pytest.mark.django_db
 @override_settings(SUPER_SEARCH_MONTHLY_LIMIT=2)
 def test_quota_increment_refunded_when_over_limit(client, api_key, monkeypatch):
@@ -469,7 +542,7 @@ def test_link_following_adds_followed_docs(client, api_key, monkeypatch):
             "title": "Python child", "extract": "about python", "links": [], "extra_links": [],
         }}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get(
         "/api/v2/super-search/?q=python",
@@ -505,7 +578,7 @@ def test_no_duplicate_consecutive_results_frames(client, api_key, monkeypatch):
     def fake_crawl(url, redis):
         return {"url": url, "status": 200, "content": None}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get(
         "/api/v2/super-search/?q=python",
@@ -537,7 +610,7 @@ def test_title_only_source_result_retained(client, api_key, monkeypatch):
     def fake_crawl(url, redis):
         return {"url": url, "status": 200, "content": None}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get("/api/v2/super-search/?q=python", HTTP_X_API_KEY=api_key.raw_key)
     assert response.status_code == 200
@@ -570,7 +643,7 @@ def test_followed_link_without_title_excluded(client, api_key, monkeypatch):
             "title": "", "extract": "python child text", "links": [], "extra_links": [],
         }}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get("/api/v2/super-search/?q=python", HTTP_X_API_KEY=api_key.raw_key)
     assert response.status_code == 200
@@ -601,7 +674,7 @@ def test_followed_link_with_title_and_no_extract_kept(client, api_key, monkeypat
             "title": "Python child", "extract": "", "links": [], "extra_links": [],
         }}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get("/api/v2/super-search/?q=python", HTTP_X_API_KEY=api_key.raw_key)
     assert response.status_code == 200
@@ -653,8 +726,8 @@ def test_blacklisted_source_results_are_not_shown(client, api_key, monkeypatch):
     })
     _stub_scoring(monkeypatch, [0.9, 0.5] + [0.0] * 20)
     _stub_blacklist(monkeypatch, {"badsite.test"})
-    monkeypatch.setattr(
-        "mwmbl.tinysearchengine.super_search.crawl_url",
+    _stub_crawl(
+        monkeypatch,
         lambda url, redis: {"url": url, "status": 200, "timestamp": 0, "content": None, "error": None})
 
     response = client.get("/api/v2/super-search/?q=python", HTTP_X_API_KEY=api_key.raw_key)
@@ -682,8 +755,8 @@ def test_blacklisted_results_are_not_indexed(client, api_key, monkeypatch):
     })
     _stub_scoring(monkeypatch, [0.9, 0.5] + [0.0] * 20)
     _stub_blacklist(monkeypatch, {"badsite.test"})
-    monkeypatch.setattr(
-        "mwmbl.tinysearchengine.super_search.crawl_url",
+    _stub_crawl(
+        monkeypatch,
         lambda url, redis: {"url": url, "status": 200, "timestamp": 0, "content": None, "error": None})
 
     indexed = []
@@ -722,10 +795,136 @@ def test_blacklisted_links_are_not_crawled(client, api_key, monkeypatch):
         return {"url": url, "status": 200, "timestamp": 0, "error": None,
                 "content": {"title": "Child", "extract": "child", "links": [], "extra_links": []}}
 
-    monkeypatch.setattr("mwmbl.tinysearchengine.super_search.crawl_url", fake_crawl)
+    _stub_crawl(monkeypatch, fake_crawl)
 
     response = client.get("/api/v2/super-search/?q=python", HTTP_X_API_KEY=api_key.raw_key)
     _read_stream(response)
 
     assert "https://badsite.test/x" not in crawled
     assert "https://other.test/y" in crawled
+
+
+# ---------------------------------------------------------------------------
+# Incremental final ranking
+# ---------------------------------------------------------------------------
+
+def _replay_score(doc):
+    # Few distinct scores, so ties (broken by arrival order) are common.
+    return (sum(map(ord, doc.url)) % 7) / 7
+
+
+def _rescore_everything(query, all_docs, final_limit):
+    """The final ranking as it was computed before FinalRanking: every document found so
+    far deduplicated, filtered, scored and ranked again on each call."""
+    from mwmbl.tinysearchengine import super_search as ss
+    from mwmbl.tinysearchengine.mmr_rank import order_and_rerank
+    from mwmbl.tokenizer import tokenize
+
+    terms = tokenize(query)
+    seen, unique = set(), []
+    for doc in all_docs:
+        if doc.url and doc.title and doc.url not in seen:
+            seen.add(doc.url)
+            unique.append(doc)
+    unique = [doc for doc in unique if ss._doc_passes_term_filter(doc, terms)]
+    if not unique:
+        return None
+    return order_and_rerank(unique, [_replay_score(doc) for doc in unique], final_limit)
+
+
+@override_settings(SUPER_SEARCH_FINAL_RESULTS_LIMIT=20)
+def test_incremental_final_ranking_replays_identically(monkeypatch):
+    """Replays a search's documents arriving in bursts - with duplicate URLs, documents
+    without titles, documents failing the term filter and tied scores - and checks every
+    `results` frame matches ranking everything from scratch, while each document is
+    scored only once."""
+    import random
+
+    from mwmbl.tinysearchengine import super_search as ss
+
+    scored = []
+
+    def fake_ltr(model, query, docs):
+        scored.extend(doc.url for doc in docs)
+        return [_replay_score(doc) for doc in docs]
+
+    monkeypatch.setattr(ss, "score_documents", fake_ltr)
+
+    rng = random.Random(41)
+    domains = ["a.example", "b.example", "c.example", "d.example"]
+    words = ["python", "async", "guide", "rust", "tutorial"]
+    bursts = []
+    for _ in range(30):
+        burst = []
+        for _ in range(rng.randint(0, 8)):
+            url = f"https://{rng.choice(domains)}/{rng.randint(0, 60)}"
+            title = " ".join(rng.sample(words, 2)) if rng.random() > 0.1 else ""
+            burst.append(Document(title=title, url=url, extract=" ".join(rng.sample(words, 3))))
+        bursts.append(burst)
+
+    async def replay():
+        frames, expected = [], []
+        ranking = ss.FinalRanking()
+        last_expected = None
+        all_docs = []
+
+        async def emit(event_type, data):
+            frames.append([(item.url, item.score) for item in data.results])
+
+        for burst in bursts:
+            all_docs.extend(burst)
+            await ss._emit_final_results("python guide", all_docs, emit, ranking, asyncio.Lock())
+            reference = _rescore_everything("python guide", all_docs, 20)
+            if reference is not None:
+                frame = [(doc.url, round(score, 4)) for doc, score in reference]
+                if [url for url, _ in frame] != last_expected:
+                    last_expected = [url for url, _ in frame]
+                    expected.append(frame)
+        return frames, expected
+
+    frames, expected = asyncio.run(replay())
+
+    assert len(frames) > 5
+    assert frames == expected
+    assert len(scored) == len(set(scored))
+
+
+def test_results_emitter_coalesces_bursts_and_flushes_the_last_documents(monkeypatch):
+    """A burst of completions ranks once per interval, not once each, and the flush
+    before `done` emits a frame with every document."""
+    from mwmbl.tinysearchengine import super_search as ss
+
+    rankings = []
+
+    def fake_ltr(model, query, docs):
+        rankings.append(len(docs))
+        return [1.0 / (1 + int(doc.url.rsplit("/", 1)[-1])) for doc in docs]
+
+    monkeypatch.setattr(ss, "score_documents", fake_ltr)
+
+    async def run():
+        frames = []
+
+        async def emit(event_type, data):
+            frames.append([item.url for item in data.results])
+
+        all_docs = []
+        results = ss.ResultsEmitter("python", all_docs, emit, interval=0.05)
+        for burst in range(5):
+            for i in range(20):
+                n = burst * 20 + i
+                all_docs.append(Document(title=f"Python {n}", url=f"https://e{n}.example/{n}", extract="python"))
+                results.mark_dirty()
+                await asyncio.sleep(0)
+            await asyncio.sleep(0.01)
+        await results.flush()
+        return frames
+
+    frames = asyncio.run(run())
+
+    # Five bursts of twenty over about 0.05s: the first frame straight away, at most a
+    # couple more, and the flush - never one per document.
+    assert 2 <= len(frames) <= 4
+    assert sum(rankings) == 100
+    assert frames[-1][0] == "https://e0.example/0"
+    assert len(frames[-1]) == 100
@@ -0,0 +1,105 @@
+import asyncio
+
+import fakeredis
+import pytest
+from redis import RedisError
+
+from mwmbl.tinysearchengine import super_search_cache
+from mwmbl.tinysearchengine.indexer import Document, DocumentState
+from mwmbl.tinysearchengine.super_search_cache import SourceResponseCache, cached_answer, store_answer
+
+
+class _BrokenRedis:
+    def __getattr__(self, name):
+        raise RedisError("connection refused")
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def cache_settings(settings):
+    settings.SUPER_SEARCH_SOURCE_CACHE_ENABLED = True
+    settings.SUPER_SEARCH_SOURCE_CACHE_TTL_SECONDS = 600
+    settings.SUPER_SEARCH_SOURCE_CACHE_EMPTY_TTL_SECONDS = 60
+    settings.SUPER_SEARCH_SOURCE_CACHE_TTLS = {"hn": 120, "live": 0}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(super_search_cache.time, "monotonic", clock)
+    monkeypatch.setattr(super_search_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def source_cache(monkeypatch):
+    cache = SourceResponseCache(max_entries=100, shared=True,
+                                redis_client=fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(super_search_cache, "_source_cache", cache)
+    return cache
+
+
+DOCS = [
+    Document(title="Python", url="https://python.org/", extract="The language", state=DocumentState.FROM_USER),
+    Document(title="PyPI", url="https://pypi.org/", extract=""),
+]
+
+
+def test_answers_are_kept_per_source_query_and_limit_for_the_source_ttl(source_cache, clock):
+    source_cache.put("hn", "Python  Tutorial", 10, DOCS)
+
+    assert source_cache.get_local("hn", "python tutorial", 10) == DOCS
+    assert source_cache.get_local("hn", "python tutorial", 10)[0] is not DOCS[0]
+    assert source_cache.get_local("hn", "python tutorial", 5) is None
+    assert source_cache.get_local("github", "python tutorial", 10) is None
+
+    clock.now += 119
+    assert source_cache.get_local("hn", "python tutorial", 10) == DOCS
+    clock.now += 1
+    assert source_cache.get_local("hn", "python tutorial", 10) is None
+
+
+def test_empty_answers_are_kept_briefly_and_uncached_sources_not_at_all(source_cache, clock):
+    source_cache.put("github", "nothing here", 10, [])
+    source_cache.put("live", "python", 10, DOCS)
+
+    assert source_cache.get_local("github", "nothing here", 10) == []
+    assert source_cache.get_local("live", "python", 10) is None
+    clock.now += 60
+    assert source_cache.get_local("github", "nothing here", 10) is None
+
+
+def test_the_local_tier_is_bounded():
+    cache = SourceResponseCache(max_entries=2, shared=False)
+    for query in ("a", "b", "c"):
+        cache.put("github", query, 10, DOCS)
+
+    assert cache.get_local("github", "a", 10) is None
+    assert cache.get_local("github", "c", 10) == DOCS
+
+
+def test_other_processes_are_answered_from_redis(source_cache, clock, monkeypatch):
+    asyncio.run(store_answer("github", "python", 10, DOCS))
+    other = SourceResponseCache(max_entries=100, shared=True, redis_client=source_cache.redis_client)
+    monkeypatch.setattr(super_search_cache, "_source_cache", other)
+
+    assert asyncio.run(cached_answer("github", "Python", 10)) == DOCS
+    # Copied into the process's own tier, for what is left of the TTL.
+    assert other.get_local("github", "python", 10) == DOCS
+    clock.now += 600
+    assert asyncio.run(cached_answer("github", "python", 10)) is None
+
+
+def test_without_redis_the_local_tier_still_answers(source_cache):
+    source_cache._redis_client = _BrokenRedis()
+
+    asyncio.run(store_answer("github", "python", 10, DOCS))
+    assert asyncio.run(cached_answer("github", "python", 10)) == DOCS
+    assert asyncio.run(cached_answer("github", "rust", 10)) is None
@@ -0,0 +1,89 @@
+import fakeredis
+import pytest
+from django.test import override_settings
+
+from mwmbl.tinysearchengine.super_search_select import health
+from mwmbl.tinysearchengine.super_search_select.health import SourceHealth
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(health, "_redis", r)
+    return r
+
+
+class _BrokenRedis:
+    def __getattr__(self, name):
+        raise health.redis.ConnectionError("connection refused")
+
+
+@override_settings(SUPER_SEARCH_PER_SOURCE_TIMEOUT=2.0, SUPER_SEARCH_MIN_SOURCE_TIMEOUT=0.25,
+                   SUPER_SEARCH_SOURCE_TIMEOUT_P95_MULTIPLIER=1.5, SUPER_SEARCH_SOURCE_MIN_OBSERVATIONS=20)
+def test_timeout_follows_the_p95_latency_between_the_bounds():
+    source = SourceHealth()
+    assert source.timeout() == 2.0
+
+    # Mostly 100ms, with one call in ten taking 600ms: the p95 is 600ms.
+    for i in range(2000):
+        source.observe(0.6 if i % 10 == 0 else 0.1, True, 0.0)
+    assert source.p95 == pytest.approx(0.6, abs=0.05)
+    assert source.timeout() == pytest.approx(source.p95 * 1.5)
+
+    fast = SourceHealth()
+    for _ in range(100):
+        fast.observe(0.01, True, 0.0)
+    assert fast.timeout() == 0.25
+
+
+@override_settings(SUPER_SEARCH_SOURCE_MIN_OBSERVATIONS=1)
+def test_a_source_that_keeps_timing_out_climbs_back_to_the_ceiling():
+    source = SourceHealth()
+    for _ in range(50):
+        source.observe(0.05, True, 0.0)
+    for _ in range(100):
+        source.observe(source.timeout(), False, 0.0)
+
+    assert source.timeout() == pytest.approx(2.0)
+    assert source.error_ema > 0.9
+
+
+@override_settings(SUPER_SEARCH_SOURCE_FAILURE_THRESHOLD=3, SUPER_SEARCH_SOURCE_COOLDOWN_SECONDS=60)
+def test_consecutive_failures_open_the_circuit_for_the_cooldown():
+    source = SourceHealth()
+    source.observe(2.0, False, 100.0)
+    source.observe(0.1, True, 101.0)
+    source.observe(2.0, False, 102.0)
+    source.observe(2.0, False, 103.0)
+    assert not source.is_open(103.0)
+
+    source.observe(2.0, False, 104.0)
+    assert source.is_open(163.0)
+    assert not source.is_open(164.0)
+
+    # The trial call after the cooldown fails: open again at once.
+    source.observe(2.0, False, 165.0)
+    assert source.is_open(200.0)
+
+
+@override_settings(SUPER_SEARCH_SOURCE_FAILURE_THRESHOLD=2)
+def test_the_statistics_are_shared_through_redis():
+    health.record("arxiv", 2.0, False)
+    health.record("arxiv", 2.0, False)
+    health.record("hn", 0.2, True)
+
+    stats = health.get_health(["arxiv", "hn", "pypi"])
+
+    assert stats["arxiv"].consecutive_failures == 2
+    assert stats["arxiv"].is_open(health.time.time())
+    assert stats["hn"] == SourceHealth(latency_ema=0.2, p95=0.2, error_ema=0.0, observations=1)
+    assert stats["pypi"] == SourceHealth()
+
+
+def test_without_redis_every_source_is_queried_with_the_flat_timeout(monkeypatch, settings):
+    monkeypatch.setattr(health, "_redis", _BrokenRedis())
+
+    assert health.record("arxiv", 2.0, False) is None
+    stats = health.get_health(["arxiv"])
+    assert not stats["arxiv"].is_open(0.0)
+    assert stats["arxiv"].timeout() == settings.SUPER_SEARCH_PER_SOURCE_TIMEOUT
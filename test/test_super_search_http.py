@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from mwmbl.tinysearchengine import super_search_http
+from mwmbl.tinysearchengine.super_search_http import (
+    SourceThrottled, new_client, shared_client, track_host_queue_wait, wait_for_source,
+)
+
+
+class _StubServer(ThreadingHTTPServer):
+    """A local source that counts the connections opened to it and the requests it
+    serves at once."""
+
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.connections = 0
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.most_in_flight = max(server.most_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        body = b'{"results": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def servers():
+    started = [_StubServer(delay=0.02), _StubServer(delay=0.02)]
+    for server in started:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield started
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+async def _query(client: httpx.AsyncClient, servers) -> None:
+    # Like a search: three requests to each source at once.
+    responses = await asyncio.gather(*(client.get(server.url) for server in servers for _ in range(3)))
+    assert all(response.status_code == 200 for response in responses)
+
+
+def test_searches_on_the_shared_client_reuse_its_connections(servers):
+    async def fresh_client_per_search():
+        for _ in range(5):
+            async with new_client() as client:
+                await _query(client, servers)
+
+    asyncio.run(fresh_client_per_search())
+    fresh = [server.connections for server in servers]
+    for server in servers:
+        server.connections = 0
+
+    async def shared_client_per_search():
+        for _ in range(5):
+            await _query(shared_client(), servers)
+        assert shared_client() is shared_client()
+        await shared_client().aclose()
+
+    asyncio.run(shared_client_per_search())
+    shared = [server.connections for server in servers]
+
+    assert fresh == [15, 15]
+    assert shared == [3, 3]
+
+
+def test_requests_to_one_host_are_limited_across_searches(servers, settings):
+    settings.SUPER_SEARCH_MAX_CONCURRENT_PER_HOST = 2
+    busy, other = servers
+
+    async def searches():
+        client = new_client()
+        transport = client._transport
+        await asyncio.gather(*(client.get(busy.url) for _ in range(8)), client.get(other.url))
+        # Hosts nobody is waiting on are forgotten.
+        assert transport._hosts == {} and transport._users == {}
+        await client.aclose()
+
+    asyncio.run(searches())
+
+    assert busy.most_in_flight == 2
+    assert busy.connections == 2
+    assert other.connections == 1
+
+
+async def _source_call(client, url, timeout):
+    """What super_search._call_source does around an adapter: (outcome, latency held against the source)."""
+    wait = track_host_queue_wait()
+    started = time.monotonic()
+    try:
+        await wait_for_source(client.get(url), timeout, wait)
+        outcome = "ok"
+    except SourceThrottled:
+        outcome = "throttled"
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+    return outcome, time.monotonic() - started - wait.waited
+
+
+def test_time_queued_for_a_busy_host_is_not_held_against_the_source(settings):
+    settings.SUPER_SEARCH_MAX_CONCURRENT_PER_HOST = 2
+    server = _StubServer(delay=0.1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def streams():
+        client = new_client()
+        # Six streams calling the same source: three rounds of 0.1s, each inside a 0.25s timeout
+        # only because the queueing does not count.
+        calls = await asyncio.gather(*(asyncio.create_task(_source_call(client, server.url, 0.25))
+                                       for _ in range(6)))
+        await client.aclose()
+        return calls
+
+    try:
+        calls = asyncio.run(streams())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [outcome for outcome, _ in calls] == ["ok"] * 6
+    assert all(latency < 0.2 for _, latency in calls)
+    assert server.most_in_flight == 2
+
+
+def test_a_call_still_queued_when_its_time_runs_out_is_throttled_not_timed_out(settings):
+    settings.SUPER_SEARCH_MAX_CONCURRENT_PER_HOST = 1
+    server = _StubServer(delay=0.3)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def streams():
+        client = new_client()
+        # The first call holds the only slot for 0.3s; the second gives up queued behind it.
+        calls = await asyncio.gather(*(asyncio.create_task(_source_call(client, server.url, timeout))
+                                       for timeout in (1.0, 0.1)))
+        await client.aclose()
+        return calls
+
+    try:
+        calls = asyncio.run(streams())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [outcome for outcome, _ in calls] == ["ok", "throttled"]
+
+
+def test_the_default_per_host_limit_lets_many_streams_through_at_once(settings):
+    server = _StubServer(delay=0.1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def streams():
+        client = new_client()
+        calls = await asyncio.gather(*(asyncio.create_task(_source_call(client, server.url, 1.0))
+                                       for _ in range(16)))
+        await client.aclose()
+        return calls
+
+    try:
+        calls = asyncio.run(streams())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [outcome for outcome, _ in calls] == ["ok"] * 16
+    assert server.most_in_flight == 16
+
+
+def test_each_loop_and_process_gets_its_own_client(monkeypatch):
+    async def borrow():
+        return shared_client()
+
+    first_loop = asyncio.new_event_loop()
+    second_loop = asyncio.new_event_loop()
+    try:
+        first = first_loop.run_until_complete(borrow())
+        assert first_loop.run_until_complete(borrow()) is first
+        assert second_loop.run_until_complete(borrow()) is not first
+
+        monkeypatch.setattr(super_search_http.os, "getpid", lambda: -1)
+        assert first_loop.run_until_complete(borrow()) is not first
+    finally:
+        first_loop.close()
+        second_loop.close()
@@ -1,4 +1,5 @@
 """Tests for the fine-tuned relevance judge (super_search_select/judge.py)."""
+import threading
 from pathlib import Path
 
 import pytest
@@ -26,6 +27,107 @@ def test_get_judge_unavailable_returns_none(monkeypatch):
     assert ss_judge.get_judge() is None
 
 
+def test_only_an_offline_call_turns_on_the_persistent_score_cache(monkeypatch, tmp_path):
+    for name in ("model.onnx", "tokenizer.json"):
+        (tmp_path / name).write_bytes(b"")
+    monkeypatch.setattr(ss_judge, "Judge", lambda model_dir: object())
+    monkeypatch.setattr(ss_judge, "_judge", None)
+    monkeypatch.setattr(ss_judge, "_persistent_score_cache_path", None)
+    monkeypatch.setattr(settings, "SUPER_SEARCH_JUDGE_MODEL_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "SUPER_SEARCH_JUDGE_BATCHING", False)
+    monkeypatch.setattr(settings, "SUPER_SEARCH_JUDGE_SCORE_CACHE_PATH", str(tmp_path / "web.sqlite"), raising=False)
+
+    monkeypatch.setattr(ss_judge, "_load_attempted", False)
+    assert ss_judge.get_judge().cache.path is None
+    with pytest.raises(RuntimeError):
+        ss_judge.use_persistent_score_cache(tmp_path / "offline.sqlite")
+
+    monkeypatch.setattr(ss_judge, "_load_attempted", False)
+    ss_judge.use_persistent_score_cache(tmp_path / "offline.sqlite")
+    assert ss_judge.get_judge().cache.path == tmp_path / "offline.sqlite"
+
+
+class _FakeJudge:
+    """Scores a pair by its lengths, and remembers the batches it was given."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def score_pairs(self, pairs):
+        self.batches.append(list(pairs))
+        if self.fail:
+            raise RuntimeError("session failed")
+        return [len(query) + len(text) / 1000 for query, text in pairs]
+
+
+def test_batcher_shares_batches_between_concurrent_callers():
+    fake = _FakeJudge()
+    batcher = ss_judge.JudgeBatcher(fake, batch_size=64, max_wait=0.5)
+    queries = ["a" * n for n in range(1, 5)]
+    texts = {query: [f"doc {i}" * (i + 1) for i in range(10)] for query in queries}
+    barrier = threading.Barrier(len(queries))
+    results = {}
+
+    def call(query):
+        barrier.wait()
+        results[query] = batcher.score(query, texts[query])
+
+    threads = [threading.Thread(target=call, args=(query,)) for query in queries]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fake.batches) < len(queries)
+    assert sum(len(batch) for batch in fake.batches) == 40
+    for query in queries:
+        assert results[query] == [len(query) + len(text) / 1000 for text in texts[query]]
+
+
+def test_batcher_runs_full_batches_without_waiting_for_the_deadline():
+    fake = _FakeJudge()
+    batcher = ss_judge.JudgeBatcher(fake, batch_size=64, max_wait=60)
+    texts = [f"doc {i}" for i in range(128)]
+
+    assert batcher.score("q", texts) == [1 + len(text) / 1000 for text in texts]
+    assert [len(batch) for batch in fake.batches] == [64, 64]
+    assert batcher.score("q", []) == []
+
+
+def test_batcher_fans_errors_out_to_the_callers_in_the_batch():
+    fake = _FakeJudge(fail=True)
+    batcher = ss_judge.JudgeBatcher(fake, batch_size=4, max_wait=0)
+
+    with pytest.raises(RuntimeError, match="session failed"):
+        batcher.score("q", ["a", "b", "c", "d", "e", "f"])
+    fake.fail = False
+    assert batcher.score("q", ["a"]) == [1.001]
+    # The failed call's second batch was dropped rather than scored for nobody.
+    assert fake.batches[-1] == [("q", "a")]
+
+
+class _WorkerCrash(BaseException):
+    """Escapes the worker's error handling, as nothing a judge raises should."""
+
+
+def test_batcher_callers_give_up_when_the_worker_dies_and_the_next_restarts_it(monkeypatch):
+    monkeypatch.setattr(ss_judge, "WORKER_CHECK_SECONDS", 0.01)
+    monkeypatch.setattr(threading, "excepthook", lambda args: None)
+    fake = _FakeJudge()
+    batcher = ss_judge.JudgeBatcher(fake, batch_size=4, max_wait=0)
+
+    def crash(pairs):
+        raise _WorkerCrash()
+
+    fake.score_pairs = crash
+    with pytest.raises(RuntimeError, match="worker thread died"):
+        batcher.score("q", ["a"])
+
+    del fake.score_pairs
+    assert batcher.score("q", ["a"]) == [1.001]
+
+
 @pytest.mark.skipif(not (MODEL_DIR / "model.onnx").exists(),
                     reason="judge model artifact not present")
 def test_judge_scores_relevant_above_irrelevant():
@@ -38,3 +140,12 @@ def test_judge_scores_relevant_above_irrelevant():
     ])
     assert all(0.0 <= s <= 1.0 for s in scores)
     assert scores[0] > scores[1]
+
+
+@pytest.mark.skipif(not (MODEL_DIR / "model.onnx").exists(),
+                    reason="judge model artifact not present")
+def test_batched_scores_match_the_judge():
+    judge = ss_judge.Judge(MODEL_DIR)
+    texts = [ss_judge.doc_text(f"Result {i}", "Some extract " * i) for i in range(70)]
+    batcher = ss_judge.JudgeBatcher(judge, batch_size=16, max_wait=0)
+    assert batcher.score("python", texts) == pytest.approx(judge.score("python", texts), abs=1e-5)
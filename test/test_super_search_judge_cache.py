@@ -0,0 +1,60 @@
+"""Tests for the relevance judge score cache (super_search_select/judge_cache.py)."""
+from mwmbl.tinysearchengine.super_search_select.judge_cache import CachingJudge, JudgeScoreCache, text_digest
+
+
+class _FakeJudge:
+    def __init__(self):
+        self.calls = []
+
+    def score(self, query, doc_texts):
+        self.calls.append(list(doc_texts))
+        return [len(query) + len(text) / 1000 for text in doc_texts]
+
+
+def test_only_unseen_pairs_reach_the_judge():
+    fake = _FakeJudge()
+    judge = CachingJudge(fake, JudgeScoreCache(max_entries=100))
+
+    first = judge.score("python", ["a", "bb"])
+    second = judge.score("python", ["bb", "ccc", "a"])
+    other_query = judge.score("Python", ["a"])
+
+    assert first == [6.001, 6.002]
+    assert second == [6.002, 6.003, 6.001]
+    assert other_query == [6.001]
+    assert fake.calls == [["a", "bb"], ["ccc"], ["a"]]
+    stats = judge.cache.stats()
+    assert (stats["local_hit"], stats["miss"], stats["lookups"]) == (2, 4, 6)
+    assert stats["hit_rate"] == 2 / 6
+
+
+def test_the_local_tier_is_bounded():
+    cache = JudgeScoreCache(max_entries=2)
+    cache.put("q", [(text_digest(text), 0.5) for text in ("a", "b", "c")])
+
+    assert cache.get("q", [text_digest("a"), text_digest("c")]) == [None, 0.5]
+
+
+def test_the_persistent_tier_outlives_the_process_for_the_same_model(tmp_path):
+    path = tmp_path / "scores.sqlite"
+    CachingJudge(_FakeJudge(), JudgeScoreCache(max_entries=100, path=path, model_id="m1")).score("q", ["a", "b"])
+
+    fake = _FakeJudge()
+    rerun = CachingJudge(fake, JudgeScoreCache(max_entries=100, path=path, model_id="m1"))
+    assert rerun.score("q", ["b", "a", "c"]) == [1.001, 1.001, 1.001]
+    assert fake.calls == [["c"]]
+    assert rerun.cache.stats()["persistent_hit"] == 2
+
+    retrained = _FakeJudge()
+    CachingJudge(retrained, JudgeScoreCache(max_entries=100, path=path, model_id="m2")).score("q", ["a"])
+    assert retrained.calls == [["a"]]
+
+
+def test_an_unusable_persistent_tier_is_skipped(tmp_path):
+    fake = _FakeJudge()
+    # A directory where the SQLite file should be.
+    judge = CachingJudge(fake, JudgeScoreCache(max_entries=0, path=tmp_path, model_id="m1"))
+
+    assert judge.score("q", ["a"]) == [1.001]
+    assert judge.score("q", ["a"]) == [1.001]
+    assert fake.calls == [["a"], ["a"]]
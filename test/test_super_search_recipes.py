@@ -5,20 +5,29 @@ url/title/extract coercion (templated URLs, relative-href resolution, HTML
 stripping) and that an HTTP error returns [] rather than propagating. We also
 verify the shipped recipe files load and register into SOURCES.
 """
+import json
 import re
 from pathlib import Path
 
 import httpx
 import pytest
+from lxml import etree
 
 from mwmbl.tinysearchengine.super_search_sources.recipe import (
     RECIPES_DIR,
     Recipe,
+    Selector,
+    compile_response,
     load_recipes,
     search_with_recipe,
 )
 
 RECIPES = load_recipes()
+REFERENCE_RECIPES = load_recipes(Path(RECIPES_DIR).parent / "recipes_reference")
+
+# Responses built from each recipe, and the documents the BeautifulSoup engine found in
+# them, generated by analyse/make_recipe_fixtures.py.
+FIXTURES = json.loads((Path(__file__).parent / "recipe_fixtures.json").read_text())
 
 # A minimal but complete recipe, used to check that valid recipes still load
 # alongside a malformed one.
@@ -314,3 +323,108 @@ async def test_xml_namespaces(httpx_mock):
     assert len(docs) == 1
     assert docs[0].title == "Deep Learning"
     assert docs[0].url == "http://arxiv.org/abs/1234.5678"
+
+
+# ---------------------------------------------------------------------------
+# Compiled recipes: parity with the BeautifulSoup engine, selectors, XML safety
+# ---------------------------------------------------------------------------
+
+def test_every_recipe_compiles():
+    assert len(REFERENCE_RECIPES) == len(list((Path(RECIPES_DIR).parent / "recipes_reference").glob("*.yaml")))
+    assert len(FIXTURES) == len([r for r in [*RECIPES.values(), *REFERENCE_RECIPES.values()]
+                                 if r.response_format in ("html", "json")])
+
+
+@pytest.mark.parametrize("case", FIXTURES, ids=lambda case: case["recipe"])
+def test_compiled_recipe_matches_the_beautifulsoup_engine(case):
+    recipes = RECIPES if case["directory"] == "recipes" else REFERENCE_RECIPES
+    parser = recipes[case["recipe"]].parser
+    if case["format"] == "html":
+        docs = parser.parse_text(case["body"])
+    else:
+        docs = parser.parse_payload(case["body"])
+    assert [[doc.title, doc.url, doc.extract] for doc in docs] == case["documents"]
+    assert case["documents"]
+
+
+SELECTOR_HTML = """<html><body>
+<div id="main" class="results  wide">
+  <article class="post"><h1 class="entry-title"><a href="/1">One</a></h1></article>
+  <article class="post featured"><span class="x"><a href="/2" data-k="a-b">Two</a></span></article>
+  <section><article class="post"><a href="./viewtopic.php?t=3">Three</a></article></section>
+</div>
+<article class="post-like"><a href="/4">Four</a></article>
+</body></html>
+"""
+
+
+@pytest.mark.parametrize("css, expected", [
+    ("article.post a", ["/1", "/2", "./viewtopic.php?t=3"]),
+    ("#main > article.post a", ["/1", "/2"]),
+    ("div.results.wide section a", ["./viewtopic.php?t=3"]),
+    ("span.x > a, h1 a", ["/1", "/2"]),
+    ("a[href*='viewtopic.php']", ["./viewtopic.php?t=3"]),
+    ("a[href^='/'], a[data-k|=a]", ["/1", "/2", "/4"]),
+    ("a[href$='=3']", ["./viewtopic.php?t=3"]),
+    ("article.featured a[data-k]", ["/2"]),
+    ("ARTICLE.post-like > A", ["/4"]),
+])
+def test_selectors_match_like_css(css, expected):
+    root = etree.fromstring(SELECTOR_HTML.encode(), etree.HTMLParser())
+    assert [element.get("href") for element in Selector(css).select(root)] == expected
+
+
+def test_a_field_selector_may_name_the_result_as_its_ancestor():
+    parser = compile_response({
+        "format": "html", "results": "h1.entry-title", "base_url": "https://example.org",
+        "fields": {"title": "h1 a", "url": {"selector": "h1 > a", "attr": "href"}},
+    })
+    docs = parser.parse_text(SELECTOR_HTML)
+    assert [(doc.title, doc.url) for doc in docs] == [("One", "https://example.org/1")]
+
+
+def test_text_leaves_out_scripts_styles_and_comments():
+    parser = compile_response({"format": "html", "results": "li", "fields": {"title": "", "url": {"attr": "id"}}})
+    html = ("<ul><li id='a'> Fish <!-- x --> &amp; <script>var a = '<b>';</script>"
+            "<style>.b {}</style><b>chips</b>&nbsp;</li></ul>")
+    assert parser.parse_text(html)[0].title == "Fish & chips"
+    assert parser.parse_text("") == []
+
+
+@pytest.mark.parametrize("css", ["a:first-child", "h1 + p", "div ~ p", "a::before", "> a", "a,", ""])
+def test_unsupported_selectors_make_a_recipe_malformed(css, tmp_path, caplog):
+    (tmp_path / "good.yaml").write_text(GOOD_RECIPE_YAML)
+    (tmp_path / "pseudo.yaml").write_text(
+        GOOD_RECIPE_YAML.replace("name: good", "name: pseudo")
+        .replace("format: json", "format: html").replace("results: results", f"results: {json.dumps(css)}"))
+    with caplog.at_level("WARNING"):
+        recipes = load_recipes(tmp_path)
+    assert set(recipes) == {"good"}
+    assert "pseudo.yaml" in caplog.text
+
+
+XML_WITH_ENTITIES = """<?xml version="1.0"?>
+<!DOCTYPE items [<!ENTITY lol "lol"><!ENTITY lol2 "&lol;&lol;&lol;&lol;">]>
+<items><item id="1"><name>&lol2;</name></item></items>
+"""
+
+XML_WITH_EXTERNAL_ENTITY = """<?xml version="1.0"?>
+<!DOCTYPE items [<!ENTITY secret SYSTEM "file:///etc/passwd">]>
+<items><item id="1"><name>&secret;</name></item></items>
+"""
+
+
+@pytest.mark.parametrize("body", [XML_WITH_ENTITIES, XML_WITH_EXTERNAL_ENTITY])
+async def test_xml_declaring_entities_is_refused(httpx_mock, body, caplog):
+    recipe = Recipe(
+        name="entities",
+        request={"url": "https://example.com/xml"},
+        response={"format": "xml", "results": ".//item",
+                  "fields": {"title": "name", "url": {"template": "https://example.com/{id}"}}},
+    )
+    httpx_mock.add_response(url=re.compile(r"https://example\.com/.*"), text=body)
+    with caplog.at_level("INFO"):
+        async with httpx.AsyncClient() as client:
+            docs = await search_with_recipe(client, recipe, "x", 5)
+    assert docs == []
+    assert "EntitiesForbidden" in caplog.text
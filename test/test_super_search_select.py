@@ -73,6 +73,62 @@ def test_batch_profiles(fake_profile_redis):
     assert got["b"] == (None, None)
 
 
+# ---------------------------------------------------------------------------
+# Vectors
+# ---------------------------------------------------------------------------
+
+def _loop_projection(features_of_text, dim):
+    """The projection as it was first written: one bucket update per feature."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for feature in features_of_text:
+        index, sign = vectors._hash_token(feature, dim)
+        vec[index] += sign
+    return vectors._l2_normalise(vec)
+
+
+def _loop_char_ngrams(text, dim):
+    grams = []
+    for token in vectors._content_tokens(text, True):
+        padded = f" {token} "
+        grams += [padded[i:i + n] for n in range(3, 6) for i in range(len(padded) - n + 1)]
+    return _loop_projection(grams, dim)
+
+
+VECTOR_TEXTS = [
+    "",
+    "the and of",
+    "Python asyncio tutorial",
+    "naïve café 東京 snake_case_identifier x86-64",
+    " ".join(f"word{i % 37} topic{i % 5}" for i in range(2000)),
+]
+
+
+@pytest.mark.parametrize("dim", [7, DIM])
+def test_batch_projections_are_bit_identical_to_the_loop(dim):
+    bow = vectors.project_bow_batch(VECTOR_TEXTS, dim)
+    cng = vectors.project_char_ngrams_batch(VECTOR_TEXTS, dim)
+    assert bow.shape == cng.shape == (len(VECTOR_TEXTS), dim)
+    assert bow.dtype == cng.dtype == np.float32
+    for row, text in enumerate(VECTOR_TEXTS):
+        expected_bow = _loop_projection(vectors._content_tokens(text, True), dim)
+        expected_cng = _loop_char_ngrams(text, dim)
+        assert bow[row].tobytes() == expected_bow.tobytes()
+        assert cng[row].tobytes() == expected_cng.tobytes()
+        assert vectors.project_bow(text, dim).tobytes() == expected_bow.tobytes()
+        assert vectors.project_char_ngrams(text, dim).tobytes() == expected_cng.tobytes()
+
+
+def test_token_hash_matches_the_reference_and_takes_lone_surrogates():
+    for token in ["python", "naïve", "東京", " sn"]:
+        packed = vectors._token_hash(token)
+        assert ((packed >> 1) % DIM, 1.0 if packed & 1 else -1.0) == vectors._hash_token(token, DIM)
+    assert vectors._token_hash("a\ud800b") != vectors._token_hash("ab")
+
+
+def test_batch_projection_of_no_texts():
+    assert vectors.project_bow_batch([], DIM).shape == (0, DIM)
+
+
 # ---------------------------------------------------------------------------
 # Features
 # ---------------------------------------------------------------------------
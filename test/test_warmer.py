@@ -0,0 +1,120 @@
+import json
+
+import fakeredis
+import pytest
+from django.test import RequestFactory
+from redis import RedisError
+
+from mwmbl.tinysearchengine import warmer
+from mwmbl.tinysearchengine.warmer import CacheWarmer, QueryLog, is_ready, top_queries, warm_progress
+
+
+class _Ranker:
+    def __init__(self, failing=()):
+        self.queries = []
+        self.failing = set(failing)
+
+    def get_results(self, q, additional_results, use_external_search=True):
+        assert not use_external_search
+        self.queries.append(q)
+        if q in self.failing:
+            raise ValueError(q)
+        return [], q.split(), []
+
+
+class _BrokenRedis:
+    def __getattr__(self, name):
+        raise RedisError("connection refused")
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch, settings):
+    settings.SEARCH_WARM_ENABLED = True
+    settings.SEARCH_WARM_MIN_COUNT = 2
+    settings.SEARCH_QUERY_LOG_MIN_CLIENTS = 2
+    settings.SEARCH_WARM_QUERIES_PER_SECOND = 10_000
+    settings.SEARCH_WARM_READY_PERCENT = 50
+    monkeypatch.setenv(warmer.BOOT_ID_VARIABLE, "test-boot")
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(warmer, "_redis", client)
+    return client
+
+
+def _log(*queries):
+    query_log = QueryLog()
+    for client, query in enumerate(queries):
+        query_log.add(query, f"client {client}")
+    query_log.flush()
+
+
+def test_a_query_is_only_stored_once_enough_clients_have_sent_it(redis_client):
+    query_log = QueryLog()
+    for _ in range(5):
+        query_log.add("Jane Doe 12 Acacia Avenue", "address:192.0.2.1")
+    assert query_log.flush() == 0
+    assert not any("jane" in key or "192.0.2.1" in key for key in redis_client.keys())
+    assert top_queries(10) == []
+
+    query_log.add("jane doe 12 acacia avenue", "address:192.0.2.1")
+    query_log.add("jane doe 12 acacia avenue", "address:198.51.100.7")
+    assert query_log.flush() == 1
+    assert redis_client.zscore(warmer._logged_hours()[0], "jane doe 12 acacia avenue") == 2
+
+
+def test_the_warm_set_is_the_most_searched_queries_seen_often_enough(redis_client):
+    _log("Python  Tutorial", "python tutorial", "python tutorial", "rust", "rust", "once only", "x" * 200)
+
+    assert top_queries(10) == ["python tutorial", "rust"]
+    assert top_queries(1) == ["python tutorial"]
+    assert not any(len(query) > 100 for query in redis_client.zrange(warmer._logged_hours()[0], 0, -1))
+
+
+def test_the_claiming_process_warms_each_query_and_records_progress():
+    _log("python", "python", "rust", "rust", "broken", "broken")
+    ranker = _Ranker(failing={"broken"})
+
+    assert CacheWarmer(ranker).run()
+
+    assert sorted(ranker.queries) == ["broken", "python", "rust"]
+    progress = warm_progress()
+    assert progress == {"boot": ":test-boot", "state": "warm", "total": 3, "done": 3, "failed": 1,
+                        "percent": 100.0}
+
+
+def test_only_one_process_warms_each_boot(monkeypatch):
+    _log("python", "python")
+    assert CacheWarmer(_Ranker()).run()
+
+    second = _Ranker()
+    assert not CacheWarmer(second).run()
+    assert second.queries == []
+
+    monkeypatch.setenv(warmer.BOOT_ID_VARIABLE, "next-boot")
+    assert CacheWarmer(second).run()
+    assert second.queries == ["python"]
+
+
+def test_ready_waits_for_the_warm_until_the_timeout(monkeypatch, settings, redis_client):
+    key = warmer._progress_key()
+    redis_client.hset(key, mapping={"state": "warming", "total": 10, "done": 4})
+    assert not is_ready(warm_progress())
+
+    redis_client.hset(key, "done", 5)
+    assert is_ready(warm_progress())
+
+    redis_client.hset(key, "done", 0)
+    settings.SEARCH_WARM_READY_TIMEOUT_SECONDS = 0
+    assert is_ready(warm_progress())
+
+
+def test_ready_view_reports_progress_and_does_not_wait_without_redis(monkeypatch):
+    monkeypatch.setattr(warmer, "_warmer", None)
+    request = RequestFactory().get("/ready")
+    response = warmer.ready_view(request)
+    assert response.status_code == 503
+    assert json.loads(response.content)["state"] == "pending"
+
+    monkeypatch.setattr(warmer, "_redis", _BrokenRedis())
+    response = warmer.ready_view(request)
+    assert response.status_code == 200
+    assert json.loads(response.content)["state"] == "unknown"